@@ -0,0 +1,139 @@
+"""
+    Python 3
+    Usage: python3 broadcastbench.py [--recipients 5000] [--rounds 20] [--size 100]
+    Micro-benchmark of the broadcast fan-out of the server. It measures the
+    cost per recipient of ServerSession.broadcast, which encodes the message
+    once and queues the same frame for every recipient, against the previous
+    implementation, which encoded the message for every recipient and checked
+    the block list of every recipient, and the cost of writing the queued
+    frames with one vectored sendmsg call against one send call per frame.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+from framing import encodeFrame
+import serverstate
+from session import ServerSession
+from outbound import OutboundQueue, sendFrames
+from blockgraph import BlockGraph
+from wire import BROADCAST
+from presence import PresenceRegistry, SessionRecord
+
+"""
+    Define a session whose outbound queue is never written to a socket, so
+    that only the fan-out itself is measured.
+"""
+class BenchSession(ServerSession):
+
+    # This is the constructor of the session of the given user
+    def __init__(self, userName):
+        ServerSession.__init__(self, ('127.0.0.1', 0))
+        self.userName = userName
+        self.outbound = OutboundQueue(self, highWatermark=1 << 40, lowWatermark=1 << 40)
+
+    # This function queues the given frame for the user
+    def sendFrame(self, frame):
+        self.outbound.push(frame)
+
+    # This function queues the frame of a message of another user
+    def deliverFrame(self, frame):
+        self.outbound.offer(frame)
+
+    # This function closes the queue of the session
+    def close(self):
+        self.outbound.close()
+
+# This function is the broadcast loop of the server before the message was
+# encoded once, kept as the baseline of the benchmark. peerList and blockerList
+# are the list of online users and the list of users blocking the sender, as
+# kept by the server before the presence registry and the block graph
+def legacyBroadcast(sender, message, peerList, blockerList):
+    message = sender.userName + ': ' + ' '.join(message[1:]) + "\n"
+    for peer in peerList:
+        if peer[0] in blockerList:
+            pass
+        elif (peer[3] != sender):
+            peer[3].outbound.offer(encodeFrame(message.encode()))
+
+# This function runs the given broadcast function for the number of rounds and
+# returns the cost per recipient in nanoseconds
+def measureFanOut(broadcast, sender, message, recipients, rounds):
+    for peer in serverstate.presence.snapshot():
+        peer.session.outbound.frames.clear()
+        peer.session.outbound.queuedBytes = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        broadcast(sender, message)
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * recipients) * 1e9
+
+# This function writes the frames through a socket pair either with one send
+# call per frame or with vectored sendmsg calls, and returns the cost per frame
+# in nanoseconds
+def measureWrite(frames, vectored):
+    writer, reader = socket.socketpair()
+    total = sum(len(frame) for frame in frames)
+
+    def consume():
+        received = 0
+        while received < total:
+            received += len(reader.recv(1 << 20))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    if vectored:
+        sendFrames(writer, frames)
+    else:
+        for frame in frames:
+            writer.sendall(frame)
+    consumer.join()
+    elapsed = time.perf_counter() - start
+    writer.close()
+    reader.close()
+    return elapsed / len(frames) * 1e9
+
+# This function parses the command line, sets up the sessions and prints the
+# results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast fan-out micro-benchmark")
+    parser.add_argument("--recipients", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--size", type=int, default=100, help="length of the broadcast text")
+    parser.add_argument("--blockers", type=int, default=50, help="number of users blocking the sender")
+    args = parser.parse_args()
+
+    sender = BenchSession('sender')
+    serverstate.presence = PresenceRegistry()
+    serverstate.presence.login(SessionRecord('sender', '127.0.0.1', 0, sender, 0))
+    for i in range(args.recipients):
+        serverstate.presence.login(SessionRecord(f'user{i}', '127.0.0.1', i, BenchSession(f'user{i}'), 0))
+    peerList = [[peer.userName, peer.ipAddress, peer.port, peer.session, peer.p2pPort] for peer in serverstate.presence.snapshot()]
+    serverstate.blockGraph = BlockGraph(None)
+    for i in range(args.blockers):
+        serverstate.blockGraph.block(f'user{i}', 'sender')
+    message = ['broadcast', 'x' * args.size]
+
+    blockerList = [f'user{i}' for i in range(args.blockers)]
+    legacy = measureFanOut(lambda session, words: legacyBroadcast(session, words, peerList, blockerList), sender, message, args.recipients, args.rounds)
+    encodeOnce = measureFanOut(lambda session, words: session.broadcast(BROADCAST, ' '.join(words[1:])), sender, message, args.recipients, args.rounds)
+    frames = [encodeFrame('sender: ' + 'x' * args.size + '\n')] * args.recipients
+    results = {
+        'recipients': args.recipients,
+        'rounds': args.rounds,
+        'messageBytes': len(frames[0]),
+        'fanOutLegacyNsPerRecipient': round(legacy, 1),
+        'fanOutEncodeOnceNsPerRecipient': round(encodeOnce, 1),
+        'writePerFrameSendNsPerFrame': round(measureWrite(frames, vectored=False), 1),
+        'writeVectoredNsPerFrame': round(measureWrite(frames, vectored=True), 1),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
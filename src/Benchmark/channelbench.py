@@ -0,0 +1,113 @@
+"""
+    Python 3
+    Usage: python3 channelbench.py [--online 50000] [--members 2000] [--offline 0.1] [--rounds 50]
+    Micro-benchmark of the fan-out of a message to a group channel. The
+    given number of users are logged in, and a channel has the given number
+    of members, a share of whom are offline. It measures the cost of
+    ServerSession.channelMessage, which fans the message out over the
+    precomputed online members of the channel and queues it offline for the
+    others, against filtering every online user by membership of the
+    channel, as a broadcast restricted to the channel would, and against a
+    broadcast to every online user. It also measures the cost of a member
+    logging in and out, which updates the online members of the channels
+    of the member.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+import serverstate
+from session import fanOut
+from blockgraph import BlockGraph
+from channels import ChannelDirectory
+from offlinestore import OfflineStore
+from presence import PresenceRegistry, SessionRecord
+from wire import Delivery, BROADCAST, CHANNEL
+from broadcastbench import BenchSession
+
+# The name of the channel of the benchmark
+CHANNEL_NAME = 'bench'
+
+# This function runs the given function for the number of rounds, emptying the
+# queues of the sessions first, and returns the microseconds per round
+def measure(function, rounds):
+    for peer in serverstate.presence.snapshot():
+        peer.session.outbound.frames.clear()
+        peer.session.outbound.queuedBytes = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return round((time.perf_counter() - start) / rounds * 1e6, 1)
+
+# This function sends a message to the channel by filtering every online user
+# by membership, the baseline of the benchmark
+def filteredFanOut(sender, body, members):
+    excluded = serverstate.blockGraph.blockersOf(sender.userName)
+    delivery = Delivery(CHANNEL, sender.userName, body, CHANNEL_NAME)
+    fanOut(delivery, excluded, sender, [peer for peer in serverstate.presence.snapshot() if peer.userName in members])
+
+# This function parses the command line, sets up the users and the channel and
+# prints the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Group channel fan-out micro-benchmark")
+    parser.add_argument("--online", type=int, default=50000, help="users logged in")
+    parser.add_argument("--members", type=int, default=2000, help="members of the channel")
+    parser.add_argument("--offline", type=float, default=0.1, help="share of the members who are offline")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--size", type=int, default=100, help="length of the message text")
+    args = parser.parse_args()
+
+    serverstate.presence = PresenceRegistry()
+    serverstate.blockGraph = BlockGraph(None)
+    serverstate.offlineMessages = OfflineStore(None)
+    serverstate.channels = ChannelDirectory(serverstate.presence, None)
+    sessions = []
+    for i in range(args.online):
+        session = BenchSession(f'user{i}')
+        sessions.append(session)
+        serverstate.presence.login(SessionRecord(session.userName, '127.0.0.1', i, session, 0))
+    offlineCount = int(args.members * args.offline)
+    step = max(1, args.online // args.members)
+    members = [f'user{i * step}' for i in range(args.members - offlineCount)]
+    members += [f'offline{i}' for i in range(offlineCount)]
+    for member in members:
+        serverstate.channels.join(CHANNEL_NAME, member)
+    memberSet = set(members)
+    sender = sessions[0]
+    sender.loginState = 'done'
+    body = 'x' * args.size
+
+    channel = measure(lambda: sender.channelMessage(CHANNEL_NAME, body), args.rounds)
+    queuedOffline = len(serverstate.offlineMessages)
+    filtered = measure(lambda: filteredFanOut(sender, body, memberSet), args.rounds)
+    broadcast = measure(lambda: sender.broadcast(BROADCAST, body), args.rounds)
+
+    # A member logging out and in again updates the online members of the
+    # channel, which are rebuilt on the next message
+    member = serverstate.presence.lookup(members[1])
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        serverstate.presence.logout(member.userName)
+        serverstate.presence.login(member)
+    presenceUs = round((time.perf_counter() - start) / (2 * args.rounds) * 1e6, 2)
+    rebuild = measure(lambda: (serverstate.presence.logout(member.userName), serverstate.presence.login(member),
+                               sender.channelMessage(CHANNEL_NAME, body)), args.rounds)
+
+    results = {
+        'online': args.online,
+        'members': args.members,
+        'offlineMembers': offlineCount,
+        'channelMessageUs': channel,
+        'filteredOnlineUsersUs': filtered,
+        'broadcastUs': broadcast,
+        'queuedOfflinePerMessage': queuedOffline // args.rounds,
+        'memberLoginOrLogoutUs': presenceUs,
+        'channelMessageAfterMemberChangeUs': rebuild,
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+    Python 3
+    Usage: python3 clientbench.py [--port 12000 | --spawn [--mode thread]] [--messages 5000] [--batch 100]
+    Benchmark of the send APIs of the programmatic client (see chatclient.py).
+    A sender and a receiver log in, and the sender sends messages to the
+    receiver in three ways: one at a time waiting for each to be delivered,
+    as a client waiting for the reply to every line would, pipelined with
+    sendMessage(), and in batches with sendMany(). For each way and for both
+    protocols it reports the messages per second received and the time the
+    sender spent sending, as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Client'))
+from chatclient import ChatClient, MESSAGE, TEXT
+from loadbench import spawnServer, freePort
+
+# The ways the sender sends its messages
+WAYS = ('lockstep', 'sendMessage', 'sendMany')
+
+# This coroutine counts the messages received by the receiver, setting
+# delivered on every message and done once count of them have arrived
+async def receive(receiver, count, delivered, done):
+    received = 0
+    async for event in receiver:
+        if event.kind == MESSAGE or event.kind == TEXT and ': cb ' in event.text:
+            received += 1
+            delivered.set()
+            if received == count:
+                done.set()
+                return
+
+# This coroutine runs one way of sending with the given protocol and returns
+# its results
+async def runWay(args, way, text, run):
+    sender = ChatClient(args.host, args.port, text)
+    receiver = ChatClient(args.host, args.port, text)
+    senderName = f"{args.prefix}s{run}"
+    receiverName = f"{args.prefix}r{run}"
+    await sender.start()
+    await receiver.start()
+    await sender.login(senderName, args.password)
+    await receiver.login(receiverName, args.password)
+    messages = [(receiverName, f"cb {index} " + 'x' * args.size) for index in range(args.messages)]
+    delivered = asyncio.Event()
+    done = asyncio.Event()
+    counter = asyncio.create_task(receive(receiver, args.messages, delivered, done))
+
+    start = time.perf_counter()
+    if way == 'lockstep':
+        # Every message waits for the delivery of the previous one
+        for userName, body in messages:
+            delivered.clear()
+            await sender.sendMessage(userName, body)
+            await asyncio.wait_for(delivered.wait(), args.timeout)
+    elif way == 'sendMessage':
+        for userName, body in messages:
+            await sender.sendMessage(userName, body)
+    else:
+        for offset in range(0, len(messages), args.batch):
+            await sender.sendMany(messages[offset:offset + args.batch])
+    sent = time.perf_counter() - start
+    await asyncio.wait_for(done.wait(), args.timeout)
+    elapsed = time.perf_counter() - start
+
+    await sender.close()
+    await receiver.close()
+    await counter
+    return {
+        'messagesPerSecond': round(args.messages / elapsed, 1),
+        'sendSeconds': round(sent, 4),
+        'totalSeconds': round(elapsed, 4),
+    }
+
+# This coroutine runs every way with both protocols
+async def runBenchmark(args):
+    results = {}
+    run = 0
+    for protocol in ('binary', 'text'):
+        results[protocol] = {}
+        for way in WAYS:
+            results[protocol][way] = await runWay(args, way, protocol == 'text', run)
+            run += 1
+    return results
+
+# This function parses the command line, starts the server if requested, runs
+# the benchmark and prints the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Send throughput of the programmatic client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port of a running server, or of the spawned server (default: a free port)")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server for the benchmark in a temporary directory")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="engine of the spawned server (default: thread)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument passed to the spawned server, may be repeated")
+    parser.add_argument("--server-timeout", type=int, default=3600,
+                        help="idle timeout in seconds of the spawned server (default: 3600)")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=100, help="messages per sendMany() call")
+    parser.add_argument("--size", type=int, default=40, help="bytes of padding in every message")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds to wait for the messages of one run to be delivered")
+    parser.add_argument("--prefix", default="cbench", help="prefix of the user names")
+    parser.add_argument("--password", default="bench")
+    args = parser.parse_args()
+    if not args.spawn and args.port is None:
+        parser.error("--port is required unless --spawn is given")
+
+    server = workDir = None
+    if args.spawn:
+        if args.port is None:
+            args.port = freePort(args.host)
+        server, workDir = spawnServer(args)
+    try:
+        results = asyncio.run(runBenchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            shutil.rmtree(workDir, ignore_errors=True)
+    print(json.dumps({'mode': args.mode if args.spawn else None, 'messages': args.messages,
+                      'batch': args.batch, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+    Python 3
+    Usage: python3 historybench.py [--volumes 10000,100000,1000000] [--users 1000] [--busy 0.1]
+    Benchmark of the message history store of the server. For every volume,
+    that many messages are appended to a new store in a temporary directory,
+    spread over random pairs of users except for the share sent in one busy
+    conversation. The store is then reopened, which reads its logs back, and
+    it measures the cost of appending, the time to read the logs back, the
+    latency of fetching the last 50 messages of the busy conversation and a
+    page of 50 from anywhere in it, and the latency of a search.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+from historystore import HistoryStore
+
+# The words the text of the messages is drawn from
+WORDS = ('hello', 'there', 'how', 'are', 'you', 'doing', 'today', 'the', 'meeting', 'is', 'at', 'noon',
+         'see', 'you', 'later', 'thanks', 'for', 'the', 'update', 'ok', 'sounds', 'good', 'lunch', 'tomorrow',
+         'deploy', 'release', 'review', 'branch', 'ticket', 'coffee', 'weekend', 'holiday', 'report', 'budget')
+
+# This function returns the percentiles of the given latencies in microseconds
+def percentiles(values):
+    values = sorted(values)
+    return {'p50': round(values[len(values) // 2] * 1e6, 1),
+            'p99': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1e6, 1)}
+
+# This function returns the latencies in seconds of the given calls
+def measure(calls):
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+# This function measures the store with the given number of messages
+def runVolume(args, volume, rng):
+    directory = tempfile.mkdtemp(prefix='historybench-')
+    try:
+        userNames = [f'user{i:05d}' for i in range(args.users)]
+        busy = (userNames[0], userNames[1])
+        store = HistoryStore(directory)
+        busyCount = 0
+        start = time.perf_counter()
+        for _ in range(volume):
+            if rng.random() < args.busy:
+                sender, recipient = busy if rng.random() < 0.5 else busy[::-1]
+                busyCount += 1
+            else:
+                sender, recipient = rng.sample(userNames, 2)
+            store.append(sender, recipient, ' '.join(rng.choice(WORDS) for _ in range(8)))
+        appendSeconds = time.perf_counter() - start
+        store.close()
+
+        start = time.perf_counter()
+        store = HistoryStore(directory)
+        store.loaded.wait()
+        loadSeconds = time.perf_counter() - start
+
+        latest = measure([lambda: store.page(busy[0], busy[1], None, 50)] * args.queries)
+        anywhere = measure([lambda beforeId=rng.randint(51, busyCount + 1): store.page(busy[0], busy[1], beforeId, 50)
+                            for _ in range(args.queries)])
+        search = measure([lambda word=rng.choice(WORDS): store.search(busy[0], [word], 20)
+                          for _ in range(args.queries)])
+        store.close()
+        return {
+            'messages': volume,
+            'busyConversation': busyCount,
+            'appendUs': round(appendSeconds / volume * 1e6, 2),
+            'loadSeconds': round(loadSeconds, 3),
+            'latestPageUs': percentiles(latest),
+            'anyPageUs': percentiles(anywhere),
+            'searchUs': percentiles(search),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+# This function parses the command line, runs the measurements and prints the
+# results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Message history store benchmark")
+    parser.add_argument("--volumes", default="10000,100000,1000000",
+                        help="numbers of messages stored, separated by commas")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--busy", type=float, default=0.1, help="share of the messages in the busy conversation")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    results = [runVolume(args, int(volume), rng) for volume in args.volumes.split(',')]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
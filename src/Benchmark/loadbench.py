@@ -0,0 +1,389 @@
+"""
+    Python 3
+    Usage: python3 loadbench.py [--port 12000 | --spawn [--mode thread]] [--clients 200]
+                                [--duration 10] [--rate 2000] [--mix message=60,broadcast=5,...]
+    Load generator and latency benchmark of the server. It connects the given
+    number of simulated clients speaking the framed protocol of client.py,
+    the ['p2pPort'] handshake followed by the login or registration, and has
+    them send a mix of message, broadcast, whoelse, block and startprivate
+    commands at a fixed total rate. Every message and broadcast carries the
+    time it was sent, so its recipients measure the delivery latency. The
+    connection setup rate, the command and delivery throughput, the delivery
+    latency percentiles and the RSS and thread count of the server processes
+    are printed as JSON, so that runs against different server modes and
+    versions can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import encodeFrame, readFrame
+
+# The commands the simulated clients send and their default share of the load
+COMMANDS = ('message', 'broadcast', 'whoelse', 'block', 'startprivate')
+DEFAULT_MIX = 'message=70,broadcast=5,whoelse=10,block=10,startprivate=5'
+
+# Every message and broadcast sent by the benchmark starts with this marker
+# followed by the time it was sent in nanoseconds
+MARKER = 'lb'
+
+# The path of the server script started by --spawn
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server', 'server.py')
+CREDENTIALS_FILE = os.path.join(os.path.dirname(SERVER_SCRIPT), 'credentials.txt')
+
+"""
+    Define a simulated client. The client reads every frame the server sends
+    to it on its own task and records the delivery latency of the messages
+    sent by other simulated clients.
+"""
+class SimulatedClient:
+
+    # This is the constructor of the client of the given user
+    def __init__(self, stats, userName, password):
+        self.stats = stats
+        self.userName = userName
+        self.password = password
+        self.reader = None
+        self.writer = None
+        self.readerTask = None
+        self.blocked = set()
+
+    # This coroutine connects to the server, performs the handshake and logs in,
+    # registering the user first if it does not exist
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(encodeFrame(f"['p2pPort'] {port}"))
+        await self.expect('Username: ')
+        self.writer.write(encodeFrame(self.userName))
+        prompt = await readFrame(self.reader)
+        if prompt is None:
+            raise ConnectionError(f"connection of {self.userName} closed during login")
+        if not prompt.endswith('password: ') and not prompt.endswith('Password: '):
+            raise ConnectionError(f"login of {self.userName} failed: {prompt.strip()}")
+        self.writer.write(encodeFrame(self.password))
+        await self.expect('Welcome')
+        self.readerTask = asyncio.create_task(self.readFrames())
+
+    # This coroutine reads frames until one contains the given text
+    async def expect(self, text):
+        while True:
+            data = await readFrame(self.reader)
+            if data is None:
+                raise ConnectionError(f"connection of {self.userName} closed during login")
+            if text in data:
+                return data
+
+    # This coroutine sends one command to the server
+    async def send(self, command):
+        self.writer.write(encodeFrame(command))
+        if self.writer.transport.get_write_buffer_size() > 64 * 1024:
+            await self.writer.drain()
+
+    # This coroutine reads the frames of the server until the connection is
+    # closed, measuring the latency of the messages of the benchmark
+    async def readFrames(self):
+        stats = self.stats
+        while True:
+            data = await readFrame(self.reader)
+            if data is None:
+                stats.disconnects += 1
+                return
+            stats.framesReceived += 1
+            text = data.split(': ', 1)
+            if len(text) == 2 and text[1].startswith(MARKER):
+                sentAt = text[1][len(MARKER):].split(' ', 1)[0]
+                if sentAt.isdigit():
+                    stats.latencies.append(time.perf_counter_ns() - int(sentAt))
+                    stats.deliveries += 1
+            elif data.startswith('Error') or 'could not be delivered' in data:
+                stats.errors += 1
+
+    # This function closes the connection
+    def close(self):
+        if self.readerTask is not None:
+            self.readerTask.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+"""
+    Define the counters of a run shared by all the simulated clients.
+"""
+class Stats:
+
+    # This is the constructor of the counters
+    def __init__(self):
+        self.latencies = []
+        self.commandsSent = dict.fromkeys(COMMANDS, 0)
+        self.framesReceived = 0
+        self.deliveries = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.connectTimes = []
+        self.connectFailures = 0
+
+# The percentiles reported for the latencies, by name
+CONNECT_PERCENTILES = {'p50': 0.5, 'p99': 0.99}
+DELIVERY_PERCENTILES = {'p50': 0.5, 'p99': 0.99, 'p999': 0.999}
+
+# This function returns the given percentiles of the nanosecond values in
+# milliseconds
+def percentiles(values, points):
+    if not values:
+        return dict.fromkeys(points)
+    values = sorted(values)
+    return {name: round(values[min(len(values) - 1, int(len(values) * point))] / 1e6, 3)
+            for name, point in points.items()}
+
+# This function parses the command mix given as name=weight pairs
+def parseMix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in COMMANDS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"invalid mix entry {item!r}")
+        mix[name] = int(weight)
+    return mix
+
+# This function returns the process ids of the given process and of all its
+# descendants, such as the workers of a sharded server, read from /proc
+def processTree(pid):
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as c:
+                    pids.extend(int(child) for child in c.read().split())
+        except OSError:
+            pass
+    return pids
+
+# This function returns the resident set size in bytes and the number of
+# threads of the given process and its descendants, read from /proc
+def processUsage(pid):
+    rss = threads = None
+    for member in processTree(pid):
+        try:
+            with open(f"/proc/{member}/status") as c:
+                for line in c:
+                    if line.startswith('VmRSS:'):
+                        rss = (rss or 0) + int(line.split()[1]) * 1024
+                    elif line.startswith('Threads:'):
+                        threads = (threads or 0) + int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+    return rss, threads
+
+# This function returns a free TCP port on the local host
+def freePort(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+# This function starts a server in a temporary working directory holding a
+# copy of the credentials file, so that the users registered by the benchmark
+# do not end up in the credentials of the repository. The given (userName,
+# password) pairs are registered in the copy beforehand
+def spawnServer(args, users=()):
+    workDir = tempfile.mkdtemp(prefix='loadbench-')
+    shutil.copy(CREDENTIALS_FILE, workDir)
+    if users:
+        with open(os.path.join(workDir, os.path.basename(CREDENTIALS_FILE)), 'a') as c:
+            c.writelines(f"\n{userName} {password}" for userName, password in users)
+    command = [sys.executable, os.path.abspath(SERVER_SCRIPT), str(args.port), '1', str(args.server_timeout),
+               '--mode', args.mode] + args.server_arg
+    server = subprocess.Popen(command, cwd=workDir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            # The probe completes the handshake so that the server sees a client
+            # leaving at the login prompt
+            with socket.create_connection((args.host, args.port), timeout=1) as probe:
+                probe.sendall(encodeFrame(f"['p2pPort'] {args.port}"))
+            return server, workDir
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("server did not start listening")
+
+# This coroutine connects all the clients, at most concurrency at a time
+async def connectClients(args, stats):
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    clients = [SimulatedClient(stats, f"{args.prefix}{index}", args.password) for index in range(args.clients)]
+
+    async def connectOne(client):
+        async with semaphore:
+            start = time.perf_counter_ns()
+            try:
+                await client.connect(args.host, args.port)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as error:
+                stats.connectFailures += 1
+                if stats.connectFailures == 1:
+                    print(f"connection failed: {error}", file=sys.stderr)
+                client.close()
+                return None
+            stats.connectTimes.append(time.perf_counter_ns() - start)
+            return client
+
+    connected = await asyncio.gather(*(connectOne(client) for client in clients))
+    return [client for client in connected if client is not None]
+
+# This function returns the command the given client sends next
+def nextCommand(client, clients, command, payload):
+    peer = random.choice(clients).userName
+    if command == 'message':
+        return f"message {peer} {MARKER}{time.perf_counter_ns()} {payload}"
+    if command == 'broadcast':
+        return f"broadcast {MARKER}{time.perf_counter_ns()} {payload}"
+    if command == 'whoelse':
+        return 'whoelse'
+    if command == 'block':
+        if peer in client.blocked:
+            client.blocked.discard(peer)
+            return f"unblock {peer}"
+        client.blocked.add(peer)
+        return f"block {peer}"
+    return f"startprivate {peer}"
+
+# This coroutine sends commands from the clients at the total rate of the
+# arguments until the duration has passed, sampling the server usage
+async def generateLoad(args, stats, clients, serverPid):
+    commands = list(args.mix)
+    weights = [args.mix[command] for command in commands]
+    payload = 'x' * max(0, args.size)
+    interval = 1.0 / args.rate
+    usage = {'peakRss': None, 'peakThreads': None}
+    start = time.perf_counter()
+    nextSample = start
+    sent = 0
+    while True:
+        now = time.perf_counter()
+        if now - start >= args.duration:
+            break
+        if serverPid is not None and now >= nextSample:
+            nextSample = now + 0.5
+            rss, threads = processUsage(serverPid)
+            if rss is not None:
+                usage['peakRss'] = max(usage['peakRss'] or 0, rss)
+                usage['peakThreads'] = max(usage['peakThreads'] or 0, threads)
+
+        # Send every command which is due, then sleep until the next one
+        due = int((now - start) / interval) + 1
+        while sent < due:
+            client = random.choice(clients)
+            command = random.choices(commands, weights)[0]
+            await client.send(nextCommand(client, clients, command, payload))
+            stats.commandsSent[command] += 1
+            sent += 1
+        await asyncio.sleep(max(0.0, start + sent * interval - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+
+    # Wait for the deliveries still in flight before the results are taken
+    await asyncio.sleep(args.drain)
+    return elapsed, usage
+
+# This coroutine runs the benchmark and returns its results
+async def runBenchmark(args, serverPid):
+    stats = Stats()
+    connectStart = time.perf_counter()
+    clients = await connectClients(args, stats)
+    connectElapsed = time.perf_counter() - connectStart
+    if not clients:
+        raise RuntimeError("no client could connect to the server")
+    idleRss, idleThreads = processUsage(serverPid) if serverPid is not None else (None, None)
+    elapsed, usage = await generateLoad(args, stats, clients, serverPid)
+    finalRss, finalThreads = processUsage(serverPid) if serverPid is not None else (None, None)
+    for client in clients:
+        client.close()
+    commandsSent = sum(stats.commandsSent.values())
+    return {
+        'mode': args.mode if args.spawn else None,
+        'clients': len(clients),
+        'connectFailures': stats.connectFailures,
+        'connectsPerSecond': round(len(clients) / connectElapsed, 1),
+        'connectLatencyMs': percentiles(stats.connectTimes, CONNECT_PERCENTILES),
+        'durationSeconds': round(elapsed, 3),
+        'commandsSent': stats.commandsSent,
+        'commandsPerSecond': round(commandsSent / elapsed, 1),
+        'framesReceived': stats.framesReceived,
+        'deliveries': stats.deliveries,
+        'deliveriesPerSecond': round(stats.deliveries / elapsed, 1),
+        'deliveryLatencyMs': percentiles(stats.latencies, DELIVERY_PERCENTILES),
+        'errors': stats.errors,
+        'disconnects': stats.disconnects,
+        'serverPid': serverPid,
+        'serverRssBytes': {'idle': idleRss, 'peak': usage['peakRss'], 'final': finalRss},
+        'serverThreads': {'idle': idleThreads, 'peak': usage['peakThreads'], 'final': finalThreads},
+    }
+
+# This function parses the command line, starts the server if requested, runs
+# the benchmark and prints the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Server load and latency benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port of a running server, or of the spawned server (default: a free port)")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="process id of a running server whose RSS and threads are reported")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server for the benchmark in a temporary directory")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="engine of the spawned server (default: thread)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument passed to the spawned server, may be repeated")
+    parser.add_argument("--server-timeout", type=int, default=3600,
+                        help="idle timeout in seconds of the spawned server (default: 3600)")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=2000.0, help="commands per second of all clients")
+    parser.add_argument("--mix", type=parseMix, default=parseMix(DEFAULT_MIX),
+                        help=f"weights of the commands (default: {DEFAULT_MIX})")
+    parser.add_argument("--size", type=int, default=64, help="bytes of padding in every message")
+    parser.add_argument("--drain", type=float, default=1.0,
+                        help="seconds to wait for deliveries in flight after the load stops")
+    parser.add_argument("--prefix", default="bench", help="prefix of the user names")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if not args.spawn and args.port is None:
+        parser.error("--port is required unless --spawn is given")
+    random.seed(args.seed)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+    server = workDir = None
+    serverPid = args.server_pid
+    if args.spawn:
+        if args.port is None:
+            args.port = freePort(args.host)
+        server, workDir = spawnServer(args)
+        serverPid = server.pid
+    try:
+        results = asyncio.run(runBenchmark(args, serverPid))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            shutil.rmtree(workDir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+    Python 3
+    Usage: python3 loginbench.py [--port 12000 | --spawn [--mode thread]] [--logins 10000]
+                                 [--chatters 20] [--chat-rate 200]
+    Reconnect storm benchmark of the server. A few users chat at a steady
+    rate while the given number of clients connect and log in at once, as
+    every client of a server does after an outage. The storm runs in its own
+    process so that it does not slow down the chatting clients. Logins
+    refused by the server because it is busy are retried after a short
+    random backoff. It reports the time for the whole storm to log in, the
+    login latency and refusals, and the delivery latency of the chat before
+    and during the storm, as JSON. Pass --server-arg=--login-workers=N or
+    --server-arg=--login-queue=N to compare settings of the server.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import encodeFrame, readFrame
+from loadbench import SimulatedClient, Stats, MARKER, percentiles, spawnServer, freePort, processUsage
+
+# The percentiles reported for the latencies, by name
+LATENCY_PERCENTILES = {'p50': 0.5, 'p99': 0.99}
+
+# The range in seconds of the backoff of a refused login before it is retried
+BACKOFF = (0.05, 0.5)
+
+# This coroutine logs one user of the storm in and returns whether it has
+# been refused because the server is busy. Any other failure raises
+async def logIn(host, port, userName, password):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(encodeFrame(f"['p2pPort'] {port}"))
+        await readFrame(reader)
+        writer.write(encodeFrame(userName))
+        await readFrame(reader)
+        writer.write(encodeFrame(password))
+        reply = await readFrame(reader)
+        if reply is None:
+            raise ConnectionError(f"connection of {userName} closed during login")
+        if reply.startswith('Welcome'):
+            return False
+        if 'busy' in reply:
+            return True
+        raise ConnectionError(f"login of {userName} failed: {reply.strip()!r}")
+    finally:
+        writer.close()
+
+# This coroutine logs every user of the storm in at once, retrying refused
+# logins, and returns the results of the storm
+async def runStorm(args):
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    latencies = []
+    counts = {'refused': 0, 'failed': 0}
+
+    async def stormOne(index):
+        start = time.perf_counter_ns()
+        while True:
+            try:
+                async with semaphore:
+                    refused = await logIn(args.host, args.port, f"{args.prefix}{index}", args.password)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                counts['failed'] += 1
+                return
+            if not refused:
+                latencies.append(time.perf_counter_ns() - start)
+                return
+            counts['refused'] += 1
+            await asyncio.sleep(random.uniform(*BACKOFF))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(stormOne(index) for index in range(args.logins)))
+    elapsed = time.perf_counter() - start
+    return {
+        'logins': len(latencies),
+        'seconds': round(elapsed, 3),
+        'loginsPerSecond': round(len(latencies) / elapsed, 1),
+        'loginLatencyMs': percentiles(latencies, LATENCY_PERCENTILES),
+        'refused': counts['refused'],
+        'failed': counts['failed'],
+    }
+
+# This function runs the storm in the process started for it and sends its
+# results back
+def stormProcess(args, results):
+    raiseFileLimit()
+    results.put(asyncio.run(runStorm(args)))
+
+# This coroutine keeps the chatting clients sending messages to each other
+# at the chat rate until stopped is set
+async def chat(args, clients, stopped):
+    interval = 1.0 / args.chat_rate
+    start = time.perf_counter()
+    sent = 0
+    while not stopped.is_set():
+        client = random.choice(clients)
+        peer = random.choice(clients).userName
+        await client.send(f"message {peer} {MARKER}{time.perf_counter_ns()} chat")
+        sent += 1
+        await asyncio.sleep(max(0.0, start + sent * interval - time.perf_counter()))
+
+# This coroutine runs the benchmark and returns its results
+async def runBenchmark(args, serverPid):
+    stats = Stats()
+    clients = [SimulatedClient(stats, f"{args.prefix}chat{index}", args.password) for index in range(args.chatters)]
+    for client in clients:
+        await client.connect(args.host, args.port)
+    stopped = asyncio.Event()
+    chatter = asyncio.create_task(chat(args, clients, stopped))
+
+    # The chat runs alone first, then during the storm in another process
+    await asyncio.sleep(args.warmup)
+    before = len(stats.latencies)
+    results = multiprocessing.Queue()
+    storm = multiprocessing.Process(target=stormProcess, args=(args, results))
+    storm.start()
+    peakRss = None
+    while storm.is_alive():
+        rss, threads = processUsage(serverPid) if serverPid is not None else (None, None)
+        if rss is not None:
+            peakRss = max(peakRss or 0, rss)
+        await asyncio.sleep(0.2)
+    during = len(stats.latencies)
+    stopped.set()
+    await chatter
+    await asyncio.sleep(0.5)
+    for client in clients:
+        client.close()
+    return {
+        'mode': args.mode if args.spawn else None,
+        'storm': results.get(),
+        'chatLatencyMs': {
+            'beforeStorm': percentiles(stats.latencies[:before], LATENCY_PERCENTILES),
+            'duringStorm': percentiles(stats.latencies[before:during], LATENCY_PERCENTILES),
+        },
+        'chatDeliveries': {'beforeStorm': before, 'duringStorm': during - before},
+        'serverPeakRssBytes': peakRss,
+    }
+
+# This function raises the limit of open file descriptors to the hard limit
+def raiseFileLimit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+# This function parses the command line, starts the server with the users of
+# the benchmark registered if requested, runs the benchmark and prints the
+# results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Reconnect storm benchmark of the logins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port of a running server, or of the spawned server (default: a free port)")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="process id of a running server whose RSS is reported")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server for the benchmark in a temporary directory")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="engine of the spawned server (default: thread)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument passed to the spawned server, may be repeated")
+    parser.add_argument("--server-timeout", type=int, default=3600,
+                        help="idle timeout in seconds of the spawned server (default: 3600)")
+    parser.add_argument("--logins", type=int, default=10000, help="users logging in during the storm")
+    parser.add_argument("--connect-concurrency", type=int, default=2000,
+                        help="connections of the storm opened at a time")
+    parser.add_argument("--chatters", type=int, default=20, help="users chatting during the storm")
+    parser.add_argument("--chat-rate", type=float, default=200.0, help="messages per second of all chatters")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of chat before the storm")
+    parser.add_argument("--prefix", default="storm", help="prefix of the user names")
+    parser.add_argument("--password", default="bench")
+    args = parser.parse_args()
+    if not args.spawn and args.port is None:
+        parser.error("--port is required unless --spawn is given")
+    raiseFileLimit()
+
+    server = workDir = None
+    serverPid = args.server_pid
+    if args.spawn:
+        if args.port is None:
+            args.port = freePort(args.host)
+        users = [(f"{args.prefix}{index}", args.password) for index in range(args.logins)]
+        users += [(f"{args.prefix}chat{index}", args.password) for index in range(args.chatters)]
+        server, workDir = spawnServer(args, users)
+        serverPid = server.pid
+    try:
+        results = asyncio.run(runBenchmark(args, serverPid))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            shutil.rmtree(workDir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+    Python 3
+    Usage: python3 p2pbench.py [--port 12000 | --spawn [--mode thread]] [--cycles 20] [--burst 200] [--pings 200]
+    Benchmark of private messaging between clients (see clientcore.py). A
+    user starts and stops private messaging with another user repeatedly,
+    once keeping the connection between the clients open across the
+    sessions and once closing it after every session, as the clients did
+    before. Then many users start private messaging with the same user at
+    once, and a private message and its reply go back and forth over the
+    connection between the clients and relayed by the server, the clients
+    being unable to connect to each other. It reports the time to set up a
+    session, the connections opened and the round trip times as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Client'))
+from clientcore import ClientCore
+from loadbench import spawnServer, freePort, percentiles
+
+# The marker of the welcome of a user, which completes the login
+WELCOME = 'welcome'
+
+"""
+    Define a client of the benchmark, which accepts every request for private
+    messaging, answers pings with pongs and resolves the futures waiting for
+    a text containing a marker.
+"""
+class BenchPeer(ClientCore):
+
+    # This is the constructor of the client
+    def __init__(self, host, port, text):
+        ClientCore.__init__(self, host, port, text)
+        self.waiters = {}
+        self.accepted = 0
+
+    # This function returns a future resolved with the time the next text
+    # containing the marker is shown
+    def expect(self, marker):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[marker] = future
+        return future
+
+    # This function resolves the futures of the markers the text contains
+    def notify(self, text):
+        for marker in [marker for marker in self.waiters if marker in text]:
+            future = self.waiters.pop(marker)
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+    # This function accepts requests for private messaging
+    def output(self, text):
+        if text.endswith('enter y or n: '):
+            self.spawn(self.handleLine('y'))
+        self.notify(text)
+
+    # This function resolves the futures waiting for the text
+    def onText(self, text):
+        self.notify(text)
+
+    # This function resolves the future waiting for the login
+    def onWelcome(self, userName, text):
+        self.notify(WELCOME)
+
+    # This function answers a ping and resolves the futures waiting for the
+    # private message
+    def onPeerText(self, text):
+        sender, separator, body = text.partition('(private): ')
+        if separator and body.startswith('ping'):
+            self.sendPeer(sender, f"{self.userName}(private): pong{body[4:]}")
+        self.notify(text)
+
+    # This coroutine counts the connections opened by the peers
+    async def acceptPeer(self, reader, writer):
+        self.accepted += 1
+        await ClientCore.acceptPeer(self, reader, writer)
+
+# This coroutine starts a client and logs the user in
+async def connect(args, userName):
+    client = BenchPeer(args.host, args.port, args.text)
+    await client.start()
+    welcome = client.expect(WELCOME)
+    await client.handleLine(userName)
+    await client.handleLine(args.password)
+    await asyncio.wait_for(welcome, args.timeout)
+    client.userName = userName
+    return client
+
+# This coroutine starts private messaging of the initiator with the target and
+# returns the seconds until the target has accepted it. The acceptance may
+# arrive over a connection kept open before the server has told the initiator
+# to start, which the initiator is waited for
+async def startPrivate(args, initiator, target):
+    accepted = initiator.expect(f"{target.userName} accepts private messaging")
+    start = time.perf_counter()
+    await initiator.handleLine(f"startprivate {target.userName}")
+    setup = await asyncio.wait_for(accepted, args.timeout) - start
+    while target.userName not in initiator.privatePeers:
+        await asyncio.sleep(0.001)
+    return setup
+
+# This coroutine stops private messaging of the initiator with the target
+async def stopPrivate(args, initiator, target):
+    closed = initiator.expect(f"Private messaging with {target.userName} closed")
+    await initiator.handleLine(f"stopprivate {target.userName}")
+    await asyncio.wait_for(closed, args.timeout)
+
+# This coroutine starts and stops private messaging cycles times, closing the
+# connections between the clients after every session unless reuse is set
+async def runCycles(args, initiator, target, reuse):
+    setups = []
+    accepted = target.accepted
+    for _ in range(args.cycles):
+        setups.append(await startPrivate(args, initiator, target))
+        await stopPrivate(args, initiator, target)
+        if not reuse:
+            for writer in list(initiator.peerWriters.values()) + list(target.peerWriters.values()):
+                writer.close()
+            while initiator.peerWriters or target.peerWriters:
+                await asyncio.sleep(0.001)
+    return {
+        'firstSetupMs': round(setups[0] * 1e3, 2),
+        'setupMs': percentiles([setup * 1e9 for setup in setups[1:] or setups], {'p50': 0.5}),
+        'connectionsOpened': target.accepted - accepted,
+    }
+
+# This coroutine sends pings from the initiator to the target and returns the
+# round trip percentiles in milliseconds
+async def runPings(args, initiator, target):
+    roundTrips = []
+    for index in range(args.pings):
+        pong = initiator.expect(f"pong {index}")
+        start = time.perf_counter()
+        await initiator.handleLine(f"private {target.userName} ping {index}")
+        roundTrips.append((await asyncio.wait_for(pong, args.timeout) - start) * 1e9)
+    return percentiles(roundTrips, {'p50': 0.5, 'p99': 0.99})
+
+# This coroutine runs the benchmark and returns its results
+async def runBenchmark(args):
+    results = {}
+    initiator = await connect(args, f"{args.prefix}a")
+    target = await connect(args, f"{args.prefix}b")
+    results['reused'] = await runCycles(args, initiator, target, True)
+    results['reconnected'] = await runCycles(args, initiator, target, False)
+
+    # Many users start private messaging with the target at once, after
+    # logging in one at a time so that the server does not refuse the logins
+    others = [await connect(args, f"{args.prefix}{index}") for index in range(args.burst)]
+    start = time.perf_counter()
+    setups = await asyncio.gather(*(startPrivate(args, other, target) for other in others))
+    results['burst'] = {
+        'sessions': args.burst,
+        'totalMs': round((time.perf_counter() - start) * 1e3, 1),
+        'setupMs': percentiles([setup * 1e9 for setup in setups], {'p50': 0.5, 'p99': 0.99}),
+        'relayed': sum(1 for other in others if target.userName not in other.peerWriters),
+    }
+    for other in others:
+        await other.handleLine('logout')
+
+    # Pings over the connection, then relayed once the clients stop listening
+    await startPrivate(args, initiator, target)
+    results['directRoundTripMs'] = await runPings(args, initiator, target)
+    await stopPrivate(args, initiator, target)
+    for client in (initiator, target):
+        client.p2pServer.close()
+        for writer in list(client.peerWriters.values()):
+            writer.close()
+    while initiator.peerWriters or target.peerWriters:
+        await asyncio.sleep(0.001)
+    relayedSetup = await startPrivate(args, initiator, target)
+    results['relayedSetupMs'] = round(relayedSetup * 1e3, 2)
+    results['relayedRoundTripMs'] = await runPings(args, initiator, target)
+    await initiator.handleLine('logout')
+    await target.handleLine('logout')
+    return results
+
+# This function parses the command line, starts the server if requested, runs
+# the benchmark and prints the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Private messaging setup and relay benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="port of a running server, or of the spawned server (default: a free port)")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server for the benchmark in a temporary directory")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="engine of the spawned server (default: thread)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument passed to the spawned server, may be repeated")
+    parser.add_argument("--server-timeout", type=int, default=3600,
+                        help="idle timeout in seconds of the spawned server (default: 3600)")
+    parser.add_argument("--text", action="store_true", help="use the text protocol")
+    parser.add_argument("--cycles", type=int, default=20, help="private messaging sessions started and stopped")
+    parser.add_argument("--burst", type=int, default=200, help="users starting private messaging at once")
+    parser.add_argument("--pings", type=int, default=200, help="private messages answered by the peer")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for any reply")
+    parser.add_argument("--prefix", default="pbench", help="prefix of the user names")
+    parser.add_argument("--password", default="bench")
+    args = parser.parse_args()
+    if not args.spawn and args.port is None:
+        parser.error("--port is required unless --spawn is given")
+
+    server = workDir = None
+    if args.spawn:
+        if args.port is None:
+            args.port = freePort(args.host)
+        users = [(f"{args.prefix}{suffix}", args.password) for suffix in ['a', 'b'] + list(range(args.burst))]
+        server, workDir = spawnServer(args, users)
+    try:
+        results = asyncio.run(runBenchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            shutil.rmtree(workDir, ignore_errors=True)
+    print(json.dumps({'mode': args.mode if args.spawn else None, 'protocol': 'text' if args.text else 'binary',
+                      'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
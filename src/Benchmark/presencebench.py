@@ -0,0 +1,80 @@
+"""
+    Python 3
+    Usage: python3 presencebench.py [--users 10000] [--lookups 2000]
+    Benchmark of the online presence registry of the server. It measures the
+    memory used per logged in user and the cost of looking up a user with
+    the PresenceRegistry against the list of lists previously scanned by the
+    server.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+from presence import PresenceRegistry, SessionRecord
+
+# This function returns the number of bytes allocated per user while building
+# the presence data with the given function
+def measureMemory(build, users):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    data = build(users)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return data, allocated / len(users)
+
+# This function builds the list of lists previously used by the server
+def buildPeerList(users):
+    return [[userName, '127.0.0.1', port, None, port + 1] for port, userName in users]
+
+# This function builds the presence registry
+def buildRegistry(users):
+    registry = PresenceRegistry()
+    for port, userName in users:
+        registry.login(SessionRecord(userName, '127.0.0.1', port, None, port + 1))
+    return registry
+
+# This function returns the average time in nanoseconds of looking up the
+# given user names with the given function
+def measureLookup(lookup, userNames):
+    start = time.perf_counter()
+    for userName in userNames:
+        lookup(userName)
+    return (time.perf_counter() - start) / len(userNames) * 1e9
+
+# This function is the lookup of a user in the list of lists, as previously
+# done by the server
+def scanPeerList(peerList, userName):
+    for peer in peerList:
+        if peer[0] == userName:
+            return peer
+    return None
+
+# This function parses the command line, runs the measurements and prints the
+# results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Presence registry benchmark")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    # The user names and ports are created up front so that only the presence
+    # data itself is measured
+    users = [(port, f'user{port}') for port in range(args.users)]
+    peerList, listBytes = measureMemory(buildPeerList, users)
+    registry, registryBytes = measureMemory(buildRegistry, users)
+    userNames = [users[(i * 7919) % args.users][1] for i in range(args.lookups)]
+    results = {
+        'users': args.users,
+        'listBytesPerUser': round(listBytes, 1),
+        'registryBytesPerUser': round(registryBytes, 1),
+        'listLookupNs': round(measureLookup(lambda userName: scanPeerList(peerList, userName), userNames), 1),
+        'registryLookupNs': round(measureLookup(registry.lookup, userNames), 1),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+    Python 3
+    Usage: python3 presencefeedbench.py [--online 1000] [--logins 3000] [--per-window 500] [--follows 0]
+    Micro-benchmark of a login storm seen by the users online. The given
+    number of users are online when the given number of users log in one
+    after another and stay online, as every client of a server does after an
+    outage. With the notices, every login is broadcast to every user online.
+    With the presence feed, every user subscribes after logging in, to all
+    the users or to --follows random users, receiving a snapshot, and the
+    changes are sent once per window of --per-window logins. It reports the
+    frames and bytes queued for the users and the time taken for each.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+import serverstate
+from blockgraph import BlockGraph
+from presence import PresenceRegistry, SessionRecord
+from presencefeed import PresenceFeed
+from wire import LOGIN
+from broadcastbench import BenchSession
+
+# This function empties the queues of the given sessions and returns the
+# number of frames and bytes which were queued
+def collect(sessions):
+    frames = size = 0
+    for session in sessions:
+        outbound = session.outbound
+        frames += len(outbound.frames)
+        size += outbound.queuedBytes
+        outbound.frames.clear()
+        outbound.queuedBytes = 0
+    return frames, size
+
+# This function logs the users in, subscribing them to the feed unless
+# notices is set, and returns the frames, bytes and seconds of the storm
+def runStorm(args, notices):
+    serverstate.presence = PresenceRegistry()
+    serverstate.blockGraph = BlockGraph(None)
+    serverstate.presenceFeed = PresenceFeed(serverstate.presence)
+    rng = random.Random(args.seed)
+    userNames = [f'user{i}' for i in range(args.online + args.logins)]
+    sessions = []
+
+    def logIn(index):
+        session = BenchSession(userNames[index])
+        sessions.append(session)
+        serverstate.presence.login(SessionRecord(session.userName, '127.0.0.1', index, session, 0))
+        if notices:
+            session.broadcast(LOGIN)
+        elif args.follows:
+            serverstate.presenceFeed.subscribe(session, rng.sample(userNames, args.follows))
+        else:
+            serverstate.presenceFeed.subscribe(session)
+
+    for index in range(args.online):
+        logIn(index)
+    serverstate.presenceFeed.flush()
+    collect(sessions)
+
+    frames = size = 0
+    start = time.perf_counter()
+    for index in range(args.online, args.online + args.logins):
+        logIn(index)
+        if (index - args.online + 1) % args.perWindow == 0:
+            serverstate.presenceFeed.flush()
+            queuedFrames, queuedBytes = collect(sessions)
+            frames += queuedFrames
+            size += queuedBytes
+    serverstate.presenceFeed.flush()
+    elapsed = time.perf_counter() - start
+    queuedFrames, queuedBytes = collect(sessions)
+    return {'frames': frames + queuedFrames, 'bytes': size + queuedBytes, 'seconds': round(elapsed, 3)}
+
+# This function parses the command line, runs the storm both ways and prints
+# the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Login storm presence micro-benchmark")
+    parser.add_argument("--online", type=int, default=1000, help="users online before the storm")
+    parser.add_argument("--logins", type=int, default=3000, help="users logging in during the storm")
+    parser.add_argument("--per-window", dest="perWindow", type=int, default=500,
+                        help="logins within one window of the presence feed")
+    parser.add_argument("--follows", type=int, default=0,
+                        help="users followed by every subscriber (default: 0, all the users)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    results = {
+        'online': args.online,
+        'logins': args.logins,
+        'loginsPerWindow': args.perWindow,
+        'follows': args.follows or 'all',
+        'notices': runStorm(args, notices=True),
+        'subscribed': runStorm(args, notices=False),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
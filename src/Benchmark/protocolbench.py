@@ -0,0 +1,174 @@
+"""
+    Python 3
+    Usage: python3 protocolbench.py [--messages 20000] [--users 50] [--size 60] [--batch 16]
+    Micro-benchmark of the wire protocols. A stream of messages, broadcasts
+    and logins from a set of users is written to one client in batches, as
+    the writer of a session takes them from its outbound queue, with the text
+    protocol, the binary protocol and the binary protocol with compression.
+    For each it measures the bytes on the wire per message, the cost of
+    encoding a batch on the server and the cost of decoding and interpreting
+    the frames on the client, and for the commands of the clients the cost of
+    parsing them on the server.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Server'))
+from framing import FrameDecoder, encodeFrame
+import binaryproto
+from binaryproto import BinaryDecoder, FieldReader, encodeBinaryFrame, encodeString
+import wire
+from wire import Delivery, TextCodec, BinaryCodec
+
+# The words the text of the messages is drawn from
+WORDS = ('hello', 'there', 'how', 'are', 'you', 'doing', 'today', 'the', 'meeting', 'is', 'at', 'noon',
+         'see', 'you', 'later', 'thanks', 'for', 'the', 'update', 'ok', 'sounds', 'good', 'lunch', 'tomorrow')
+
+# This function returns the deliveries of the stream: mostly messages, some
+# broadcasts and a few logins and logouts
+def makeDeliveries(count, users, size, seed=1):
+    rng = random.Random(seed)
+    userNames = [f'user{i:04d}' for i in range(users)]
+    deliveries = []
+    for _ in range(count):
+        roll = rng.random()
+        sender = rng.choice(userNames)
+        if roll < 0.05:
+            deliveries.append(Delivery(wire.LOGIN if roll < 0.025 else wire.LOGOUT, sender))
+            continue
+        words = []
+        while sum(len(word) + 1 for word in words) < size:
+            words.append(rng.choice(WORDS))
+        deliveries.append(Delivery(wire.BROADCAST if roll < 0.2 else wire.MESSAGE, sender, ' '.join(words)))
+    return deliveries
+
+# This function encodes the deliveries in batches with the given codec and
+# returns the encoded bytes and the encoding cost per message in nanoseconds.
+# The binary frames of the deliveries are built beforehand, as they are shared
+# by all the recipients of a broadcast
+def encodeStream(codec, deliveries, batch):
+    for delivery in deliveries:
+        delivery.binaryFrame()
+    chunks = []
+    start = time.perf_counter()
+    for offset in range(0, len(deliveries), batch):
+        chunks.append(b''.join(codec.encodeBatch(deliveries[offset:offset + batch])))
+    elapsed = time.perf_counter() - start
+    return chunks, elapsed / len(deliveries) * 1e9
+
+# This function interprets the chunks of the text protocol as the client
+# does, returning the cost per message in nanoseconds
+def decodeText(chunks, count):
+    decoder = FrameDecoder()
+    shown = []
+    start = time.perf_counter()
+    for chunk in chunks:
+        for data in decoder.feed(chunk):
+            data = data.decode()
+            if "['EXIT']" in data:
+                shown.append(data[:-8])
+            elif "['TARGET']" in data:
+                shown.append(data.split())
+            else:
+                shown.append(data)
+    elapsed = time.perf_counter() - start
+    assert len(shown) == count
+    return elapsed / count * 1e9
+
+# This function interprets the chunks of the binary protocol as the client
+# does, returning the cost per message in nanoseconds
+def decodeBinary(chunks, count):
+    decoder = BinaryDecoder()
+    userNames = {}
+    shown = []
+    start = time.perf_counter()
+    for chunk in chunks:
+        for body in decoder.feed(chunk):
+            opcode = body[0]
+            fields = FieldReader(body)
+            if opcode == binaryproto.MESSAGE or opcode == binaryproto.BROADCAST:
+                sender = userNames[fields.varint()]
+                shown.append(f"{sender}: {fields.string()}\n")
+            elif opcode == binaryproto.USER:
+                id = fields.varint()
+                userNames[id] = fields.string()
+            elif opcode == binaryproto.PRESENCE:
+                user = userNames[fields.varint()]
+                shown.append(f"{user} logged {'in' if fields.byte() else 'out'}\n")
+            elif opcode == binaryproto.TEXT:
+                shown.append(fields.string())
+    elapsed = time.perf_counter() - start
+    assert len(shown) == count
+    return elapsed / count * 1e9
+
+# This function measures the parsing of message commands on the server, from
+# the received bytes to the recipient and the body, in both protocols and
+# returns the costs per command in nanoseconds
+def measureCommands(deliveries, batch):
+    commands = [(delivery.userName, delivery.body) for delivery in deliveries if delivery.kind == wire.MESSAGE]
+    textChunks = [b''.join(encodeFrame(f"message {user} {body}") for user, body in commands[offset:offset + batch])
+                  for offset in range(0, len(commands), batch)]
+    binaryChunks = [b''.join(encodeBinaryFrame(binaryproto.SEND, encodeString(user), encodeString(body))
+                             for user, body in commands[offset:offset + batch])
+                    for offset in range(0, len(commands), batch)]
+
+    decoder = FrameDecoder()
+    parsed = []
+    start = time.perf_counter()
+    for chunk in textChunks:
+        for payload in decoder.feed(chunk):
+            message = payload.decode().split()
+            if message[0] == 'message' and len(message) >= 2:
+                parsed.append((message[1], ' '.join(message[2:])))
+    text = (time.perf_counter() - start) / len(commands) * 1e9
+    assert parsed == commands
+
+    decoder = BinaryDecoder()
+    parsed = []
+    start = time.perf_counter()
+    for chunk in binaryChunks:
+        for body in decoder.feed(chunk):
+            if body[0] == binaryproto.SEND:
+                fields = FieldReader(body)
+                parsed.append((fields.string(), fields.string()))
+    binary = (time.perf_counter() - start) / len(commands) * 1e9
+    assert parsed == commands
+    return {
+        'textBytesPerCommand': round(sum(map(len, textChunks)) / len(commands), 1),
+        'binaryBytesPerCommand': round(sum(map(len, binaryChunks)) / len(commands), 1),
+        'textParseNsPerCommand': round(text, 1),
+        'binaryParseNsPerCommand': round(binary, 1),
+    }
+
+# This function parses the command line, runs the measurements and prints the
+# results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Wire protocol micro-benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50, help="number of distinct senders")
+    parser.add_argument("--size", type=int, default=60, help="length of the text of the messages")
+    parser.add_argument("--batch", type=int, default=16, help="messages written to the client at a time")
+    args = parser.parse_args()
+
+    deliveries = makeDeliveries(args.messages, args.users, args.size)
+    results = {'messages': args.messages, 'users': args.users, 'size': args.size, 'batch': args.batch}
+    codecs = (('text', TextCodec()), ('binary', BinaryCodec(False)), ('binaryZlib', BinaryCodec(True)))
+    for name, codec in codecs:
+        if codec.binary:
+            codec.started = True
+        chunks, encodeCost = encodeStream(codec, deliveries, args.batch)
+        decodeCost = decodeBinary(chunks, args.messages) if codec.binary else decodeText(chunks, args.messages)
+        results[name] = {
+            'bytesPerMessage': round(sum(map(len, chunks)) / args.messages, 1),
+            'encodeNsPerMessage': round(encodeCost, 1),
+            'clientDecodeNsPerMessage': round(decodeCost, 1),
+        }
+    results['commands'] = measureCommands(deliveries, args.batch)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
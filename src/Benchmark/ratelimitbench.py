@@ -0,0 +1,128 @@
+"""
+    Python 3
+    Usage: python3 ratelimitbench.py [--mode thread] [--flooders 50] [--flood-rate 20000] [--rate 20]
+                                     [--duration 10] [--limits "--global-rate 2000 --user-rate 100"]
+    Benchmark of the rate limits of the server (see ratelimit.py). Many
+    users flood the server with broadcasts and whoelsesince while one user
+    sends direct messages to another at a fixed rate. The server is started
+    once without limits and once with the given limits, and the delivery
+    latency of the direct messages, the flood commands sent and the commands
+    refused by the server are printed as JSON for both runs.
+"""
+import argparse
+import asyncio
+import json
+import shlex
+import shutil
+import subprocess
+import time
+from loadbench import SimulatedClient, Stats, spawnServer, freePort, percentiles, MARKER, DELIVERY_PERCENTILES
+
+# The commands of the flood, sent in turn, and the commands sent per batch of a
+# flooder before it yields to the other tasks
+FLOOD_COMMANDS = ('broadcast flood', 'whoelsesince 3600')
+FLOOD_BATCH = 10
+
+# This coroutine sends the commands of the flood at the given rate until the
+# deadline and returns the number of commands sent
+async def flood(client, rate, deadline):
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(FLOOD_BATCH):
+            await client.send(FLOOD_COMMANDS[sent % len(FLOOD_COMMANDS)])
+            sent += 1
+        delay = start + sent / rate - time.perf_counter()
+        await asyncio.sleep(max(0.0, delay))
+    return sent
+
+# This coroutine sends direct messages carrying the time they were sent from
+# the sender to the recipient at the given rate until the deadline and
+# returns the number of messages sent
+async def chat(sender, recipient, rate, deadline):
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        await sender.send(f"message {recipient.userName} {MARKER}{time.perf_counter_ns()} direct")
+        sent += 1
+        await asyncio.sleep(max(0.0, start + sent / rate - time.perf_counter()))
+    return sent
+
+# This coroutine logs the clients in, runs the flood and the direct messages
+# and returns the results of the run
+async def runOnce(args):
+    chatStats, floodStats = Stats(), Stats()
+    sender = SimulatedClient(Stats(), f"{args.prefix}s", args.password)
+    recipient = SimulatedClient(chatStats, f"{args.prefix}r", args.password)
+    flooders = [SimulatedClient(floodStats, f"{args.prefix}{index}", args.password)
+                for index in range(args.flooders)]
+    for client in [sender, recipient] + flooders:
+        await client.connect(args.host, args.port)
+    await asyncio.sleep(0.5)
+
+    deadline = time.perf_counter() + args.duration
+    floodRate = args.flood_rate / max(1, args.flooders)
+    counts = await asyncio.gather(chat(sender, recipient, args.rate, deadline),
+                                  *(flood(flooder, floodRate, deadline) for flooder in flooders))
+    await asyncio.sleep(args.drain)
+    for client in [sender, recipient] + flooders:
+        client.close()
+    return {
+        'directSent': counts[0],
+        'directDelivered': chatStats.deliveries,
+        'directLatencyMs': percentiles(chatStats.latencies, DELIVERY_PERCENTILES),
+        'directRefused': sender.stats.errors,
+        'floodSent': sum(counts[1:]),
+        'floodRefused': floodStats.errors,
+    }
+
+# This function starts a server with the given extra arguments, runs the
+# benchmark against it and stops it
+def runServer(args, serverArgs):
+    run = argparse.Namespace(**vars(args))
+    run.port = freePort(args.host)
+    run.server_arg = args.server_arg + serverArgs
+    users = [(f"{args.prefix}{suffix}", args.password) for suffix in ['s', 'r'] + list(range(args.flooders))]
+    server, workDir = spawnServer(run, users)
+    try:
+        return asyncio.run(runOnce(run))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+# This function parses the command line, runs the benchmark without and with
+# the limits and prints the results as JSON
+def main():
+    parser = argparse.ArgumentParser(description="Rate limit and overload shedding benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="engine of the spawned servers (default: thread)")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument passed to both servers, may be repeated")
+    parser.add_argument("--server-timeout", type=int, default=3600,
+                        help="idle timeout in seconds of the spawned servers (default: 3600)")
+    parser.add_argument("--limits", default="--global-rate 2000 --user-rate 100",
+                        help="arguments of the server setting the limits of the second run")
+    parser.add_argument("--flooders", type=int, default=50, help="users flooding the server")
+    parser.add_argument("--flood-rate", type=float, default=20000.0,
+                        help="broadcasts and whoelsesince per second of all the flooders")
+    parser.add_argument("--rate", type=float, default=20.0, help="direct messages per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--drain", type=float, default=2.0,
+                        help="seconds to wait for deliveries in flight after the load stops")
+    parser.add_argument("--prefix", default="rbench", help="prefix of the user names")
+    parser.add_argument("--password", default="bench")
+    args = parser.parse_args()
+
+    results = {
+        'unlimited': runServer(args, []),
+        'limited': runServer(args, shlex.split(args.limits)),
+    }
+    print(json.dumps({'mode': args.mode, 'limits': args.limits, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
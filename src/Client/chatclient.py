@@ -0,0 +1,285 @@
+"""
+    Python 3
+    Programmatic client for applications and integrations, built on the core
+    of the client (see clientcore.py). A ChatClient logs in, sends messages
+    and broadcasts without waiting for any reply, so that requests are
+    pipelined on the connection, and hands what it receives to the
+    application as Event objects through an async iterator:
+
+        client = ChatClient('localhost', 12000)
+        await client.start()
+        await client.login('hans', 'falcon*solo')
+        await client.sendMessage('yoda', 'hello')
+        await client.sendMany([('yoda', 'one'), ('vader', 'two')])
+        async for event in client:
+            print(event.kind, event.user, event.text)
+
+    Messages, broadcasts, channel messages and presence carry their user
+    only with the binary protocol; with the text protocol everything the
+    server sends is a 'text' event.
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from clientcore import ClientCore
+from framing import encodeFrame
+import binaryproto
+from binaryproto import encodeBinaryFrame, encodeString
+
+# The kinds of events. A message, a broadcast or a private message carries
+# the user who sent it and the text, a channel message also the name of its
+# channel, a login or logout the user, users the
+# list of user names of whoelse or whoelsesince, snapshot the online users
+# followed once subscribed to presence, text any other text of the
+# server or of a peer, and exit the last text of the server
+MESSAGE = 'message'
+BROADCAST = 'broadcast'
+CHANNEL = 'channel'
+PRIVATE = 'private'
+LOGIN = 'login'
+LOGOUT = 'logout'
+USERS = 'users'
+SNAPSHOT = 'snapshot'
+TEXT = 'text'
+EXIT = 'exit'
+
+# The prompts of the login procedure, which are answered by login() rather
+# than handed to the application. The password is only sent once the server
+# has asked for it
+USERNAME_PROMPT = "Username: "
+PASSWORD_PROMPTS = ("Password: ", "This is a new user. Enter a password: ")
+
+"""
+    Define the error raised by login() when the server does not log the user
+    in, with the text of the server
+"""
+class LoginError(Exception):
+    pass
+
+"""
+    Define an event received by the client.
+"""
+class Event:
+    __slots__ = ('kind', 'user', 'text', 'users', 'channel')
+
+    # This is the constructor of the event
+    def __init__(self, kind, user=None, text='', users=(), channel=None):
+        self.kind = kind
+        self.user = user
+        self.text = text
+        self.users = users
+        self.channel = channel
+
+    # This function returns the representation of the event
+    def __repr__(self):
+        return f"Event({self.kind!r}, {self.user!r}, {self.text!r}, {list(self.users)!r}, {self.channel!r})"
+
+"""
+    Define the programmatic client. Events are queued until the application
+    takes them, which it should keep doing while the client runs.
+"""
+class ChatClient(ClientCore):
+
+    # This is the constructor of the client of the server at the given
+    # address. text selects the text protocol
+    def __init__(self, serverHost, serverPort, text=False):
+        ClientCore.__init__(self, serverHost, serverPort, text)
+        self.eventQueue = None
+        self.loginResult = None
+
+        # The version of the presence feed of the server which the last
+        # snapshot or change received is at, or None unless subscribed
+        self.presenceVersion = None
+
+    """
+        Public APIs of the client.
+    """
+
+    # This coroutine connects to the server and negotiates the protocol
+    async def start(self):
+        self.eventQueue = asyncio.Queue()
+        await ClientCore.start(self)
+
+    # This coroutine logs the user in, registering the user if new, and
+    # returns once the server has welcomed the user. The password is sent once
+    # the server has asked for it, so that it is never taken for a user name.
+    # LoginError is raised if the server refuses them, after which the client
+    # should be closed
+    async def login(self, userName, password):
+        await self.answerLogin(userName)
+        await self.answerLogin(password)
+
+        # The welcome of the binary protocol names the user who has logged in,
+        # that of the text protocol does not, the user is then the one whose
+        # password was asked for
+        if self.userName is None:
+            self.userName = userName
+
+    # This coroutine sends a message to the user, without waiting for the
+    # server to deliver it
+    async def sendMessage(self, userName, text):
+        self.writeFrames([self.messageFrame(userName, text)])
+        await self.drain()
+
+    # This coroutine broadcasts a message to every user online
+    async def broadcast(self, text):
+        if self.binary:
+            frame = encodeBinaryFrame(binaryproto.SEND_BROADCAST, encodeString(text))
+        else:
+            frame = encodeFrame(f"broadcast {text}")
+        self.writeFrames([frame])
+        await self.drain()
+
+    # This coroutine sends a message to the members of the channel, which the
+    # user must have joined with send('join <channel>')
+    async def sendChannel(self, channel, text):
+        self.sendToServer(f"channel {channel} {text}")
+        await self.drain()
+
+    # This coroutine sends the messages of the given (userName, text) pairs
+    # with as few writes as possible, compressed together with the binary
+    # protocol
+    async def sendMany(self, messages):
+        self.writeFrames([self.messageFrame(userName, text) for userName, text in messages])
+        await self.drain()
+
+    # This coroutine subscribes to the presence of the given users, or of all
+    # the users if none are given. The online users followed are received as
+    # a snapshot event, then their logins and logouts as login and logout
+    # events, gathered by the server over a short window
+    async def subscribe(self, userNames=()):
+        self.sendToServer(' '.join(('subscribe',) + tuple(userNames)))
+        await self.drain()
+
+    # This coroutine ends the subscription to presence, after which the login
+    # and logout notices of all the users are received again
+    async def unsubscribe(self):
+        self.sendToServer('unsubscribe')
+        await self.drain()
+
+    # This coroutine sends any command, as typed in the terminal client
+    async def send(self, line):
+        await self.handleLine(line)
+
+    # This coroutine yields the events received until the client is closed
+    async def events(self):
+        while True:
+            event = await self.eventQueue.get()
+            if event is None:
+                return
+            yield event
+
+    # This function returns the iterator of the events of the client
+    def __aiter__(self):
+        return self.events()
+
+    # This coroutine closes the client, which ends the iterator of its events
+    async def close(self):
+        if self.closed.is_set():
+            return
+        await ClientCore.close(self)
+        self.eventQueue.put_nowait(None)
+        if self.loginResult is not None and not self.loginResult.done():
+            self.loginResult.set_exception(LoginError("connection closed"))
+
+    """
+        Helper functions of the client.
+    """
+
+    # This coroutine waits while the data written to the server is above the
+    # high watermark of the connection, which is the only time the client
+    # waits when sending
+    async def drain(self):
+        try:
+            await self.serverWriter.drain()
+        except (ConnectionError, OSError):
+            await self.close()
+
+    # This coroutine sends one answer of the login procedure and returns once
+    # the server has asked for the password or welcomed the user
+    async def answerLogin(self, answer):
+        self.loginResult = asyncio.get_running_loop().create_future()
+        self.sendToServer(answer)
+        await self.drain()
+        try:
+            await self.loginResult
+        finally:
+            self.loginResult = None
+
+    # This function returns the frame of a message to the user
+    def messageFrame(self, userName, text):
+        if self.binary:
+            return encodeBinaryFrame(binaryproto.SEND, encodeString(userName), encodeString(text))
+        return encodeFrame(f"message {userName} {text}")
+
+    # This function queues an event for the application
+    def emit(self, kind, user=None, text='', users=(), channel=None):
+        self.eventQueue.put_nowait(Event(kind, user, text, users, channel))
+
+    # This function queues any other text shown by the core as a text event
+    def output(self, text):
+        self.emit(TEXT, text=text)
+
+    # This function hands the prompt for the password to login(), or queues
+    # the text as an event. Any text but a prompt while logging in means that
+    # the login has failed
+    def onText(self, text):
+        if self.loginResult is not None and not self.loginResult.done():
+            if text in PASSWORD_PROMPTS:
+                self.loginResult.set_result(None)
+            elif text != USERNAME_PROMPT:
+                self.loginResult.set_exception(LoginError(text.strip().split('\n')[0]))
+            return
+        self.emit(TEXT, text=text)
+
+    # This function completes the login
+    def onWelcome(self, userName, text):
+        if self.loginResult is not None and not self.loginResult.done():
+            self.loginResult.set_result(None)
+
+    # This function queues a message or broadcast as an event
+    def onMessage(self, sender, body, broadcast):
+        self.emit(BROADCAST if broadcast else MESSAGE, sender, body)
+
+    # This function queues a message to a channel as an event
+    def onChannel(self, channel, sender, body):
+        self.emit(CHANNEL, sender, body, channel=channel)
+
+    # This function queues a login or logout as an event
+    def onPresence(self, userName, online):
+        self.emit(LOGIN if online else LOGOUT, userName)
+
+    # This function queues the online users followed as a snapshot event
+    def onPresenceSnapshot(self, version, userNames):
+        self.presenceVersion = version
+        self.emit(SNAPSHOT, users=userNames)
+
+    # This function queues the logins and logouts of the followed users as
+    # events, leaving out changes older than the last snapshot, which has them
+    def onPresenceDeltas(self, version, changes):
+        if self.presenceVersion is not None and version <= self.presenceVersion:
+            return
+        self.presenceVersion = version
+        for userName, online in changes:
+            self.emit(LOGIN if online else LOGOUT, userName)
+
+    # This function queues a list of users as an event
+    def onUsers(self, userNames):
+        self.emit(USERS, users=userNames)
+
+    # This function queues a private message, or a notice of private messaging,
+    # as an event
+    def onPeerText(self, text):
+        sender, separator, body = text.partition('(private): ')
+        if separator:
+            self.emit(PRIVATE, sender, body)
+        else:
+            self.emit(TEXT, text=text + '\n')
+
+    # This function queues the last text of the server as an event, or fails
+    # the login it ends
+    def onExit(self, text):
+        if self.loginResult is not None and not self.loginResult.done():
+            self.loginResult.set_exception(LoginError(text.strip()))
+        self.emit(EXIT, text=text)
@@ -0,0 +1,575 @@
+"""
+    Python 3
+    Event driven core of the client, separate from the terminal interface of
+    client.py so that it can be imported as a library. One asyncio event loop
+    multiplexes the connection to the server, the listening socket for
+    private messaging and the connections to every peer, so a process can
+    run many clients at once, such as bots or the clients of a load test.
+
+    The core speaks the binary protocol (see binaryproto.py) unless asked
+    for the text protocol or the server does not accept it. Private messages
+    are exchanged with a peer over one connection, opened by the client
+    initiating private messaging to the listening socket of the other and
+    framed like the messages of the server. The connection is kept open
+    once private messaging stops, so that a later session with the same
+    peer starts without connecting again. When the peers cannot connect to
+    each other, their private messages are relayed by the server instead.
+"""
+import asyncio
+import os
+import sys
+from collections import deque
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import FrameDecoder, FrameError, encodeFrame, RECV_SIZE
+import binaryproto
+from binaryproto import (FieldReader, BinaryDecoder, BatchCompressor, encodeBinaryFrame, encodeVarint,
+                         encodeString, BINARY_TOKEN, ZLIB)
+
+# The text the server welcomes a user with, which tells a client of the text
+# protocol that the user has logged in
+WELCOME_TEXT = "Welcome to the greatest messaging application ever!\n"
+
+# The first frame sent over a connection to a peer, naming the user of the
+# client, and the marker of the frames of private messaging relayed by the
+# server
+HELLO = "['HELLO']"
+RELAY = "['RELAY']"
+
+# The seconds to wait for a connection to a peer, and for a peer which has
+# initiated private messaging to connect before connecting to it instead
+CONNECT_TIMEOUT = 2
+LINK_TIMEOUT = 1
+
+# The backlog of the listening socket for private messaging, so that many
+# peers may start private messaging at once, and the number of connections
+# to peers kept open without a private messaging session
+PEER_BACKLOG = 1024
+MAX_IDLE_LINKS = 32
+
+# The commands of the binary protocol taking a user name
+BINARY_USER_COMMANDS = {
+    'block': binaryproto.BLOCK,
+    'unblock': binaryproto.UNBLOCK,
+    'startprivate': binaryproto.STARTPRIVATE,
+}
+
+"""
+    Define the reader of the frames of one connection, decoded by a
+    FrameDecoder or, once the binary protocol has been negotiated, by a
+    BinaryDecoder.
+"""
+class StreamFrameReader:
+
+    # This is the constructor of the reader of the given stream
+    def __init__(self, reader):
+        self.reader = reader
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.undecoded = False
+
+    # This coroutine returns the payload of the next frame, or None once the
+    # connection has been closed. The first frame is read alone, leaving what
+    # follows it to the decoder given to setDecoder()
+    async def readFrame(self, first=False):
+        if first:
+            frames = self.decoder.feed(b'', 1)
+            while not frames:
+                data = await self.reader.read(RECV_SIZE)
+                if not data:
+                    return None
+                frames = self.decoder.feed(data, 1)
+            self.undecoded = True
+            return frames[0]
+        if self.undecoded:
+            self.undecoded = False
+            self.pending.extend(self.decoder.feed(b''))
+        while not self.pending:
+            data = await self.reader.read(RECV_SIZE)
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    # This function decodes the rest of the input with the given decoder
+    def setDecoder(self, decoder):
+        self.pending.extend(decoder.feed(bytes(self.decoder.buffer)))
+        self.decoder = decoder
+        self.undecoded = False
+
+"""
+    Define the core of a client. The interface gives the lines typed by the
+    user to handleLine() and shows what output() is called with, which
+    prints by default. What the client receives is handed to the on...()
+    functions first, which show it with output() unless overridden. The
+    client runs until closed, by the user logging out, by the server ending
+    the session or by close().
+"""
+class ClientCore:
+
+    # This is the constructor of the client of the server at the given
+    # address. text selects the text protocol
+    def __init__(self, serverHost, serverPort, text=False):
+        self.serverHost = serverHost
+        self.serverPort = serverPort
+        self.text = text
+
+        # userName keeps track of the user of the client. privateRequests holds
+        # the peers which have started private messaging and wait for the user
+        # to accept it, the first of which the next line typed answers
+        self.userName = None
+        self.privateRequests = deque()
+
+        # binary is set once the server has accepted the binary protocol,
+        # loggedIn once it has welcomed the user, and userNames maps the ids
+        # of the users it defined to their names
+        self.binary = False
+        self.loggedIn = False
+        self.userNames = {}
+        self.compressor = None
+
+        # The connection to each peer, least recently used first, including
+        # those kept open after private messaging has stopped, and every
+        # connection read from. privatePeers are the peers of the current
+        # private messaging sessions, and linkWaiters the futures of those
+        # waiting for the peer to connect
+        self.peerWriters = {}
+        self.peerConnections = set()
+        self.privatePeers = set()
+        self.linkWaiters = {}
+
+        self.serverReader = None
+        self.serverWriter = None
+        self.p2pServer = None
+        self.p2pPort = None
+        self.tasks = set()
+        self.closed = None
+
+    """
+        Public APIs of the client.
+    """
+
+    # This coroutine connects to the server, starts listening for private
+    # messaging and negotiates the protocol. The binary protocol is asked for
+    # in the handshake: a server accepting it replies with the binary token,
+    # an older server with the login prompt, which is then shown as usual
+    async def start(self):
+        self.closed = asyncio.Event()
+        reader, self.serverWriter = await asyncio.open_connection(self.serverHost, self.serverPort)
+        self.serverReader = StreamFrameReader(reader)
+        self.p2pServer = await asyncio.start_server(self.acceptPeer, 'localhost', 0, backlog=PEER_BACKLOG)
+        self.p2pPort = self.p2pServer.sockets[0].getsockname()[1]
+        if self.text:
+            self.serverWriter.write(encodeFrame(f"['p2pPort'] {self.p2pPort}"))
+        else:
+            self.serverWriter.write(encodeFrame(f"['p2pPort'] {self.p2pPort} {BINARY_TOKEN} {ZLIB}"))
+            reply = await self.serverReader.readFrame(first=True)
+            if reply is None:
+                await self.close()
+                return
+            reply = reply.decode()
+            if reply.startswith(BINARY_TOKEN):
+                self.binary = True
+                self.compressor = BatchCompressor(ZLIB in reply.split())
+                self.serverReader.setDecoder(BinaryDecoder())
+            else:
+                self.onText(reply)
+        self.spawn(self.readServer())
+
+    # This coroutine handles a line typed by the user. Everything is sent to
+    # the server unless the user answers a request for private messaging,
+    # privately messages a peer, stops a private messaging session or logs out
+    async def handleLine(self, line):
+        if self.closed.is_set():
+            return
+        if line.lower() == "logout":
+            for peer in self.privatePeers:
+                self.sendPeer(peer, f"['EXIT'] {self.userName} {peer}")
+            await self.close()
+        elif self.privateRequests:
+
+            # The server is told the answer, as it only relays the frames of
+            # private messaging which has been accepted. A decline ends private
+            # messaging at once, without waiting for the peer to answer, and is
+            # sent before the server is told
+            peer = self.privateRequests.popleft()
+            if line == 'y':
+                self.sendToServer(f"acceptprivate {peer}")
+                self.sendPeer(peer, f"{self.userName} accepts private messaging")
+            else:
+                self.sendPeer(peer, f"{self.userName} declines private messaging")
+                self.sendPeer(peer, f"['EXIT'] {self.userName} ['END']")
+                self.sendToServer(f"declineprivate {peer}")
+                self.privatePeers.discard(peer)
+                self.pruneLinks()
+                self.output(f"Private messaging with {peer} closed\n")
+            if self.privateRequests:
+                self.output(f"{self.privateRequests[0]} would like to private message, enter y or n: ")
+        else:
+
+            # A blank line is not sent to the server
+            words = line.split()
+            if not words:
+                return
+            if len(words) >= 2 and words[0] == "private":
+                if words[1] in self.privatePeers:
+                    self.sendToServer("['0']")
+                    self.sendPeer(words[1], f"{self.userName}(private): " + ' '.join(words[2:]))
+                else:
+                    self.output(f"Error. Private messaging to {words[1]} not enabled\n")
+            elif len(words) == 2 and words[0] == "stopprivate":
+                if words[1] in self.privatePeers:
+                    self.sendToServer("['0']")
+                    self.sendPeer(words[1], f"['EXIT'] {self.userName} {words[1]}")
+                else:
+                    self.output(f"Error. Cannot stop an inexist private session with {words[1]}\n")
+            else:
+                self.sendToServer(' '.join(words))
+        try:
+            await self.serverWriter.drain()
+        except (ConnectionError, OSError):
+            await self.close()
+
+    # This function sends a line, or a keep-alive, to the server
+    def sendToServer(self, message):
+        if self.binary:
+            self.writeFrames([self.encodeCommand(message)])
+        else:
+            self.writeFrames([encodeFrame(message)])
+
+    # This function writes the given frames to the server at once, compressed
+    # together if the binary protocol is compressed
+    def writeFrames(self, frames):
+        if self.binary:
+            frames = self.compressor.pack(frames)
+        self.serverWriter.writelines(frames)
+
+    # This function shows the given text to the user
+    def output(self, text):
+        print(text, end="", flush=True)
+
+    """
+        Handlers of what the client receives, which show it to the user.
+    """
+
+    # This function handles any text of the server
+    def onText(self, text):
+        self.output(text)
+
+    # This function handles the welcome of the server once the user has logged
+    # in. userName is None in the text protocol
+    def onWelcome(self, userName, text):
+        self.output(text)
+
+    # This function handles a message, or a broadcast if broadcast is set, of
+    # another user
+    def onMessage(self, sender, body, broadcast):
+        self.output(f"{sender}: {body}\n")
+
+    # This function handles a message of another user to a channel
+    def onChannel(self, channel, sender, body):
+        self.output(f"[#{channel}] {sender}: {body}\n")
+
+    # This function handles another user logging in or out
+    def onPresence(self, userName, online):
+        self.output(f"{userName} logged {'in' if online else 'out'}\n")
+
+    # This function handles the online users followed by the client at the
+    # given version of the presence feed of the server, once subscribed
+    def onPresenceSnapshot(self, version, userNames):
+        self.output(f"Presence version {version}, online: {' '.join(userNames) or 'nobody'}\n")
+
+    # This function handles the followed users who have logged in or out, a
+    # list of (userName, online) pairs, at the given version of the feed
+    def onPresenceDeltas(self, version, changes):
+        text = ', '.join(f"{userName} logged {'in' if online else 'out'}" for userName, online in changes)
+        self.output(f"Presence version {version}: {text}\n")
+
+    # This function handles a list of users
+    def onUsers(self, userNames):
+        self.output(''.join(userName + '\n' for userName in userNames))
+
+    # This function handles a private message, or a notice of private
+    # messaging, received from a peer
+    def onPeerText(self, text):
+        self.output(text + '\n')
+
+    # This function handles the last text of the server, which has ended the
+    # session
+    def onExit(self, text):
+        self.output(text)
+
+    # This coroutine closes the connections of the client and stops it
+    async def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        for writer in list(self.peerWriters.values()) + list(self.peerConnections):
+            writer.close()
+        self.peerWriters.clear()
+        self.peerConnections.clear()
+        self.privatePeers.clear()
+        if self.p2pServer is not None:
+            self.p2pServer.close()
+        if self.serverWriter is not None:
+            self.serverWriter.close()
+        for task in list(self.tasks):
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    # This coroutine waits until the client has been closed
+    async def waitClosed(self):
+        await self.closed.wait()
+
+    """
+        Helper functions of the client.
+    """
+
+    # This function runs the given coroutine as a task of the client, which
+    # is cancelled when the client is closed
+    def spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # This function sends a private message, or a control message of private
+    # messaging, to the peer, over the connection to the peer if there is one
+    # and through the server otherwise
+    def sendPeer(self, peer, message):
+        writer = self.peerWriters.get(peer)
+        if writer is not None and not writer.is_closing():
+            writer.write(encodeFrame(message))
+        else:
+            self.sendToServer(f"relay {peer} {message}")
+
+    # This coroutine handles the frames sent to the client by the server until
+    # the connection is closed
+    async def readServer(self):
+        try:
+            while True:
+                data = await self.serverReader.readFrame()
+                if data is None:
+                    break
+                if self.binary:
+                    await self.handleBinaryFrame(data)
+                else:
+                    await self.handleTextFrame(data.decode())
+        except (ConnectionError, OSError, FrameError):
+            pass
+        await self.close()
+
+    # This coroutine handles a frame of the text protocol, looking for the
+    # markers of the server in the text
+    async def handleTextFrame(self, data):
+        if data.startswith(RELAY):
+            self.handlePeerFrame(data.split(' ', 2)[2])
+        elif "['EXIT']" in data:
+            await self.exitSession(data[:-8])
+        elif "['TARGET']" in data:
+            data = data.split()
+            self.userName = data[4]
+            await self.startNewPrivateConnection(data[1], data[2], data[3], data[5] == 'True')
+        elif data == WELCOME_TEXT:
+            self.loggedIn = True
+            self.onWelcome(None, data)
+        else:
+            self.onText(data)
+
+    # This coroutine handles a frame of the binary protocol, dispatching on its
+    # opcode
+    async def handleBinaryFrame(self, body):
+        opcode = body[0]
+        fields = FieldReader(body)
+        if opcode == binaryproto.MESSAGE or opcode == binaryproto.BROADCAST:
+            sender = self.userNames[fields.varint()]
+            self.onMessage(sender, fields.string(), opcode == binaryproto.BROADCAST)
+        elif opcode == binaryproto.CHANNEL:
+            sender = self.userNames[fields.varint()]
+            channel = fields.string()
+            self.onChannel(channel, sender, fields.string())
+        elif opcode == binaryproto.TEXT:
+            self.onText(fields.string())
+        elif opcode == binaryproto.USER:
+            id = fields.varint()
+            self.userNames[id] = fields.string()
+        elif opcode == binaryproto.PRESENCE:
+            user = self.userNames[fields.varint()]
+            self.onPresence(user, bool(fields.byte()))
+        elif opcode == binaryproto.USERS:
+            count = fields.varint()
+            self.onUsers([self.userNames[fields.varint()] for _ in range(count)])
+        elif opcode == binaryproto.SNAPSHOT:
+            version = fields.varint()
+            count = fields.varint()
+            self.onPresenceSnapshot(version, [self.userNames[fields.varint()] for _ in range(count)])
+        elif opcode == binaryproto.DELTAS:
+            version = fields.varint()
+            count = fields.varint()
+            self.onPresenceDeltas(version, [(self.userNames[fields.varint()], bool(fields.byte()))
+                                            for _ in range(count)])
+        elif opcode == binaryproto.TARGET:
+            peer = self.userNames[fields.varint()]
+            address = fields.string()
+            port = fields.varint()
+            self.userName = self.userNames[fields.varint()]
+            await self.startNewPrivateConnection(peer, address, port, bool(fields.byte()))
+        elif opcode == binaryproto.RELAY:
+            fields.varint()
+            self.handlePeerFrame(fields.string())
+        elif opcode == binaryproto.WELCOME:
+            self.userName = self.userNames[fields.varint()]
+            self.loggedIn = True
+            self.onWelcome(self.userName, fields.string())
+        elif opcode == binaryproto.EXIT:
+            await self.exitSession(fields.string())
+
+    # This function returns the frame of the binary protocol for a line typed
+    # by the user. Commands are encoded with their own opcodes once logged in,
+    # anything else is sent as text for the server to interpret
+    def encodeCommand(self, message):
+        words = message.split()
+        if self.loggedIn and words:
+            command = words[0]
+            if command == 'message' and len(words) >= 2:
+                return encodeBinaryFrame(binaryproto.SEND, encodeString(words[1]), encodeString(' '.join(words[2:])))
+            if command == 'broadcast':
+                return encodeBinaryFrame(binaryproto.SEND_BROADCAST, encodeString(' '.join(words[1:])))
+            if command == 'whoelse':
+                return encodeBinaryFrame(binaryproto.WHOELSE)
+            if command == 'whoelsesince' and len(words) == 2 and words[1].isdecimal():
+                return encodeBinaryFrame(binaryproto.WHOELSESINCE, encodeVarint(int(words[1])))
+            if command == 'relay' and len(words) >= 3:
+                return encodeBinaryFrame(binaryproto.SEND_RELAY, encodeString(words[1]),
+                                         encodeString(' '.join(words[2:])))
+            if command in BINARY_USER_COMMANDS and len(words) == 2:
+                return encodeBinaryFrame(BINARY_USER_COMMANDS[command], encodeString(words[1]))
+            if message == "['0']":
+                return encodeBinaryFrame(binaryproto.KEEPALIVE)
+        return encodeBinaryFrame(binaryproto.TEXT, encodeString(message))
+
+    # This coroutine starts private messaging with the peer, listening on the
+    # given address and port, once the server has accepted it. The initiator
+    # connects to the peer, unless a connection to it is open already, while
+    # the user of the other client is asked whether to accept it
+    async def startNewPrivateConnection(self, peer, address, port, initiator):
+        self.privatePeers.add(peer)
+        if initiator:
+            if not await self.connectPeer(peer, address, port):
+                self.output(f"Private messaging with {peer} relayed through the server\n")
+            return
+        self.privateRequests.append(peer)
+        if len(self.privateRequests) == 1:
+            self.output(f"{peer} would like to private message, enter y or n: ")
+        if not self.hasLink(peer):
+            self.spawn(self.awaitLink(peer, address, port))
+
+    # This coroutine shows the last text of the server, closes the private
+    # messaging sessions and stops the client once the server has ended the
+    # session
+    async def exitSession(self, text):
+        self.onExit(text)
+        for peer in self.privatePeers:
+            self.sendPeer(peer, f"['EXIT'] {self.userName} {peer} True")
+        await self.close()
+
+    # This coroutine is started for every connection opened by a peer
+    async def acceptPeer(self, reader, writer):
+        await self.readPeer(StreamFrameReader(reader), writer, None)
+
+    # This coroutine handles the frames received over a connection to the given
+    # peer, or to a peer which names itself in its first frame, until the
+    # connection is closed
+    async def readPeer(self, frameReader, writer, peer):
+        self.peerConnections.add(writer)
+        try:
+            while True:
+                data = await frameReader.readFrame()
+                if data is None:
+                    break
+                data = data.decode()
+                if data.startswith(HELLO):
+                    peer = data.split()[1]
+                    self.addLink(peer, writer)
+                else:
+                    self.handlePeerFrame(data)
+        except (ConnectionError, OSError, FrameError, IndexError):
+            pass
+        self.peerConnections.discard(writer)
+        if peer is not None and self.peerWriters.get(peer) is writer:
+            del self.peerWriters[peer]
+        writer.close()
+
+    # This function handles a frame of private messaging from a peer, received
+    # over a connection or relayed by the server. A peer ending private
+    # messaging is answered, and the connection to it kept for later
+    def handlePeerFrame(self, data):
+        if "['EXIT']" not in data:
+            self.onPeerText(data)
+            return
+        words = data.split()
+        peer = words[1]
+        if "['END']" not in data:
+            self.sendPeer(peer, f"{words[0]} {words[2]} ['END']")
+        self.privatePeers.discard(peer)
+        if peer in self.privateRequests:
+            self.privateRequests.remove(peer)
+        self.pruneLinks()
+        if len(words) > 3 and words[3] == 'True':
+            self.output(f"Private messaging with {peer} closed due to inactivity\n")
+        else:
+            self.output(f"Private messaging with {peer} closed\n")
+
+    # This function returns whether a connection to the peer is open
+    def hasLink(self, peer):
+        writer = self.peerWriters.get(peer)
+        return writer is not None and not writer.is_closing()
+
+    # This function records the connection to the peer, keeping the one found
+    # first if both clients have connected to each other, and wakes up the
+    # session waiting for it
+    def addLink(self, peer, writer):
+        current = self.peerWriters.get(peer)
+        if current is None or current.is_closing() or current is writer:
+            self.peerWriters.pop(peer, None)
+            self.peerWriters[peer] = writer
+        waiter = self.linkWaiters.pop(peer, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        self.pruneLinks()
+
+    # This coroutine names the user to the peer over the connection to it,
+    # which is opened unless it is open already. It returns False if the peer
+    # could not be connected to, leaving its messages to be relayed
+    async def connectPeer(self, peer, address, port):
+        writer = self.peerWriters.pop(peer, None)
+        if writer is None or writer.is_closing():
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(address, int(port)),
+                                                        CONNECT_TIMEOUT)
+            except (OSError, ValueError, asyncio.TimeoutError):
+                return False
+            self.spawn(self.readPeer(StreamFrameReader(reader), writer, peer))
+        self.peerWriters[peer] = writer
+        writer.write(encodeFrame(f"{HELLO} {self.userName}"))
+        return True
+
+    # This coroutine waits for the peer which has initiated private messaging
+    # to connect, and connects to the peer instead if it has not, in case only
+    # this client can reach the other. Until then the messages are relayed
+    async def awaitLink(self, peer, address, port):
+        waiter = self.linkWaiters.get(peer)
+        if waiter is None:
+            waiter = self.linkWaiters[peer] = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), LINK_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.linkWaiters.pop(peer, None)
+            if peer in self.privatePeers and not self.hasLink(peer):
+                await self.connectPeer(peer, address, port)
+
+    # This function closes the least recently used connections to peers without
+    # a private messaging session beyond MAX_IDLE_LINKS
+    def pruneLinks(self):
+        idle = [peer for peer in self.peerWriters if peer not in self.privatePeers]
+        for peer in idle[:len(idle) - MAX_IDLE_LINKS]:
+            self.peerWriters.pop(peer).close()
@@ -0,0 +1,125 @@
+"""
+    Python 3
+    Unit tests of the login procedure of the programmatic client of
+    chatclient.py, against a server scripted like the login procedure of the
+    real one.
+    Usage: python3 -m pytest src/Client
+"""
+import asyncio
+import unittest
+from chatclient import ChatClient, LoginError
+from clientcore import StreamFrameReader, WELCOME_TEXT
+from framing import encodeFrame
+
+# The registered users of the scripted server and the user already logged in
+PASSWORDS = {'hans': 'falcon*solo', 'yoda': 'wise@!man'}
+ACTIVE = 'hans'
+
+"""
+    Define a server answering the login procedure of the text protocol. Every
+    frame it receives is kept, with the prompt it was an answer to.
+"""
+class ScriptedServer:
+
+    # This is the constructor of the server
+    def __init__(self):
+        self.received = []
+        self.registered = {}
+
+    # This coroutine starts the server on a free port
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, 'localhost', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    # This coroutine closes the server
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    # This coroutine serves one client until it has logged in
+    async def serve(self, reader, writer):
+        frames = StreamFrameReader(reader)
+        await frames.readFrame(first=True)
+        prompt = "Username: "
+        while True:
+            writer.write(encodeFrame(prompt))
+            data = await frames.readFrame()
+            if data is None:
+                break
+            data = data.decode()
+            self.received.append((prompt, data))
+            if prompt.endswith("Username: "):
+                userName = data
+                if userName == ACTIVE:
+                    prompt = "This user is currently active. Please login with another user\nUsername: "
+                elif userName in PASSWORDS:
+                    prompt = "Password: "
+                else:
+                    prompt = "This is a new user. Enter a password: "
+            elif prompt == "Password: " and data != PASSWORDS[userName]:
+                prompt = "Invalid Password. Please try again\nPassword: "
+            else:
+                if prompt.startswith("This is a new user"):
+                    self.registered[userName] = data
+                writer.write(encodeFrame(WELCOME_TEXT))
+                break
+        await writer.drain()
+
+"""
+    Define the tests of the login of a client of the text protocol.
+"""
+class ChatClientLoginTest(unittest.TestCase):
+
+    # This function runs the given coroutine with a client of a scripted
+    # server, and returns the server
+    def runLogin(self, steps):
+        async def main():
+            server = ScriptedServer()
+            port = await server.start()
+            client = ChatClient('localhost', port, text=True)
+            await client.start()
+            try:
+                await steps(client)
+            finally:
+                await client.close()
+                await server.close()
+            return server
+        return asyncio.run(main())
+
+    def testPasswordSentAfterPrompt(self):
+        async def steps(client):
+            await client.login('yoda', 'wise@!man')
+            self.assertEqual(client.userName, 'yoda')
+        server = self.runLogin(steps)
+        self.assertEqual(server.received, [("Username: ", 'yoda'), ("Password: ", 'wise@!man')])
+
+    def testNewUser(self):
+        async def steps(client):
+            await client.login('luke', 'force')
+            self.assertEqual(client.userName, 'luke')
+        server = self.runLogin(steps)
+        self.assertEqual(server.registered, {'luke': 'force'})
+
+    def testActiveUserThenOtherUser(self):
+
+        # The password of the active user is not sent, and is never taken for
+        # the name of a new user
+        async def steps(client):
+            with self.assertRaises(LoginError):
+                await client.login('hans', 'falcon*solo')
+            self.assertIsNone(client.userName)
+            await client.login('yoda', 'wise@!man')
+            self.assertEqual(client.userName, 'yoda')
+        server = self.runLogin(steps)
+        self.assertEqual([data for prompt, data in server.received], ['hans', 'yoda', 'wise@!man'])
+        self.assertEqual(server.registered, {})
+
+    def testInvalidPassword(self):
+        async def steps(client):
+            with self.assertRaises(LoginError):
+                await client.login('yoda', 'dark')
+            self.assertIsNone(client.userName)
+        self.runLogin(steps)
+
+if __name__ == "__main__":
+    unittest.main()
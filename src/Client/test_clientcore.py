@@ -0,0 +1,207 @@
+"""
+    Python 3
+    Unit tests of the client core of clientcore.py, whose connections are
+    replaced by writers which keep what the client writes.
+    Usage: python3 -m pytest src/Client
+"""
+import asyncio
+import unittest
+from clientcore import ClientCore, HELLO
+from framing import FrameDecoder
+import binaryproto
+from binaryproto import BatchCompressor, encodeBinaryFrame, encodeString, encodeVarint
+
+"""
+    Define a stream writer which keeps the bytes written to it.
+"""
+class RecordingWriter:
+
+    # This is the constructor of the writer
+    def __init__(self):
+        self.data = bytearray()
+        self.closing = False
+
+    # This function keeps the written bytes
+    def write(self, data):
+        self.data += data
+
+    # This function keeps the written buffers
+    def writelines(self, buffers):
+        for data in buffers:
+            self.write(data)
+
+    # This coroutine returns at once, as nothing is buffered
+    async def drain(self):
+        pass
+
+    # This function returns whether the writer has been closed
+    def is_closing(self):
+        return self.closing
+
+    # This function closes the writer
+    def close(self):
+        self.closing = True
+
+    # This function returns the texts of the frames written since the last
+    # call, in the text protocol
+    def takeTexts(self):
+        data, self.data = bytes(self.data), bytearray()
+        return [payload.decode() for payload in FrameDecoder().feed(data)]
+
+"""
+    Define a client whose connection to the server is a recording writer and
+    which keeps what it would show to the user.
+"""
+class RecordingClient(ClientCore):
+
+    # This is the constructor of the client of the given protocol, logged in
+    # as hans
+    def __init__(self, binary=False):
+        ClientCore.__init__(self, 'localhost', 0, text=not binary)
+        self.binary = binary
+        self.compressor = BatchCompressor(False)
+        self.serverWriter = RecordingWriter()
+        self.userName = 'hans'
+        self.loggedIn = True
+        self.shown = []
+
+    # This function keeps the text shown to the user
+    def output(self, text):
+        self.shown.append(text)
+
+"""
+    Define the base of the tests, which run the coroutines of their client.
+"""
+class ClientTestCase(unittest.TestCase):
+
+    # This function runs the given coroutine on a new event loop, on which the
+    # client is set up to run
+    def runClient(self, coroutine):
+        async def main():
+            self.client.closed = asyncio.Event()
+            await coroutine
+        asyncio.run(main())
+
+"""
+    Define the tests of the commands sent to the server.
+"""
+class ClientCommandTest(ClientTestCase):
+
+    def testEncodeCommand(self):
+        self.client = RecordingClient(binary=True)
+
+        # Commands are encoded with their own opcodes once logged in
+        self.assertEqual(self.client.encodeCommand('message yoda hello there'),
+                         encodeBinaryFrame(binaryproto.SEND, encodeString('yoda'), encodeString('hello there')))
+        self.assertEqual(self.client.encodeCommand('broadcast hi all'),
+                         encodeBinaryFrame(binaryproto.SEND_BROADCAST, encodeString('hi all')))
+        self.assertEqual(self.client.encodeCommand('whoelse'), encodeBinaryFrame(binaryproto.WHOELSE))
+        self.assertEqual(self.client.encodeCommand('whoelsesince 300'),
+                         encodeBinaryFrame(binaryproto.WHOELSESINCE, encodeVarint(300)))
+        self.assertEqual(self.client.encodeCommand('block vader'),
+                         encodeBinaryFrame(binaryproto.BLOCK, encodeString('vader')))
+        self.assertEqual(self.client.encodeCommand("['0']"), encodeBinaryFrame(binaryproto.KEEPALIVE))
+
+        # Anything else is sent as text for the server to interpret
+        for command in ('whoelsesince soon', 'block', 'logon yoda'):
+            self.assertEqual(self.client.encodeCommand(command),
+                             encodeBinaryFrame(binaryproto.TEXT, encodeString(command)))
+
+    def testEncodeBeforeLogin(self):
+
+        # The user name and the password are sent as text, even if they look
+        # like commands
+        self.client = RecordingClient(binary=True)
+        self.client.loggedIn = False
+        self.assertEqual(self.client.encodeCommand('whoelse'),
+                         encodeBinaryFrame(binaryproto.TEXT, encodeString('whoelse')))
+
+    def testBinaryLines(self):
+        self.client = RecordingClient(binary=True)
+        self.runClient(self.client.handleLine('message yoda  hello'))
+        self.assertEqual(bytes(self.client.serverWriter.data),
+                         encodeBinaryFrame(binaryproto.SEND, encodeString('yoda'), encodeString('hello')))
+
+    def testTextLines(self):
+        self.client = RecordingClient()
+        self.runClient(self.client.handleLine('message yoda  hello'))
+        self.runClient(self.client.handleLine('whoelse'))
+        self.assertEqual(self.client.serverWriter.takeTexts(), ['message yoda hello', 'whoelse'])
+
+    def testBlankLines(self):
+
+        # A blank line is not sent to the server, in either protocol
+        for binary in (False, True):
+            self.client = RecordingClient(binary)
+            for line in ('', '   ', '\t'):
+                self.runClient(self.client.handleLine(line))
+            self.assertEqual(self.client.serverWriter.data, b'')
+            self.assertEqual(self.client.shown, [])
+
+"""
+    Define the tests of private messaging with the peers of the client.
+"""
+class PeerTest(ClientTestCase):
+
+    def setUp(self):
+        self.client = RecordingClient()
+
+    def testPeerText(self):
+        self.client.handlePeerFrame("yoda(private): hello")
+        self.assertEqual(self.client.shown, ["yoda(private): hello\n"])
+
+    def testPeerExit(self):
+
+        # A peer stopping private messaging is answered over the connection to
+        # it, which is kept open for a later session
+        writer = RecordingWriter()
+        self.client.peerWriters['yoda'] = writer
+        self.client.privatePeers.add('yoda')
+        self.client.handlePeerFrame("['EXIT'] yoda hans")
+        self.assertEqual(writer.takeTexts(), ["['EXIT'] hans ['END']"])
+        self.assertNotIn('yoda', self.client.privatePeers)
+        self.assertIs(self.client.peerWriters['yoda'], writer)
+        self.assertEqual(self.client.shown, ["Private messaging with yoda closed\n"])
+
+        # The answer to the answer ends private messaging without a reply
+        self.client.privatePeers.add('yoda')
+        self.client.handlePeerFrame("['EXIT'] yoda hans True ['END']")
+        self.assertEqual(writer.takeTexts(), [])
+        self.assertEqual(self.client.shown[-1], "Private messaging with yoda closed due to inactivity\n")
+
+    def testPeerExitRelayed(self):
+
+        # Without a connection to the peer, the answer is relayed by the server
+        self.client.privateRequests.append('yoda')
+        self.client.handlePeerFrame("['EXIT'] yoda hans")
+        self.assertEqual(self.client.serverWriter.takeTexts(), ["relay yoda ['EXIT'] hans ['END']"])
+        self.assertEqual(list(self.client.privateRequests), [])
+
+    def testReuseConnection(self):
+
+        # A connection kept open since an earlier session is used again, the
+        # client naming its user over it instead of connecting again
+        writer = RecordingWriter()
+        self.client.peerWriters['yoda'] = writer
+        self.client.peerWriters['vader'] = RecordingWriter()
+        self.runClient(self.client.startNewPrivateConnection('yoda', '127.0.0.1', 1, True))
+        self.assertEqual(writer.takeTexts(), [f"{HELLO} hans"])
+        self.assertEqual(list(self.client.peerWriters), ['vader', 'yoda'])
+        self.assertEqual(self.client.shown, [])
+        self.client.sendPeer('yoda', "hans(private): hello")
+        self.assertEqual(writer.takeTexts(), ["hans(private): hello"])
+        self.assertEqual(self.client.serverWriter.takeTexts(), [])
+
+    def testConnectionClosed(self):
+
+        # Once the connection to the peer has been closed, its messages are
+        # relayed by the server
+        writer = RecordingWriter()
+        self.client.peerWriters['yoda'] = writer
+        writer.close()
+        self.client.sendPeer('yoda', "hans(private): hello")
+        self.assertEqual(writer.data, b'')
+        self.assertEqual(self.client.serverWriter.takeTexts(), ["relay yoda hans(private): hello"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+"""
+    Python 3
+    Compact binary protocol between the client and the server, negotiated in
+    the ['p2pPort'] handshake: a client which sends
+    "['p2pPort'] PORT ['BINARY'] zlib" and receives "['BINARY'] 1 zlib" in
+    reply switches, like the server, to binary frames for the rest of the
+    connection. Every binary frame is a varint length followed by an opcode
+    byte and the fields of the opcode, varints and varint-prefixed UTF-8
+    strings. Users are referred to by ids which the server defines once per
+    connection with a USER frame. Frames may be batched and compressed into
+    a COMPRESSED frame with a zlib stream kept for the whole connection, so
+    that the repeated text of consecutive messages compresses well.
+"""
+import zlib
+from framing import FrameError, MAX_FRAME_SIZE
+
+# The handshake token asking for and accepting the binary protocol, the
+# version of the protocol and the name of the compression feature
+BINARY_TOKEN = "['BINARY']"
+VERSION = 1
+ZLIB = 'zlib'
+
+# The opcodes of the frames sent by the server
+TEXT = 0x01           # string: any text for the user, such as prompts and replies
+WELCOME = 0x02        # varint user id, string text: the login has succeeded
+USER = 0x03           # varint user id, string name: defines the id of a user
+MESSAGE = 0x04        # varint sender id, string body: a message from a user
+BROADCAST = 0x05      # varint sender id, string body: a broadcast from a user
+PRESENCE = 0x06       # varint user id, byte 1 or 0: a user has logged in or out
+USERS = 0x07          # varint count, varint user ids: a whoelse or whoelsesince list
+TARGET = 0x08         # peer id, string address, varint port, varint own id, byte
+                      # 1 if the client initiates: start private messaging
+EXIT = 0x09           # string text: the server has closed the session
+CHANNEL = 0x0a        # varint sender id, string channel, string body: a message to a channel
+SNAPSHOT = 0x0b       # varint version, varint count, varint user ids: the online users followed
+DELTAS = 0x0c         # varint version, varint count, then varint user id and byte 1 or 0
+                      # per user: the followed users who have logged in or out
+RELAY = 0x0d          # varint sender id, string frame: private messaging relayed by the server
+
+# The opcodes of the frames sent by the client. TEXT carries the login input
+# and any command the client does not encode itself
+SEND = 0x21           # string recipient, string body
+SEND_BROADCAST = 0x22  # string body
+WHOELSE = 0x23
+WHOELSESINCE = 0x24   # varint seconds
+BLOCK = 0x25          # string user
+UNBLOCK = 0x26        # string user
+STARTPRIVATE = 0x27   # string user
+KEEPALIVE = 0x28
+SEND_RELAY = 0x29     # string peer, string frame: private messaging to relay to the peer
+
+# A batch of frames compressed with the zlib stream of the connection
+COMPRESSED = 0x7f
+
+# Batches of fewer bytes are not worth compressing
+COMPRESS_THRESHOLD = 512
+
+# The size of the window of a zlib stream, the history a compressed batch may
+# refer back to
+WINDOW_SIZE = 32 * 1024
+
+# This function encodes a non-negative integer as a varint, 7 bits per byte
+# from the least significant, with the high bit set on all bytes but the last
+def encodeVarint(value):
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+# This function decodes the varint at the given offset of the buffer and
+# returns its value and the offset after it, or None if the buffer ends first
+def decodeVarint(buffer, offset=0):
+    value = shift = 0
+    while offset < len(buffer):
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift > 35:
+            raise FrameError("varint too long")
+    return None
+
+# This function encodes a string as the varint length of its UTF-8 bytes
+# followed by the bytes
+def encodeString(text):
+    data = text.encode()
+    return encodeVarint(len(data)) + data
+
+# This function encodes a frame from its opcode and its encoded fields
+def encodeBinaryFrame(opcode, *fields):
+    body = bytes((opcode,)) + b''.join(fields)
+    return encodeVarint(len(body)) + body
+
+"""
+    Define the reader of the fields of a frame body, after the opcode.
+"""
+class FieldReader:
+    __slots__ = ('body', 'offset')
+
+    # This is the constructor of the reader of the given body
+    def __init__(self, body):
+        self.body = body
+        self.offset = 1
+
+    # This function reads a varint. Values below 0x80, a single byte, are the
+    # common case and read without decoding
+    def varint(self):
+        body = self.body
+        offset = self.offset
+        if offset < len(body) and body[offset] < 0x80:
+            self.offset = offset + 1
+            return body[offset]
+        result = decodeVarint(body, offset)
+        if result is None:
+            raise FrameError("truncated frame")
+        value, self.offset = result
+        return value
+
+    # This function reads a string
+    def string(self):
+        length = self.varint()
+        start = self.offset
+        end = start + length
+        if end > len(self.body):
+            raise FrameError("truncated frame")
+        self.offset = end
+        return self.body[start:end].decode()
+
+    # This function reads a single byte
+    def byte(self):
+        if self.offset >= len(self.body):
+            raise FrameError("truncated frame")
+        self.offset += 1
+        return self.body[self.offset - 1]
+
+"""
+    Define the incremental decoder of binary frames, the counterpart of
+    FrameDecoder in framing.py. Compressed batches are decompressed with the
+    zlib stream of the connection and their frames returned in order. A
+    decoder keeping its window remembers the last WINDOW_SIZE decompressed
+    bytes, from which another decoder can continue the stream, such as the
+    decoder of a server taking over the connection.
+"""
+class BinaryDecoder:
+
+    # This is the constructor of the decoder. window is None for a new stream,
+    # or the window of the decoder whose stream this decoder continues
+    def __init__(self, keepWindow=False, window=None):
+        self.buffer = bytearray()
+        self.keepWindow = keepWindow
+        self.window = window
+        if window is None:
+            self.decompressor = zlib.decompressobj()
+        elif window:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=window)
+        else:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    # This function appends the received bytes to the buffer and returns the
+    # bodies of all frames which are complete
+    def feed(self, data):
+        self.buffer += data
+        bodies = []
+        offset = self.split(self.buffer, bodies, True)
+        if offset:
+            del self.buffer[:offset]
+        return bodies
+
+    # This function returns whether a partial frame is still buffered
+    def hasPartialFrame(self):
+        return len(self.buffer) > 0
+
+    # This function appends the bodies of the complete frames of the buffer to
+    # bodies and returns the offset of the first incomplete frame. Compressed
+    # frames are expanded unless they are themselves in a compressed batch
+    def split(self, buffer, bodies, expand):
+        offset = 0
+        size = len(buffer)
+        while offset < size:
+            length = buffer[offset]
+            if length < 0x80 and length:
+                start = offset + 1
+            else:
+                header = decodeVarint(buffer, offset)
+                if header is None:
+                    break
+                length, start = header
+                if length > MAX_FRAME_SIZE or length == 0:
+                    raise FrameError(f"invalid frame length {length}")
+            end = start + length
+            if end > size:
+                break
+            body = bytes(buffer[start:end])
+            if body[0] != COMPRESSED:
+                bodies.append(body)
+            elif expand:
+                self.expand(body, bodies)
+            else:
+                raise FrameError("nested compressed frame")
+            offset = end
+        return offset
+
+    # This function decompresses a compressed batch, which holds complete
+    # frames only, and appends their bodies
+    def expand(self, body, bodies):
+        try:
+            batch = self.decompressor.decompress(body[1:], MAX_FRAME_SIZE)
+        except zlib.error as error:
+            raise FrameError(f"invalid compressed frame: {error}")
+        if self.decompressor.unconsumed_tail:
+            raise FrameError("compressed frame exceeds the maximum frame size")
+        if self.keepWindow:
+            self.window = ((self.window or b'') + batch)[-WINDOW_SIZE:]
+        if self.split(batch, bodies, False) != len(batch):
+            raise FrameError("compressed frame ends with a partial frame")
+
+"""
+    Define the compressor of the batches of frames written to a connection.
+    Batches of at least COMPRESS_THRESHOLD bytes are compressed into one
+    frame, flushed so that the peer can decode it right away. Every batch
+    given to the stream must be sent, since the peer decompresses with the
+    same history. The fastest level is the default: it compresses chat text
+    nearly as well as the higher levels for a fraction of their CPU time.
+"""
+class BatchCompressor:
+
+    # This is the constructor of the compressor, which leaves every batch
+    # as it is unless enabled. A resumed compressor continues a stream which
+    # another compressor has started, without a new zlib header
+    def __init__(self, enabled=True, level=1, resumed=False):
+        self.started = resumed
+        if not enabled:
+            self.compressor = None
+        elif resumed:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        else:
+            self.compressor = zlib.compressobj(level)
+
+    # This function returns the frames to write for the given batch of frames
+    def pack(self, frames):
+        if self.compressor is None:
+            return frames
+        size = 0
+        for frame in frames:
+            size += len(frame)
+        if size < COMPRESS_THRESHOLD:
+            return frames
+        self.started = True
+        data = self.compressor.compress(b''.join(frames)) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return [encodeBinaryFrame(COMPRESSED, data)]
@@ -0,0 +1,177 @@
+"""
+    Python 3
+    Length-prefixed message framing shared by the server, the client and the
+    peer to peer connections. Every message on a connection is sent as a
+    4 byte big-endian length followed by that many bytes of UTF-8 payload,
+    so messages are never truncated at the recv() size nor merged together
+    when several of them arrive in the same TCP segment.
+"""
+import select
+import struct
+from collections import deque
+
+# The header in front of every frame, the length of the payload in bytes
+HEADER = struct.Struct('>I')
+
+# The largest payload accepted from the network. A peer announcing a larger
+# frame is considered broken and the connection should be dropped
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# The number of bytes requested from a socket at a time
+RECV_SIZE = 65536
+
+"""
+    Define the error raised when the received data is not a valid frame
+"""
+class FrameError(ValueError):
+    pass
+
+"""
+    Define the error raised by a reader whose interrupt file descriptor has
+    become readable, before it receives anything more from its socket
+"""
+class ReadInterrupted(Exception):
+    pass
+
+# This function encodes the given message, a string or bytes, into a frame
+def encodeFrame(message):
+    if isinstance(message, str):
+        message = message.encode()
+    return HEADER.pack(len(message)) + message
+
+# This function encodes the given messages into one buffer, so that many
+# messages can be sent with a single send call
+def encodeFrames(messages):
+    return b''.join(encodeFrame(message) for message in messages)
+
+# This function sends the given message as one frame through a blocking socket
+def sendFrame(sock, message):
+    sock.sendall(encodeFrame(message))
+
+"""
+    Define the incremental frame decoder. Bytes received from the network are
+    fed into the decoder which buffers incomplete frames and returns every
+    complete payload.
+"""
+class FrameDecoder:
+
+    # This is the constructor of the decoder
+    def __init__(self):
+        self.buffer = bytearray()
+
+    # This function appends the received bytes to the buffer and returns the
+    # list of payloads of all frames which are complete, or of the first
+    # maxFrames of them leaving the following bytes in the buffer
+    def feed(self, data, maxFrames=None):
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size and len(frames) != maxFrames:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise FrameError(f"frame of {length} bytes exceeds the maximum frame size")
+            end = offset + HEADER.size + length
+            if end > len(self.buffer):
+                break
+            frames.append(bytes(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+    # This function returns whether a partial frame is still buffered
+    def hasPartialFrame(self):
+        return len(self.buffer) > 0
+
+"""
+    Define the buffered frame reader of a blocking socket. Frames which arrive
+    together are queued and returned one at a time by recvFrame(). If an
+    interrupt file descriptor is given, the reader waits for either the
+    socket or the descriptor before every receive and raises ReadInterrupted
+    once the descriptor is readable, leaving the data of the socket unread.
+"""
+class SocketFrameReader:
+
+    # This is the constructor of the reader for the given socket
+    def __init__(self, sock, interruptFd=None):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.receivedBytes = 0
+        self.interruptFd = interruptFd
+
+        # Set while the bytes received with the first frame are left undecoded
+        self.undecoded = False
+        self.poller = None
+        if interruptFd is not None:
+            self.poller = select.poll()
+            self.poller.register(sock, select.POLLIN)
+            self.poller.register(interruptFd, select.POLLIN)
+
+    # This function blocks until a complete frame is received and returns its
+    # payload decoded as a string, or None once the peer has closed the
+    # connection. An empty frame is returned as an empty string
+    def recvFrame(self):
+        payload = self.recvFrameBytes()
+        return None if payload is None else payload.decode()
+
+    # This function blocks until a complete frame is received and returns its
+    # payload as bytes, or None once the peer has closed the connection
+    def recvFrameBytes(self):
+        if self.undecoded:
+            self.undecoded = False
+            self.pending.extend(self.decoder.feed(b''))
+        while not self.pending:
+            data = self.recvData()
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    # This function receives the first frame of a connection like
+    # recvFrameBytes(), but leaves the bytes which follow it undecoded so that
+    # they can be handed to another decoder by setDecoder()
+    def recvFirstFrameBytes(self):
+        frames = self.decoder.feed(b'', 1)
+        while not frames:
+            data = self.recvData()
+            if not data:
+                return None
+            frames = self.decoder.feed(data, 1)
+        self.undecoded = True
+        return frames[0]
+
+    # This function decodes the rest of the stream with the given decoder, such
+    # as the BinaryDecoder of binaryproto.py, from the bytes already received
+    def setDecoder(self, decoder):
+        self.pending.extend(decoder.feed(bytes(self.decoder.buffer)))
+        self.decoder = decoder
+        self.undecoded = False
+
+    # This function receives the next bytes from the socket
+    def recvData(self):
+        if self.poller is not None:
+            for fd, event in self.poller.poll():
+                if fd == self.interruptFd:
+                    raise ReadInterrupted()
+        data = self.sock.recv(RECV_SIZE)
+        self.receivedBytes += len(data)
+        return data
+
+# This coroutine reads one frame from an asyncio StreamReader and returns its
+# payload decoded as a string, or None at the end of the stream
+async def readFrame(reader):
+    payload = await readFrameBytes(reader)
+    return None if payload is None else payload.decode()
+
+# This coroutine reads one frame from an asyncio StreamReader and returns its
+# payload as bytes, or None at the end of the stream
+async def readFrameBytes(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f"frame of {length} bytes exceeds the maximum frame size")
+        return await reader.readexactly(length)
+    except EOFError:
+        return None
@@ -0,0 +1,136 @@
+"""
+    Python 3
+    Unit tests of the binary protocol of binaryproto.py: the varints and the
+    fields of the frames, the decoder and the compressed batches, also when
+    another process continues the stream of a connection.
+    Usage: python3 -m pytest src/Common
+"""
+import random
+import unittest
+import binaryproto
+from binaryproto import (BinaryDecoder, BatchCompressor, FieldReader, FrameError, COMPRESS_THRESHOLD,
+                         encodeBinaryFrame, encodeString, encodeVarint, decodeVarint)
+
+# This function returns the frames of a batch of messages of the given sender,
+# long enough together to be compressed
+def messageFrames(sender, count, seed=0):
+    words = ('hello', 'there', 'meeting', 'noon', 'thanks', 'lunch', 'tomorrow', 'héllo')
+    generator = random.Random(seed)
+    return [encodeBinaryFrame(binaryproto.MESSAGE, encodeVarint(sender),
+                              encodeString(' '.join(generator.choice(words) for _ in range(12))))
+            for _ in range(count)]
+
+# This function returns the bodies of the given frames, without their length
+def bodies(frames):
+    return [BinaryDecoder().feed(frame)[0] for frame in frames]
+
+"""
+    Define the tests of the varints and of the fields of a frame.
+"""
+class FieldsTest(unittest.TestCase):
+
+    def testVarints(self):
+        for value in (0, 1, 0x7f, 0x80, 300, 0x3fff, 0x4000, 2 ** 32 - 1):
+            data = encodeVarint(value)
+            self.assertEqual(decodeVarint(b'x' + data, 1), (value, len(data) + 1))
+        self.assertEqual(len(encodeVarint(0x7f)), 1)
+        self.assertEqual(len(encodeVarint(0x80)), 2)
+        self.assertIsNone(decodeVarint(encodeVarint(300)[:1]))
+        with self.assertRaises(FrameError):
+            decodeVarint(b'\xff' * 6)
+
+    def testFields(self):
+        frame = encodeBinaryFrame(binaryproto.TARGET, encodeVarint(5), encodeString('127.0.0.1'),
+                                  encodeVarint(12000), encodeString('wörld'), bytes((1,)))
+        body, = BinaryDecoder().feed(frame)
+        self.assertEqual(body[0], binaryproto.TARGET)
+        fields = FieldReader(body)
+        self.assertEqual((fields.varint(), fields.string(), fields.varint(), fields.string(), fields.byte()),
+                         (5, '127.0.0.1', 12000, 'wörld', 1))
+        with self.assertRaises(FrameError):
+            fields.byte()
+
+    def testTruncatedFields(self):
+        with self.assertRaises(FrameError):
+            FieldReader(bytes((binaryproto.SEND,)) + encodeVarint(10) + b'hans').string()
+        with self.assertRaises(FrameError):
+            FieldReader(bytes((binaryproto.WHOELSESINCE, 0x80))).varint()
+        with self.assertRaises(UnicodeDecodeError):
+            FieldReader(bytes((binaryproto.SEND, 2)) + b'\xff\xfe').string()
+
+"""
+    Define the tests of the decoder of the frames and of the compressor of the
+    batches.
+"""
+class BinaryDecoderTest(unittest.TestCase):
+
+    def testFramesByteByByte(self):
+        frames = messageFrames(1, 3) + [encodeBinaryFrame(binaryproto.WHOELSE),
+                                        encodeBinaryFrame(binaryproto.TEXT, encodeString('x' * 300))]
+        decoder = BinaryDecoder()
+        data = b''.join(frames)
+        received = []
+        for index in range(len(data)):
+            received.extend(decoder.feed(data[index:index + 1]))
+        self.assertEqual(received, bodies(frames))
+        self.assertFalse(decoder.hasPartialFrame())
+
+    def testInvalidFrames(self):
+        with self.assertRaises(FrameError):
+            BinaryDecoder().feed(b'\x00')
+        with self.assertRaises(FrameError):
+            BinaryDecoder().feed(encodeBinaryFrame(binaryproto.COMPRESSED, b'not zlib'))
+
+    def testSmallBatchesNotCompressed(self):
+        frames = messageFrames(1, 1)
+        self.assertLess(len(frames[0]), COMPRESS_THRESHOLD)
+        self.assertEqual(BatchCompressor().pack(frames), frames)
+        self.assertEqual(BatchCompressor(enabled=False).pack(messageFrames(1, 50)), messageFrames(1, 50))
+
+    def testCompressedRoundTrip(self):
+        compressor = BatchCompressor()
+        decoder = BinaryDecoder()
+        for batch in range(20):
+            frames = messageFrames(batch, 1 + batch * 5, batch)
+            packed = compressor.pack(frames)
+            if sum(len(frame) for frame in frames) >= COMPRESS_THRESHOLD:
+                self.assertEqual(len(packed), 1)
+                self.assertLess(len(packed[0]), sum(len(frame) for frame in frames))
+            self.assertEqual(decoder.feed(b''.join(packed)), bodies(frames))
+
+    def testNestedCompressedFrame(self):
+        compressor = BatchCompressor()
+        inner = compressor.pack(messageFrames(1, 20))
+        outer = BatchCompressor().pack(inner * 2)
+        with self.assertRaises(FrameError):
+            BinaryDecoder().feed(outer[0])
+
+    def testDecoderContinuedFromWindow(self):
+        compressor = BatchCompressor()
+        first = BinaryDecoder(keepWindow=True)
+        for batch in range(5):
+            frames = messageFrames(1, 20, batch)
+            self.assertEqual(first.feed(b''.join(compressor.pack(frames))), bodies(frames))
+        self.assertLessEqual(len(first.window), binaryproto.WINDOW_SIZE)
+
+        # The batches which follow refer back to the history of the first
+        # decoder, which the decoder of the new process is given
+        second = BinaryDecoder(keepWindow=True, window=first.window)
+        for batch in range(5):
+            frames = messageFrames(1, 20, batch)
+            self.assertEqual(second.feed(b''.join(compressor.pack(frames))), bodies(frames))
+
+    def testCompressorResumed(self):
+        decoder = BinaryDecoder()
+        frames = messageFrames(1, 20)
+        self.assertEqual(decoder.feed(b''.join(BatchCompressor().pack(frames))), bodies(frames))
+
+        # The compressor of the new process continues the stream without a
+        # header and without the history of the old one
+        resumed = BatchCompressor(resumed=True)
+        for batch in range(3):
+            frames = messageFrames(2, 20, batch)
+            self.assertEqual(decoder.feed(b''.join(resumed.pack(frames))), bodies(frames))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+    Python 3
+    Unit tests of the frame decoder and of the frame reader of a socket of
+    framing.py.
+    Usage: python3 -m pytest src/Common
+"""
+import socket
+import unittest
+from framing import (FrameDecoder, SocketFrameReader, FrameError, HEADER, MAX_FRAME_SIZE, encodeFrame,
+                     encodeFrames)
+
+"""
+    Define the tests of the incremental frame decoder.
+"""
+class FrameDecoderTest(unittest.TestCase):
+
+    def testFramesTogether(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(encodeFrames(['whoelse', 'message yoda hi', ''])),
+                         [b'whoelse', b'message yoda hi', b''])
+        self.assertFalse(decoder.hasPartialFrame())
+
+    def testFramesByteByByte(self):
+        decoder = FrameDecoder()
+        data = encodeFrames(['hello', 'héllo wörld'])
+        frames = []
+        for index in range(len(data) - 1):
+            frames.extend(decoder.feed(data[index:index + 1]))
+        self.assertTrue(decoder.hasPartialFrame())
+        frames.extend(decoder.feed(data[-1:]))
+        self.assertEqual(frames, [b'hello', 'héllo wörld'.encode()])
+        self.assertFalse(decoder.hasPartialFrame())
+
+    def testMaxFrames(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(encodeFrames(['a', 'b', 'c']), 1), [b'a'])
+        self.assertEqual(decoder.feed(b'', 1), [b'b'])
+        self.assertEqual(decoder.feed(b''), [b'c'])
+
+    def testOversizedFrame(self):
+        decoder = FrameDecoder()
+        with self.assertRaises(FrameError):
+            decoder.feed(HEADER.pack(MAX_FRAME_SIZE + 1))
+        self.assertEqual(FrameDecoder().feed(HEADER.pack(MAX_FRAME_SIZE)), [])
+
+    def testBytesPayload(self):
+        self.assertEqual(encodeFrame(b'\xff\xfe'), HEADER.pack(2) + b'\xff\xfe')
+        self.assertEqual(FrameDecoder().feed(encodeFrame(b'\xff\xfe')), [b'\xff\xfe'])
+
+"""
+    Define the tests of the frame reader of a blocking socket.
+"""
+class SocketFrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sender, receiver = socket.socketpair()
+        self.addCleanup(self.sender.close)
+        self.addCleanup(receiver.close)
+        self.reader = SocketFrameReader(receiver)
+
+    def testFramesAndClose(self):
+        three = encodeFrame('three')
+        self.sender.sendall(encodeFrames(['one', 'two']) + three[:5])
+        self.assertEqual(self.reader.recvFrame(), 'one')
+        self.assertEqual(self.reader.recvFrameBytes(), b'two')
+        self.sender.sendall(three[5:])
+        self.assertEqual(self.reader.recvFrame(), 'three')
+
+        # An empty frame is told apart from the end of the connection
+        self.sender.sendall(encodeFrame(''))
+        self.assertEqual(self.reader.recvFrame(), '')
+        self.sender.close()
+        self.assertIsNone(self.reader.recvFrameBytes())
+        self.assertIsNone(self.reader.recvFrame())
+
+    def testFirstFrameLeavesRestUndecoded(self):
+        self.sender.sendall(encodeFrames(['handshake', 'user']))
+        self.assertEqual(self.reader.recvFirstFrameBytes(), b'handshake')
+        self.assertEqual(self.reader.recvFrameBytes(), b'user')
+
+    def testFirstFrameThenOtherDecoder(self):
+        self.sender.sendall(encodeFrames(['handshake', 'user']))
+        self.assertEqual(self.reader.recvFirstFrameBytes(), b'handshake')
+        other = FrameDecoder()
+        self.reader.setDecoder(other)
+        self.assertIs(self.reader.decoder, other)
+        self.assertEqual(self.reader.recvFrameBytes(), b'user')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+    Python 3
+    Activity index of the users for whoelsesince. The users currently logged
+    in are kept in a dictionary and the users who have logged out are kept in
+    an array ordered by the time of their last logout, so listing the users
+    active within the last N seconds is a binary search followed by a walk
+    over the k matching entries. Entries older than the retention period are
+    evicted from the front of the array. Logins and logouts may be appended
+    to a write-ahead log with snapshots (see statestore.py), read back in the
+    background when the server starts. The users who were logged in when the
+    server stopped are only recorded as logged out by settle(), so that users
+    who come back right away, such as the sessions handed over to the new
+    server, do not appear to have left.
+"""
+import threading
+import time
+from bisect import bisect_left
+from statestore import decodeFields
+
+# The records of the log, a user logging in or out at a time. A snapshot
+# holds a LOGGED_OUT record with the last logout of every logged out user
+LOGIN = 1
+LOGOUT = 2
+LOGGED_OUT = 3
+
+"""
+    Define the activity index. retention is the number of seconds for which
+    a user who has logged out is kept, or None to keep every user, and log is
+    the SnapshotLog of the index, or None to keep it in memory only.
+"""
+class ActivityIndex:
+
+    # This is the constructor of the index. The log is read in the background,
+    # calls made before it has been read wait for it
+    def __init__(self, retention=None, log=None):
+        self.retention = retention
+        self.log = log
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+
+        # loginTimes maps each logged in user to the time of the login,
+        # logoutTimes maps each logged out user to the time of the last logout
+        self.loginTimes = {}
+        self.logoutTimes = {}
+
+        # The users who were logged in when the server stopped and have not
+        # logged in again since, until settle()
+        self.unsettled = set()
+
+        # The logouts in time order as two parallel arrays. A user who logs out
+        # again gets a new entry, the previous entry becomes stale and is
+        # skipped because it no longer matches logoutTimes
+        self.orderedTimes = []
+        self.orderedUsers = []
+        if log is None:
+            self.loaded.set()
+        else:
+            loader = threading.Thread(name="activityLoader", target=self.load)
+            loader.daemon = True
+            loader.start()
+
+    """
+        Public APIs of the index.
+    """
+
+    # This function records that the user has logged in
+    def login(self, userName, now=None):
+        now = time.time() if now is None else now
+        self.loaded.wait()
+        with self.lock:
+
+            # A user back from before the restart has never left
+            if userName in self.unsettled:
+                self.unsettled.discard(userName)
+                return
+            self.applyLogin(userName, now)
+            if self.log is not None:
+                self.log.append(LOGIN, userName, now)
+
+    # This function records that the user has logged out
+    def logout(self, userName, now=None):
+        now = time.time() if now is None else now
+        self.loaded.wait()
+        with self.lock:
+            self.unsettled.discard(userName)
+            if self.applyLogout(userName, now) and self.log is not None:
+                self.log.append(LOGOUT, userName, now)
+
+    # This function records the users who were logged in when the server
+    # stopped and have not logged in again since as logged out now
+    def settle(self, now=None):
+        now = time.time() if now is None else now
+        self.loaded.wait()
+        with self.lock:
+            for userName in self.unsettled:
+                if self.applyLogout(userName, now) and self.log is not None:
+                    self.log.append(LOGOUT, userName, now)
+            self.unsettled = set()
+
+    # This function returns the users who are logged in or have logged out
+    # within the given number of seconds, at most the retention period, the
+    # logged in users first and then the others from the most recent logout
+    def since(self, seconds, now=None):
+        now = time.time() if now is None else now
+        if self.retention is not None:
+            seconds = min(seconds, self.retention)
+        self.loaded.wait()
+        with self.lock:
+            users = list(self.loginTimes)
+            seen = set()
+            start = bisect_left(self.orderedTimes, now - seconds)
+            for index in range(len(self.orderedTimes) - 1, start - 1, -1):
+                userName = self.orderedUsers[index]
+                if userName not in seen and self.logoutTimes.get(userName) == self.orderedTimes[index]:
+                    seen.add(userName)
+                    users.append(userName)
+            return users
+
+    # This function returns the number of users in the index
+    def __len__(self):
+        return len(self.loginTimes) + len(self.logoutTimes)
+
+    # This function writes the log to the disk, and replaces it with a
+    # snapshot of the index once it has grown enough. Only the copy of the
+    # index is made under the lock
+    def checkpoint(self):
+        if self.log is None or not self.loaded.is_set():
+            return
+        self.log.sync()
+        if not self.log.needsSnapshot(len(self)):
+            return
+        with self.lock:
+            logins = list(self.loginTimes.items())
+            logouts = list(zip(self.orderedUsers, self.orderedTimes))
+            logoutTimes = dict(self.logoutTimes)
+            generation = self.log.rotate()
+        records = [(LOGGED_OUT, entry) for entry in logouts if logoutTimes.get(entry[0]) == entry[1]]
+        records.extend((LOGIN, entry) for entry in logins)
+        self.log.writeSnapshot(generation, records)
+
+    # This function reads the index from its log. The users who were logged
+    # in when the server stopped stay logged in until settle(). If the log
+    # cannot be read the index is kept in memory only
+    def load(self):
+        try:
+            with self.lock:
+                for recordType, data in self.log.recover():
+                    userName, recordTime = decodeFields(data, 'st')
+                    if recordType == LOGIN:
+                        self.applyLogin(userName, recordTime)
+                    elif recordType == LOGOUT:
+                        self.applyLogout(userName, recordTime)
+                    elif recordType == LOGGED_OUT:
+                        self.applyLogin(userName, recordTime)
+                        self.applyLogout(userName, recordTime)
+                self.unsettled = set(self.loginTimes)
+        finally:
+            self.loaded.set()
+
+    """
+        Helper functions of the index, the caller must hold the lock.
+    """
+
+    # This function records that the user has logged in at the given time
+    def applyLogin(self, userName, now):
+        self.loginTimes[userName] = now
+        self.logoutTimes.pop(userName, None)
+
+    # This function records that the user has logged out at the given time. It
+    # returns False if the user was not logged in
+    def applyLogout(self, userName, now):
+        if self.loginTimes.pop(userName, None) is None:
+            return False
+
+        # The array stays ordered even if the clock has been set back
+        if self.orderedTimes and now < self.orderedTimes[-1]:
+            now = self.orderedTimes[-1]
+        self.logoutTimes[userName] = now
+        self.orderedTimes.append(now)
+        self.orderedUsers.append(userName)
+        self.evict(now)
+        if len(self.orderedUsers) > 2 * len(self.logoutTimes) + 1000:
+            self.compact()
+        return True
+
+    # This function removes the users who logged out before the retention
+    # period
+    def evict(self, now):
+        if self.retention is None or self.orderedTimes[0] >= now - self.retention:
+            return
+        end = bisect_left(self.orderedTimes, now - self.retention)
+        for index in range(end):
+            userName = self.orderedUsers[index]
+            if self.logoutTimes.get(userName) == self.orderedTimes[index]:
+                del self.logoutTimes[userName]
+        del self.orderedTimes[:end]
+        del self.orderedUsers[:end]
+
+    # This function removes the stale entries of the users who have logged out
+    # more than once, or have logged in again, from the ordered arrays
+    def compact(self):
+        live = [(logoutTime, userName) for logoutTime, userName in zip(self.orderedTimes, self.orderedUsers)
+                if self.logoutTimes.get(userName) == logoutTime]
+        self.orderedTimes = [logoutTime for logoutTime, userName in live]
+        self.orderedUsers = [userName for logoutTime, userName in live]
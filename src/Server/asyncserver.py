@@ -0,0 +1,372 @@
+"""
+    Python 3
+    asyncio server engine. Every client session runs as a coroutine on one
+    event loop instead of on its own thread, which allows a single process
+    to hold tens of thousands of mostly idle connections on one core.
+    Started by server.py with --mode async.
+"""
+import asyncio
+import os
+import resource
+import time
+from collections import deque
+import serverstate
+from framing import FrameDecoder, FrameError, RECV_SIZE
+from session import ServerSession, REJECTED
+from outbound import OutboundQueue
+
+# The listen backlog of the server socket, large enough to absorb bursts of
+# connecting clients
+LISTEN_BACKLOG = 4096
+
+# The sessions which are being served, handed over to a new server process on
+# a handoff
+liveSessions = set()
+
+# The tasks of the sessions taken over from another server process, which
+# the event loop only references weakly
+takenOverTasks = set()
+
+"""
+    Define the coroutine based session for a client. All the functionalities
+    of the program on the server side are inherited from ServerSession.
+"""
+class AsyncClientSession(ServerSession):
+
+    # This is the constructor of a session and will be used to initialise
+    # a session every time a user connects to the server
+    def __init__(self, reader, writer):
+        ServerSession.__init__(self, writer.get_extra_info('peername'))
+        self.reader = reader
+        self.writer = writer
+        self.offlineDelivery = None
+
+        # Everything sent to the client is queued and written by a writer task
+        # of the session, so that a slow client never holds up another session
+        self.outbound = OutboundQueue(self, serverstate.outboundHighWatermark, serverstate.outboundLowWatermark,
+                                      serverstate.slowConsumerPolicy, notify=self.wakeWriter,
+                                      metrics=serverstate.metrics)
+        self.writerWakeup = asyncio.Event()
+        self.queueDrained = asyncio.Event()
+        self.writerTask = None
+
+        # The decoder of the input, replaced by the decoder of the binary
+        # protocol once negotiated, the payloads it has decoded which have not
+        # been processed yet, and whether the bytes received with the
+        # handshake are still left undecoded
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.undecoded = False
+
+        # Whether reading has stopped for a handoff to another server, and
+        # whether the session has stopped reading since
+        self.task = None
+        self.handingOff = False
+        self.interrupted = False
+
+    # This coroutine takes care of the main functionality of the server for
+    # one client. It will keep running since a client logs onto the system and
+    # until the client logs out from the server or disconnects. A session
+    # handed over by another server continues from where it was
+    async def run(self):
+        self.writerTask = asyncio.get_running_loop().create_task(self.runWriter())
+        self.task = asyncio.current_task()
+        liveSessions.add(self)
+        try:
+            await self.serve()
+        except asyncio.CancelledError:
+            if not self.handingOff:
+                raise
+            self.interrupted = True
+        if not self.interrupted:
+            liveSessions.discard(self)
+
+    # This coroutine reads the handshake, the login procedure and then the
+    # commands of the client until the client disconnects
+    async def serve(self):
+        if self.resumed and self.clientAlive:
+            self.loadCachedMessage()
+        try:
+            if not self.handshaken:
+                data = await self.readPayload(first=True)
+                if data is None:
+                    self.close()
+                    return
+                self.processHandshake(data.decode())
+                self.startLogin()
+            while self.isLoggingIn():
+                data = await self.readPayload()
+                if data is None:
+                    self.loginState = 'closed'
+                    self.close()
+                    return
+                text = self.inputText(data)
+                self.handleLoginInput(text, await self.authenticate(self.loginWork(text)))
+            while self.clientAlive:
+                message = await self.readPayload()
+
+                # Once the client has closed the connection, the client is set as
+                # offline. An empty frame is a command like any other
+                if message is None:
+                    self.handleDisconnect()
+                    break
+
+                # A command over the rate limits is refused, or delayed by not
+                # reading the next commands of the client meanwhile
+                delay = self.admitCommand(message)
+                if delay is None:
+                    continue
+                if delay:
+                    await asyncio.sleep(delay)
+                self.handleInput(message)
+        # Text which is not UTF-8 in the handshake or the login ends the session
+        # like a broken frame
+        except (ConnectionError, OSError, FrameError, UnicodeDecodeError):
+            if self.clientAlive:
+                self.handleDisconnect()
+            else:
+                self.close()
+
+    # This coroutine reads a complete frame from the client and returns its
+    # payload, or None once the client has closed the connection. The
+    # handshake is read as the first frame, leaving what follows it to the
+    # decoder of the negotiated protocol
+    async def readPayload(self, first=False):
+        if first:
+            frames = self.decoder.feed(b'', 1)
+            while not frames:
+                data = await self.reader.read(RECV_SIZE)
+                if not data:
+                    return None
+                serverstate.metrics.bytesIn.inc(len(data))
+                frames = self.decoder.feed(data, 1)
+            self.undecoded = True
+            return frames[0]
+        if self.undecoded:
+            self.undecoded = False
+            self.pending.extend(self.decoder.feed(b''))
+        while not self.pending:
+            data = await self.reader.read(RECV_SIZE)
+            if not data:
+                return None
+            serverstate.metrics.bytesIn.inc(len(data))
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    # This coroutine runs the work of an input during the login procedure on
+    # the authentication pool and returns its result, or REJECTED if the pool
+    # has no room for it. The event loop serves the other sessions meanwhile.
+    # A handoff waits for the work, as the input it was made for has been
+    # read, and stops the session at its next wait for input
+    async def authenticate(self, work):
+        if work is None:
+            return None
+        future = serverstate.loginPool.submit(*work)
+        if future is None:
+            return REJECTED
+        result = asyncio.wrap_future(future)
+        try:
+            return await asyncio.shield(result)
+        except asyncio.CancelledError:
+            if not self.handingOff:
+                raise
+        value = await result
+        self.task.cancel()
+        return value
+
+    # This function decodes the rest of the input with the given decoder,
+    # starting with what the previous decoder holds
+    def setDecoder(self, decoder):
+        self.pending.extend(decoder.feed(bytes(self.decoder.buffer)))
+        self.decoder = decoder
+        self.undecoded = False
+
+    # This function stops reading from the client for a handoff, leaving the
+    # rest of the input in the socket, and cancels the delivery of the offline
+    # messages, the batch being delivered is still written. The task running
+    # the session is cancelled where it waits for input
+    def stopReading(self):
+        self.handingOff = True
+        self.writer.transport.pause_reading()
+        if self.offlineDelivery is not None:
+            self.offlineDelivery.cancel()
+        self.task.cancel()
+
+    # This function returns the socket of the client, the decoder of its input
+    # and the bytes which the stream reader has received but not returned yet
+    # (held in its private buffer, as StreamReader has no way to take them
+    # without waiting)
+    def handoffTransport(self):
+        return self.writer.get_extra_info('socket').fileno(), self.decoder, bytes(self.reader._buffer)
+
+    # This function continues the session handed over with the given state.
+    # The frames which the old server had received but not decoded are decoded
+    # before anything more is read, except during the handshake which is
+    # decoded alone
+    def restoreState(self, state):
+        self.decoder = ServerSession.restoreState(self, state)
+        if self.handshaken:
+            self.pending.extend(self.decoder.feed(b''))
+
+    # This coroutine writes the queued frames to the client until the session
+    # is closed and closes the connection afterwards
+    async def runWriter(self):
+        try:
+            while True:
+                frames = self.outbound.take()
+                if frames:
+                    frames = self.codec.encodeBatch(frames)
+                    self.writer.writelines(frames)
+                    await self.writer.drain()
+                    self.outbound.wrote(sum(map(len, frames)))
+                elif self.outbound.isFinished():
+                    break
+                else:
+                    self.queueDrained.set()
+                    self.writerWakeup.clear()
+                    await self.writerWakeup.wait()
+        except (ConnectionError, OSError):
+            self.writer.transport.abort()
+        self.queueDrained.set()
+        self.writer.close()
+
+    # This function wakes up the writer task once frames have been queued
+    def wakeWriter(self):
+        self.writerWakeup.set()
+
+    # This function queues the given frame to be sent to the client
+    def sendFrame(self, frame):
+        self.outbound.push(frame)
+
+    # This function queues the frame of a message of another user for the
+    # client, subject to the slow consumer policy
+    def deliverFrame(self, frame):
+        self.outbound.offer(frame)
+
+    # This function closes the session. The writer task sends the frames which
+    # are still queued and closes the connection
+    def close(self):
+        self.outbound.close()
+
+    # This function disconnects a client which does not keep up with its
+    # messages
+    def disconnectSlowConsumer(self):
+        self.outbound.close()
+        self.writer.transport.abort()
+
+    # This function starts streaming the offline messages of the user to the
+    # client, so that a long queue does not hold up the event loop
+    def loadCachedMessage(self):
+        if serverstate.offlineMessages.pendingFor(self.userName):
+            self.offlineDelivery = asyncio.get_running_loop().create_task(self.streamCachedMessages())
+
+    # This coroutine sends the offline messages of the user one batch at a time,
+    # waiting for each batch to be written before taking the next one
+    async def streamCachedMessages(self):
+        for batch in serverstate.offlineMessages.drainBatches(self.userName):
+            self.queueDrained.clear()
+            for message in batch:
+                self.send(message)
+            await self.queueDrained.wait()
+            if self.outbound.closed:
+                return
+
+# This coroutine is started by asyncio for every accepted connection, and for
+# every connection taken over from another server with the state of its
+# session
+async def handleConnection(reader, writer, state=None):
+    serverstate.metrics.connections.inc()
+    serverstate.metrics.openConnections.inc()
+    session = AsyncClientSession(reader, writer)
+    if state is not None:
+        session.restoreState(state)
+    try:
+        await session.run()
+        await session.writerTask
+    finally:
+        serverstate.metrics.openConnections.dec()
+
+# This coroutine stops the engine for a handoff to another server: the idle
+# timeouts, the presence feed, whose pending changes are sent first, and the
+# listening socket stop, and every session stops reading. It returns a
+# duplicate of the listening socket, which stays open after the server is
+# closed, and the sessions which have stopped reading before the deadline
+async def prepareHandoff(server, idleTimeoutTask, presenceTask, deadline):
+    serverstate.idleTimeouts.stop()
+    idleTimeoutTask.cancel()
+    serverstate.presenceFeed.stop()
+    presenceTask.cancel()
+    serverstate.presenceFeed.flush()
+    listenFd = os.dup(server.sockets[0].fileno())
+    server.close()
+    sessions = list(liveSessions)
+    for session in sessions:
+        session.stopReading()
+    while any(not session.interrupted for session in sessions if session in liveSessions):
+        if time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.01)
+    return listenFd, [session for session in sessions if session.interrupted]
+
+# This function raises the limit of open file descriptors to the hard limit so
+# that the number of connections is not capped by the default soft limit
+def raiseFileLimit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+# This coroutine starts listening on the server address and serves clients
+# until the process is stopped, or continues with the listening socket and
+# the sessions taken over from another server
+async def serve(serverHost, serverPort, reusePort=False, takeover=None):
+    if takeover is None:
+        server = await asyncio.start_server(handleConnection, serverHost, serverPort, backlog=LISTEN_BACKLOG,
+                                            reuse_address=True, reuse_port=reusePort or None)
+    else:
+        server = await asyncio.start_server(handleConnection, sock=takeover.listenSocket, backlog=LISTEN_BACKLOG)
+        for state, clientSocket in takeover.sessions:
+            reader, writer = await asyncio.open_connection(sock=clientSocket)
+            task = asyncio.create_task(handleConnection(reader, writer, state))
+            takenOverTasks.add(task)
+            task.add_done_callback(takenOverTasks.discard)
+
+        # The sessions are restored as soon as their tasks start, before this
+        # coroutine resumes
+        await asyncio.sleep(0)
+        serverstate.activity.settle()
+    idleTimeoutTask = asyncio.create_task(serverstate.idleTimeouts.runAsync())
+    presenceTask = asyncio.create_task(serverstate.presenceFeed.runAsync())
+
+    # The handoff is prepared on the event loop, from the thread of the
+    # handoff server
+    if serverstate.handoff is not None:
+        loop = asyncio.get_running_loop()
+        serverstate.handoff.start(lambda deadline: asyncio.run_coroutine_threadsafe(
+            prepareHandoff(server, idleTimeoutTask, presenceTask, deadline), loop).result())
+
+    # The messages of the other workers of a sharded server are handled on the
+    # event loop, like the commands of the clients
+    if serverstate.bus is not None:
+        serverstate.bus.start(asyncio.get_running_loop().call_soon_threadsafe)
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            if serverstate.handoff is None:
+                raise
+
+        # The server has been closed for a handoff, which exits the process
+        await asyncio.Event().wait()
+
+# This function runs the asyncio server engine on the given address. reusePort
+# lets several processes listen on the same port, takeover holds the listening
+# socket and the sessions taken over from another server, if any
+def runAsyncServer(serverHost, serverPort, reusePort=False, takeover=None):
+    raiseFileLimit()
+    try:
+        asyncio.run(serve(serverHost, serverPort, reusePort, takeover))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,257 @@
+"""
+    Python 3
+    Block graph of the users. Every user has the set of users blocking the
+    user and the set of users blocked by the user, so checking a block is a
+    set membership test and the bulk queries of whoelse and broadcast filter
+    the online users against one set. Changes are appended to a log file so
+    that blocks survive a restart; the log is read by a background thread at
+    startup and compacted when it holds many outdated records, at startup
+    and, through checkpoint(), while the server runs.
+"""
+import os
+import threading
+
+# The records of the log, a user blocking or unblocking another user
+BLOCK = '+'
+UNBLOCK = '-'
+
+# The log is rewritten when it holds more records than this factor times the
+# number of current blocks, plus COMPACT_SLACK
+COMPACT_FACTOR = 2
+COMPACT_SLACK = 1000
+
+# An empty set returned for users without any blocks
+NO_USERS = frozenset()
+
+"""
+    Define the block graph, loaded from and persisted to the given log file,
+    or kept in memory only if path is None.
+"""
+class BlockGraph:
+
+    # This is the constructor of the graph. The log is read in the background,
+    # queries made before it has been read wait for it
+    def __init__(self, path='blocks.log'):
+        self.path = path
+        self.blockersByUser = {}
+        self.blockedByUser = {}
+        self.edgeCount = 0
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.logFile = None
+        self.logRecords = 0
+
+        # The records logged while the log is compacted in the background,
+        # which are appended to the compacted log before it replaces the log
+        self.pendingRecords = None
+
+        # The functions called with the record, the blocker and the user after
+        # every block or unblock, such as the bus of a sharded server
+        self.listeners = []
+        if path is None:
+            self.loaded.set()
+        else:
+            loader = threading.Thread(name="blockGraphLoader", target=self.load)
+            loader.daemon = True
+            loader.start()
+
+    """
+        Public APIs of the graph.
+    """
+
+    # This function records that blocker blocks user. It returns False if
+    # blocker already blocks user
+    def block(self, blocker, user):
+        self.loaded.wait()
+        with self.lock:
+            if not self.addEdge(blocker, user):
+                return False
+            self.writeRecord(BLOCK, blocker, user)
+        for listener in self.listeners:
+            listener(BLOCK, blocker, user)
+        return True
+
+    # This function removes the block of user by blocker. It returns False if
+    # blocker did not block user
+    def unblock(self, blocker, user):
+        self.loaded.wait()
+        with self.lock:
+            if not self.removeEdge(blocker, user):
+                return False
+            self.writeRecord(UNBLOCK, blocker, user)
+        for listener in self.listeners:
+            listener(UNBLOCK, blocker, user)
+        return True
+
+    # This function applies a block or unblock made elsewhere, such as on
+    # another node of a cluster. It is only written to the log if log is set,
+    # as a node sharing the log with the other nodes finds it logged already
+    def apply(self, record, blocker, user, log=False):
+        self.loaded.wait()
+        with self.lock:
+            if record == BLOCK:
+                changed = self.addEdge(blocker, user)
+            elif record == UNBLOCK:
+                changed = self.removeEdge(blocker, user)
+            else:
+                return
+            if changed and log:
+                self.writeRecord(record, blocker, user)
+
+    # This function returns whether blocker blocks user
+    def hasBlocked(self, blocker, user):
+        self.loaded.wait()
+        return blocker in self.blockersByUser.get(user, NO_USERS)
+
+    # This function returns the set of users who block the given user
+    def blockersOf(self, user):
+        self.loaded.wait()
+        return self.blockersByUser.get(user, NO_USERS)
+
+    # This function returns the set of users blocked by the given user
+    def blockedBy(self, user):
+        self.loaded.wait()
+        return self.blockedByUser.get(user, NO_USERS)
+
+    # This function returns the users among the given online users who do not
+    # block the given user
+    def onlineNotBlocking(self, user, onlineUsers):
+        blockers = self.blockersOf(user)
+        if not blockers:
+            return list(onlineUsers)
+        return [online for online in onlineUsers if online not in blockers]
+
+    # This function returns the number of blocks
+    def __len__(self):
+        self.loaded.wait()
+        return self.edgeCount
+
+    # This function compacts the log once it holds many outdated records. The
+    # compacted log is written from a copy of the graph without holding the
+    # lock, so blocks and unblocks only wait for the copy and the final swap,
+    # and queries never wait. It must not be used while other processes
+    # append to the same log
+    def checkpoint(self):
+        if not self.loaded.is_set():
+            return
+        with self.lock:
+            if self.logFile is None or self.logRecords <= COMPACT_FACTOR * self.edgeCount + COMPACT_SLACK:
+                return
+            edges = [(blocker, list(blocked)) for blocker, blocked in self.blockedByUser.items()]
+            self.pendingRecords = []
+        temporaryPath = self.path + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as c:
+                records = 0
+                for blocker, blocked in edges:
+                    for user in blocked:
+                        c.write(f"{BLOCK} {blocker} {user}\n")
+                        records += 1
+                with self.lock:
+                    if self.logFile is None:
+                        return
+                    c.writelines(self.pendingRecords)
+                    c.flush()
+                    os.fsync(c.fileno())
+                    os.replace(temporaryPath, self.path)
+                    self.logFile.close()
+                    self.logFile = open(self.path, 'a')
+                    self.logRecords = records + len(self.pendingRecords)
+        finally:
+            with self.lock:
+                self.pendingRecords = None
+
+    # This function closes the log file
+    def close(self):
+        with self.lock:
+            if self.logFile is not None:
+                self.logFile.close()
+                self.logFile = None
+
+    """
+        Helper functions of the graph.
+    """
+
+    # This function adds an edge to both adjacency sets. The caller must hold
+    # the lock
+    def addEdge(self, blocker, user):
+        blockers = self.blockersByUser.get(user)
+        if blockers is None:
+            blockers = self.blockersByUser[user] = set()
+        elif blocker in blockers:
+            return False
+        blockers.add(blocker)
+        self.blockedByUser.setdefault(blocker, set()).add(user)
+        self.edgeCount += 1
+        return True
+
+    # This function removes an edge from both adjacency sets. The caller must
+    # hold the lock
+    def removeEdge(self, blocker, user):
+        blockers = self.blockersByUser.get(user)
+        if not blockers or blocker not in blockers:
+            return False
+        blockers.discard(blocker)
+        if not blockers:
+            del self.blockersByUser[user]
+        blocked = self.blockedByUser[blocker]
+        blocked.discard(user)
+        if not blocked:
+            del self.blockedByUser[blocker]
+        self.edgeCount -= 1
+        return True
+
+    # This function appends a record to the log. The caller must hold the lock
+    def writeRecord(self, record, blocker, user):
+        if self.logFile is not None:
+            line = f"{record} {blocker} {user}\n"
+            self.logFile.write(line)
+            self.logFile.flush()
+            self.logRecords += 1
+            if self.pendingRecords is not None:
+                self.pendingRecords.append(line)
+
+    # This function reads the log into the graph, compacts it if needed and
+    # opens it for appending. A line which was only partly written when the
+    # server stopped ends the log, and is cut off
+    def load(self):
+        records = 0
+        with self.lock:
+            try:
+                offset = 0
+                with open(self.path, 'r') as c:
+                    for line in c:
+                        if not line.endswith('\n'):
+                            break
+                        offset += len(line.encode())
+                        detail = line.split()
+                        if len(detail) != 3:
+                            continue
+                        records += 1
+                        if detail[0] == BLOCK:
+                            self.addEdge(detail[1], detail[2])
+                        elif detail[0] == UNBLOCK:
+                            self.removeEdge(detail[1], detail[2])
+                if offset < os.path.getsize(self.path):
+                    with open(self.path, 'r+b') as c:
+                        c.truncate(offset)
+            except FileNotFoundError:
+                pass
+            if records > COMPACT_FACTOR * self.edgeCount + COMPACT_SLACK:
+                self.compact()
+                records = self.edgeCount
+            self.logRecords = records
+            self.logFile = open(self.path, 'a')
+        self.loaded.set()
+
+    # This function rewrites the log with one record per current block and
+    # replaces the old log atomically. The caller must hold the lock
+    def compact(self):
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as c:
+            for blocker, blocked in self.blockedByUser.items():
+                for user in blocked:
+                    c.write(f"{BLOCK} {blocker} {user}\n")
+            c.flush()
+            os.fsync(c.fileno())
+        os.replace(temporaryPath, self.path)
@@ -0,0 +1,328 @@
+"""
+    Python 3
+    Group channels of the users. Every channel has the set of its members and
+    every user the set of channels the user has joined, and every channel
+    also keeps the records of its members who are online, kept up to date
+    by the logins and logouts of the presence registry. A message to a
+    channel is thus fanned out over a tuple of its online members, rebuilt
+    only when one of them joins, leaves, logs in or logs out, without
+    looking at the other users online. Joins and leaves are appended to a
+    log file so that the channels survive a restart; the log is read by a
+    background thread at startup and compacted like the block log (see
+    blockgraph.py).
+"""
+import os
+import re
+import threading
+
+# The records of the log, a user joining or leaving a channel
+JOIN = '+'
+LEAVE = '-'
+
+# The log is rewritten when it holds more records than this factor times the
+# number of memberships, plus COMPACT_SLACK
+COMPACT_FACTOR = 2
+COMPACT_SLACK = 1000
+
+# The names of the channels: letters, digits, '_' and '-', after an optional '#'
+CHANNEL_NAME = re.compile(r'#?[A-Za-z0-9_-]{1,32}')
+
+# An empty set returned for users and channels without any members
+NO_MEMBERS = frozenset()
+
+# This function returns the name of the channel given by a user, without its
+# '#', or None if it is not a valid channel name
+def channelName(name):
+    if CHANNEL_NAME.fullmatch(name) is None:
+        return None
+    return name.lstrip('#')
+
+"""
+    Define the channels of the users, loaded from and persisted to the given
+    log file, or kept in memory only if path is None. The online members are
+    tracked from the logins and logouts of the given presence registry.
+"""
+class ChannelDirectory:
+
+    # This is the constructor of the directory. The log is read in the
+    # background, queries made before it has been read wait for it
+    def __init__(self, presence, path='channels.log'):
+        self.path = path
+        self.membersByChannel = {}
+        self.channelsByUser = {}
+        self.membershipCount = 0
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.logFile = None
+        self.logRecords = 0
+        self.pendingRecords = None
+
+        # The records of the online members of every channel by user name, and
+        # the tuple of them a message to the channel is fanned out over, which
+        # is None until used again after the online members have changed
+        self.presence = presence
+        self.onlineByChannel = {}
+        self.fanOutLists = {}
+        presence.loginListeners.append(self.memberLoggedIn)
+        presence.logoutListeners.append(self.memberLoggedOut)
+
+        # The functions called with the record, the channel and the user after
+        # every join or leave, such as the bus of a sharded server
+        self.listeners = []
+        if path is None:
+            self.load()
+        else:
+            loader = threading.Thread(name="channelLoader", target=self.load)
+            loader.daemon = True
+            loader.start()
+
+    """
+        Public APIs of the directory.
+    """
+
+    # This function adds user to the members of the channel. It returns False
+    # if user is a member already
+    def join(self, channel, user):
+        self.loaded.wait()
+        with self.lock:
+            if not self.addMember(channel, user):
+                return False
+            self.writeRecord(JOIN, channel, user)
+        for listener in self.listeners:
+            listener(JOIN, channel, user)
+        return True
+
+    # This function removes user from the members of the channel. It returns
+    # False if user is not a member
+    def leave(self, channel, user):
+        self.loaded.wait()
+        with self.lock:
+            if not self.removeMember(channel, user):
+                return False
+            self.writeRecord(LEAVE, channel, user)
+        for listener in self.listeners:
+            listener(LEAVE, channel, user)
+        return True
+
+    # This function applies a join or leave made elsewhere, such as on another
+    # node of a cluster. It is only written to the log if log is set, as a
+    # node sharing the log with the other nodes finds it logged already
+    def apply(self, record, channel, user, log=False):
+        self.loaded.wait()
+        with self.lock:
+            if record == JOIN:
+                changed = self.addMember(channel, user)
+            elif record == LEAVE:
+                changed = self.removeMember(channel, user)
+            else:
+                return
+            if changed and log:
+                self.writeRecord(record, channel, user)
+
+    # This function returns whether user is a member of the channel
+    def isMember(self, channel, user):
+        self.loaded.wait()
+        return user in self.membersByChannel.get(channel, NO_MEMBERS)
+
+    # This function returns a tuple of the presence records (see presence.py)
+    # of the online members of the channel. Like the snapshot of the presence
+    # registry, the tuple is not affected by later changes, so it can be
+    # iterated while other sessions change the channel
+    def onlineMembers(self, channel):
+        self.loaded.wait()
+        fanOutList = self.fanOutLists.get(channel)
+        if fanOutList is None:
+            with self.lock:
+                fanOutList = self.fanOutLists.get(channel)
+                if fanOutList is None:
+                    fanOutList = tuple(self.onlineByChannel.get(channel, {}).values())
+                    if channel in self.membersByChannel:
+                        self.fanOutLists[channel] = fanOutList
+        return fanOutList
+
+    # This function returns a list of the members of the channel who are not
+    # online, without looking at the members when all of them are online
+    def offlineMembers(self, channel):
+        self.loaded.wait()
+        with self.lock:
+            members = self.membersByChannel.get(channel, NO_MEMBERS)
+            online = self.onlineByChannel.get(channel, NO_MEMBERS)
+            if len(online) == len(members):
+                return []
+            return [user for user in members if user not in online]
+
+    # This function returns the number of memberships
+    def __len__(self):
+        self.loaded.wait()
+        return self.membershipCount
+
+    # This function compacts the log once it holds many outdated records. The
+    # compacted log is written from a copy of the memberships without holding
+    # the lock, so joins and leaves only wait for the copy and the final swap.
+    # It must not be used while other processes append to the same log
+    def checkpoint(self):
+        if not self.loaded.is_set():
+            return
+        with self.lock:
+            if self.logFile is None or self.logRecords <= COMPACT_FACTOR * self.membershipCount + COMPACT_SLACK:
+                return
+            memberships = [(channel, list(members)) for channel, members in self.membersByChannel.items()]
+            self.pendingRecords = []
+        temporaryPath = self.path + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as c:
+                records = 0
+                for channel, members in memberships:
+                    for user in members:
+                        c.write(f"{JOIN} {channel} {user}\n")
+                        records += 1
+                with self.lock:
+                    if self.logFile is None:
+                        return
+                    c.writelines(self.pendingRecords)
+                    c.flush()
+                    os.fsync(c.fileno())
+                    os.replace(temporaryPath, self.path)
+                    self.logFile.close()
+                    self.logFile = open(self.path, 'a')
+                    self.logRecords = records + len(self.pendingRecords)
+        finally:
+            with self.lock:
+                self.pendingRecords = None
+
+    # This function closes the log file
+    def close(self):
+        with self.lock:
+            if self.logFile is not None:
+                self.logFile.close()
+                self.logFile = None
+
+    """
+        Helper functions of the directory.
+    """
+
+    # This function adds a membership to both sets, and the user to the online
+    # members of the channel if the user is online. The caller must hold the
+    # lock
+    def addMember(self, channel, user):
+        members = self.membersByChannel.get(channel)
+        if members is None:
+            members = self.membersByChannel[channel] = set()
+        elif user in members:
+            return False
+        members.add(user)
+        self.channelsByUser.setdefault(user, set()).add(channel)
+        self.membershipCount += 1
+        record = self.presence.lookup(user)
+        if record is not None:
+            self.onlineByChannel.setdefault(channel, {})[user] = record
+            self.fanOutLists.pop(channel, None)
+        return True
+
+    # This function removes a membership from both sets, and the user from the
+    # online members of the channel. The caller must hold the lock
+    def removeMember(self, channel, user):
+        members = self.membersByChannel.get(channel)
+        if not members or user not in members:
+            return False
+        members.discard(user)
+        if not members:
+            del self.membersByChannel[channel]
+        channels = self.channelsByUser[user]
+        channels.discard(channel)
+        if not channels:
+            del self.channelsByUser[user]
+        self.membershipCount -= 1
+        online = self.onlineByChannel.get(channel)
+        if online is not None and online.pop(user, None) is not None:
+            if not online:
+                del self.onlineByChannel[channel]
+            self.fanOutLists.pop(channel, None)
+        return True
+
+    # This function adds a user who has logged in to the online members of the
+    # channels of the user. Logins before the log has been read are added once
+    # it has been
+    def memberLoggedIn(self, record):
+        with self.lock:
+            if not self.loaded.is_set():
+                return
+            for channel in self.channelsByUser.get(record.userName, NO_MEMBERS):
+                self.onlineByChannel.setdefault(channel, {})[record.userName] = record
+                self.fanOutLists.pop(channel, None)
+
+    # This function removes a user who has logged out from the online members
+    # of the channels of the user, unless the user has logged in again with
+    # another session meanwhile
+    def memberLoggedOut(self, record):
+        with self.lock:
+            if not self.loaded.is_set():
+                return
+            for channel in self.channelsByUser.get(record.userName, NO_MEMBERS):
+                online = self.onlineByChannel.get(channel)
+                if online is not None and online.get(record.userName) is record:
+                    del online[record.userName]
+                    if not online:
+                        del self.onlineByChannel[channel]
+                    self.fanOutLists.pop(channel, None)
+
+    # This function appends a record to the log. The caller must hold the lock
+    def writeRecord(self, record, channel, user):
+        if self.logFile is not None:
+            line = f"{record} {channel} {user}\n"
+            self.logFile.write(line)
+            self.logFile.flush()
+            self.logRecords += 1
+            if self.pendingRecords is not None:
+                self.pendingRecords.append(line)
+
+    # This function reads the log into the directory, compacts it if needed and
+    # opens it for appending. A line which was only partly written when the
+    # server stopped ends the log, and is cut off. The users who have logged in
+    # meanwhile are added to the online members of their channels
+    def load(self):
+        records = 0
+        with self.lock:
+            if self.path is not None:
+                try:
+                    offset = 0
+                    with open(self.path, 'r') as c:
+                        for line in c:
+                            if not line.endswith('\n'):
+                                break
+                            offset += len(line.encode())
+                            detail = line.split()
+                            if len(detail) != 3:
+                                continue
+                            records += 1
+                            if detail[0] == JOIN:
+                                self.addMember(detail[1], detail[2])
+                            elif detail[0] == LEAVE:
+                                self.removeMember(detail[1], detail[2])
+                    if offset < os.path.getsize(self.path):
+                        with open(self.path, 'r+b') as c:
+                            c.truncate(offset)
+                except FileNotFoundError:
+                    pass
+                if records > COMPACT_FACTOR * self.membershipCount + COMPACT_SLACK:
+                    self.compact()
+                    records = self.membershipCount
+                self.logRecords = records
+                self.logFile = open(self.path, 'a')
+            for record in self.presence.snapshot():
+                for channel in self.channelsByUser.get(record.userName, NO_MEMBERS):
+                    self.onlineByChannel.setdefault(channel, {})[record.userName] = record
+                    self.fanOutLists.pop(channel, None)
+            self.loaded.set()
+
+    # This function rewrites the log with one record per membership and
+    # replaces the old log atomically. The caller must hold the lock
+    def compact(self):
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as c:
+            for channel, members in self.membersByChannel.items():
+                for user in members:
+                    c.write(f"{JOIN} {channel} {user}\n")
+            c.flush()
+            os.fsync(c.fileno())
+        os.replace(temporaryPath, self.path)
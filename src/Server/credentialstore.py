@@ -0,0 +1,131 @@
+"""
+    Python 3
+    In-memory index of the credentials file. The file is read once into a
+    dictionary so that checking a user name or a password is a hash lookup,
+    new users are appended to the file under a lock, and changes made to the
+    file by hand are picked up incrementally once its modification time or
+    size changes.
+"""
+import os
+import threading
+import time
+
+"""
+    Define the credential store for the given credentials file, in which
+    every line holds a user name and a password separated by a space. As when
+    the file was read on every lookup, a user may have several lines and logs
+    in with the password of any of them.
+"""
+class CredentialStore:
+
+    # This is the constructor of the store. refreshInterval is the minimum
+    # number of seconds between two checks of the file for outside changes,
+    # so that lookups on the message path do not touch the file system
+    def __init__(self, path='credentials.txt', refreshInterval=1.0):
+        self.path = path
+        self.refreshInterval = refreshInterval
+        self.passwords = {}
+        self.lock = threading.Lock()
+        self.offset = 0
+        self.fileId = None
+        self.tailEntry = None
+        self.lastCheck = 0.0
+        self.reload()
+
+    # This function returns whether the user has been registered in the system
+    def exists(self, userName):
+        self.maybeRefresh()
+        return userName in self.passwords
+
+    # This function returns whether the user name & password matches the
+    # record stored in the credentials file
+    def verify(self, userName, password):
+        self.maybeRefresh()
+        return password in self.passwords.get(userName, ())
+
+    # This function adds the user name and password of a newly registered user
+    # to the index and to the end of the credentials file
+    def add(self, userName, password):
+        with self.lock:
+            self.refresh()
+            with open(self.path, 'a') as c:
+                c.write('\n' + userName + ' ' + password)
+            self.passwords.setdefault(userName, set()).add(password)
+            self.refresh()
+
+    # This function adds a user who has been written to the credentials file by
+    # another process to the index, ahead of the next refresh
+    def remember(self, userName, password):
+        with self.lock:
+            self.passwords.setdefault(userName, set()).add(password)
+
+    # This function returns the number of registered users
+    def __len__(self):
+        return len(self.passwords)
+
+    # This function checks the file for outside changes at most once every
+    # refreshInterval seconds
+    def maybeRefresh(self):
+        now = time.monotonic()
+        if now - self.lastCheck >= self.refreshInterval:
+            with self.lock:
+                self.lastCheck = now
+                self.refresh()
+
+    # This function reads the entire credentials file into a new index
+    def reload(self):
+        with self.lock:
+            self.passwords = {}
+            self.offset = 0
+            self.fileId = None
+            self.tailEntry = None
+            self.refresh()
+
+    # This function brings the index up to date with the file. If the file has
+    # only grown, just the new lines are read; if it has been replaced or
+    # shrunk, it is read again from the start. The caller must hold the lock
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        fileId = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if fileId == self.fileId:
+            return
+        if self.fileId is not None and (stat.st_ino != self.fileId[0] or stat.st_size < self.offset):
+            self.passwords = {}
+            self.offset = 0
+            self.tailEntry = None
+        if self.tailEntry is not None:
+            self.removeEntry(*self.tailEntry)
+            self.tailEntry = None
+        with open(self.path, 'rb') as c:
+            c.seek(self.offset)
+            data = c.read()
+        self.fileId = fileId
+
+        # The last line of the file has no line break, it is parsed now and read
+        # again on the next change in case the line was still being written.
+        # What it added is kept so that it can be taken back then
+        lines = data.split(b'\n')
+        self.offset += len(data) - len(lines[-1])
+        for line in lines:
+            detail = line.decode(errors='replace').split()
+            if not detail:
+                continue
+            newUser = detail[0] not in self.passwords
+            passwords = self.passwords.setdefault(detail[0], set())
+            password = detail[1] if len(detail) > 1 and detail[1] not in passwords else None
+            if password is not None:
+                passwords.add(password)
+            if line is lines[-1]:
+                self.tailEntry = (detail[0], password, newUser)
+
+    # This function takes back what a line of the file added to the index: the
+    # given password of the user, or the user if it was new. The caller must
+    # hold the lock
+    def removeEntry(self, userName, password, newUser):
+        if newUser:
+            self.passwords.pop(userName, None)
+        elif password is not None:
+            self.passwords[userName].discard(password)
@@ -0,0 +1,209 @@
+"""
+    Python 3
+    Handoff of a running server to a new server process, so that the server
+    can be restarted or upgraded without dropping its connections. The old
+    server, started with --handoff PATH, listens on the Unix socket PATH. A
+    new server started with --takeover PATH connects to it before loading
+    any state, and the old server then
+        - stops timing out idle sessions, accepting connections and reading
+          from its clients, leaving what the clients send in the sockets,
+        - waits for the frames queued for its clients to be written,
+        - writes its state to the disk and frees the metrics port,
+        - passes the listening socket and the socket of every client to the
+          new server (SCM_RIGHTS), with the state of every session: the user
+          logged in, the p2p port, the login procedure, the idle deadline and
+          the codec and decoder of the protocol of the connection,
+        - and exits once the new server has received everything.
+    The new server loads the state written by the old one and continues
+    every session from where it was, so the users stay logged in and their
+    clients never notice the restart. Connections made meanwhile wait in the
+    backlog of the listening socket.
+
+    Sessions which do not stop reading or writing in time, such as the
+    sessions of clients which do not keep up with their messages, are closed
+    instead and their clients have to log in again.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from socket import socket, AF_UNIX, SOCK_STREAM, send_fds, recv_fds
+import serverstate
+import wire
+
+# The seconds the old server waits for its sessions to stop reading and for
+# their queued frames to be written
+HANDOFF_TIMEOUT = 5.0
+
+# The sockets passed in one message, below the limit of the kernel
+FDS_PER_MESSAGE = 250
+
+# The header of every message of the handoff, the length of its JSON body and
+# the number of sockets passed with it
+MESSAGE_HEADER = struct.Struct('>II')
+
+# The requests of the new server, asking for the handoff and acknowledging it
+TAKEOVER = b'TAKEOVER'
+DONE = b'DONE'
+
+# This function sends one message, the given object as JSON with the given
+# file descriptors. The descriptors are attached to the header only, so that
+# the receiver never reads the descriptors of two messages at once
+def sendMessage(sock, body, fds=()):
+    body = json.dumps(body).encode()
+    send_fds(sock, [MESSAGE_HEADER.pack(len(body), len(fds))], list(fds))
+    sock.sendall(body)
+
+# This function receives one message sent by sendMessage() and returns its
+# object and its file descriptors
+def recvMessage(sock):
+    header, fds, flags, address = recv_fds(sock, MESSAGE_HEADER.size, FDS_PER_MESSAGE)
+    header += recvExactly(sock, MESSAGE_HEADER.size - len(header))
+    length, count = MESSAGE_HEADER.unpack(header)
+    if len(fds) != count:
+        raise ConnectionError(f"expected {count} sockets in the handoff, received {len(fds)}")
+    return json.loads(recvExactly(sock, length)), fds
+
+# This function receives exactly size bytes from the socket
+def recvExactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("handoff connection closed")
+        data += chunk
+    return bytes(data)
+
+# This function waits until every frame queued for the session has been
+# written, and returns whether it has before the deadline
+def waitDrained(session, deadline):
+    while not session.outbound.isIdle():
+        if session.outbound.closed or time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return not session.outbound.closed
+
+# This function writes the state of the process to the disk and closes the
+# files and the ports the new server opens again
+def closeState():
+    serverstate.snapshots.close()
+    serverstate.offlineMessages.close()
+    serverstate.history.close()
+    serverstate.blockGraph.close()
+    serverstate.channels.close()
+    serverstate.metrics.stopHttpServer()
+
+"""
+    Define the handoff server of the old server process. The server engine
+    calls start() once it is serving, with a function which stops the engine
+    for the handoff and returns the file descriptor of the listening socket
+    and the sessions which have stopped reading. The engine stops reading from
+    the sessions of the thread engine by polling interruptFd, which becomes
+    readable once the handoff has started.
+"""
+class HandoffServer:
+
+    # This is the constructor of the handoff server listening on the Unix
+    # socket at path
+    def __init__(self, path, timeout=HANDOFF_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.interruptFd, self.interruptWriteFd = os.pipe()
+        self.prepare = None
+        self.thread = None
+
+    """
+        Public APIs of the handoff server.
+    """
+
+    # This function starts listening for a new server in a background thread.
+    # prepare(deadline) is called to stop the engine once a new server has
+    # connected
+    def start(self, prepare):
+        self.prepare = prepare
+        listener = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        listener.bind(self.path)
+        listener.listen()
+        self.thread = threading.Thread(name="handoff", target=self.run, args=(listener,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    # This function wakes up the readers polling interruptFd, which stop
+    # reading for the handoff
+    def interrupt(self):
+        os.write(self.interruptWriteFd, b'!')
+
+    # This function blocks until the handoff is over, which exits the process
+    def wait(self):
+        self.thread.join()
+
+    """
+        Helper functions of the handoff server.
+    """
+
+    # This function waits for a new server and hands the process over to it.
+    # The process exits once the engine has been stopped, whether the new
+    # server has taken over or not
+    def run(self, listener):
+        while True:
+            connection, address = listener.accept()
+            try:
+                if recvExactly(connection, len(TAKEOVER)) == TAKEOVER:
+                    break
+            except OSError:
+                pass
+            connection.close()
+        listener.close()
+        os.unlink(self.path)
+        try:
+            self.handOff(connection)
+        finally:
+            os._exit(0)
+
+    # This function stops the engine and sends the listening socket and the
+    # sessions to the new server
+    def handOff(self, connection):
+        deadline = time.monotonic() + self.timeout
+        listenFd, sessions = self.prepare(deadline)
+        sessions = [session for session in sessions if waitDrained(session, deadline)]
+        closeState()
+        userNames = sorted(wire.userIds, key=wire.userIds.get)
+        sendMessage(connection, {'userNames': userNames, 'sessions': len(sessions)}, [listenFd])
+        for offset in range(0, len(sessions), FDS_PER_MESSAGE):
+            chunk = [session.handoffState() for session in sessions[offset:offset + FDS_PER_MESSAGE]]
+            sendMessage(connection, [state for fd, state in chunk], [fd for fd, state in chunk])
+        recvExactly(connection, len(DONE))
+
+"""
+    Define the connections and the state received from the old server by
+    takeOver(): the listening socket, and the state and socket of every
+    session.
+"""
+class Takeover:
+
+    # This is the constructor of the takeover
+    def __init__(self, listenSocket, sessions):
+        self.listenSocket = listenSocket
+        self.sessions = sessions
+
+# This function takes the listening socket and the sessions over from the old
+# server listening on the Unix socket at path. The user ids of the binary
+# protocol are taken over as well, as the clients know the users by them
+def takeOver(path):
+    connection = socket(AF_UNIX, SOCK_STREAM)
+    connection.connect(path)
+    connection.sendall(TAKEOVER)
+    header, (listenFd,) = recvMessage(connection)
+    wire.userIds.update((userName, id) for id, userName in enumerate(header['userNames']))
+    sessions = []
+    while len(sessions) < header['sessions']:
+        states, fds = recvMessage(connection)
+        sessions.extend((state, socket(fileno=fd)) for state, fd in zip(states, fds))
+    connection.sendall(DONE)
+    connection.close()
+    return Takeover(socket(fileno=listenFd), sessions)
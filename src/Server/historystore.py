@@ -0,0 +1,429 @@
+"""
+    Python 3
+    Message history store. Every message between two users is appended to
+    the log of their conversation, a directory of append-only segments, and
+    numbered from 1 within the conversation. Every INDEX_INTERVAL-th message
+    of a conversation is kept in a sparse index of its segment and offset, so
+    a page of messages is found by one lookup and read by scanning at most
+    INDEX_INTERVAL records before it, from segments mapped into memory, in
+    time independent of the number of messages stored. Words of the messages
+    are indexed incrementally in an inverted index held in memory, which is
+    rebuilt by a background thread from the logs when the server starts; a
+    conversation used before the thread has reached it is read at once.
+"""
+import heapq
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Every record starts with the length of the rest of the record, followed by
+# the number of the message in its conversation, the sequence number of the
+# message in the store, the time it was sent and the length of the sender.
+# The sender and the text of the message follow. The sequence numbers are
+# the microseconds since the epoch when the messages were appended, made
+# unique, so that they keep increasing across restarts without reading every
+# log first
+RECORD_HEADER = struct.Struct('>IIQdH')
+
+# Every INDEX_INTERVAL-th message of a conversation is in the sparse index
+INDEX_INTERVAL = 32
+
+# The segments of a conversation mapped and the segments open for appending
+# at a time
+MAPPED_SEGMENTS = 64
+OPEN_SEGMENTS = 128
+
+# The words of the messages indexed for search, and the longest word indexed
+WORD = re.compile(r'\w+')
+MAX_WORD_LENGTH = 64
+
+# This function returns the key of the conversation between two users
+def conversationKey(userA, userB):
+    return (userA, userB) if userA < userB else (userB, userA)
+
+# This function returns the distinct words of the text indexed for search
+def indexWords(text):
+    return {word for word in WORD.findall(text.lower()) if len(word) <= MAX_WORD_LENGTH}
+
+# This function returns the distinct words of a search in the order given.
+# Words too long to be indexed are kept, so that they match nothing
+def queryWords(text):
+    return list(dict.fromkeys(WORD.findall(text.lower())))
+
+"""
+    Define a message of the history.
+"""
+class HistoryMessage:
+    __slots__ = ('id', 'seq', 'timestamp', 'sender', 'text')
+
+    # This is the constructor of the message
+    def __init__(self, id, seq, timestamp, sender, text):
+        self.id = id
+        self.seq = seq
+        self.timestamp = timestamp
+        self.sender = sender
+        self.text = text
+
+"""
+    Define the state of one conversation: the number of its next message,
+    the sequence numbers of its messages for search, and either the sparse
+    index of its log or its messages when the store is kept in memory.
+"""
+class Conversation:
+    __slots__ = ('key', 'directory', 'nextId', 'seqs', 'sparse', 'segment', 'segmentSize', 'messages')
+
+    # This is the constructor of an empty conversation
+    def __init__(self, key, directory):
+        self.key = key
+        self.directory = directory
+        self.nextId = 1
+        self.seqs = array('Q')
+        self.sparse = []
+        self.segment = 1
+        self.segmentSize = 0
+        self.messages = [] if directory is None else None
+
+"""
+    Define the history store. directory is where the logs of the
+    conversations are kept, or None to keep the history in memory only. The
+    store is safe to use from several threads. Searching before the logs have
+    been read returns None.
+"""
+class HistoryStore:
+
+    # This is the constructor of the store
+    def __init__(self, directory='history', segmentSize=1024 * 1024):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.lock = threading.Lock()
+        self.conversations = {}
+        self.nextSeq = 1
+        self.count = 0
+
+        # The conversations of every user, and for every word the sequence
+        # numbers of the messages containing it in every conversation
+        self.conversationsOf = {}
+        self.postings = {}
+
+        # The segments mapped into memory, as (mmap, size), and the segments
+        # open for appending, least recently used first
+        self.maps = OrderedDict()
+        self.files = OrderedDict()
+        self.dirty = set()
+
+        # The conversations found on the disk whose logs have not been read yet
+        self.unread = set()
+        self.loaded = threading.Event()
+        if directory is None:
+            self.loaded.set()
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.unread = set(self.listConversations())
+            loader = threading.Thread(name="historyLoader", target=self.load)
+            loader.daemon = True
+            loader.start()
+
+    """
+        Public APIs of the store.
+    """
+
+    # This function appends a message sent by sender to recipient to their
+    # conversation, and returns its number in the conversation. timestamp is
+    # the time the message was sent, now unless given
+    def append(self, sender, recipient, text, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            conversation = self.conversation(conversationKey(sender, recipient))
+            seq = max(self.nextSeq, int(timestamp * 1e6))
+            message = HistoryMessage(conversation.nextId, seq, timestamp, sender, text)
+            self.nextSeq = seq + 1
+            if conversation.messages is not None:
+                conversation.messages.append(message)
+            else:
+                self.writeMessage(conversation, message)
+            self.indexMessage(conversation, message)
+            return message.id
+
+    # This function returns up to limit messages between the two users, the
+    # latest ones numbered below beforeId or the latest ones if beforeId is
+    # None, oldest first
+    def page(self, userA, userB, beforeId=None, limit=50):
+        with self.lock:
+            conversation = self.conversation(conversationKey(userA, userB), create=False)
+            if conversation is None or limit <= 0:
+                return []
+            last = conversation.nextId - 1
+            if beforeId is not None:
+                last = min(last, beforeId - 1)
+            first = max(1, last - limit + 1)
+            if last < first:
+                return []
+            return self.readMessages(conversation, first, last)
+
+    # This function returns up to limit of the latest messages of the
+    # conversations of the user which contain every given word, latest first,
+    # as (peer, message) pairs, or None until the logs have been read. The
+    # words are split as the messages are indexed, so punctuation is ignored,
+    # and a query without any word matches nothing
+    def search(self, userName, words, limit=20):
+        if not self.loaded.is_set():
+            return None
+        words = queryWords(' '.join(words))
+        if not words:
+            return []
+        with self.lock:
+            lists = [self.postings.get(word) for word in words]
+            if any(postings is None for postings in lists):
+                return []
+
+            # The conversations are taken from the shortest of the user's
+            # conversations and of those of the rarest word
+            rarest = min(lists, key=len)
+            keys = self.conversationsOf.get(userName, ())
+            if len(rarest) < len(keys):
+                keys = [key for key in rarest if userName in key]
+            matches = []
+            for key in keys:
+                seqs = rarest.get(key)
+                if seqs is None:
+                    continue
+                others = [postings.get(key) for postings in lists if postings is not rarest]
+                if any(other is None for other in others):
+                    continue
+                found = 0
+                for seq in reversed(seqs):
+                    if all(contains(other, seq) for other in others):
+                        matches.append((seq, key))
+                        found += 1
+                        if found == limit:
+                            break
+            results = []
+            for seq, key in heapq.nlargest(limit, matches):
+                conversation = self.conversations[key]
+                id = bisect_left(conversation.seqs, seq) + 1
+                message = self.readMessages(conversation, id, id)[0]
+                results.append((key[1] if key[0] == userName else key[0], message))
+            return results
+
+    # This function returns the number of messages in the store
+    def __len__(self):
+        return self.count
+
+    # This function writes the appended messages to the disk, called by the
+    # snapshotter (see statestore.py) with the other state of the server. The
+    # segments closed since the last checkpoint are opened again to be synced
+    def checkpoint(self):
+        with self.lock:
+            for c in self.files.values():
+                c.flush()
+            paths = list(self.dirty)
+            self.dirty.clear()
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # This function writes the appended messages to the disk and closes the
+    # segments
+    def close(self):
+        self.checkpoint()
+        with self.lock:
+            for c in self.files.values():
+                c.close()
+            self.files.clear()
+            for data, size in self.maps.values():
+                data.close()
+            self.maps.clear()
+
+    """
+        Helper functions of the store.
+    """
+
+    # This function returns the conversation with the given key, reading its
+    # log if it has not been read yet. A new conversation is created, or None
+    # returned if create is False. The caller must hold the lock
+    def conversation(self, key, create=True):
+        conversation = self.conversations.get(key)
+        if conversation is not None:
+            return conversation
+        if not create and key not in self.unread:
+            return None
+        directory = None
+        if self.directory is not None:
+            directory = os.path.join(self.directory, '\n'.join(key).encode().hex())
+        conversation = self.conversations[key] = Conversation(key, directory)
+        for userName in key:
+            self.conversationsOf.setdefault(userName, set()).add(key)
+        if key in self.unread:
+            self.unread.discard(key)
+            self.recoverConversation(conversation)
+        elif directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        return conversation
+
+    # This function adds the message, the next of its conversation, to the
+    # indexes. The caller must hold the lock
+    def indexMessage(self, conversation, message):
+        self.count += 1
+        conversation.nextId = message.id + 1
+        conversation.seqs.append(message.seq)
+        for word in indexWords(message.text):
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+            seqs = postings.get(conversation.key)
+            if seqs is None:
+                seqs = postings[conversation.key] = array('Q')
+            seqs.append(message.seq)
+
+    # This function returns the path of the given segment of a conversation
+    def segmentPath(self, conversation, segment):
+        return os.path.join(conversation.directory, f"segment-{segment:08d}.log")
+
+    # This function appends the message to the log of its conversation,
+    # starting a new segment once the current one is full. The caller must
+    # hold the lock
+    def writeMessage(self, conversation, message):
+        if conversation.segmentSize >= self.segmentSize:
+            conversation.segment += 1
+            conversation.segmentSize = 0
+        if (message.id - 1) % INDEX_INTERVAL == 0:
+            conversation.sparse.append((conversation.segment, conversation.segmentSize))
+        sender = message.sender.encode()
+        data = sender + message.text.encode()
+        record = RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(data), message.id, message.seq,
+                                    message.timestamp, len(sender)) + data
+        path = self.segmentPath(conversation, conversation.segment)
+        self.openFile(path).write(record)
+        self.dirty.add(path)
+        conversation.segmentSize += len(record)
+
+    # This function returns the segment at path open for appending, closing
+    # the least recently used segment to make room. The caller must hold the
+    # lock
+    def openFile(self, path):
+        c = self.files.get(path)
+        if c is not None:
+            self.files.move_to_end(path)
+            return c
+        if len(self.files) >= OPEN_SEGMENTS:
+            self.files.popitem(last=False)[1].close()
+        c = self.files[path] = open(path, 'ab')
+        return c
+
+    # This function returns the segment at path mapped into memory, with its
+    # size. A segment which has grown since it was mapped is mapped again,
+    # after the messages appended to it are written. The caller must hold
+    # the lock
+    def mapSegment(self, path):
+        c = self.files.get(path)
+        if c is not None:
+            c.flush()
+        entry = self.maps.get(path)
+        size = os.path.getsize(path)
+        if entry is not None:
+            if entry[1] == size:
+                self.maps.move_to_end(path)
+                return entry
+            entry[0].close()
+            del self.maps[path]
+        if len(self.maps) >= MAPPED_SEGMENTS:
+            self.maps.popitem(last=False)[1][0].close()
+        with open(path, 'rb') as c:
+            entry = self.maps[path] = (mmap.mmap(c.fileno(), size, access=mmap.ACCESS_READ), size)
+        return entry
+
+    # This function returns the messages of the conversation numbered from
+    # first to last. The log is read from the closest entry of the sparse
+    # index at or before first. The caller must hold the lock
+    def readMessages(self, conversation, first, last):
+        if conversation.messages is not None:
+            return conversation.messages[first - 1:last]
+        segment, offset = conversation.sparse[(first - 1) // INDEX_INTERVAL]
+        messages = []
+        while len(messages) <= last - first:
+            data, size = self.mapSegment(self.segmentPath(conversation, segment))
+            for message, offset in readRecords(data, size, offset):
+                if message.id > last:
+                    return messages
+                if message.id >= first:
+                    messages.append(message)
+            segment += 1
+            offset = 0
+        return messages
+
+    # This function returns the keys of the conversations on the disk
+    def listConversations(self):
+        for name in os.listdir(self.directory):
+            try:
+                key = tuple(bytes.fromhex(name).decode().split('\n'))
+            except ValueError:
+                continue
+            if len(key) == 2:
+                yield key
+
+    # This function reads the logs of the conversations which have not been
+    # read yet, one conversation at a time so that the store is used meanwhile
+    def load(self):
+        try:
+            for key in list(self.unread):
+                with self.lock:
+                    if key in self.unread:
+                        self.conversation(key)
+        finally:
+            self.loaded.set()
+
+    # This function reads the log of one conversation into the indexes. A
+    # record which was only partly written when the server stopped ends its
+    # segment and is cut off. The caller must hold the lock
+    def recoverConversation(self, conversation):
+        segments = sorted(int(name[8:16]) for name in os.listdir(conversation.directory)
+                          if name.startswith('segment-') and name.endswith('.log'))
+        for segment in segments:
+            path = self.segmentPath(conversation, segment)
+            size = os.path.getsize(path)
+            offset = 0
+            if size:
+                with open(path, 'rb') as c, mmap.mmap(c.fileno(), size, access=mmap.ACCESS_READ) as data:
+                    start = 0
+                    for message, offset in readRecords(data, size, 0):
+                        if message.id != conversation.nextId:
+                            break
+                        if (message.id - 1) % INDEX_INTERVAL == 0:
+                            conversation.sparse.append((segment, start))
+                        self.nextSeq = max(self.nextSeq, message.seq + 1)
+                        self.indexMessage(conversation, message)
+                        start = offset
+                    offset = start
+            if offset < size:
+                with open(path, 'r+b') as c:
+                    c.truncate(offset)
+            conversation.segment = segment
+            conversation.segmentSize = offset
+
+# This function yields the messages recorded in the mapped segment from the
+# given offset, with the offset of the record following each
+def readRecords(data, size, offset):
+    while offset + RECORD_HEADER.size <= size:
+        length, id, seq, timestamp, senderLength = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + 4 + length
+        if end > size:
+            return
+        start = offset + RECORD_HEADER.size
+        sender = data[start:start + senderLength].decode()
+        text = data[start + senderLength:end].decode()
+        yield HistoryMessage(id, seq, timestamp, sender, text), end
+        offset = end
+
+# This function returns whether the sorted array holds the value
+def contains(values, value):
+    index = bisect_left(values, value)
+    return index < len(values) and values[index] == value
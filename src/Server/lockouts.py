@@ -0,0 +1,118 @@
+"""
+    Python 3
+    Login lockouts of the users who have failed to log in three times in a
+    row. The lockouts are kept in a dictionary from user name to the time the
+    user was locked out, so that checking a user is a hash lookup, and a heap
+    of the times the lockouts expire, from which expired lockouts are evicted
+    as the lockouts are used and checkpointed. Every change may be appended
+    to a write-ahead log with snapshots (see statestore.py) so that a restart
+    of the server does not lift them.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+from statestore import decodeFields
+
+# The records of the log, a user locked out at a time or let in again
+LOCKOUT = 1
+LIFT = 2
+
+"""
+    Define the dictionary of lockouts, persisted to the given SnapshotLog or
+    kept in memory only if log is None. Lockouts expire duration seconds
+    after they were made, or never if duration is None.
+"""
+class LoginLockouts(dict):
+
+    # This is the constructor of the dictionary, which reads the log at once:
+    # it only holds the lockouts of the last duration seconds
+    def __init__(self, log=None, duration=None):
+        dict.__init__(self)
+        self.log = log
+        self.duration = duration
+        self.lock = threading.Lock()
+
+        # The heap of (expiry, userName, blockedTime) of the lockouts. An entry
+        # whose lockout has been lifted or made again is left in the heap and
+        # skipped when it comes up
+        self.expiries = []
+        if log is not None:
+            self.load()
+
+    """
+        Public APIs of the dictionary.
+    """
+
+    # This function locks the user out from the given time
+    def add(self, userName, blockedTime):
+        with self.lock:
+            self.evictExpired()
+            self[userName] = blockedTime
+            if self.duration is not None:
+                heapq.heappush(self.expiries, (blockedTime.timestamp() + self.duration, userName, blockedTime))
+            if self.log is not None:
+                self.log.append(LOCKOUT, userName, blockedTime.timestamp())
+
+    # This function lets the user log in again
+    def lift(self, userName):
+        with self.lock:
+            if self.pop(userName, None) is not None and self.log is not None:
+                self.log.append(LIFT, userName)
+
+    # This function returns the time the user was locked out, or None if the
+    # user is not locked out or the lockout has expired
+    def blockedTime(self, userName):
+        with self.lock:
+            self.evictExpired()
+            return self.get(userName)
+
+    # This function writes the log to the disk, and replaces it with a
+    # snapshot of the dictionary once it has grown enough. Expired lockouts are
+    # evicted first, so that an idle server does not keep them
+    def checkpoint(self):
+        with self.lock:
+            self.evictExpired()
+        if self.log is None:
+            return
+        self.log.sync()
+        if not self.log.needsSnapshot(len(self)):
+            return
+        with self.lock:
+            entries = list(self.items())
+            generation = self.log.rotate()
+        self.log.writeSnapshot(generation, [(LOCKOUT, (userName, blockedTime.timestamp()))
+                                            for userName, blockedTime in entries])
+
+    """
+        Helper functions of the dictionary.
+    """
+
+    # This function removes the lockouts which have expired. An expired
+    # lockout is dropped from the log by the next snapshot, and left out when
+    # the log is read, so its removal is not logged. The caller must hold the
+    # lock
+    def evictExpired(self):
+        expiries = self.expiries
+        now = time.time()
+        while expiries and expiries[0][0] < now:
+            expiry, userName, blockedTime = heapq.heappop(expiries)
+            if self.get(userName) is blockedTime:
+                del self[userName]
+
+    # This function reads the dictionary from its log, leaving out the
+    # lockouts which have expired
+    def load(self):
+        lockouts = {}
+        for recordType, data in self.log.recover():
+            if recordType == LOCKOUT:
+                userName, blockedTime = decodeFields(data, 'st')
+                lockouts[userName] = datetime.fromtimestamp(blockedTime)
+            elif recordType == LIFT:
+                lockouts.pop(decodeFields(data, 's')[0], None)
+        self.update(lockouts)
+        if self.duration is not None:
+            self.expiries = [(blockedTime.timestamp() + self.duration, userName, blockedTime)
+                             for userName, blockedTime in lockouts.items()]
+            heapq.heapify(self.expiries)
+            self.evictExpired()
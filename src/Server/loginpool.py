@@ -0,0 +1,79 @@
+"""
+    Python 3
+    Bounded pool of authentication workers. The sessions hand the checks of
+    the passwords and the registrations of new users to a few worker threads
+    instead of running them themselves, so that however many clients log in
+    at once, such as every client reconnecting after an outage, at most that
+    many logins are worked on at a time and the sessions of the users already
+    logged in keep being served. Work is admitted while fewer than queueLimit
+    logins are waiting or being worked on; beyond that the login is refused
+    at once and the client has to try again later.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# The default number of workers and of logins admitted at a time
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_LIMIT = 64
+
+"""
+    Define the pool of authentication workers. submit() returns a Future
+    (concurrent.futures), on which the thread engine blocks and which the
+    asyncio engine awaits with asyncio.wrap_future().
+"""
+class LoginPool:
+
+    # This is the constructor of the pool, which starts its workers
+    def __init__(self, workers=DEFAULT_WORKERS, queueLimit=DEFAULT_QUEUE_LIMIT, metrics=None):
+        self.queueLimit = queueLimit
+        self.metrics = metrics
+        self.queue = deque()
+        self.pending = 0
+        self.condition = threading.Condition()
+        for index in range(workers):
+            worker = threading.Thread(name=f"login-{index}", target=self.runWorker)
+            worker.daemon = True
+            worker.start()
+
+    """
+        Public APIs of the pool.
+    """
+
+    # This function admits function(*args) to be run by a worker and returns
+    # the Future of its result, or None if the pool has no room for it
+    def submit(self, function, *args):
+        with self.condition:
+            if self.pending >= self.queueLimit:
+                if self.metrics is not None:
+                    self.metrics.loginsRejected.inc()
+                return None
+            future = Future()
+            self.pending += 1
+            self.queue.append((future, function, args))
+            self.condition.notify()
+        return future
+
+    # This function returns the number of logins waiting or being worked on
+    def __len__(self):
+        return self.pending
+
+    """
+        Helper functions of the pool.
+    """
+
+    # This function runs the admitted work in order, for as long as the
+    # process runs
+    def runWorker(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                future, function, args = self.queue.popleft()
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                with self.condition:
+                    self.pending -= 1
@@ -0,0 +1,258 @@
+"""
+    Python 3
+    Metrics of the server. Counters and histograms are plain integers updated
+    without a lock, so instrumenting the hot paths costs a few attribute
+    updates; an update racing with another thread may rarely be lost, which
+    is acceptable for monitoring. The metrics are rendered in the Prometheus
+    text format for the optional HTTP endpoint and as one line for the
+    periodic log.
+"""
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The upper bounds of the buckets of the latency histogram in seconds and of
+# the fan-out histogram in recipients
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The commands counted by name, every other command is counted as invalid
+COMMAND_NAMES = frozenset(('message', 'broadcast', 'whoelse', 'whoelsesince', 'block', 'unblock',
+                           'startprivate', 'acceptprivate', 'declineprivate', 'relay', 'subscribe', 'unsubscribe',
+                           'join', 'leave', 'channel', 'history', 'search', "['0']"))
+
+"""
+    Define a counter, a gauge which may also go down, or a gauge whose value
+    is read from a function when the metrics are rendered.
+"""
+class Counter:
+
+    # This is the constructor of the metric. kind is 'counter' or 'gauge'
+    def __init__(self, name, help, kind='counter', function=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.function = function
+        self.value = 0
+
+    # This function adds amount to the metric
+    def inc(self, amount=1):
+        self.value += amount
+
+    # This function subtracts amount from the metric
+    def dec(self, amount=1):
+        self.value -= amount
+
+    # This function returns the current value of the metric
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return 0
+        return self.value
+
+    # This function returns the lines of the metric in the text format
+    def render(self):
+        return [f"{self.name} {self.get()}"]
+
+"""
+    Define a counter with one value per label, such as per command.
+"""
+class LabeledCounter:
+
+    # This is the constructor of the counter
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.kind = 'counter'
+        self.label = label
+        self.values = {}
+
+    # This function adds amount to the counter of the given label value
+    def inc(self, labelValue, amount=1):
+        self.values[labelValue] = self.values.get(labelValue, 0) + amount
+
+    # This function returns the total of all label values
+    def get(self):
+        return sum(self.values.values())
+
+    # This function returns the lines of the counter in the text format
+    def render(self):
+        return [f'{self.name}{{{self.label}="{value}"}} {count}' for value, count in sorted(self.values.items())]
+
+"""
+    Define a histogram with the given bucket upper bounds.
+"""
+class Histogram:
+
+    # This is the constructor of the histogram
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.kind = 'histogram'
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    # This function records one observed value
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # This function returns the number of observed values
+    def get(self):
+        return self.count
+
+    # This function returns the smallest bucket bound below which the given
+    # fraction of the observed values lie, or None before any observation
+    def quantile(self, fraction):
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= total * fraction:
+                return bound
+        return float('inf')
+
+    # This function returns the lines of the histogram in the text format, with
+    # cumulative buckets
+    def render(self):
+        lines = []
+        seen = 0
+        counts = list(self.counts)
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {seen}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {seen + counts[-1]}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {seen + counts[-1]}")
+        return lines
+
+"""
+    Define the metrics of a server process.
+"""
+class Metrics:
+
+    # This is the constructor of the metrics
+    def __init__(self):
+        self.connections = Counter('chat_connections_total', 'Connections accepted')
+        self.openConnections = Counter('chat_connections_open', 'Connections currently open', 'gauge')
+        self.logins = Counter('chat_logins_total', 'Successful logins')
+        self.loginFailures = Counter('chat_login_failures_total', 'Failed login attempts, including locked out users')
+        self.registrations = Counter('chat_registrations_total', 'New users registered')
+        self.loginsRejected = Counter('chat_logins_rejected_total', 'Logins refused because the authentication pool was full')
+        self.commands = LabeledCounter('chat_commands_total', 'Commands received by type', 'command')
+        self.delivered = Counter('chat_messages_delivered_total', 'Messages queued for online recipients')
+        self.queuedOffline = Counter('chat_messages_offline_total', 'Messages queued for offline recipients')
+        self.spilled = Counter('chat_messages_spilled_total', 'Messages of slow recipients moved to the offline store')
+        self.dropped = Counter('chat_messages_dropped_total', 'Messages of slow recipients dropped')
+        self.fanOut = Histogram('chat_broadcast_fanout', 'Recipients on this process of each broadcast', FANOUT_BUCKETS)
+        self.latency = Histogram('chat_delivery_seconds',
+                                 'Time from reading a command to writing the first frame of a burst it queued for a client',
+                                 LATENCY_BUCKETS)
+        self.bytesIn = Counter('chat_bytes_in_total', 'Bytes read from clients')
+        self.bytesOut = Counter('chat_bytes_out_total', 'Bytes written to clients')
+        self.rateLimited = LabeledCounter('chat_rate_limited_total',
+                                          'Commands delayed, rejected or shed by the rate limits', 'action')
+        self.rateRefused = LabeledCounter('chat_rate_refused_total',
+                                          'Commands rejected or shed by the rate limits by type', 'command')
+        self.metrics = [self.connections, self.openConnections, self.logins, self.loginFailures, self.registrations,
+                        self.loginsRejected, self.commands, self.delivered, self.queuedOffline, self.spilled,
+                        self.dropped, self.fanOut, self.latency, self.bytesIn, self.bytesOut, self.rateLimited,
+                        self.rateRefused]
+
+        # The time the command being handled by the current thread was read,
+        # given to the frames it queues to measure their latency
+        self.current = threading.local()
+        self.httpServer = None
+
+    # This function adds a gauge whose value is read from the given function
+    def addGauge(self, name, help, function):
+        self.metrics.append(Counter(name, help, 'gauge', function))
+
+    # This function records that a command of the given name has been read and
+    # is being handled by the current thread
+    def commandStarted(self, command):
+        self.commands.inc(command if command in COMMAND_NAMES else 'invalid')
+        self.current.readTime = time.perf_counter()
+
+    # This function records that the current thread has handled its command
+    def commandFinished(self):
+        self.current.readTime = None
+
+    # This function returns the time the command being handled by the current
+    # thread was read, or now if the thread is not handling a command
+    def readTime(self):
+        readTime = getattr(self.current, 'readTime', None)
+        return time.perf_counter() if readTime is None else readTime
+
+    # This function returns every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # This function returns the main metrics as one line for the log
+    def summary(self):
+        fields = [f"{metric.name[5:]}={metric.get()}" for metric in self.metrics if metric.kind != 'histogram']
+        for name, histogram in (('fanout', self.fanOut), ('delivery_seconds', self.latency)):
+            fields.append(f"{name}_p50={histogram.quantile(0.5)}")
+            fields.append(f"{name}_p99={histogram.quantile(0.99)}")
+        return 'metrics ' + ' '.join(fields)
+
+    # This function serves the metrics over HTTP on the given address from a
+    # background thread
+    def startHttpServer(self, host, port):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            # This function answers every GET request with the metrics
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # This function keeps the requests out of the server output
+            def log_message(self, format, *args):
+                pass
+
+        httpServer = ThreadingHTTPServer((host, port), MetricsHandler)
+        httpServer.daemon_threads = True
+        thread = threading.Thread(name="metricsHttp", target=httpServer.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.httpServer = httpServer
+        return httpServer
+
+    # This function stops serving the metrics over HTTP and frees the port
+    def stopHttpServer(self):
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+            self.httpServer.server_close()
+            self.httpServer = None
+
+    # This function prints the summary line every interval seconds from a
+    # background thread
+    def startLogger(self, interval):
+        def runLogger():
+            while True:
+                time.sleep(interval)
+                print(self.summary(), flush=True)
+
+        thread = threading.Thread(name="metricsLog", target=runLogger)
+        thread.daemon = True
+        thread.start()
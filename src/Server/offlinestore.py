@@ -0,0 +1,329 @@
+"""
+    Python 3
+    Offline message store. Messages for users who are not online are kept in
+    a queue per recipient, so queueing a message is O(1) and delivering the
+    k messages of a user is O(k). The queues are backed by a segmented
+    append-only log on disk, fsynced in batches, so queued messages survive
+    a restart of the server; segments whose messages have all been delivered
+    are deleted and sparse segments are compacted into the active one. The
+    log is read back by a background thread when the server starts, so the
+    server accepts clients at once however many messages are queued.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+# Every record of the log starts with the length of the rest of the record,
+# followed by the record type, the sequence number and the record data
+RECORD_HEADER = struct.Struct('>IcQ')
+
+# An enqueue record holds the length of the recipient, the recipient and the
+# message. A drain record holds the recipient and means every message of the
+# recipient up to and including the sequence number has been delivered
+ENQUEUE = b'E'
+DRAIN = b'D'
+RECIPIENT_LENGTH = struct.Struct('>H')
+
+# The default number of messages delivered at a time when a user logs in
+DRAIN_BATCH_SIZE = 256
+
+"""
+    Define the offline message store. The store is safe to use from several
+    threads; a background thread flushes and fsyncs the log every
+    fsyncInterval seconds and compacts it. Calls made before the log has been
+    read wait for it.
+"""
+class OfflineStore:
+
+    # This is the constructor of the store. directory is where the log
+    # segments are kept, or None to keep the queues in memory only
+    def __init__(self, directory='offline', segmentSize=4 * 1024 * 1024,
+                 fsyncInterval=0.05, compactRatio=0.25):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.fsyncInterval = fsyncInterval
+        self.compactRatio = compactRatio
+        self.lock = threading.Lock()
+
+        # queues maps a recipient to a deque of [sequenceNumber, segmentId, message]
+        self.queues = {}
+        self.queuedCount = 0
+        self.nextSeq = 1
+
+        # segmentLive and segmentTotal keep the number of undelivered and of all
+        # enqueue records in each segment of the log
+        self.segmentLive = {}
+        self.segmentTotal = {}
+        self.segmentMinSeq = {}
+
+        # delivered maps a recipient to the sequence number of the last message
+        # delivered to the recipient, as recorded by the drain records
+        self.delivered = {}
+        self.activeSegment = None
+        self.activeFile = None
+        self.activeSize = 0
+        self.dirty = False
+        self.running = False
+        self.loaded = threading.Event()
+        if directory is None:
+            self.loaded.set()
+        else:
+            os.makedirs(directory, exist_ok=True)
+            loader = threading.Thread(name="offlineStoreLoader", target=self.load)
+            loader.daemon = True
+            loader.start()
+
+    """
+        Public APIs of the store.
+    """
+
+    # This function queues a message for the given recipient
+    def enqueue(self, recipient, message):
+        self.loaded.wait()
+        with self.lock:
+            seq = self.nextSeq
+            self.nextSeq += 1
+            queue = self.queues.get(recipient)
+            if queue is None:
+                queue = self.queues[recipient] = deque()
+            queue.append([seq, self.activeSegment, message])
+            self.queuedCount += 1
+            if self.activeFile is not None:
+                self.segmentLive[self.activeSegment] += 1
+                self.segmentTotal[self.activeSegment] += 1
+                self.segmentMinSeq.setdefault(self.activeSegment, seq)
+                self.writeEnqueue(seq, recipient, message)
+
+    # This function returns the number of messages queued for the recipient
+    def pendingFor(self, recipient):
+        self.loaded.wait()
+        queue = self.queues.get(recipient)
+        return len(queue) if queue else 0
+
+    # This function returns the number of messages queued for all recipients
+    def __len__(self):
+        return self.queuedCount
+
+    # This function removes and returns up to batchSize of the oldest messages
+    # queued for the recipient. The messages are recorded as delivered in the log
+    def takeBatch(self, recipient, batchSize=DRAIN_BATCH_SIZE):
+        self.loaded.wait()
+        with self.lock:
+            queue = self.queues.get(recipient)
+            if not queue:
+                return []
+            batch = []
+            while queue and len(batch) < batchSize:
+                seq, segment, message = queue.popleft()
+                batch.append(message)
+                if segment is not None:
+                    self.segmentLive[segment] -= 1
+            if not queue:
+                del self.queues[recipient]
+            self.queuedCount -= len(batch)
+            if self.activeFile is not None:
+                self.delivered[recipient] = seq
+                self.writeRecord(DRAIN, seq, recipient.encode())
+            return batch
+
+    # This function yields the messages queued for the recipient in batches of
+    # at most batchSize messages, until the queue is empty
+    def drainBatches(self, recipient, batchSize=DRAIN_BATCH_SIZE):
+        while True:
+            batch = self.takeBatch(recipient, batchSize)
+            if not batch:
+                return
+            yield batch
+
+    # This function starts the background thread which fsyncs and compacts the
+    # log
+    def start(self):
+        if self.directory is None or self.running:
+            return
+        self.running = True
+        flusher = threading.Thread(name="offlineStore", target=self.runFlusher)
+        flusher.daemon = True
+        flusher.start()
+
+    # This function flushes the log to disk and stops the background thread
+    def close(self):
+        self.running = False
+        if self.activeFile is not None:
+            self.sync()
+            with self.lock:
+                self.activeFile.close()
+                self.activeFile = None
+
+    # This function writes the buffered records to the disk and fsyncs the log
+    def sync(self):
+        with self.lock:
+            if not self.dirty or self.activeFile is None:
+                return
+            self.activeFile.flush()
+            self.dirty = False
+            fd = self.activeFile.fileno()
+        os.fsync(fd)
+
+    """
+        Helper functions of the log.
+    """
+
+    # This function reads the log and opens a new active segment. If the log
+    # cannot be read the store keeps the messages in memory only
+    def load(self):
+        try:
+            with self.lock:
+                self.recover()
+                self.openSegment(max(self.segmentLive, default=0) + 1)
+        finally:
+            self.loaded.set()
+
+    # This function is the main loop of the background thread
+    def runFlusher(self):
+        while self.running:
+            time.sleep(self.fsyncInterval)
+            try:
+                self.sync()
+                self.compact()
+            except (OSError, ValueError):
+                pass
+
+    # This function returns the path of the given segment
+    def segmentPath(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:08d}.log")
+
+    # This function opens a new active segment. The caller must hold the lock
+    # or be the constructor
+    def openSegment(self, segment):
+        if self.activeFile is not None:
+            self.activeFile.flush()
+            os.fsync(self.activeFile.fileno())
+            self.activeFile.close()
+        self.activeSegment = segment
+        self.activeFile = open(self.segmentPath(segment), 'ab')
+        self.activeSize = self.activeFile.tell()
+        self.segmentLive.setdefault(segment, 0)
+        self.segmentTotal.setdefault(segment, 0)
+
+    # This function appends one enqueue record to the active segment. The
+    # caller must hold the lock
+    def writeEnqueue(self, seq, recipient, message):
+        recipient = recipient.encode()
+        self.writeRecord(ENQUEUE, seq, RECIPIENT_LENGTH.pack(len(recipient)) + recipient + message.encode())
+
+    # This function appends one record to the active segment and rolls over to
+    # a new segment once the active one is full. The caller must hold the lock
+    def writeRecord(self, recordType, seq, data):
+        record = RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(data), recordType, seq) + data
+        self.activeFile.write(record)
+        self.activeSize += len(record)
+        self.dirty = True
+        if self.activeSize >= self.segmentSize:
+            self.openSegment(self.activeSegment + 1)
+
+    # This function deletes the segments whose messages have all been delivered
+    # and moves the remaining messages of sparse segments into the active
+    # segment so that those segments can be deleted as well
+    def compact(self):
+        with self.lock:
+            dead = set()
+            sparse = set()
+            for segment in self.segmentLive:
+                if segment == self.activeSegment:
+                    continue
+                if self.segmentLive[segment] == 0:
+                    dead.add(segment)
+                elif self.segmentLive[segment] < self.segmentTotal[segment] * self.compactRatio:
+                    sparse.add(segment)
+            if not dead and not sparse:
+                return
+            for recipient, queue in self.queues.items():
+                for entry in queue:
+                    if entry[1] in sparse:
+                        self.segmentLive[entry[1]] -= 1
+                        entry[1] = self.activeSegment
+                        self.segmentLive[self.activeSegment] += 1
+                        self.segmentTotal[self.activeSegment] += 1
+                        self.segmentMinSeq[self.activeSegment] = min(self.segmentMinSeq.get(self.activeSegment, entry[0]), entry[0])
+                        self.writeEnqueue(entry[0], recipient, entry[2])
+
+            # The drain records in the removed segments are written again for
+            # the recipients whose delivered messages may remain in other segments
+            removed = dead | sparse
+            oldestSeq = min((seq for segment, seq in self.segmentMinSeq.items() if segment not in removed), default=self.nextSeq)
+            for recipient in [recipient for recipient, seq in self.delivered.items() if seq < oldestSeq]:
+                del self.delivered[recipient]
+            for recipient, seq in self.delivered.items():
+                self.writeRecord(DRAIN, seq, recipient.encode())
+            self.activeFile.flush()
+            os.fsync(self.activeFile.fileno())
+            self.dirty = False
+            for segment in removed:
+                self.removeSegment(segment)
+
+    # This function deletes the given segment. The caller must hold the lock
+    def removeSegment(self, segment):
+        del self.segmentLive[segment]
+        del self.segmentTotal[segment]
+        self.segmentMinSeq.pop(segment, None)
+        try:
+            os.remove(self.segmentPath(segment))
+        except FileNotFoundError:
+            pass
+
+    # This function rebuilds the queues from the segments of the log. A message
+    # moved by compaction may be found in two segments, the later copy is kept;
+    # a drain record covers every message of the recipient up to its sequence
+    # number, as messages are always delivered in sequence order
+    def recover(self):
+        segments = sorted(int(name[8:16]) for name in os.listdir(self.directory)
+                          if name.startswith('segment-') and name.endswith('.log'))
+        entries = {}
+        delivered = self.delivered
+        for segment in segments:
+            self.segmentLive[segment] = 0
+            self.segmentTotal[segment] = 0
+            for recordType, seq, data in self.readSegment(segment):
+                self.nextSeq = max(self.nextSeq, seq + 1)
+                if recordType == ENQUEUE:
+                    (length,) = RECIPIENT_LENGTH.unpack_from(data)
+                    recipient = data[2:2 + length].decode()
+                    entries.setdefault(recipient, {})[seq] = (segment, data[2 + length:].decode())
+                    self.segmentTotal[segment] += 1
+                    self.segmentMinSeq[segment] = min(self.segmentMinSeq.get(segment, seq), seq)
+                else:
+                    recipient = data.decode()
+                    delivered[recipient] = max(seq, delivered.get(recipient, 0))
+        for recipient, messages in entries.items():
+            upTo = delivered.get(recipient, 0)
+            queue = deque([seq, segment, message] for seq, (segment, message) in sorted(messages.items()) if seq > upTo)
+            if queue:
+                self.queues[recipient] = queue
+                for entry in queue:
+                    self.segmentLive[entry[1]] += 1
+        self.queuedCount = sum(len(queue) for queue in self.queues.values())
+
+    # This function reads the records of the given segment, mapped into memory
+    # rather than read. A record which was only partly written when the server
+    # stopped ends the segment and is cut off
+    def readSegment(self, segment):
+        path = self.segmentPath(segment)
+        offset = 0
+        with open(path, 'rb') as c:
+            size = os.fstat(c.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(c.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset + RECORD_HEADER.size <= size:
+                    length, recordType, seq = RECORD_HEADER.unpack_from(data, offset)
+                    end = offset + 4 + length
+                    if end > size or recordType not in (ENQUEUE, DRAIN):
+                        break
+                    yield recordType, seq, data[offset + RECORD_HEADER.size:end]
+                    offset = end
+        if offset < size:
+            with open(path, 'r+b') as c:
+                c.truncate(offset)
@@ -0,0 +1,239 @@
+"""
+    Python 3
+    Bounded outbound queue of a client connection. Every session writes the
+    frames for its client into its own queue, which is drained by the writer
+    of that session (a thread for the thread per client engine, a task for
+    the asyncio engine), so delivering a message never blocks the sender on
+    a slow recipient. Once the queued bytes reach the high watermark the
+    connection is congested until they fall back to the low watermark, and
+    messages delivered meanwhile are handled by the slow consumer policy.
+"""
+import random
+import threading
+import time
+from collections import deque
+from framing import HEADER
+
+# The slow consumer policies. 'drop' discards the messages delivered while the
+# connection is congested, 'disconnect' closes the connection and 'spill'
+# moves the messages to the offline store, from which they are taken back once
+# the connection has drained below the low watermark
+DROP = 'drop'
+DISCONNECT = 'disconnect'
+SPILL = 'spill'
+POLICIES = (DROP, DISCONNECT, SPILL)
+
+# The default watermarks of a queue in bytes
+DEFAULT_HIGH_WATERMARK = 1024 * 1024
+DEFAULT_LOW_WATERMARK = 256 * 1024
+
+# The number of spilled messages taken back from the offline store at a time
+RECOVER_BATCH_SIZE = 256
+
+# One burst of frames in this many is timed for the latency metrics
+LATENCY_SAMPLE_INTERVAL = 16
+
+# The largest number of buffers passed to a single sendmsg call
+IOV_MAX = 1024
+
+# This function writes all the given frames to a blocking socket with vectored
+# sendmsg calls, so that the frames are neither copied into one buffer nor
+# written with one system call each. It returns the number of bytes written
+def sendFrames(sock, frames):
+    buffers = [memoryview(frame) for frame in frames]
+    index = 0
+    total = 0
+    while index < len(buffers):
+        sent = sock.sendmsg(buffers[index:index + IOV_MAX])
+        total += sent
+        while sent:
+            length = len(buffers[index])
+            if sent >= length:
+                sent -= length
+                index += 1
+            else:
+                buffers[index] = buffers[index][sent:]
+                sent = 0
+    return total
+
+"""
+    Define the outbound queue of a session. session provides spillMessage(),
+    recoverSpilledMessages() and disconnectSlowConsumer() for the policies
+    and the codec encoding spilled messages taken back, notify is called
+    whenever frames are queued for the writer. If metrics is given (see
+    metrics.py), the queue counts the bytes written by the writer and times
+    the first frame queued into the empty queue, from the read of
+    the command which queued it to its write, for one burst of frames in
+    LATENCY_SAMPLE_INTERVAL, so that timing costs little per frame.
+"""
+class OutboundQueue:
+
+    # This is the constructor of the queue
+    def __init__(self, session, highWatermark=DEFAULT_HIGH_WATERMARK,
+                 lowWatermark=DEFAULT_LOW_WATERMARK, policy=SPILL, notify=None, metrics=None):
+        self.session = session
+        self.highWatermark = highWatermark
+        self.lowWatermark = min(lowWatermark, highWatermark)
+        self.policy = policy
+        self.notify = notify
+        self.metrics = metrics
+        self.frames = deque()
+        self.queuedBytes = 0
+        self.congested = False
+        self.spilling = False
+        self.closed = False
+        self.inFlight = False
+        self.droppedCount = 0
+        self.spilledCount = 0
+        self.condition = threading.Condition()
+
+        # The read time of the command of the first frame of the queue, and of
+        # the first frame last taken by the writer, if they are timed. The
+        # bursts are counted from a random offset so that the queues which
+        # receive the same broadcasts do not all time the same one
+        self.headStamp = None
+        self.takenStamp = None
+        self.burstCount = random.randrange(LATENCY_SAMPLE_INTERVAL)
+
+    # This function queues a frame regardless of the watermarks, used for the
+    # responses to the commands of the client and for control messages
+    def push(self, frame):
+        with self.condition:
+            if self.closed:
+                return
+            self.append(frame)
+
+    # This function queues a frame delivered from another user, applying the
+    # slow consumer policy if the connection is congested. It returns True if
+    # the frame has been queued for the writer
+    def offer(self, frame):
+        disconnect = False
+        with self.condition:
+            if self.closed:
+                return False
+            overflow = self.frames and self.queuedBytes + len(frame) > self.highWatermark
+            if not (self.congested or self.spilling or overflow):
+                self.append(frame)
+                return True
+            self.congested = self.congested or bool(overflow)
+            if self.policy == SPILL:
+                self.spilling = True
+                self.spilledCount += 1
+                self.session.spillMessage(frame[HEADER.size:].decode())
+                if self.metrics is not None:
+                    self.metrics.spilled.value += 1
+            else:
+                self.droppedCount += 1
+                disconnect = self.policy == DISCONNECT
+                if self.metrics is not None:
+                    self.metrics.dropped.value += 1
+        if disconnect:
+            self.session.disconnectSlowConsumer()
+        return False
+
+    # This function removes and returns the queued frames, up to maxBytes bytes
+    # but at least one frame. Spilled messages are taken back into the queue
+    # once the connection has drained below the low watermark
+    def take(self, maxBytes=256 * 1024):
+        with self.condition:
+            return self.takeLocked(maxBytes)
+
+    # This function blocks until frames are queued or the queue is closed and
+    # then returns them like take(). An empty list is returned once the queue is
+    # closed and every frame has been taken
+    def waitAndTake(self, maxBytes=256 * 1024):
+        with self.condition:
+            while True:
+                frames = self.takeLocked(maxBytes)
+                if frames or self.closed:
+                    return frames
+                self.condition.wait()
+
+    # This function blocks until the queued bytes are below the low watermark
+    # or the queue is closed
+    def waitForRoom(self):
+        with self.condition:
+            while self.queuedBytes > self.lowWatermark and not self.closed:
+                self.condition.wait()
+
+    # This function closes the queue. The frames already queued are still
+    # returned to the writer, which closes the connection afterwards
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.notify is not None:
+            self.notify()
+
+    # This function returns whether the queue has been closed and emptied
+    def isFinished(self):
+        return self.closed and not self.frames
+
+    # This function returns whether every frame queued so far has been written
+    def isIdle(self):
+        return not self.frames and not self.inFlight
+
+    # This function is called by the writer once it has written the frames it
+    # took, size bytes, and records the latency of the first one if it was timed
+    def wrote(self, size):
+        self.inFlight = False
+        if self.metrics is None:
+            return
+        self.metrics.bytesOut.value += size
+        if self.takenStamp is not None:
+            self.metrics.latency.observe(time.perf_counter() - self.takenStamp)
+            self.takenStamp = None
+
+    """
+        Helper functions of the queue, the caller must hold the condition.
+    """
+
+    # This function appends a frame and wakes up the writer. The writer only
+    # waits while the queue is empty, so it is woken up for the first frame only
+    def append(self, frame):
+        self.frames.append(frame)
+        self.queuedBytes += len(frame)
+        if self.queuedBytes > self.highWatermark:
+            self.congested = True
+        if len(self.frames) == 1:
+            if self.metrics is not None:
+                self.burstCount += 1
+                if self.burstCount % LATENCY_SAMPLE_INTERVAL == 0:
+                    self.headStamp = self.metrics.readTime()
+            self.condition.notify()
+            if self.notify is not None:
+                self.notify()
+
+    # This function removes the queued frames up to maxBytes bytes. Spilled
+    # messages are taken back first if nothing else is queued
+    def takeLocked(self, maxBytes):
+        if not self.frames and self.spilling and not self.closed:
+            self.recoverLocked()
+        frames = []
+        size = 0
+        while self.frames and (not frames or size + len(self.frames[0]) <= maxBytes):
+            frame = self.frames.popleft()
+            frames.append(frame)
+            size += len(frame)
+        if size:
+            self.inFlight = True
+            if self.metrics is not None:
+                self.takenStamp = self.headStamp
+                self.headStamp = None
+            self.queuedBytes -= size
+            if self.congested and self.queuedBytes <= self.lowWatermark:
+                self.congested = False
+            self.condition.notify_all()
+        return frames
+
+    # This function takes a batch of spilled messages back from the offline
+    # store into the queue, and stops spilling once none are left
+    def recoverLocked(self):
+        batch = self.session.recoverSpilledMessages(RECOVER_BATCH_SIZE)
+        if not batch:
+            self.spilling = False
+            return
+        for message in batch:
+            frame = self.session.codec.text(message)
+            self.frames.append(frame)
+            self.queuedBytes += len(frame)
@@ -0,0 +1,92 @@
+"""
+    Python 3
+    Online presence registry. The logged in users are kept in a dictionary
+    keyed by user name, so logging in, logging out and looking up a user are
+    O(1), and the fan-out of broadcast and whoelse iterates over an immutable
+    snapshot of the records which is rebuilt only when somebody logs in or
+    out.
+"""
+import threading
+
+"""
+    Define the record of a logged in user. __slots__ keeps a record smaller
+    than the list [userName, ipAddress, port, session, p2pPort] it replaces.
+"""
+class SessionRecord:
+    __slots__ = ('userName', 'ipAddress', 'port', 'session', 'p2pPort')
+
+    # This is the constructor of the record
+    def __init__(self, userName, ipAddress, port, session, p2pPort):
+        self.userName = userName
+        self.ipAddress = ipAddress
+        self.port = port
+        self.session = session
+        self.p2pPort = p2pPort
+
+"""
+    Define the registry of the logged in users. It is safe to use from
+    several threads as well as from the event loop of the asyncio engine.
+"""
+class PresenceRegistry:
+
+    # This is the constructor of the registry
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+        self.cachedSnapshot = ()
+
+        # The functions called with every record after it has logged in and
+        # after it has logged out, such as the bus of a sharded server
+        self.loginListeners = []
+        self.logoutListeners = []
+
+    # This function registers the given record. It returns False, leaving the
+    # registry unchanged, if the user is already logged in
+    def login(self, record):
+        with self.lock:
+            if record.userName in self.records:
+                return False
+            self.records[record.userName] = record
+            self.cachedSnapshot = None
+        for listener in self.loginListeners:
+            listener(record)
+        return True
+
+    # This function removes the user from the registry. If session is given,
+    # the user is only removed while still logged in with that session. It
+    # returns the removed record or None
+    def logout(self, userName, session=None):
+        with self.lock:
+            record = self.records.get(userName)
+            if record is None or (session is not None and record.session is not session):
+                return None
+            del self.records[userName]
+            self.cachedSnapshot = None
+        for listener in self.logoutListeners:
+            listener(record)
+        return record
+
+    # This function returns the record of the user or None if the user is not
+    # logged in
+    def lookup(self, userName):
+        return self.records.get(userName)
+
+    # This function returns whether the user is logged in
+    def isOnline(self, userName):
+        return userName in self.records
+
+    # This function returns a tuple of the records of all logged in users. The
+    # tuple is not affected by later logins and logouts, so it can be iterated
+    # while other sessions change the registry
+    def snapshot(self):
+        snapshot = self.cachedSnapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.cachedSnapshot
+                if snapshot is None:
+                    snapshot = self.cachedSnapshot = tuple(self.records.values())
+        return snapshot
+
+    # This function returns the number of logged in users
+    def __len__(self):
+        return len(self.records)
@@ -0,0 +1,241 @@
+"""
+    Python 3
+    Presence feed of the subscribed sessions. A session subscribing to the
+    feed receives the online users it follows, all the users or a list of
+    them, once with the version of the feed, and from then on only the
+    changes of those users, instead of polling whoelse or receiving the
+    login and logout notices broadcast to every user. The changes are
+    gathered over a short window and coalesced, a user logging in and out
+    again within the window being left out, and sent in one frame per
+    subscriber and window. The changes of the window are the same for every
+    subscriber following all the users, so their frame is built once and
+    shared, and a burst of logins costs one frame per subscriber rather than
+    one notice per login and user online. One driver (a thread for the
+    thread per client engine, a task for the asyncio engine) sends the
+    changes at the end of every window.
+"""
+import asyncio
+import threading
+import time
+import serverstate
+from wire import PresenceDeltas
+
+# The default length in seconds of the window over which changes are coalesced
+DEFAULT_WINDOW = 0.1
+
+# This function records that the user has logged in or out in the given dict
+# of changes, mapping each user to whether the user was online before the
+# first change of the window and whether the user is online now
+def recordChange(changes, userName, online):
+    change = changes.get(userName)
+    changes[userName] = (not online if change is None else change[0], online)
+
+# This function returns the changes of the given dict which the subscriber of
+# the given user sees, leaving out those of the subscriber itself, of users
+# who block the subscriber and of users whose state is the same as before
+def visibleChanges(changes, userName):
+    blockers = serverstate.blockGraph.blockersOf(userName)
+    return [(changed, online) for changed, (wasOnline, online) in changes
+            if wasOnline != online and changed != userName and changed not in blockers]
+
+"""
+    Define the subscription of a session to the feed. followsAll is set if the
+    session follows all the users, otherwise followed holds the users it
+    follows and changes their changes since the last window.
+"""
+class Subscription:
+    __slots__ = ('session', 'followsAll', 'followed', 'changes')
+
+    # This is the constructor of the subscription of the session
+    def __init__(self, session):
+        self.session = session
+        self.followsAll = False
+        self.followed = set()
+        self.changes = {}
+
+"""
+    Define the presence feed, following the logins and logouts of the given
+    presence registry and sending the changes every window seconds.
+"""
+class PresenceFeed:
+
+    # This is the constructor of the feed
+    def __init__(self, presence, window=DEFAULT_WINDOW):
+        self.presence = presence
+        self.window = window
+        self.lock = threading.Lock()
+        self.running = False
+        self.driver = None
+
+        # The version counts the changes of the feed, so a change is newer
+        # than a snapshot if it has a greater version
+        self.version = 0
+        self.subscriptions = {}
+
+        # The subscriptions following all the users and the changes of the
+        # window which they share, and the subscriptions following each user
+        # and those which have changes of their own in the window
+        self.allFollowers = set()
+        self.sharedChanges = {}
+        self.followersByUser = {}
+        self.pending = set()
+        presence.loginListeners.append(self.userLoggedIn)
+        presence.logoutListeners.append(self.userLoggedOut)
+
+    """
+        Public APIs of the feed.
+    """
+
+    # This function subscribes the session to the changes of the given users,
+    # or of all the users if userNames is None, in addition to the users it
+    # follows already, and sends it the online users it follows with the
+    # current version. The snapshot is queued while holding the lock so that
+    # the changes after it are queued after it
+    def subscribe(self, session, userNames=None):
+        with self.lock:
+            subscription = self.subscriptions.get(session)
+            if subscription is None:
+                subscription = self.subscriptions[session] = Subscription(session)
+                session.followsPresence = True
+            if userNames is None and not subscription.followsAll:
+                self.unfollowAll(subscription)
+                subscription.followsAll = True
+                self.allFollowers.add(subscription)
+            elif not subscription.followsAll:
+                for userName in userNames:
+                    subscription.followed.add(userName)
+                    self.followersByUser.setdefault(userName, set()).add(subscription)
+            if subscription.followsAll:
+                online = [record.userName for record in self.presence.snapshot()]
+            else:
+                online = [userName for userName in subscription.followed if self.presence.isOnline(userName)]
+            blockers = serverstate.blockGraph.blockersOf(session.userName)
+            session.sendFrame(session.codec.snapshot(self.version, sorted(
+                userName for userName in online if userName != session.userName and userName not in blockers)))
+
+    # This function ends the subscription of the session. It returns False if
+    # the session was not subscribed
+    def unsubscribe(self, session):
+        with self.lock:
+            subscription = self.subscriptions.pop(session, None)
+            if subscription is None:
+                return False
+            session.followsPresence = False
+            self.unfollowAll(subscription)
+            self.allFollowers.discard(subscription)
+            self.pending.discard(subscription)
+            return True
+
+    # This function returns what the session follows, None if it is not
+    # subscribed, True if it follows all the users or the list of the users it
+    # follows, as handed to another server taking over the session
+    def follows(self, session):
+        subscription = self.subscriptions.get(session)
+        if subscription is None:
+            return None
+        return True if subscription.followsAll else sorted(subscription.followed)
+
+    # This function sends the changes of the window to the subscribers. The
+    # subscribers following all the users share one frame, unless some of the
+    # changes are hidden from them
+    def flush(self):
+        with self.lock:
+            if not self.sharedChanges and not self.pending:
+                return
+            version = self.version
+            shared = list(self.sharedChanges.items()) if self.allFollowers else []
+            allFollowers = list(self.allFollowers) if shared else []
+            self.sharedChanges = {}
+            own = []
+            for subscription in self.pending:
+                own.append((subscription.session, list(subscription.changes.items())))
+                subscription.changes = {}
+            self.pending = set()
+        if allFollowers:
+            changedUsers = {userName for userName, change in shared}
+            deltas = None
+            for subscription in allFollowers:
+                session = subscription.session
+                if session.userName in changedUsers or not serverstate.blockGraph.blockersOf(
+                        session.userName).isdisjoint(changedUsers):
+                    own.append((session, shared))
+                    continue
+                if deltas is None:
+                    deltas = PresenceDeltas(version, [(userName, online) for userName, (wasOnline, online) in shared
+                                                      if wasOnline != online])
+                    if not deltas.changes:
+                        break
+                session.sendFrame(deltas)
+        for session, changes in own:
+            changes = visibleChanges(changes, session.userName)
+            if changes:
+                session.sendFrame(PresenceDeltas(version, changes))
+
+    # This function returns the number of subscribed sessions
+    def __len__(self):
+        return len(self.subscriptions)
+
+    # This function starts a daemon thread which sends the changes once per
+    # window, used by the thread per client engine
+    def start(self):
+        self.running = True
+        self.driver = threading.Thread(name="presenceFeed", target=self.runThread)
+        self.driver.daemon = True
+        self.driver.start()
+
+    # This function is the main loop of the driver thread
+    def runThread(self):
+        while self.running:
+            time.sleep(self.window)
+            self.flush()
+
+    # This coroutine sends the changes once per window, used by the asyncio
+    # engine as a task on the event loop
+    async def runAsync(self):
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.window)
+            self.flush()
+
+    # This function stops the driver
+    def stop(self):
+        self.running = False
+
+    """
+        Helper functions of the feed.
+    """
+
+    # This function records the login of a user for its followers
+    def userLoggedIn(self, record):
+        self.userChanged(record.userName, True)
+
+    # This function records the logout of a user for its followers, and ends
+    # the subscription of the session of the user
+    def userLoggedOut(self, record):
+        if record.session in self.subscriptions:
+            self.unsubscribe(record.session)
+        self.userChanged(record.userName, False)
+
+    # This function records a change of the user for the subscribers following
+    # it, to be sent at the end of the window
+    def userChanged(self, userName, online):
+        with self.lock:
+            self.version += 1
+            if self.allFollowers:
+                recordChange(self.sharedChanges, userName, online)
+            for subscription in self.followersByUser.get(userName, ()):
+                recordChange(subscription.changes, userName, online)
+                self.pending.add(subscription)
+
+    # This function stops the subscription following the users of its list.
+    # The caller must hold the lock
+    def unfollowAll(self, subscription):
+        for userName in subscription.followed:
+            followers = self.followersByUser.get(userName)
+            if followers is not None:
+                followers.discard(subscription)
+                if not followers:
+                    del self.followersByUser[userName]
+        subscription.followed.clear()
+        subscription.changes = {}
+        self.pending.discard(subscription)
@@ -0,0 +1,290 @@
+"""
+    Python 3
+    Usage: python3 pubsub.py BROKER_PORT [--host 127.0.0.1]
+    Publish/subscribe transport connecting the nodes of a server cluster. A
+    node subscribes to topics and publishes messages to topics through a
+    PubSub client; every message is delivered to the other clients
+    subscribed to its topic, never back to its publisher. Two backends are
+    provided: StreamPubSub talks to a PubSubBroker over a socket (TCP for
+    nodes on several machines, a Unix socket pair for the workers of one
+    server), and LocalPubSub connects clients within one process without a
+    broker. Run this module to start a standalone TCP broker for a cluster.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+from collections import deque
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import SocketFrameReader, encodeFrame, readFrameBytes, FrameError
+
+# The operations sent by a client to the broker, each followed by a topic. A
+# publish and a will also carry the data of the message after a line break.
+# The will of a client is published by the broker once the client is gone
+SUBSCRIBE = b'S'
+PUBLISH = b'P'
+WILL = b'W'
+
+"""
+    Define the interface of a publish/subscribe client. onMessage(topic, data)
+    is called with every message of the subscribed topics and onClose() once
+    the client has been disconnected from the other clients.
+"""
+class PubSub:
+
+    # This function starts delivering messages to the given functions
+    def start(self, onMessage, onClose=None):
+        raise NotImplementedError
+
+    # This function subscribes to the given topic
+    def subscribe(self, topic):
+        raise NotImplementedError
+
+    # This function publishes the data, bytes, to the other subscribers of the
+    # given topic
+    def publish(self, topic, data):
+        raise NotImplementedError
+
+    # This function sets the message published to the given topic once this
+    # client is gone
+    def setWill(self, topic, data):
+        raise NotImplementedError
+
+    # This function disconnects the client
+    def close(self):
+        raise NotImplementedError
+
+"""
+    Define the client of a PubSubBroker over a connected stream socket. The
+    requests are written in batches by a writer thread and the messages of
+    the broker are read by a reader thread.
+"""
+class StreamPubSub(PubSub):
+
+    # This is the constructor of the client for the given socket
+    def __init__(self, sock):
+        self.sock = sock
+        self.frameReader = SocketFrameReader(sock)
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.onMessage = None
+        self.onClose = None
+
+    # This function starts the reader and writer threads
+    def start(self, onMessage, onClose=None):
+        self.onMessage = onMessage
+        self.onClose = onClose
+        for name, target in (("pubSubReader", self.runReader), ("pubSubWriter", self.runWriter)):
+            thread = threading.Thread(name=name, target=target)
+            thread.daemon = True
+            thread.start()
+
+    # This function subscribes to the given topic
+    def subscribe(self, topic):
+        self.queue(SUBSCRIBE + topic.encode())
+
+    # This function publishes the data to the given topic
+    def publish(self, topic, data):
+        self.queue(PUBLISH + topic.encode() + b'\n' + data)
+
+    # This function sets the will of the client
+    def setWill(self, topic, data):
+        self.queue(WILL + topic.encode() + b'\n' + data)
+
+    # This function disconnects the client
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # This function queues a request for the writer thread
+    def queue(self, payload):
+        frame = encodeFrame(payload)
+        with self.condition:
+            self.frames.append(frame)
+            if len(self.frames) == 1:
+                self.condition.notify()
+
+    # This function writes the queued requests to the broker
+    def runWriter(self):
+        while True:
+            with self.condition:
+                while not self.frames:
+                    self.condition.wait()
+                frames = list(self.frames)
+                self.frames.clear()
+            try:
+                self.sock.sendall(b''.join(frames))
+            except OSError:
+                return
+
+    # This function reads the messages of the broker until it disconnects
+    def runReader(self):
+        while True:
+            try:
+                payload = self.frameReader.recvFrameBytes()
+            except (OSError, FrameError):
+                payload = None
+            if payload is None:
+                if self.onClose is not None:
+                    self.onClose()
+                return
+            topic, _, data = payload.partition(b'\n')
+            self.onMessage(topic.decode(), data)
+
+# This function connects a StreamPubSub client to the TCP broker at the given
+# address, given as host:port
+def connectPubSub(address):
+    host, _, port = address.rpartition(':')
+    return StreamPubSub(socket.create_connection((host or '127.0.0.1', int(port))))
+
+"""
+    Define the in-process client, connected to the other LocalPubSub clients
+    of the same process. Every client delivers its messages on its own
+    thread, as if they had come from a broker.
+"""
+class LocalPubSub(PubSub):
+
+    # The subscribers of every topic, shared by the clients of the process
+    subscribers = {}
+    lock = threading.Lock()
+
+    # This is the constructor of the client
+    def __init__(self):
+        self.messages = deque()
+        self.condition = threading.Condition()
+        self.topics = set()
+        self.will = None
+        self.closed = False
+
+    # This function starts the delivery thread
+    def start(self, onMessage, onClose=None):
+        self.onMessage = onMessage
+        self.onClose = onClose
+        thread = threading.Thread(name="pubSubDelivery", target=self.runDelivery)
+        thread.daemon = True
+        thread.start()
+
+    # This function subscribes to the given topic
+    def subscribe(self, topic):
+        with LocalPubSub.lock:
+            LocalPubSub.subscribers.setdefault(topic, set()).add(self)
+            self.topics.add(topic)
+
+    # This function publishes the data to the other subscribers of the topic
+    def publish(self, topic, data):
+        with LocalPubSub.lock:
+            subscribers = list(LocalPubSub.subscribers.get(topic, ()))
+        for subscriber in subscribers:
+            if subscriber is not self:
+                subscriber.receive(topic, data)
+
+    # This function sets the will of the client
+    def setWill(self, topic, data):
+        self.will = (topic, data)
+
+    # This function disconnects the client and publishes its will
+    def close(self):
+        with LocalPubSub.lock:
+            for topic in self.topics:
+                LocalPubSub.subscribers[topic].discard(self)
+        if self.will is not None:
+            self.publish(*self.will)
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    # This function queues a message for the delivery thread
+    def receive(self, topic, data):
+        with self.condition:
+            self.messages.append((topic, data))
+            if len(self.messages) == 1:
+                self.condition.notify()
+
+    # This function delivers the queued messages until the client is closed
+    def runDelivery(self):
+        while True:
+            with self.condition:
+                while not self.messages and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    break
+                topic, data = self.messages.popleft()
+            self.onMessage(topic, data)
+        if self.onClose is not None:
+            self.onClose()
+
+"""
+    Define the broker relaying the messages of StreamPubSub clients.
+"""
+class PubSubBroker:
+
+    # This is the constructor of the broker
+    def __init__(self):
+        self.subscribers = {}
+
+    # This coroutine serves the clients connected to the given sockets until
+    # all of them have disconnected
+    async def serveSockets(self, sockets):
+        async def serveSocket(sock):
+            reader, writer = await asyncio.open_unix_connection(sock=sock)
+            await self.serveClient(reader, writer)
+        await asyncio.gather(*(serveSocket(sock) for sock in sockets))
+
+    # This coroutine accepts clients on the given TCP address until the process
+    # is stopped
+    async def serveTcp(self, host, port):
+        server = await asyncio.start_server(self.serveClient, host, port, reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+    # This coroutine serves the requests of one client until it disconnects
+    async def serveClient(self, reader, writer):
+        topics = []
+        will = None
+        try:
+            while True:
+                payload = await readFrameBytes(reader)
+                if payload is None:
+                    break
+                operation, request = payload[:1], payload[1:]
+                if operation == SUBSCRIBE:
+                    self.subscribers.setdefault(request, set()).add(writer)
+                    topics.append(request)
+                elif operation == PUBLISH:
+                    self.publish(request, writer)
+                elif operation == WILL:
+                    will = request
+        except (ConnectionError, OSError, FrameError):
+            pass
+        for topic in topics:
+            self.subscribers[topic].discard(writer)
+        if will is not None:
+            self.publish(will, writer)
+        writer.close()
+
+    # This function sends a message, its topic followed by its data, to the
+    # subscribers of the topic except its publisher
+    def publish(self, message, publisher):
+        topic = message.partition(b'\n')[0]
+        frame = encodeFrame(message)
+        for writer in self.subscribers.get(topic, ()):
+            if writer is not publisher:
+                writer.write(frame)
+
+# This function parses the command line and runs a standalone TCP broker
+def main():
+    parser = argparse.ArgumentParser(description="Publish/subscribe broker of a server cluster")
+    parser.add_argument("brokerPort", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+    try:
+        asyncio.run(PubSubBroker().serveTcp(args.host, args.brokerPort))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
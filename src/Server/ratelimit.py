@@ -0,0 +1,246 @@
+"""
+    Python 3
+    Rate limits of the commands of the users. Every command costs a number
+    of tokens by type, a broadcast or a search costing more than a direct
+    message, and is charged to a token bucket of the session and to a token
+    bucket of the whole process. A user over its own rate has its
+    command delayed until the tokens are refilled, up to a maximum delay,
+    or refused. The process over its rate is overloaded: it sheds the
+    expensive commands of every user, which are refused at once, while the
+    cheap ones such as direct messages still go through, so that a spike of
+    broadcasts and whoelsesince does not hold up the direct messages. The
+    buckets are refilled from the time elapsed when they are charged, so no
+    thread or timer is needed. The buckets of the users are kept by user name,
+    so a user logging in again or reconnecting goes on with its own bucket.
+"""
+import threading
+import time
+
+# The verdicts on a command: handled at once, handled after a delay, refused
+# because the session is over its rate, or refused because the process is
+# overloaded
+ADMITTED = 'admitted'
+DELAYED = 'delayed'
+REJECTED = 'rejected'
+SHED = 'shed'
+
+# The policies applied to a session over its rate
+POLICIES = ('delay', 'reject')
+
+# The default cost in tokens of every command, of the commands not listed and
+# the highest cost of the commands which are not shed when overloaded
+COMMAND_COSTS = {
+    "['0']": 0,
+    'logout': 0,
+    'message': 1,
+    'relay': 1,
+    'block': 2,
+    'unblock': 2,
+    'startprivate': 2,
+    'join': 2,
+    'leave': 2,
+    'unsubscribe': 1,
+    'subscribe': 5,
+    'whoelse': 5,
+    'whoelsesince': 5,
+    'history': 5,
+    'channel': 5,
+    'broadcast': 10,
+    'search': 10,
+}
+DEFAULT_COST = 1
+CHEAP_COST = 1
+
+# The default number of seconds of the rate a bucket holds when full, and the
+# longest delay of a command before it is refused
+DEFAULT_BURST_SECONDS = 5
+DEFAULT_MAX_DELAY = 1.0
+
+# The number of buckets of the users kept before the buckets which have been
+# refilled are dropped, a full bucket being the same as a new one
+PRUNE_THRESHOLD = 1024
+
+# This function parses the costs given as name=cost pairs separated by commas
+# into a dict updating the default costs
+def parseCosts(text):
+    costs = dict(COMMAND_COSTS)
+    for pair in text.split(','):
+        if not pair.strip():
+            continue
+        name, separator, cost = pair.partition('=')
+        if not separator or not cost.strip().isdigit():
+            raise ValueError(f"invalid command cost: {pair}")
+        costs[name.strip()] = int(cost)
+    return costs
+
+"""
+    Define a token bucket refilled at rate tokens per second up to burst
+    tokens. A command delayed takes its tokens at once, leaving the bucket in
+    debt, so that the commands after it wait for it to be paid back. A command
+    is always admitted on a full bucket, even if it costs more than the
+    burst.
+"""
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    # This is the constructor of the bucket, which starts full at the given
+    # time
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    # This function refills the bucket for the time elapsed until now. A time
+    # read before the last refill, by another thread, refills nothing
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # This function returns whether the bucket holds all its burst
+    def isFull(self):
+        return self.tokens >= self.burst
+
+    # This function takes cost tokens and returns the seconds until the bucket
+    # is out of debt again, or full for a command costing more than the burst,
+    # or returns None and takes nothing if that is more than maxDelay
+    def take(self, cost, now, maxDelay=0.0):
+        self.refill(now)
+        wait = 0.0
+        if self.tokens < cost and not self.isFull():
+            wait = (min(cost, self.burst) - self.tokens) / self.rate
+        if wait > maxDelay:
+            return None
+        self.tokens -= cost
+        return wait
+
+"""
+    Define the rate limits of a server process: userRate and userBurst tokens
+    for every user, globalRate and globalBurst tokens for the process, a rate
+    of 0 meaning no limit, and the policy applied to a user over its rate. A
+    burst is raised to the highest cost of a command, so that every command
+    can be admitted. The given metrics count the commands delayed, rejected
+    and shed.
+"""
+class RateLimiter:
+
+    # This is the constructor of the limits
+    def __init__(self, userRate=0, userBurst=None, globalRate=0, globalBurst=None, policy='delay',
+                 maxDelay=DEFAULT_MAX_DELAY, costs=None, metrics=None):
+        self.costs = COMMAND_COSTS if costs is None else costs
+        highestCost = max(list(self.costs.values()) + [DEFAULT_COST])
+        self.userRate = userRate
+        self.userBurst = max(highestCost, userRate * DEFAULT_BURST_SECONDS if userBurst is None else userBurst)
+        self.policy = policy
+        self.maxDelay = maxDelay if policy == 'delay' else 0.0
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.userBuckets = {}
+        self.pruneThreshold = PRUNE_THRESHOLD
+        self.globalBucket = None
+        if globalRate:
+            globalBurst = globalRate * DEFAULT_BURST_SECONDS if globalBurst is None else globalBurst
+            self.globalBucket = TokenBucket(globalRate, max(highestCost, globalBurst))
+
+    """
+        Public APIs of the limits.
+    """
+
+    # This function charges a command of the given name sent by the given user
+    # to the bucket of the user and to the bucket of the process, and returns
+    # the verdict on it with the seconds to wait before handling it
+    def admit(self, userName, command, now=None):
+        cost = self.costs.get(command, DEFAULT_COST)
+        if not cost:
+            return ADMITTED, 0.0
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.userBucket(userName, now)
+            wait = 0.0 if bucket is None else bucket.take(cost, now, self.maxDelay)
+            shed = wait is not None and self.globalBucket is not None and not self.chargeGlobal(cost, now)
+            if shed and bucket is not None:
+                bucket.tokens += cost
+        if wait is None:
+            return self.refuse(REJECTED, command)
+        if shed:
+            return self.refuse(SHED, command)
+        if wait:
+            if self.metrics is not None:
+                self.metrics.rateLimited.inc(DELAYED)
+            return DELAYED, wait
+        return ADMITTED, 0.0
+
+    # This function returns whether the process is over its rate, shedding the
+    # expensive commands
+    def isOverloaded(self, now=None):
+        if self.globalBucket is None:
+            return False
+        with self.lock:
+            self.globalBucket.refill(time.monotonic() if now is None else now)
+            return self.globalBucket.tokens < CHEAP_COST
+
+    # This function returns the tokens left to the given user, to be handed
+    # over with its session to another server process, or None if the user
+    # has no bucket
+    def userTokens(self, userName, now=None):
+        with self.lock:
+            bucket = self.userBuckets.get(userName)
+            if bucket is None:
+                return None
+            bucket.refill(time.monotonic() if now is None else now)
+            return bucket.tokens
+
+    # This function gives the given user the tokens handed over with its
+    # session by another server process
+    def restoreUserTokens(self, userName, tokens):
+        if not self.userRate:
+            return
+        with self.lock:
+            bucket = self.userBucket(userName, time.monotonic())
+            bucket.tokens = min(bucket.burst, tokens)
+
+    """
+        Helper functions of the limits.
+    """
+
+    # This function returns the bucket of the given user, created full if the
+    # user has none, or None if the users are not limited. The buckets which
+    # have been refilled are dropped once there are many of them. The caller
+    # must hold the lock
+    def userBucket(self, userName, now):
+        if not self.userRate:
+            return None
+        bucket = self.userBuckets.get(userName)
+        if bucket is None:
+            if len(self.userBuckets) >= self.pruneThreshold:
+                for name, idle in list(self.userBuckets.items()):
+                    idle.refill(now)
+                    if idle.isFull():
+                        del self.userBuckets[name]
+                self.pruneThreshold = max(PRUNE_THRESHOLD, 2 * len(self.userBuckets))
+            bucket = self.userBuckets[userName] = TokenBucket(self.userRate, self.userBurst, now)
+        return bucket
+
+    # This function takes the cost of a command from the bucket of the process
+    # and returns whether the command may be handled. An expensive command
+    # needs the tokens, unless the bucket is full, while a cheap one may leave
+    # the bucket in debt down to minus its burst, so that it is only refused
+    # once the cheap commands alone are over the rate. The caller must hold
+    # the lock
+    def chargeGlobal(self, cost, now):
+        bucket = self.globalBucket
+        bucket.refill(now)
+        floor = cost - bucket.burst if cost <= CHEAP_COST else cost
+        if bucket.tokens < floor and not bucket.isFull():
+            return False
+        bucket.tokens -= cost
+        return True
+
+    # This function counts a command refused with the given verdict and
+    # returns the verdict
+    def refuse(self, verdict, command):
+        if self.metrics is not None:
+            self.metrics.rateLimited.inc(verdict)
+            self.metrics.rateRefused.inc(command if command in self.costs else 'invalid')
+        return verdict, 0.0
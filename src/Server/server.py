@@ -1,468 +1,533 @@
-"""
-    Python 3
-    Usage: python3 server.py localhost 12000
-"""
-from socket import *
-from threading import Thread
-import sys
-from datetime import datetime
-import threading
-import time
-from signal import signal, SIGPIPE, SIG_DFL, SIG_IGN
-
-"""
-    Define multi-thread class for client including the main thread and all 
-    corresponding functionalities of the program on the server side
-"""
-class ClientThread(Thread):
-    
-    # This is the constructor of a thread and will be used to initialise
-    # a thread every time a user connects to the server
-    def __init__(self, clientAddress, clientSocket):
-        Thread.__init__(self)
-        self.clientAddress = clientAddress
-        self.clientSocket = clientSocket
-        self.clientAlive = False
-        
-        #print("===== New connection created for: ", clientAddress)
-        self.userName = 'userName'
-        self.p2pPort = 0
-        
-    # This function takes care of the main functionality of the server. 
-    # It will keep running since a client logs onto the system and until 
-    # the client logs out from the server or timed out by the server.
-    def run(self):
-        self.p2pPort = self.clientSocket.recv(1024).decode().split()[1]
-        self.processLogin()
-        message = ''
-        while self.clientAlive:
-            timer = threading.Timer(serverTimeout, self.systemTimeOut)
-            timer.start()
-            data = self.clientSocket.recv(1024)
-            message = data.decode()
-            
-            # if the message from client is empty, the client would be off-line 
-            # then set the client as offline (alive=Flase)
-            if message == '':
-                timer.cancel()
-                self.clientAlive = False
-                #print("===== the user disconnected - ", clientAddress)
-                self.selectAndRemove(peerList, self.userName)
-                self.updateActivityListLogout(self.userName, datetime.now())
-                self.broadcast(f"{self.userName} logged out\n", appendix=False)
-                self.clientSocket.close()
-                break
-            
-            message = message.split()
-            if message[0] == 'message':
-                self.message(message, timer)
-            elif message[0] == 'broadcast':
-                timer.cancel()
-                self.broadcast(message)
-            elif message[0] == 'whoelse':
-                timer.cancel()
-                self.clientSocket.send(self.listAllCurrentUsers().encode())
-            elif message[0] == 'whoelsesince' and len(message) == 2:
-                timePeriod = int(message[1])
-                timer.cancel()
-                self.clientSocket.send(self.listAllUserSince(timePeriod).encode())
-            elif message[0] == 'block' and len(message) == 2:
-                self.blockUser(message[1], timer)
-            elif message[0] == 'unblock' and len(message) == 2:
-                self.unblockUser(message[1], timer)
-            elif message[0] == 'startprivate' and len(message) == 2:
-                self.startPrivateMessaging(message[1], timer)
-            elif message[0] == "['0']":
-                timer.cancel()
-            else:
-                self.clientSocket.send("Error. Invalid command\n".encode())
-    
-    """
-        Customized APIs for the server to utilise for different operations.
-    """
-    
-    # This function takes in the user name of a user and tries to start p2p 
-    # messaging between the user and the client by sending user connection info
-    # and signal to the client to initiate p2p session. If the client is trying 
-    # to start a p2p session with himself or the user is not registered with the 
-    # system or the user is not online or the client have been blocked by the user,
-    # an error would occur and the client will be notified by the server.
-    def startPrivateMessaging(self, user, timer):
-        if user == self.userName:
-            self.clientSocket.send("Error. Cannot privately message self\n".encode())
-        elif self.checkUsers(user):
-            timer.cancel()
-            for peer in peerList:
-                if peer[0] == user:
-                    if self.checkIfUserBeenBlocked(peer[0], self.userName):
-                        self.clientSocket.send(f"Error. You can not privately message {user} as the recipient has blocked you\n".encode())
-                    else:
-                        self.clientSocket.send(f"Start private messaging with {user}\n".encode())
-                        time.sleep(0.1)
-                        self.clientSocket.send(f"['TARGET'] {peer[0]} {peer[1]} {peer[4]} {self.userName} {True}\n".encode())
-                        peer[3].clientSocket.send(f"['TARGET'] {self.userName} {self.clientAddress[0]} {self.p2pPort} {peer[0]} {False}\n".encode())
-                    break
-            else:
-                self.clientSocket.send("Error. User is not online\n".encode())        
-        else:
-            self.clientSocket.send("Error. Invaid user\n".encode())        
-    
-    # This function takes in the user name of a user and unblocks the user 
-    # from not being able to send message to the client or receive notification 
-    # from the client. If the client tries to unblock himself or a user that has
-    # not been registered with the system, an error would return to the client. 
-    # If the given user have not been blocked, an error would raise and the client 
-    # woud be notified.
-    def unblockUser(self, user, timer):
-        if user == self.userName:
-            self.clientSocket.send("Error. Cannot unblock self\n".encode())
-        elif (self.checkUsers(user)):
-            timer.cancel()
-            if user in userBlockedList:
-                if self.userName in userBlockedList[user]:
-                    userBlockedList[user].remove(self.userName)
-                    self.clientSocket.send(f"{user} is unblocked\n".encode())
-                else:
-                    self.clientSocket.send(f"Error. {user} was not blocked\n".encode())
-            else:
-                self.clientSocket.send(f"Error. {user} was not blocked\n".encode())
-        else:
-            self.clientSocket.send("Error. Invalid user\n".encode())
-    
-    # This function takes in the user name of a user and blocks the user from 
-    # being able to send messages to the client or receive notification from 
-    # client. If the client tries to block himself or a user that has not been 
-    # registered with the system, an error message would return to the client. 
-    # If the user has already been blocked, the user would be notified.
-    def blockUser(self, user, timer):
-        if user == self.userName:
-            self.clientSocket.send("Error. Cannot block self\n".encode())
-        elif (self.checkUsers(user)):
-            timer.cancel()
-            if user in userBlockedList:
-                if self.userName in userBlockedList[user]:
-                    self.clientSocket.send(f"Error. {user} has already been blocked\n".encode())
-                else:
-                    userBlockedList[user].append(self.userName)
-                    self.clientSocket.send(f"{user} is blocked\n".encode())
-            else:
-                userBlockedList[user] = [self.userName]
-                self.clientSocket.send(f"{user} is blocked\n".encode())
-        else:
-            self.clientSocket.send("Error. Invalid user\n".encode())
-    
-    # This function takes in the message itself and the user who the message
-    # would be sent to as a whole, processes the command, and sends the message
-    # to the corresponding user if the user is online. If the user has blocked 
-    # the client or the user does not exist, an error occurs. If the user is not 
-    # currently online, the message will be cached in the server and be sent to 
-    # the user once the user logs onto the system
-    def message(self, message, timer):
-        toUser = message[1]
-        message = self.userName + ': ' + ' '.join(message[2:]) + '\n'
-        if toUser == self.userName:
-            self.clientSocket.send("Error. Cannot send message to your self\n".encode())
-        elif (self.checkUsers(toUser)):
-            timer.cancel()
-            if (self.checkIfUserBeenBlocked(toUser, self.userName)):
-                self.clientSocket.send("Your message could not be delivered as the recipient has blocked you\n".encode())
-            else:
-                for peer in peerList:
-                    if (peer[0] == toUser):
-                        peer[3].clientSocket.send(message.encode())
-                        break;
-                else:
-                    messageToSend.append([toUser, message])
-        else:
-            self.clientSocket.send("Error. Invalid user\n".encode())
-    
-    # This function lists all the users who has logged into the system since
-    # the given time, excluding those who have blocked the client for the 
-    # whoelsesince functionality
-    def listAllUserSince(self, time):
-        message = ''
-        currentTime = datetime.now()
-        for peer in activityList:
-            if (self.checkIfUserBeenBlocked(peer[0], self.userName) or peer[0] == self.userName):
-                pass
-            else:
-                if (peer[2] == None and peer[0] not in message):
-                    message = message + peer[0] + '\n'
-                elif (peer[0] not in message and (currentTime - peer[2]).total_seconds() < time):
-                    message = message + peer[0] + '\n'
-                else:
-                    pass
-        return message
-
-    # This function lists all the currently active user who has not currently
-    # blocked the client for the whoelse functionality
-    def listAllCurrentUsers(self):
-        message = ''
-        for peer in peerList:
-            if (self.checkIfUserBeenBlocked(peer[0], self.userName)):
-                pass
-            else:
-                if (peer[3] != self):
-                    message = message + peer[0] + '\n'
-        return message
-    
-    # This function processes the timeout functionality of the server, sends the
-    # timeout signal to the client to initiate an active logout by the client
-    def systemTimeOut(self):
-        self.clientSocket.send("You have been timed out due to inactivity for a long period of time. Please re-login later\n['EXIT']".encode())
-        self.selectAndRemove(peerList, clientAddress[1])
-    
-    # This function processes the broadcase operation of the server, broadcasting 
-    # the user's message to all the currently active users
-    def broadcast(self, message, appendix=True):
-        ifBeingBlocked = False
-        if appendix:
-            message = self.userName + ': ' + ' '.join(message[1:]) + "\n"
-            for peer in peerList:
-                if self.checkIfUserBeenBlocked(peer[0], self.userName):
-                    ifBeingBlocked = True
-                elif (peer[3] != self):
-                    peer[3].clientSocket.send(message.encode())
-        else:
-            for peer in peerList:
-                if self.checkIfUserBeenBlocked(self.userName, peer[0]):
-                    pass
-                elif (peer[3] != self):
-                    peer[3].clientSocket.send(message.encode())
-        if ifBeingBlocked:
-            self.clientSocket.send("Your message could not be delivered to some recipients\n".encode())
-
-    # This function processes the user authentication operation, inlcuding both
-    # existing user login and new user registration for the server
-    def processLogin(self):
-        loginAttempts = 0;
-        loginStatus = False;
-        self.clientSocket.sendall("Username: ".encode()) 
-        userName = self.clientSocket.recv(1024).decode()
-        while self.checkIfAlreadyLoggedIn(userName):
-            self.clientSocket.send("This user is currently active. Please login with another user\nUsername: ".encode())
-            userName = self.clientSocket.recv(1024).decode()
-
-        if (self.checkUsers(userName)):
-            self.clientSocket.sendall("Password: ".encode()) 
-            while (loginStatus != True):
-                if (loginAttempts == 3):
-                    self.clientSocket.sendall("Invalid Password. Your account has been blocked. Please try again later\n['EXIT']".encode())
-                    loginBlockedList.append([userName, datetime.now()])
-                    self.clientSocket.close()
-                    break;
-                password = self.clientSocket.recv(1024).decode()
-                loginAttempts += 1
-                if (self.checkIfBeenBlocked(loginBlockedList, userName)):
-                    if (datetime.now() - self.getBlockedTime(loginBlockedList, userName)).total_seconds() >serverBlockDuration:
-                        self.unblockUserLogin(loginBlockedList, userName)
-                    else:
-                        self.clientSocket.sendall("Your account is blocked due to multiple login failures. Please try again later\n['EXIT']".encode())
-                        self.clientSocket.close()
-                        break;
-                if (self.verifyPassword(userName, password)):
-                    peerList.append([userName, self.clientSocket.getpeername()[0], self.clientSocket.getpeername()[1], self, self.p2pPort])
-                    self.userName = userName
-                    self.clientSocket.sendall("Welcome to the greatest messaging application ever!\n".encode())
-                    self.broadcast(f"{userName} logged in\n", appendix=False)
-                    self.updateActivityList(self.userName)
-                    loginStatus = True;
-                    self.clientAlive = True
-                    self.loadCachedMessage()
-                elif loginAttempts < 3: 
-                    self.clientSocket.sendall("Invalid Password. Please try again\nPassword: ".encode())
-                else:
-                    pass
-        else:
-            self.clientSocket.sendall("This is a new user. Enter a password: ".encode()) 
-            newPassword = self.clientSocket.recv(1024).decode()
-            self.addNewCredentials(userName, newPassword)
-            peerList.append([userName, self.clientSocket.getpeername()[0], self.clientSocket.getpeername()[1], self, self.p2pPort])
-            self.userName = userName
-            self.updateActivityList(self.userName)
-            self.broadcast(f"{userName} logged in\n", False)
-            self.clientSocket.sendall("Welcome to the greatest messaging application ever!\n".encode())
-            self.clientAlive = True
-    
-    """
-        Helper Functions utilised on the server.
-    """
-    
-    # This functions iterates through the safed message list and send all the
-    # unread message (messages being sent to the user when the user is not 
-    # currently active on the system) to the client 
-    def loadCachedMessage(self):
-        for i in range(0, len(messageToSend)):
-            if messageToSend[i][0] == self.userName:
-                self.clientSocket.send(messageToSend[i][1].encode())
-                messageToSend.remove(messageToSend[i])
-    
-    # This function takes in two users, userA and userB and verifies if userB 
-    # has been blocked by userA.
-    def checkIfUserBeenBlocked(self, userA, userB):
-        if userB in userBlockedList:
-            if userA in userBlockedList[userB]:
-                return True
-        return False
-    
-    # This function updates the activity list, which keeps track of the time 
-    # when a user has logged into the system, by including logout timestamps 
-    # of a user for listing users who have logged in since a particular time 
-    # functionality
-    def updateActivityListLogout(self, userName, time):
-        for peer in activityList:
-            if userName == peer[0]:
-                peer[2] = time
-
-    # This function updates the activity list, which keeps track of the time 
-    # when a user has logged into the system, by creating logged in information 
-    # (user name and logged in time stamp) for listing users who have logged in 
-    # since a particular time functionality
-    def updateActivityList(self, userName):
-        for peer in activityList:
-            if userName == peer[0]:
-                peer[1] = datetime.now()
-                peer[2] = None
-        else:
-            activityList.append([userName, datetime.now(), None])
-    
-    # This function iterates through the credentials file and check if the
-    # user is a valid user/ has been registered in the system
-    def checkUsers(self, userName):
-        c = open('credentials.txt', 'r')
-        f = c.readlines()
-        for line in f:
-            detail = line.split()
-            if (detail[0] == userName):
-                c.close()
-                return True;
-        c.close()
-        return False;
-    
-    # This function iterates through the peerList, which keeps track of the active
-    # users, and checks if a users has been succfully logged into the application
-    def checkIfAlreadyLoggedIn(self, userName):
-        for peer in peerList:
-            if userName == peer[0]:
-                return True
-        return False
-
-    # This function iterates through the credentials file and check if the
-    # user name & password matches the record stored in the credentials.txt
-    def verifyPassword(self, userName, password):
-        c = open('credentials.txt', 'r')
-        f = c.readlines()
-        for line in f:
-            detail = line.split()
-            if (detail[0] == userName):
-                if (detail[1] == password):
-                    c.close()
-                    return True;
-        c.close
-        return False; 
-    
-    # This function adds the user name and password of a newly registered user
-    # into the end of the credentials file
-    def addNewCredentials(self, userName, password):
-        c = open('credentials.txt', 'a')
-        c.write('\n')
-        newCredentials = userName + ' ' + password
-        c.write(newCredentials)
-        c.close()   
-        
-    # This function iterates through the peerList, which keeps track of the active
-    # users, and logs a user out by removing the corresponding data from the list
-    def selectAndRemove(self, peerList, data):
-        for i in range(0, len(peerList)):
-            if peerList[i][0] == data:
-                peerList.remove(peerList[i])
-                break;
-
-    # This function iterates through the blockedList, which keeps track of the user 
-    # information of users who have multiple unsuccessful login attemps, and 
-    # determine whether a user have been blocked by the system
-    def checkIfBeenBlocked(self, blockedList, userName):
-        for i in blockedList:
-            if (i[0] == userName):
-                return True;
-        return False;
-    
-    # This function iterates through the blockedList, which keeps track of the user 
-    # information of users who have multiple unsuccessful login attemps, and unblock
-    # the given user from the system
-    def unblockUserLogin(self, blockedList, userName):
-        for i in range(0, len(blockedList)):
-            if blockedList[i][0] == userName:
-                blockedList.remove(blockedList[i])
-               
-    # This function iterates through the blockedList, which keeps track of the user
-    # information of users who have multiple unsuccessful login attemps, and returns
-    # the time when a user have been blocked by the system
-    def getBlockedTime(self, blockedList, userName):
-        for i in blockedList:
-            if (i[0] == userName):
-                return i[1];
-
-"""
-    Main execution of the server function
-"""
-
-# Verify if sufficient information have been provided by the command line
-# Proceed if sufficient. Print out error and stop execution otherwise.
-if len(sys.argv) != 4:
-    print("\n===== Error usage, python3 TCPServer3.py SERVER_PORT ======\n");
-    exit(0);
-    
-# Acquire serverPort, serverBlockDuration, and serverTimeout from command line
-# parameter. serverHost have been set to localhost, 127.0.0.1, by default. This
-# may change under different usages.
-serverHost = "127.0.0.1"
-serverPort = int(sys.argv[1])
-serverBlockDuration = int(sys.argv[2])
-serverTimeout = int(sys.argv[3])
-serverAddress = (serverHost, serverPort)
-
-# Define socket for the server side and bind address for connectivity purposes
-serverSocket = socket(AF_INET, SOCK_STREAM)
-serverSocket.bind(serverAddress)
-
-'''
-    The Definition of server side data structure
-'''
-
-# The loginBlockedList keeps track of the list of users who have been blocked by
-# the server due to multiple unsuccessful logins. Each element of the 
-# loginBlockedList would be a list in the following data structure: 
-# [userName, timestampWhenUserHadBeenBlocked]
-loginBlockedList = []
-
-# The peerList keeps track of the currently logged in users and their corresponding
-# information. Each element of the peerList would be a list in the following data 
-# structure: [userName, userIpAddress, userPortNumber, userSocket, userP2pPortNumber]
-peerList = []
-
-# The activityList keeps track of the user activity of logging in to and out of the 
-# server. Each element of the activityList would be a list in the following data 
-# structure: [userName, mostRecentLoginTimestamp, mostRecentLogOffTimestamp]. 
-# Note: the most recent log off tiem stamp would be set to None when the user is 
-# currently active.
-activityList = []
-
-# The messageToSend list keeps track of the offline messages which needs to be send 
-# to the corresponding user when the user logs into the system. Each element of the 
-# messageToSend list would be a list in the following data structure: 
-# [userName, messageContentToBeSendToUserName]
-messageToSend = []
-
-# The userBlockedList keeps track of a list of whom had currently blocked the user. 
-# The userBlockedList would be a dictionary in the following format: 
-# {userA: [userB, userC, etc.]}, which userA had been blocked by userB, userC, etc. 
-userBlockedList = {}
-
-# Main execution loop of the server
-while True:
-    serverSocket.listen()
-    clientSockt, clientAddress = serverSocket.accept()
-    clientThread = ClientThread(clientAddress, clientSockt)
-    clientThread.start()
-    signal(SIGPIPE, SIG_IGN)
\ No newline at end of file
+"""
+    Python 3
+    Usage: python3 server.py SERVER_PORT BLOCK_DURATION TIMEOUT [--mode thread|async] [--workers N]
+                            [--cluster HOST:PORT --node-id K --cluster-nodes N]
+                            [--metrics-port PORT] [--metrics-log SECONDS]
+                            [--state-dir DIR | --state-memory] [--snapshot-interval SECONDS]
+                            [--history-dir DIR | --history-memory] [--presence-window SECONDS]
+                            [--login-workers N] [--login-queue N] [--handoff PATH] [--takeover PATH]
+                            [--user-rate TOKENS] [--global-rate TOKENS] [--rate-policy delay|reject]
+"""
+from socket import *
+import threading
+from threading import Thread
+import sys
+import os
+import select
+import time
+import argparse
+import atexit
+from signal import signal, SIGPIPE, SIG_IGN
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import SocketFrameReader, FrameError, ReadInterrupted
+import serverstate
+from session import ServerSession
+from timingwheel import TimingWheel
+from credentialstore import CredentialStore
+from offlinestore import OfflineStore
+from historystore import HistoryStore
+from blockgraph import BlockGraph
+from channels import ChannelDirectory
+from activityindex import ActivityIndex
+from lockouts import LoginLockouts
+from loginpool import LoginPool, DEFAULT_WORKERS, DEFAULT_QUEUE_LIMIT
+from ratelimit import RateLimiter, POLICIES as RATE_POLICIES, DEFAULT_MAX_DELAY, parseCosts
+from presencefeed import PresenceFeed, DEFAULT_WINDOW
+from statestore import SnapshotLog, Snapshotter
+from shardbus import ShardBus, PartitionedOfflineStore, ReplicatedHistoryStore, runShardedServer
+from pubsub import connectPubSub
+from outbound import OutboundQueue, POLICIES, sendFrames
+from handoff import HandoffServer, takeOver
+
+# The sessions of the thread engine which are being served, handed over to a
+# new server process on a handoff
+liveSessions = set()
+
+# The seconds a node of a cluster waits for the other nodes to announce their
+# users before recording the users who were logged in when it stopped, and
+# have not come back, as logged out
+SETTLE_DELAY = 5
+
+"""
+    Define multi-thread class for client including the main thread of each
+    client. All the functionalities of the program on the server side are
+    inherited from ServerSession (see session.py).
+"""
+class ClientThread(ServerSession, Thread):
+    
+    # This is the constructor of a thread and will be used to initialise
+    # a thread every time a user connects to the server
+    def __init__(self, clientAddress, clientSocket):
+        Thread.__init__(self)
+        ServerSession.__init__(self, clientAddress)
+        self.clientSocket = clientSocket
+
+        # Frames are written as soon as they are queued, as the asyncio engine
+        # does, so that the frames which start private messaging are not held
+        # back until the client acknowledges the previous ones
+        clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.frameReader = SocketFrameReader(clientSocket, None if serverstate.handoff is None
+                                             else serverstate.handoff.interruptFd)
+        self.interrupted = False
+        liveSessions.add(self)
+
+        # Everything sent to the client is queued and written by a writer thread
+        # of the session, so that a slow client never blocks another session
+        self.outbound = OutboundQueue(self, serverstate.outboundHighWatermark, serverstate.outboundLowWatermark,
+                                      serverstate.slowConsumerPolicy, metrics=serverstate.metrics)
+        self.writerThread = Thread(name="writer", target=self.runWriter)
+        self.writerThread.daemon = True
+        self.writerDone = False
+        
+    # This function takes care of the main functionality of the server. 
+    # It will keep running since a client logs onto the system and until 
+    # the client logs out from the server or timed out by the server.
+    def run(self):
+        serverstate.metrics.connections.inc()
+        serverstate.metrics.openConnections.inc()
+        self.writerThread.start()
+        try:
+            self.serve()
+        except ReadInterrupted:
+            self.interrupted = True
+        # Text which is not UTF-8 in the handshake or the login ends the session
+        # like a broken frame
+        except (ConnectionError, OSError, FrameError, UnicodeDecodeError):
+            if self.clientAlive:
+                self.handleDisconnect()
+            else:
+                self.close()
+        if not self.interrupted:
+            liveSessions.discard(self)
+
+    # This function reads the handshake, the login procedure and then the
+    # commands of the client until the client disconnects. A session handed
+    # over by another server continues from where it was
+    def serve(self):
+        if self.resumed and self.clientAlive:
+            self.loadCachedMessage()
+        if not self.handshaken:
+            handshake = self.recvPayload(first=True)
+            if handshake is None:
+                self.close()
+                return
+            self.processHandshake(handshake.decode())
+            self.startLogin()
+        while self.isLoggingIn():
+            data = self.recvPayload()
+            if data is None:
+                self.loginState = 'closed'
+                self.close()
+                return
+            text = self.inputText(data)
+            self.handleLoginInput(text, self.authenticate(self.loginWork(text)))
+        while self.clientAlive:
+            message = self.recvPayload()
+
+            # Once the client has closed the connection, the client is set as
+            # offline. An empty frame is a command like any other
+            if message is None:
+                self.handleDisconnect()
+                break
+
+            # A command over the rate limits is refused, or delayed by not
+            # reading the next commands of the client meanwhile
+            delay = self.admitCommand(message)
+            if delay is None:
+                continue
+            if delay:
+                time.sleep(delay)
+            self.handleInput(message)
+
+    # This function blocks until a complete frame is received from the client
+    # and returns its payload, or None once the client has closed the
+    # connection. The handshake is read as the first frame, leaving what follows
+    # it to the decoder of the negotiated protocol
+    def recvPayload(self, first=False):
+        received = self.frameReader.receivedBytes
+        if first:
+            payload = self.frameReader.recvFirstFrameBytes()
+        else:
+            payload = self.frameReader.recvFrameBytes()
+        serverstate.metrics.bytesIn.inc(self.frameReader.receivedBytes - received)
+        return payload
+
+    # This function decodes the rest of the input with the given decoder
+    def setDecoder(self, decoder):
+        self.frameReader.setDecoder(decoder)
+
+    # This function returns the socket of the client and the decoder of its
+    # input, which holds everything received
+    def handoffTransport(self):
+        return self.clientSocket.fileno(), self.frameReader.decoder, b''
+
+    # This function continues the session handed over with the given state.
+    # The frames which the old server had received but not decoded are decoded
+    # before anything more is received, except during the handshake which is
+    # decoded alone
+    def restoreState(self, state):
+        decoder = ServerSession.restoreState(self, state)
+        self.frameReader.decoder = decoder
+        if self.handshaken:
+            self.frameReader.pending.extend(decoder.feed(b''))
+
+    # This function writes the queued frames to the socket until the session
+    # is closed and closes the socket afterwards. If writing fails the socket is
+    # shut down, which also ends the session thread waiting for a command
+    def runWriter(self):
+        try:
+            while True:
+                frames = self.outbound.waitAndTake()
+                if not frames:
+                    break
+                self.outbound.wrote(sendFrames(self.clientSocket, self.codec.encodeBatch(frames)))
+        except OSError:
+            self.shutdownSocket()
+        serverstate.metrics.openConnections.dec()
+        self.writerDone = True
+        if self.outbound.closed:
+            self.clientSocket.close()
+
+    # This function queues the given frame to be sent to the client
+    def sendFrame(self, frame):
+        self.outbound.push(frame)
+
+    # This function queues the frame of a message of another user for the
+    # client, subject to the slow consumer policy
+    def deliverFrame(self, frame):
+        self.outbound.offer(frame)
+
+    # This function blocks until the queued frames have been mostly written
+    def waitForRoom(self):
+        self.outbound.waitForRoom()
+
+    # This function closes the session. The writer thread sends the frames
+    # which are still queued and closes the socket of the client
+    def close(self):
+        self.outbound.close()
+        if self.writerDone:
+            self.clientSocket.close()
+
+    # This function disconnects a client which does not keep up with its
+    # messages
+    def disconnectSlowConsumer(self):
+        self.outbound.close()
+        self.shutdownSocket()
+
+    # This function shuts the socket down in both directions, waking up the
+    # threads blocked on it
+    def shutdownSocket(self):
+        try:
+            self.clientSocket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+"""
+    Main execution of the server function
+"""
+
+# Parse the command line. serverPort, serverBlockDuration and serverTimeout are
+# required, the server engine may be selected with --mode: 'thread' starts one
+# thread per client (default) and 'async' runs every client session as a
+# coroutine on a single asyncio event loop.
+parser = argparse.ArgumentParser(description="Instant messaging server")
+parser.add_argument("serverPort", type=int)
+parser.add_argument("blockDuration", type=int)
+parser.add_argument("timeout", type=int)
+parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                    help="server engine used to serve the clients (default: thread)")
+parser.add_argument("--offline-dir", default="offline",
+                    help="directory of the log of the offline messages (default: offline)")
+parser.add_argument("--offline-memory", action="store_true",
+                    help="keep the offline messages in memory only")
+parser.add_argument("--history-dir", default="history",
+                    help="directory of the logs of the message history (default: history)")
+parser.add_argument("--history-memory", action="store_true",
+                    help="keep the message history in memory only")
+parser.add_argument("--queue-high", type=int, default=serverstate.outboundHighWatermark,
+                    help="bytes queued for a client before it is considered slow (default: 1 MiB)")
+parser.add_argument("--queue-low", type=int, default=serverstate.outboundLowWatermark,
+                    help="bytes queued for a slow client before it is considered caught up (default: 256 KiB)")
+parser.add_argument("--slow-policy", choices=POLICIES, default=serverstate.slowConsumerPolicy,
+                    help="handling of messages for a slow client (default: spill to the offline store)")
+parser.add_argument("--blocks-file", default="blocks.log",
+                    help="log file of the blocks between users (default: blocks.log)")
+parser.add_argument("--channels-file", default="channels.log",
+                    help="log file of the members of the group channels (default: channels.log)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="number of server processes sharing the port through SO_REUSEPORT (default: 1)")
+parser.add_argument("--cluster", metavar="HOST:PORT", default=None,
+                    help="join a cluster of servers through the pubsub.py broker at the given address")
+parser.add_argument("--node-id", type=int, default=0,
+                    help="number of this server in the cluster, from 0 (default: 0)")
+parser.add_argument("--cluster-nodes", type=int, default=1,
+                    help="number of servers in the cluster (default: 1)")
+parser.add_argument("--activity-retention", type=int, default=None,
+                    help="seconds for which logged out users are listed by whoelsesince (default: forever)")
+parser.add_argument("--metrics-port", type=int, default=None,
+                    help="serve the metrics in plain text over HTTP on this port, one port per worker from it")
+parser.add_argument("--metrics-log", type=float, default=None, metavar="SECONDS",
+                    help="print a line with the main metrics every SECONDS seconds")
+parser.add_argument("--state-dir", default="state",
+                    help="directory of the snapshots and logs of the activity and lockouts (default: state)")
+parser.add_argument("--state-memory", action="store_true",
+                    help="keep the activity of the users and the login lockouts in memory only")
+parser.add_argument("--snapshot-interval", type=float, default=1.0, metavar="SECONDS",
+                    help="interval at which the state logs are written to disk and snapshotted if needed (default: 1)")
+parser.add_argument("--login-workers", type=int, default=DEFAULT_WORKERS,
+                    help=f"threads checking passwords and registering users (default: {DEFAULT_WORKERS})")
+parser.add_argument("--login-queue", type=int, default=DEFAULT_QUEUE_LIMIT,
+                    help=f"logins admitted at a time, further logins are refused (default: {DEFAULT_QUEUE_LIMIT})")
+parser.add_argument("--presence-window", type=float, default=DEFAULT_WINDOW, metavar="SECONDS",
+                    help="seconds over which the changes sent to the presence subscribers are coalesced (default: 0.1)")
+parser.add_argument("--user-rate", type=float, default=0, metavar="TOKENS",
+                    help="tokens per second of the commands of every user, 0 for no limit (default: 0)")
+parser.add_argument("--user-burst", type=float, default=None, metavar="TOKENS",
+                    help="tokens a user may spend at once, at least the highest cost of a command "
+                         "(default: 5 seconds of --user-rate)")
+parser.add_argument("--global-rate", type=float, default=0, metavar="TOKENS",
+                    help="tokens per second of the commands of all the users of a process, beyond which "
+                         "expensive commands are shed, 0 for no limit (default: 0)")
+parser.add_argument("--global-burst", type=float, default=None, metavar="TOKENS",
+                    help="tokens all the users may spend at once, at least the highest cost of a command "
+                         "(default: 5 seconds of --global-rate)")
+parser.add_argument("--rate-policy", choices=RATE_POLICIES, default='delay',
+                    help="handling of the commands of a user over the rate (default: delay them)")
+parser.add_argument("--rate-max-delay", type=float, default=DEFAULT_MAX_DELAY, metavar="SECONDS",
+                    help=f"longest delay of a command, beyond which it is refused (default: {DEFAULT_MAX_DELAY})")
+parser.add_argument("--command-costs", default='', metavar="NAME=COST,...",
+                    help="tokens of the given commands, such as broadcast=10,message=1 (see ratelimit.py)")
+parser.add_argument("--handoff", metavar="PATH", default=None,
+                    help="hand the connections over to a new server connecting to the Unix socket PATH")
+parser.add_argument("--takeover", metavar="PATH", default=None,
+                    help="take the connections over from the server handing them over at the Unix socket PATH")
+args = parser.parse_args()
+if not 0 <= args.node_id < args.cluster_nodes:
+    parser.error("--node-id must be less than --cluster-nodes")
+if (args.handoff or args.takeover) and (args.workers > 1 or args.cluster is not None):
+    parser.error("--handoff and --takeover need a single server process")
+if args.user_rate < 0 or args.global_rate < 0:
+    parser.error("--user-rate and --global-rate must not be negative")
+if (args.user_burst is not None and args.user_burst <= 0) or (args.global_burst is not None and args.global_burst <= 0):
+    parser.error("--user-burst and --global-burst must be positive")
+try:
+    commandCosts = parseCosts(args.command_costs)
+except ValueError as error:
+    parser.error(str(error))
+    
+# Acquire serverPort, serverBlockDuration, and serverTimeout from command line
+# parameter. serverHost have been set to localhost, 127.0.0.1, by default. This
+# may change under different usages.
+serverHost = "127.0.0.1"
+serverPort = args.serverPort
+serverstate.serverBlockDuration = args.blockDuration
+serverstate.serverTimeout = args.timeout
+serverstate.outboundHighWatermark = args.queue_high
+serverstate.outboundLowWatermark = args.queue_low
+serverstate.slowConsumerPolicy = args.slow_policy
+serverAddress = (serverHost, serverPort)
+signal(SIGPIPE, SIG_IGN)
+
+# A server taking over from another one receives its connections before
+# loading any state, which the other server writes to the disk before
+# handing the connections over
+takeover = None
+if args.takeover is not None:
+    takeover = takeOver(args.takeover)
+if args.handoff is not None:
+    serverstate.handoff = HandoffServer(args.handoff)
+
+# The credentials file is loaded once into an index which is kept up to date
+# with the file
+serverstate.credentials = CredentialStore('credentials.txt')
+
+# Blocks between users are kept in a graph which is restored from its log file
+# in the background. A sharded server loads it before forking the workers,
+# which append their own changes to the inherited log file
+serverstate.blockGraph = BlockGraph(args.blocks_file)
+atexit.register(serverstate.blockGraph.close)
+
+# The members of the group channels are restored from their log file in the
+# background the same way, and the online members of every channel are kept
+# up to date from the logins and logouts
+serverstate.channels = ChannelDirectory(serverstate.presence, args.channels_file)
+atexit.register(serverstate.channels.close)
+
+# This function sets up the state of one server process, with its offline
+# messages and its other state in the given directories, and serves the
+# clients with the selected engine. reusePort lets several processes listen on
+# the server port and metricsPort is the HTTP port of the metrics of the
+# process, if any
+def runServer(offlineDirectory, stateDirectory, historyDirectory, reusePort=False, metricsPort=args.metrics_port):
+
+    # Offline messages are queued per recipient and logged to disk so that they
+    # survive a restart of the server
+    offlineMessages = OfflineStore(None if args.offline_memory else offlineDirectory)
+    if serverstate.bus is not None:
+        offlineMessages = PartitionedOfflineStore(offlineMessages, serverstate.bus)
+    serverstate.offlineMessages = offlineMessages
+    serverstate.offlineMessages.start()
+    atexit.register(serverstate.offlineMessages.close)
+
+    # Logins and logouts are indexed by time for whoelsesince, logged out users
+    # are evicted once they are older than the retention period. The index and
+    # the login lockouts are logged to the state directory and snapshotted in
+    # the background, so that they survive a restart of the server
+    activityLog = lockoutLog = None
+    if not args.state_memory:
+        activityLog = SnapshotLog(stateDirectory, 'activity')
+        lockoutLog = SnapshotLog(stateDirectory, 'lockouts')
+    serverstate.activity = ActivityIndex(args.activity_retention, activityLog)
+    serverstate.loginBlockedList = LoginLockouts(lockoutLog, serverstate.serverBlockDuration)
+    serverstate.snapshots = Snapshotter(args.snapshot_interval)
+    serverstate.snapshots.add(serverstate.activity)
+
+    # The users who were logged in when the server stopped are recorded as
+    # logged out unless they come back: the sessions handed over are settled
+    # by the engine once restored, a node of a cluster first waits for the
+    # other nodes to announce their users
+    if takeover is None:
+        settleTimer = threading.Timer(0 if serverstate.bus is None else SETTLE_DELAY, serverstate.activity.settle)
+        settleTimer.daemon = True
+        settleTimer.start()
+    serverstate.snapshots.add(serverstate.loginBlockedList)
+
+    # Messages between users are appended to the history of their conversation,
+    # which is written to the disk with the other state. Every node of a
+    # cluster keeps the messages sent through all the nodes
+    history = HistoryStore(None if args.history_memory else historyDirectory)
+    if serverstate.bus is not None:
+        history = ReplicatedHistoryStore(history, serverstate.bus)
+    serverstate.history = history
+    serverstate.snapshots.add(serverstate.history)
+    atexit.register(serverstate.history.close)
+
+    # The block and channel logs are compacted in the background too, unless
+    # the workers of a sharded server append to them together
+    if args.workers == 1:
+        serverstate.snapshots.add(serverstate.blockGraph)
+        serverstate.snapshots.add(serverstate.channels)
+    serverstate.snapshots.start()
+    atexit.register(serverstate.snapshots.close)
+
+    # Passwords are checked and new users registered by a bounded pool of
+    # workers, which refuses logins beyond its queue so that a burst of logins
+    # never holds up the users already logged in
+    serverstate.loginPool = LoginPool(args.login_workers, args.login_queue, serverstate.metrics)
+
+    # The commands are charged to the rate limits of their user and of the
+    # process when limits are given, so that a few users cannot use up the
+    # server, and expensive commands are shed while the process is overloaded
+    if args.user_rate or args.global_rate:
+        serverstate.rateLimiter = RateLimiter(args.user_rate, args.user_burst, args.global_rate, args.global_burst,
+                                              args.rate_policy, args.rate_max_delay, commandCosts,
+                                              serverstate.metrics)
+
+    # The sessions subscribed to presence receive the changes of the users they
+    # follow once per window instead of a notice for every login and logout
+    serverstate.presenceFeed = PresenceFeed(serverstate.presence, args.presence_window)
+
+    # A single timing wheel times out all the idle sessions instead of one timer
+    # thread per command
+    serverstate.idleTimeouts = TimingWheel(serverstate.serverTimeout, ServerSession.systemTimeOut)
+
+    # The metrics are always counted, and only exposed when asked for
+    startMetrics(metricsPort)
+
+    if args.mode == "async":
+        import asyncserver
+        asyncserver.runAsyncServer(serverHost, serverPort, reusePort, takeover)
+    else:
+        runThreadServer(reusePort)
+
+# This function adds the gauges read from the state of the process to the
+# metrics, and exposes the metrics over HTTP on the given port and in the log
+# as selected on the command line
+def startMetrics(metricsPort):
+    metrics = serverstate.metrics
+    metrics.addGauge('chat_users_online', 'Users logged in to this process or known from other processes',
+                     lambda: len(serverstate.presence))
+    metrics.addGauge('chat_offline_queue_depth', 'Offline messages waiting for their recipients',
+                     lambda: len(serverstate.offlineMessages))
+    metrics.addGauge('chat_login_queue_depth', 'Logins waiting for or being worked on by the authentication pool',
+                     lambda: len(serverstate.loginPool))
+    metrics.addGauge('chat_presence_subscribers', 'Sessions subscribed to the presence feed',
+                     lambda: len(serverstate.presenceFeed))
+    metrics.addGauge('chat_pending_timers', 'Sessions with a pending idle timeout',
+                     serverstate.idleTimeouts.pendingCount)
+    metrics.addGauge('chat_overloaded', 'Whether the process is over its global rate and sheds expensive commands',
+                     lambda: int(serverstate.rateLimiter is not None and serverstate.rateLimiter.isOverloaded()))
+    if metricsPort is not None:
+        metrics.startHttpServer(serverHost, metricsPort)
+    if args.metrics_log:
+        metrics.startLogger(args.metrics_log)
+
+# This function serves the clients with one thread per client
+def runThreadServer(reusePort):
+
+    # Define socket for the server side and bind address for connectivity
+    # purposes, or continue with the socket and the sessions taken over
+    if takeover is None:
+        serverSocket = socket(AF_INET, SOCK_STREAM)
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if reusePort:
+            serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        serverSocket.bind(serverAddress)
+        serverSocket.listen()
+    else:
+        serverSocket = takeover.listenSocket
+        for state, clientSocket in takeover.sessions:
+            clientThread = ClientThread(tuple(state['clientAddress']), clientSocket)
+            clientThread.restoreState(state)
+            clientThread.start()
+        serverstate.activity.settle()
+    serverstate.idleTimeouts.start()
+    serverstate.presenceFeed.start()
+    if serverstate.bus is not None:
+        serverstate.bus.start()
+
+    # A server which may hand its connections over waits for the listening
+    # socket or the start of the handoff, after which it stops accepting
+    poller = None
+    if serverstate.handoff is not None:
+        poller = select.poll()
+        poller.register(serverSocket, select.POLLIN)
+        poller.register(serverstate.handoff.interruptFd, select.POLLIN)
+        serverstate.handoff.start(lambda deadline: prepareHandoff(serverSocket, deadline))
+
+    # Main execution loop of the server
+    while poller is None or all(fd != serverstate.handoff.interruptFd for fd, event in poller.poll()):
+        clientSockt, clientAddress = serverSocket.accept()
+        clientThread = ClientThread(clientAddress, clientSockt)
+        clientThread.start()
+    serverstate.handoff.wait()
+
+# This function stops the thread engine for a handoff: the idle timeouts stop,
+# and the accept loop and every session stop reading. It returns the listening
+# socket and the sessions which have stopped reading before the deadline
+def prepareHandoff(serverSocket, deadline):
+    serverstate.idleTimeouts.stop(wait=True)
+    serverstate.handoff.interrupt()
+    for session in list(liveSessions):
+        session.join(max(0, deadline - time.monotonic()))
+    return serverSocket.fileno(), [session for session in list(liveSessions) if session.interrupted]
+
+# This function runs one node of a cluster, a worker of this server or this
+# server itself, connected to the other nodes through the given PubSub client.
+# Nodes on other machines keep their own files, workers share those of their
+# server
+def runNode(shard, pubsub):
+    node = args.node_id * args.workers + shard
+    serverstate.bus = ShardBus(pubsub, node, args.cluster_nodes * args.workers, sharedFiles=args.cluster is None)
+    metricsPort = None if args.metrics_port is None else args.metrics_port + shard
+    runServer(os.path.join(args.offline_dir, f"shard-{node}"), os.path.join(args.state_dir, f"shard-{node}"),
+              os.path.join(args.history_dir, f"shard-{node}"), args.workers > 1, metricsPort)
+
+if args.workers > 1:
+    serverstate.blockGraph.loaded.wait()
+    serverstate.channels.loaded.wait()
+    runShardedServer(args.workers, runNode, None if args.cluster is None else lambda: connectPubSub(args.cluster))
+elif args.cluster is not None:
+    runNode(0, connectPubSub(args.cluster))
+else:
+    runServer(args.offline_dir, args.state_dir, args.history_dir)
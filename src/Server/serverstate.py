@@ -0,0 +1,107 @@
+"""
+    Python 3
+    Shared server side configuration and data structures. Every server engine
+    (thread per client or asyncio event loop) imports this module so that all
+    sessions operate on the same state regardless of how they are scheduled.
+"""
+from presence import PresenceRegistry
+from metrics import Metrics
+from lockouts import LoginLockouts
+
+'''
+    Server configuration, set by server.py from the command line parameters
+'''
+
+# The number of seconds a user stays blocked after three failed login attempts
+serverBlockDuration = 0
+
+# The number of seconds a user may stay inactive before being timed out
+serverTimeout = 0
+
+# The shared idle timeout scheduler (a TimingWheel, see timingwheel.py) which
+# times out the sessions, created by server.py once the timeout is known
+idleTimeouts = None
+
+# The watermarks in bytes of the outbound queue of every client and the policy
+# applied to a client whose queue is congested: 'drop', 'disconnect' or 'spill'
+outboundHighWatermark = 1024 * 1024
+outboundLowWatermark = 256 * 1024
+slowConsumerPolicy = 'spill'
+
+# The handoff server which hands the connections of this process over to a new
+# server process taking over the port (a HandoffServer, see handoff.py), or
+# None unless enabled on the command line
+handoff = None
+
+# The bus connecting this process to the other processes of a sharded server (a
+# ShardBus, see shardbus.py), or None when the server runs as a single process
+bus = None
+
+# The counters and histograms of this process (a Metrics, see metrics.py),
+# exposed over HTTP and in the log when enabled on the command line
+metrics = Metrics()
+
+# The bounded pool of workers which check passwords and register new users
+# for the sessions (a LoginPool, see loginpool.py), created by server.py
+loginPool = None
+
+# The rate limits of the commands of the users (a RateLimiter, see
+# ratelimit.py), or None unless limits are given on the command line
+rateLimiter = None
+
+# The in-memory index of credentials.txt (a CredentialStore, see
+# credentialstore.py) used to look up users without reading the file
+credentials = None
+
+'''
+    The Definition of server side data structure
+'''
+
+# The loginBlockedList keeps track of the users who have been blocked by the
+# server due to multiple unsuccessful logins, mapping each userName to the time
+# the user had been blocked until the lockout expires. It is a LoginLockouts
+# (see lockouts.py), replaced by server.py with one persisted to the state
+# directory
+loginBlockedList = LoginLockouts()
+
+# The presence registry keeps track of the currently logged in users and their
+# corresponding information. It is a PresenceRegistry (see presence.py) holding a
+# SessionRecord with userName, ipAddress, port, session and p2pPort of each user
+presence = PresenceRegistry()
+
+# The activity index keeps track of the users who are logged in and of the time
+# each other user has last logged out of the server, for whoelsesince. It is an
+# ActivityIndex (see activityindex.py), created by server.py once the retention
+# period of logged out users is known
+activity = None
+
+# The presence feed sends the subscribed sessions the changes of the users
+# they follow, coalesced over a short window, instead of the login and logout
+# notices. It is a PresenceFeed (see presencefeed.py), created by server.py
+presenceFeed = None
+
+# The offlineMessages store keeps track of the offline messages which needs to be
+# send to the corresponding user when the user logs into the system. It is an
+# OfflineStore (see offlinestore.py) holding a queue of messages per recipient,
+# created by server.py
+offlineMessages = None
+
+# The channels keep the members of every group channel and which of them are
+# online, for the join, leave and channel commands. It is a ChannelDirectory
+# (see channels.py) persisted to a log file, created by server.py
+channels = None
+
+# The history keeps every message sent between two users, for the history and
+# search commands. It is a HistoryStore (see historystore.py) holding an
+# append-only log per conversation, created by server.py
+history = None
+
+# The snapshotter writes the logs of the activity index, the login lockouts
+# and the block graph to the disk and snapshots them in the background. It is
+# a Snapshotter (see statestore.py), created by server.py
+snapshots = None
+
+# The blockGraph keeps track of whom had currently blocked each user and whom each
+# user had blocked. It is a BlockGraph (see blockgraph.py) persisted to a log file,
+# created by server.py
+blockGraph = None
@@ -0,0 +1,937 @@
+"""
+    Python 3
+    Transport independent session logic of the server. A ServerSession holds
+    the login procedure and every user command of the messaging application,
+    and leaves reading from and writing to the client to the server engine
+    which subclasses it (see ClientThread in server.py and AsyncClientSession
+    in asyncserver.py).
+"""
+import base64
+from datetime import datetime
+from framing import encodeFrame, FrameError, FrameDecoder
+import serverstate
+import binaryproto
+from binaryproto import FieldReader, BinaryDecoder, BINARY_TOKEN, VERSION, ZLIB
+from presence import SessionRecord
+from wire import Delivery, BinaryCodec, TEXT_CODEC, MESSAGE, BROADCAST, CHANNEL, LOGIN, LOGOUT, restoreCodec
+from channels import channelName
+from ratelimit import REJECTED as RATE_REJECTED, SHED
+
+# The names of the commands of the binary protocol, as counted in the metrics
+BINARY_COMMANDS = {
+    binaryproto.SEND: 'message',
+    binaryproto.SEND_BROADCAST: 'broadcast',
+    binaryproto.WHOELSE: 'whoelse',
+    binaryproto.WHOELSESINCE: 'whoelsesince',
+    binaryproto.BLOCK: 'block',
+    binaryproto.UNBLOCK: 'unblock',
+    binaryproto.STARTPRIVATE: 'startprivate',
+    binaryproto.SEND_RELAY: 'relay',
+    binaryproto.KEEPALIVE: "['0']",
+}
+
+# The results of the check of a password by the authentication pool, and of an
+# input refused because the pool has no room for it
+VALID = 'valid'
+INVALID = 'invalid'
+LOCKED_OUT = 'lockedOut'
+REJECTED = 'rejected'
+
+# The states of private messaging with a peer, as kept by the session of a
+# user: the user has asked the peer, the peer has asked the user, or the
+# request has been accepted
+PRIVATE_ASKING = 'asking'
+PRIVATE_ASKED = 'asked'
+PRIVATE_ACCEPTED = 'accepted'
+
+# The number of messages shown by history by default and at most, and the
+# number of messages found by search
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+SEARCH_RESULTS = 20
+
+# This function returns the line showing a message of the history
+def formatHistory(message):
+    sentAt = datetime.fromtimestamp(message.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    return f"#{message.id} [{sentAt}] {message.sender}: {message.text}\n"
+
+# This function checks the password of the user who is logging in, run by the
+# authentication pool. A user who has been locked out after failed logins is
+# not let in until the lockout expires, even with the right password
+def checkPassword(userName, password):
+    if serverstate.loginBlockedList.blockedTime(userName) is not None:
+        return LOCKED_OUT
+    if serverstate.credentials.verify(userName, password):
+        return VALID
+    return INVALID
+
+# This function queues the delivery for every user logged in to this process except
+# the sender and the users in excluded, or only for those among the given
+# presence records, such as the online members of a channel. Login and logout
+# notices are not queued for the users subscribed to the presence feed, who
+# receive them from the feed. It returns whether any of the users, including
+# those of other processes, is in excluded
+def fanOut(delivery, excluded, sender=None, records=None):
+    ifExcluded = False
+    recipients = 0
+    notice = delivery.kind == LOGIN or delivery.kind == LOGOUT
+    if records is None:
+        records = serverstate.presence.snapshot()
+    for peer in records:
+        if peer.userName in excluded:
+            ifExcluded = True
+        elif peer.session is not sender and not peer.session.remote:
+            if notice and peer.session.followsPresence:
+                continue
+            peer.session.deliverFrame(delivery)
+            recipients += 1
+    metrics = serverstate.metrics
+    metrics.delivered.value += recipients
+    metrics.fanOut.observe(recipients)
+    return ifExcluded
+
+"""
+    Define the session class including all corresponding functionalities of
+    the program on the server side. Subclasses provide sendFrame() and close()
+    for their own transport. Everything sent to the client is encoded by the
+    codec of the session (see wire.py), for the text protocol unless the
+    client has negotiated the binary protocol in its handshake.
+"""
+class ServerSession:
+
+    # Sessions of users connected to another process of a sharded server are
+    # represented by a RemoteSession (see shardbus.py) instead
+    remote = False
+
+    # This is the constructor of a session and will be used to initialise
+    # a session every time a user connects to the server
+    def __init__(self, clientAddress):
+        self.clientAddress = clientAddress
+        self.clientAlive = False
+
+        self.userName = 'userName'
+        self.p2pPort = 0
+        self.codec = TEXT_CODEC
+        self.handshaken = False
+
+        # Whether the session has been handed over by another server process
+        # (see handoff.py) rather than started by the client connecting
+        self.resumed = False
+
+        # The login procedure is driven by the input of the client. loginState
+        # would be one of 'userName', 'password', 'newPassword', 'done' or 'closed'
+        self.loginState = 'userName'
+        self.loginAttempts = 0
+        self.pendingUserName = None
+
+        # Whether the session is subscribed to the presence feed (see
+        # presencefeed.py) instead of receiving the login and logout notices
+        self.followsPresence = False
+
+        # The state of private messaging with every peer the user has asked or
+        # has been asked by, so that frames of private messaging are only
+        # relayed once a request has been accepted
+        self.privateSessions = {}
+
+    """
+        Transport APIs which need to be implemented by each server engine.
+    """
+
+    # This function sends the given frame, encoded by the codec, to the client
+    def sendFrame(self, frame):
+        raise NotImplementedError
+
+    # This function closes the connection to the client
+    def close(self):
+        raise NotImplementedError
+
+    # This function decodes the rest of the input of the client with the given
+    # decoder, once the binary protocol has been negotiated
+    def setDecoder(self, decoder):
+        raise NotImplementedError
+
+    # This function blocks until the messages sent to the client have been
+    # mostly written, used to pace long deliveries
+    def waitForRoom(self):
+        pass
+
+    # This function returns the file descriptor of the connection, the decoder
+    # of its input and the bytes received which the decoder has not been fed
+    # yet, once reading has stopped for a handoff to another server
+    def handoffTransport(self):
+        raise NotImplementedError
+
+    # This function delivers a message of another user, a Delivery (see
+    # wire.py), to the client. Unlike send(), a delivery may be dropped,
+    # spilled to the offline store or close the connection if the client does
+    # not keep up with its messages
+    def deliver(self, delivery):
+        serverstate.metrics.delivered.value += 1
+        self.deliverFrame(delivery)
+
+    # This function delivers a message without counting it, so that the same
+    # immutable Delivery can be shared by many recipients
+    def deliverFrame(self, delivery):
+        raise NotImplementedError
+
+    """
+        Encoding of what is sent to the client by the codec of the session.
+    """
+
+    # This function sends the given text to the client. Like a send of zero
+    # bytes, an empty text sends nothing
+    def send(self, text):
+        if text:
+            self.sendFrame(self.codec.text(text))
+
+    # This function sends the given list of user names to the client
+    def sendUsers(self, userNames):
+        frame = self.codec.users(userNames)
+        if frame is not None:
+            self.sendFrame(frame)
+
+    # This function asks the client to start private messaging with the peer,
+    # listening on the given address and port. userName is the user of this
+    # session and initiator whether the client initiates the connection. A
+    # session accepted before between them ends, until accepted again
+    def sendTarget(self, peerName, address, port, userName, initiator):
+        self.privateSessions[peerName] = PRIVATE_ASKING if initiator else PRIVATE_ASKED
+        self.sendFrame(self.codec.target(peerName, address, port, userName, initiator))
+
+    # This function sends the client a frame of private messaging relayed from
+    # the sender
+    def sendRelay(self, sender, text):
+        self.sendFrame(self.codec.relay(sender, text))
+
+    # This function sends the given text and tells the client that the session
+    # is over
+    def sendExit(self, text):
+        self.sendFrame(self.codec.exit(text))
+
+    # This function closes the connection of a client which does not keep up
+    # with its messages
+    def disconnectSlowConsumer(self):
+        self.close()
+
+    # This function keeps a message which could not be queued for the client
+    # because it does not keep up, in the offline store of the user
+    def spillMessage(self, text):
+        serverstate.offlineMessages.enqueue(self.userName, text)
+
+    # This function takes up to count messages spilled to the offline store back
+    # for delivery to the client
+    def recoverSpilledMessages(self, count):
+        return serverstate.offlineMessages.takeBatch(self.userName, count)
+
+    """
+        Dispatch of the data received from the client.
+    """
+
+    # This function processes the p2pPort handshake which is the first data a
+    # client sends after connecting to the server. A client asking for the
+    # binary protocol is answered in the text protocol, and both sides switch
+    # to the binary protocol right after the answer
+    def processHandshake(self, data):
+        words = data.split()
+        if len(words) < 2:
+            raise FrameError("invalid handshake")
+        self.p2pPort = words[1]
+        self.handshaken = True
+        if len(words) > 2 and words[2] == BINARY_TOKEN:
+            compress = ZLIB in words[3:]
+            self.codec = BinaryCodec(compress)
+            self.sendFrame(encodeFrame(f"{BINARY_TOKEN} {VERSION}" + (f" {ZLIB}" if compress else '')))
+            self.setDecoder(BinaryDecoder(keepWindow=True))
+
+    # This function returns the text of a frame received during the login
+    # procedure, which a client of the binary protocol sends as TEXT frames
+    def inputText(self, payload):
+        if not self.codec.binary:
+            return payload.decode()
+        if not payload or payload[0] != binaryproto.TEXT:
+            raise FrameError("unexpected frame during the login")
+        return FieldReader(payload).string()
+
+    # This function charges a command received from a logged in client to the
+    # rate limits, and returns the seconds for which the engine delays it or
+    # None if it is refused, the client being told why
+    def admitCommand(self, payload):
+        limiter = serverstate.rateLimiter
+        if limiter is None:
+            return 0.0
+        verdict, wait = limiter.admit(self.userName, self.commandName(payload))
+        if verdict == RATE_REJECTED:
+            self.send("Error. Too many commands. Please slow down\n")
+            return None
+        if verdict == SHED:
+            self.send("Error. The server is busy. Please try again later\n")
+            return None
+        return wait
+
+    # This function returns the name of the command in a frame received from a
+    # logged in client, as counted in the metrics
+    def commandName(self, payload):
+        if not payload:
+            return ''
+        if self.codec.binary:
+            if payload[0] != binaryproto.TEXT:
+                return BINARY_COMMANDS.get(payload[0], 'invalid')
+            try:
+                payload = FieldReader(payload).string()
+            except (FrameError, UnicodeDecodeError):
+                return 'invalid'
+        words = payload.split(None, 1)
+        if not words:
+            return ''
+        return words[0] if isinstance(words[0], str) else words[0].decode(errors='replace')
+
+    # This function processes one frame received from a logged in client
+    def handleInput(self, payload):
+        if self.codec.binary:
+            self.handleBinaryCommand(payload)
+            return
+        try:
+            command = payload.decode()
+        except UnicodeDecodeError:
+            self.send("Error. Invalid command\n")
+            return
+        self.handleCommand(command)
+
+    # This function starts the login procedure by prompting for the user name
+    def startLogin(self):
+        self.send("Username: ")
+
+    # This function returns whether the login procedure is still in progress
+    def isLoggingIn(self):
+        return self.loginState not in ('done', 'closed')
+
+    # This function returns the work needed by one input of the client during
+    # the login procedure, as a function and its arguments to be run by the
+    # authentication pool (see loginpool.py), or None if the input needs none
+    def loginWork(self, data):
+        if self.loginState == 'password':
+            return (checkPassword, self.pendingUserName, data)
+        if self.loginState == 'newPassword' and data:
+            return (self.addNewCredentials, self.pendingUserName, data)
+        return None
+
+    # This function runs the work of an input during the login procedure on the
+    # authentication pool, blocking until it is done, and returns its result or
+    # REJECTED if the pool has no room for it
+    def authenticate(self, work):
+        if work is None:
+            return None
+        future = serverstate.loginPool.submit(*work)
+        if future is None:
+            return REJECTED
+        return future.result()
+
+    # This function processes one input of the client during the login procedure,
+    # inlcuding both existing user login and new user registration for the server.
+    # result is the result of the work of the input (see loginWork())
+    def handleLoginInput(self, data, result=None):
+        if result is REJECTED:
+            serverstate.metrics.loginFailures.inc()
+            self.sendExit("The server is busy logging other users in. Please try again later\n")
+            self.loginState = 'closed'
+            self.close()
+        elif self.loginState == 'userName':
+            if not data:
+                self.send("Invalid username. Please try again\nUsername: ")
+            elif self.checkIfAlreadyLoggedIn(data):
+                self.send("This user is currently active. Please login with another user\nUsername: ")
+            elif self.checkUsers(data):
+                self.pendingUserName = data
+                self.loginState = 'password'
+                self.send("Password: ")
+            else:
+                self.pendingUserName = data
+                self.loginState = 'newPassword'
+                self.send("This is a new user. Enter a password: ")
+        elif self.loginState == 'password':
+            userName = self.pendingUserName
+            self.loginAttempts += 1
+            if result == LOCKED_OUT:
+                serverstate.metrics.loginFailures.inc()
+                self.sendExit("Your account is blocked due to multiple login failures. Please try again later\n")
+                self.loginState = 'closed'
+                self.close()
+                return
+            if result == VALID:
+                self.completeLogin(userName)
+                return
+            serverstate.metrics.loginFailures.inc()
+            if self.loginAttempts < 3:
+                self.send("Invalid Password. Please try again\nPassword: ")
+            else:
+                self.sendExit("Invalid Password. Your account has been blocked. Please try again later\n")
+                serverstate.loginBlockedList.add(userName, datetime.now())
+                if serverstate.bus is not None:
+                    serverstate.bus.publishLockout(userName)
+                self.loginState = 'closed'
+                self.close()
+        elif self.loginState == 'newPassword':
+            if not data:
+                self.send("Invalid password. Please try again\nThis is a new user. Enter a password: ")
+            else:
+                self.completeLogin(self.pendingUserName)
+
+    # This function logs the user onto the system once the user has been
+    # authenticated or registered
+    def completeLogin(self, userName):
+        if not serverstate.presence.login(SessionRecord(userName, self.clientAddress[0], self.clientAddress[1], self, self.p2pPort)):
+            self.loginState = 'userName'
+            self.loginAttempts = 0
+            self.send("This user is currently active. Please login with another user\nUsername: ")
+            return
+        serverstate.metrics.logins.inc()
+        self.userName = userName
+        self.loginState = 'done'
+        self.sendFrame(self.codec.welcome(userName, "Welcome to the greatest messaging application ever!\n"))
+        self.broadcast(LOGIN)
+        self.updateActivityList(self.userName)
+        self.clientAlive = True
+        self.recordActivity()
+        self.loadCachedMessage()
+
+    # This function processes one command of a logged in client, recording it in
+    # the metrics so that the frames it queues are timed from now
+    def handleCommand(self, data):
+        message = data.split()
+        serverstate.metrics.commandStarted(message[0] if message else '')
+        try:
+            self.dispatchCommand(message)
+        finally:
+            serverstate.metrics.commandFinished()
+
+    # This function dispatches one command, split into words, and acts
+    # correspondingly. As with the timer of the original server, only valid
+    # commands record activity of the client: invalid commands and commands
+    # failing with an error do not postpone its idle timeout
+    def dispatchCommand(self, message):
+        if not message:
+            self.send("Error. Invalid command\n")
+        elif message[0] == 'message' and len(message) >= 2:
+            self.message(message[1], ' '.join(message[2:]))
+        elif message[0] == 'broadcast':
+            self.recordActivity()
+            self.broadcast(BROADCAST, ' '.join(message[1:]))
+        elif message[0] == 'whoelse':
+            self.recordActivity()
+            self.sendUsers(self.listAllCurrentUsers())
+        elif message[0] == 'whoelsesince' and len(message) == 2 and message[1].isdigit():
+            self.recordActivity()
+            self.sendUsers(self.listAllUserSince(int(message[1])))
+        elif message[0] == 'block' and len(message) == 2:
+            self.blockUser(message[1])
+        elif message[0] == 'unblock' and len(message) == 2:
+            self.unblockUser(message[1])
+        elif message[0] == 'startprivate' and len(message) == 2:
+            self.startPrivateMessaging(message[1])
+        elif message[0] == 'acceptprivate' and len(message) == 2:
+            self.answerPrivateMessaging(message[1], True)
+        elif message[0] == 'declineprivate' and len(message) == 2:
+            self.answerPrivateMessaging(message[1], False)
+        elif message[0] == 'relay' and len(message) >= 3:
+            self.relayPrivate(message[1], ' '.join(message[2:]))
+        elif message[0] == 'subscribe':
+            self.subscribePresence(message[1:])
+        elif message[0] == 'unsubscribe' and len(message) == 1:
+            self.unsubscribePresence()
+        elif message[0] == 'join' and len(message) == 2:
+            self.joinChannel(message[1])
+        elif message[0] == 'leave' and len(message) == 2:
+            self.leaveChannel(message[1])
+        elif message[0] == 'channel' and len(message) >= 2:
+            self.channelMessage(message[1], ' '.join(message[2:]))
+        elif message[0] == 'history' and 2 <= len(message) <= 4 and all(word.isdigit() for word in message[2:]):
+            self.showHistory(message[1], *map(int, message[2:]))
+        elif message[0] == 'search' and len(message) >= 2:
+            self.searchHistory(message[1:])
+        elif message[0] == "['0']":
+            self.recordActivity()
+        else:
+            self.send("Error. Invalid command\n")
+
+    # This function processes one command of a logged in client of the binary
+    # protocol. A TEXT frame holds a command in the text protocol
+    def handleBinaryCommand(self, body):
+        if not body:
+            self.send("Error. Invalid command\n")
+            return
+        opcode = body[0]
+        if opcode == binaryproto.TEXT:
+            try:
+                command = FieldReader(body).string()
+            except (FrameError, UnicodeDecodeError):
+                self.send("Error. Invalid command\n")
+                return
+            self.handleCommand(command)
+            return
+        serverstate.metrics.commandStarted(BINARY_COMMANDS.get(opcode, 'invalid'))
+        try:
+            self.dispatchBinaryCommand(opcode, FieldReader(body))
+        except (FrameError, UnicodeDecodeError):
+            self.send("Error. Invalid command\n")
+        finally:
+            serverstate.metrics.commandFinished()
+
+    # This function dispatches one command of the binary protocol, reading its
+    # fields from the given FieldReader, and acts correspondingly. Only valid
+    # commands record activity, as for the text protocol
+    def dispatchBinaryCommand(self, opcode, fields):
+        if opcode == binaryproto.SEND:
+            toUser = fields.string()
+            self.message(toUser, fields.string())
+        elif opcode == binaryproto.SEND_BROADCAST:
+            self.recordActivity()
+            self.broadcast(BROADCAST, fields.string())
+        elif opcode == binaryproto.WHOELSE:
+            self.recordActivity()
+            self.sendUsers(self.listAllCurrentUsers())
+        elif opcode == binaryproto.WHOELSESINCE:
+            self.recordActivity()
+            self.sendUsers(self.listAllUserSince(fields.varint()))
+        elif opcode == binaryproto.BLOCK:
+            self.blockUser(fields.string())
+        elif opcode == binaryproto.UNBLOCK:
+            self.unblockUser(fields.string())
+        elif opcode == binaryproto.STARTPRIVATE:
+            self.startPrivateMessaging(fields.string())
+        elif opcode == binaryproto.SEND_RELAY:
+            peer = fields.string()
+            self.relayPrivate(peer, fields.string())
+        elif opcode == binaryproto.KEEPALIVE:
+            self.recordActivity()
+        else:
+            self.send("Error. Invalid command\n")
+
+    # This function processes the disconnection of a logged in client, logs the
+    # user out and notifies the other users. A session which has already been
+    # logged out by the server is only closed, even if the user has logged in
+    # again with another session meanwhile
+    def handleDisconnect(self):
+        self.clientAlive = False
+        if self.loginState == 'closed':
+            self.close()
+            return
+        self.loginState = 'closed'
+        if serverstate.idleTimeouts is not None:
+            serverstate.idleTimeouts.cancel(self)
+        self.logoutSession()
+        self.close()
+
+    """
+        Handoff of the session to another server process (see handoff.py).
+    """
+
+    # This function returns the file descriptor of the connection and the
+    # state of the session, which another server process continues the
+    # session from without the client noticing
+    def handoffState(self):
+        fd, decoder, unread = self.handoffTransport()
+        window = getattr(decoder, 'window', None)
+        idleRemaining = None
+        if self.loginState == 'done' and serverstate.idleTimeouts is not None:
+            idleRemaining = serverstate.idleTimeouts.remaining(self)
+        return fd, {
+            'clientAddress': list(self.clientAddress),
+            'p2pPort': self.p2pPort,
+            'handshaken': self.handshaken,
+            'userName': self.userName,
+            'loginState': self.loginState,
+            'loginAttempts': self.loginAttempts,
+            'pendingUserName': self.pendingUserName,
+            'idleRemaining': idleRemaining,
+            'follows': serverstate.presenceFeed.follows(self),
+            'privateSessions': self.privateSessions,
+            'rateTokens': self.rateTokens(),
+            'codec': self.codec.handoffState(),
+            'unread': base64.b64encode(bytes(decoder.buffer) + unread).decode(),
+            'window': None if window is None else base64.b64encode(window).decode(),
+        }
+
+    # This function returns the tokens left to the user in its rate limit
+    # bucket, or None if the user has none
+    def rateTokens(self):
+        if self.loginState != 'done' or serverstate.rateLimiter is None:
+            return None
+        return serverstate.rateLimiter.userTokens(self.userName)
+
+    # This function continues the session handed over with the given state and
+    # returns the decoder of the rest of the input. A logged in user is put
+    # back online without notifying the other users, who never saw the user
+    # leave
+    def restoreState(self, state):
+        self.resumed = True
+        self.p2pPort = state['p2pPort']
+        self.handshaken = state['handshaken']
+        self.userName = state['userName']
+        self.loginState = state['loginState']
+        self.loginAttempts = state['loginAttempts']
+        self.pendingUserName = state['pendingUserName']
+        self.privateSessions = state.get('privateSessions', {})
+        self.codec = restoreCodec(state['codec'])
+        if self.codec.binary:
+            window = state['window']
+            decoder = BinaryDecoder(keepWindow=True, window=None if window is None else base64.b64decode(window))
+        else:
+            decoder = FrameDecoder()
+        decoder.buffer += base64.b64decode(state['unread'])
+        if self.loginState == 'done':
+            serverstate.presence.login(SessionRecord(self.userName, self.clientAddress[0], self.clientAddress[1],
+                                                     self, self.p2pPort))
+            self.updateActivityList(self.userName)
+            self.clientAlive = True
+            if state['idleRemaining'] is not None:
+                serverstate.idleTimeouts.restore(self, state['idleRemaining'])
+            follows = state.get('follows')
+            if follows is not None:
+                serverstate.presenceFeed.subscribe(self, None if follows is True else follows)
+            rateTokens = state.get('rateTokens')
+            if rateTokens is not None and serverstate.rateLimiter is not None:
+                serverstate.rateLimiter.restoreUserTokens(self.userName, rateTokens)
+        return decoder
+
+    """
+        Customized APIs for the server to utilise for different operations.
+    """
+
+    # This function takes in the user name of a user and tries to start p2p
+    # messaging between the user and the client by sending user connection info
+    # and signal to the client to initiate p2p session. If the client is trying
+    # to start a p2p session with himself or the user is not registered with the
+    # system or the user is not online or the client have been blocked by the user,
+    # an error would occur and the client will be notified by the server.
+    def startPrivateMessaging(self, user):
+        if user == self.userName:
+            self.send("Error. Cannot privately message self\n")
+        elif self.checkUsers(user):
+            self.recordActivity()
+            peer = serverstate.presence.lookup(user)
+            if peer is None:
+                self.send("Error. User is not online\n")
+            elif self.checkIfUserBeenBlocked(peer.userName, self.userName):
+                self.send(f"Error. You can not privately message {user} as the recipient has blocked you\n")
+            else:
+                self.send(f"Start private messaging with {user}\n")
+                self.sendTarget(peer.userName, peer.ipAddress, peer.p2pPort, self.userName, True)
+                peer.session.sendTarget(self.userName, self.clientAddress[0], self.p2pPort, peer.userName, False)
+        else:
+            self.send("Error. Invaid user\n")
+
+    # This function records the answer of the client to the request of the
+    # given user to start private messaging, and passes it on to the session
+    # of that user
+    def answerPrivateMessaging(self, user, accepted):
+        if self.privateSessions.get(user) != PRIVATE_ASKED:
+            self.send(f"Error. {user} has not asked to private message\n")
+            return
+        self.recordActivity()
+        if accepted:
+            self.privateSessions[user] = PRIVATE_ACCEPTED
+        else:
+            del self.privateSessions[user]
+        peer = serverstate.presence.lookup(user)
+        if peer is not None:
+            peer.session.updatePrivatePeer(self.userName, accepted)
+
+    # This function records the answer of the peer asked by the user to start
+    # private messaging: accepted, or not once the peer has declined it or
+    # logged out, which ends private messaging with the peer
+    def updatePrivatePeer(self, peerName, accepted):
+        if not accepted:
+            self.privateSessions.pop(peerName, None)
+        elif self.privateSessions.get(peerName) == PRIVATE_ASKING:
+            self.privateSessions[peerName] = PRIVATE_ACCEPTED
+
+    # This function relays a frame of private messaging to the given user, for
+    # clients which cannot connect to each other directly. The user must be
+    # online and must not have blocked the client, and the request of one of
+    # them to start private messaging must have been accepted, or be answered
+    # by the frame. Otherwise the user is treated as unknown
+    def relayPrivate(self, user, text):
+        peer = serverstate.presence.lookup(user)
+        if peer is None or self.privateSessions.get(user) not in (PRIVATE_ASKED, PRIVATE_ACCEPTED):
+            self.send(f"Error. Cannot relay private messages to {user}\n")
+        elif self.checkIfUserBeenBlocked(peer.userName, self.userName):
+            self.send(f"Error. You can not privately message {user} as the recipient has blocked you\n")
+        else:
+            self.recordActivity()
+            peer.session.sendRelay(self.userName, text)
+
+    # This function takes in the user name of a user and unblocks the user
+    # from not being able to send message to the client or receive notification
+    # from the client. If the client tries to unblock himself or a user that has
+    # not been registered with the system, an error would return to the client.
+    # If the given user have not been blocked, an error would raise and the client
+    # woud be notified.
+    def unblockUser(self, user):
+        if user == self.userName:
+            self.send("Error. Cannot unblock self\n")
+        elif (self.checkUsers(user)):
+            self.recordActivity()
+            if serverstate.blockGraph.unblock(self.userName, user):
+                self.send(f"{user} is unblocked\n")
+            else:
+                self.send(f"Error. {user} was not blocked\n")
+        else:
+            self.send("Error. Invalid user\n")
+
+    # This function takes in the user name of a user and blocks the user from
+    # being able to send messages to the client or receive notification from
+    # client. If the client tries to block himself or a user that has not been
+    # registered with the system, an error message would return to the client.
+    # If the user has already been blocked, the user would be notified.
+    def blockUser(self, user):
+        if user == self.userName:
+            self.send("Error. Cannot block self\n")
+        elif (self.checkUsers(user)):
+            self.recordActivity()
+            if serverstate.blockGraph.block(self.userName, user):
+                self.send(f"{user} is blocked\n")
+            else:
+                self.send(f"Error. {user} has already been blocked\n")
+        else:
+            self.send("Error. Invalid user\n")
+
+    # This function takes in the user who the message would be sent to and the
+    # message itself, and sends the message to the corresponding user if the
+    # user is online. If the user has blocked the client or the user does not
+    # exist, an error occurs. If the user is not currently online, the message
+    # will be cached in the server and be sent to the user once the user logs
+    # onto the system
+    def message(self, toUser, body):
+        if toUser == self.userName:
+            self.send("Error. Cannot send message to your self\n")
+        elif (self.checkUsers(toUser)):
+            self.recordActivity()
+            if (self.checkIfUserBeenBlocked(toUser, self.userName)):
+                self.send("Your message could not be delivered as the recipient has blocked you\n")
+            else:
+                peer = serverstate.presence.lookup(toUser)
+                message = Delivery(MESSAGE, self.userName, body)
+                if peer is not None:
+                    peer.session.deliver(message)
+                else:
+                    serverstate.offlineMessages.enqueue(toUser, message.text())
+                    serverstate.metrics.queuedOffline.inc()
+                if serverstate.history is not None:
+                    serverstate.history.append(self.userName, toUser, body)
+        else:
+            self.send("Error. Invalid user\n")
+
+    # This function subscribes the client to the presence feed for the given
+    # users, or for all the users if none are given. The client receives the
+    # online users it follows with the version of the feed, then the changes
+    # of those users instead of the login and logout notices
+    def subscribePresence(self, users):
+        for user in users:
+            if user == self.userName:
+                self.send("Error. Cannot follow your self\n")
+                return
+            if not self.checkUsers(user):
+                self.send("Error. Invalid user\n")
+                return
+        self.recordActivity()
+        serverstate.presenceFeed.subscribe(self, users or None)
+
+    # This function ends the subscription of the client to the presence feed,
+    # after which it receives the login and logout notices again
+    def unsubscribePresence(self):
+        self.recordActivity()
+        if serverstate.presenceFeed.unsubscribe(self):
+            self.send("Unsubscribed from presence\n")
+        else:
+            self.send("Error. You are not subscribed to presence\n")
+
+    # This function adds the client to the members of the given channel, which
+    # is created by its first member
+    def joinChannel(self, name):
+        channel = channelName(name)
+        if channel is None:
+            self.send("Error. Invalid channel name\n")
+            return
+        self.recordActivity()
+        if serverstate.channels.join(channel, self.userName):
+            self.send(f"You have joined #{channel}\n")
+        else:
+            self.send(f"Error. You have already joined #{channel}\n")
+
+    # This function removes the client from the members of the given channel
+    def leaveChannel(self, name):
+        channel = channelName(name)
+        if channel is None:
+            self.send("Error. Invalid channel name\n")
+            return
+        self.recordActivity()
+        if serverstate.channels.leave(channel, self.userName):
+            self.send(f"You have left #{channel}\n")
+        else:
+            self.send(f"Error. You have not joined #{channel}\n")
+
+    # This function sends a message of the client to the other members of a
+    # channel the client has joined. The message is fanned out over the online
+    # members of the channel only, filtered against the block sets of the
+    # client like a broadcast, and queued in the offline store for the members
+    # who are offline. On a sharded server the message is also published once
+    # to the other processes
+    def channelMessage(self, name, body):
+        channel = channelName(name)
+        if channel is None:
+            self.send("Error. Invalid channel name\n")
+        elif not serverstate.channels.isMember(channel, self.userName):
+            self.send(f"Error. You have not joined #{channel}\n")
+        else:
+            self.recordActivity()
+            excluded = serverstate.blockGraph.blockersOf(self.userName)
+            delivery = Delivery(CHANNEL, self.userName, body, channel)
+            ifBeingBlocked = fanOut(delivery, excluded, self, serverstate.channels.onlineMembers(channel))
+            if serverstate.bus is not None:
+                serverstate.bus.publishChannel(channel, self.userName, body)
+            text = None
+            for userName in serverstate.channels.offlineMembers(channel):
+                if userName in excluded:
+                    ifBeingBlocked = True
+                    continue
+                if text is None:
+                    text = delivery.text()
+                serverstate.offlineMessages.enqueue(userName, text)
+                serverstate.metrics.queuedOffline.inc()
+            if ifBeingBlocked:
+                self.send("Your message could not be delivered to some recipients\n")
+
+    # This function sends the client a page of the messages between the client
+    # and the given user: the latest limit messages numbered below beforeId,
+    # or the latest ones. Every message shows its number, which the client
+    # gives as beforeId to page further back
+    def showHistory(self, user, beforeId=None, limit=HISTORY_PAGE_SIZE):
+        if user == self.userName:
+            self.send("Error. Cannot show the history with your self\n")
+        elif self.checkUsers(user):
+            self.recordActivity()
+            messages = serverstate.history.page(self.userName, user, beforeId, min(limit, HISTORY_MAX_PAGE_SIZE))
+            if messages:
+                self.send(''.join(formatHistory(message) for message in messages))
+            else:
+                self.send(f"No messages with {user}\n")
+        else:
+            self.send("Error. Invalid user\n")
+
+    # This function sends the client the latest messages of its conversations
+    # containing every given word
+    def searchHistory(self, words):
+        self.recordActivity()
+        results = serverstate.history.search(self.userName, words, SEARCH_RESULTS)
+        if results is None:
+            self.send("Error. The history is still being loaded. Please try again later\n")
+        elif results:
+            self.send(''.join(f"with {peer} " + formatHistory(message) for peer, message in results))
+        else:
+            self.send(f"No messages matching {' '.join(words)}\n")
+
+    # This function lists all the users who has logged into the system since
+    # the given time, excluding those who have blocked the client for the
+    # whoelsesince functionality
+    def listAllUserSince(self, time):
+        blockers = serverstate.blockGraph.blockersOf(self.userName)
+        return [userName for userName in serverstate.activity.since(time)
+                if userName not in blockers and userName != self.userName]
+
+    # This function lists all the currently active user who has not currently
+    # blocked the client for the whoelse functionality
+    def listAllCurrentUsers(self):
+        blockers = serverstate.blockGraph.blockersOf(self.userName)
+        return [peer.userName for peer in serverstate.presence.snapshot()
+                if peer.userName not in blockers and peer.session != self]
+
+    # This function processes the timeout functionality of the server, sends the
+    # timeout signal to the client to initiate an active logout by the client
+    def systemTimeOut(self):
+        self.sendExit("You have been timed out due to inactivity for a long period of time. Please re-login later\n")
+        self.logoutSession()
+
+    # This function logs the user of the session out and notifies the other
+    # users, unless the user is no longer logged in with this session
+    def logoutSession(self):
+        if serverstate.presence.logout(self.userName, self) is None:
+            return
+        self.updateActivityListLogout(self.userName)
+        self.broadcast(LOGOUT)
+        for peerName in list(self.privateSessions):
+            peer = serverstate.presence.lookup(peerName)
+            if peer is not None:
+                peer.session.updatePrivatePeer(self.userName, False)
+        self.privateSessions.clear()
+
+    # This function processes the broadcase operation of the server, broadcasting
+    # a message of the user, or the login or logout notice of the user, to all
+    # the currently active users. The message is encoded once and the same
+    # Delivery is queued for every recipient, and the recipients are filtered
+    # against the block sets of the client. On a sharded server the message is
+    # also published once to the other processes
+    def broadcast(self, kind, body=''):
+        if kind == BROADCAST:
+            excluded = serverstate.blockGraph.blockersOf(self.userName)
+        else:
+            excluded = serverstate.blockGraph.blockedBy(self.userName)
+        ifBeingBlocked = fanOut(Delivery(kind, self.userName, body), excluded, self)
+        if serverstate.bus is not None:
+            serverstate.bus.publishBroadcast(kind, self.userName, body)
+        if kind == BROADCAST and ifBeingBlocked:
+            self.send("Your message could not be delivered to some recipients\n")
+
+    """
+        Helper Functions utilised on the server.
+    """
+
+    # This function records activity of the client, postponing the idle
+    # timeout of the session in the shared timing wheel
+    def recordActivity(self):
+        if serverstate.idleTimeouts is not None:
+            serverstate.idleTimeouts.touch(self)
+
+    # This functions sends all the unread message (messages being sent to the
+    # user when the user is not currently active on the system) to the client,
+    # taking them from the offline store in batches
+    def loadCachedMessage(self):
+        for batch in serverstate.offlineMessages.drainBatches(self.userName):
+            for message in batch:
+                self.send(message)
+            self.waitForRoom()
+
+    # This function takes in two users, userA and userB and verifies if userB
+    # has been blocked by userA.
+    def checkIfUserBeenBlocked(self, userA, userB):
+        return serverstate.blockGraph.hasBlocked(userA, userB)
+
+    # This function updates the activity index, which keeps track of the time
+    # when a user has logged out of the system, for listing users who have
+    # logged in since a particular time functionality
+    def updateActivityListLogout(self, userName):
+        serverstate.activity.logout(userName)
+
+    # This function updates the activity index, which keeps track of the users
+    # who are logged into the system, for listing users who have logged in
+    # since a particular time functionality
+    def updateActivityList(self, userName):
+        serverstate.activity.login(userName)
+
+    # This function checks the credential index to see if the user is a valid
+    # user/ has been registered in the system
+    def checkUsers(self, userName):
+        return serverstate.credentials.exists(userName)
+
+    # This function looks up the presence registry, which keeps track of the
+    # active users, and checks if a users has been succfully logged into the
+    # application
+    def checkIfAlreadyLoggedIn(self, userName):
+        return serverstate.presence.isOnline(userName)
+
+    # This function adds the user name and password of a newly registered user
+    # into the credential index and the end of the credentials file
+    def addNewCredentials(self, userName, password):
+        serverstate.credentials.add(userName, password)
+        serverstate.metrics.registrations.inc()
+        if serverstate.bus is not None:
+            serverstate.bus.publishRegister(userName, password)
@@ -0,0 +1,541 @@
+"""
+    Python 3
+    Message bus of a server cluster. Every node of the cluster, a worker
+    process of a server started with --workers or a server started with
+    --cluster, is connected to the other nodes through a publish/subscribe
+    client (see pubsub.py). Presence, blocks, channel memberships,
+    registrations, activity and login lockouts are published to every node
+    so that they are looked up locally. Broadcasts and channel messages are
+    published once to every node, which fans them out to its own users.
+    Users logged in to another node are represented by a RemoteSession which
+    publishes what is sent to them to the topic of that node only. Offline
+    messages are partitioned, every node owning the queues of the recipients
+    hashed to it. Every node keeps the whole message history, the messages
+    of each conversation being appended in the order of the node owning it.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import zlib
+from datetime import datetime
+import serverstate
+from presence import SessionRecord
+from session import fanOut
+from historystore import conversationKey
+import wire
+from wire import Delivery
+from pubsub import StreamPubSub, PubSubBroker
+
+# The topic every node subscribes to, and the topic of each single node
+ALL_NODES = 'all'
+NODE_TOPIC = 'node.{}'
+
+# The kinds of the messages on the bus. Every message is a JSON array whose
+# first element is its kind
+LOGIN = 'login'
+LOGOUT = 'logout'
+DELIVER = 'deliver'
+SEND = 'send'
+BROADCAST = 'broadcast'
+TARGET = 'target'
+RELAY = 'relay'
+PRIVATE = 'private'
+BLOCKS = 'blocks'
+CHANNEL = 'channel'
+CHANNELS = 'channels'
+REGISTER = 'register'
+LOCKOUT = 'lockout'
+OFFLINE = 'offline'
+DRAIN = 'drain'
+HISTORY = 'history'
+SYNC = 'sync'
+LEFT = 'left'
+
+# This function returns the node owning the offline messages of the user. A
+# CRC is used rather than hash() so that the owner stays the same across
+# restarts of the server
+def ownerOf(userName, nodeCount):
+    return zlib.crc32(userName.encode()) % nodeCount
+
+"""
+    Define the session of a user logged in to another node. Everything sent
+    or delivered to it is published to the topic of that node.
+"""
+class RemoteSession:
+    remote = True
+
+    # This is the constructor of the session of the given user and node
+    def __init__(self, bus, userName, node):
+        self.bus = bus
+        self.userName = userName
+        self.node = node
+
+    # This function sends the given text to the user
+    def send(self, text):
+        self.bus.publishTo(self.node, [SEND, self.userName, text])
+
+    # This function asks the user to start private messaging with the peer
+    def sendTarget(self, peerName, address, port, userName, initiator):
+        self.bus.publishTo(self.node, [TARGET, userName, peerName, address, port, initiator])
+
+    # This function relays a frame of private messaging from the sender
+    def sendRelay(self, sender, text):
+        self.bus.publishTo(self.node, [RELAY, self.userName, sender, text])
+
+    # This function records the answer of the peer asked by the user to start
+    # private messaging
+    def updatePrivatePeer(self, peerName, accepted):
+        self.bus.publishTo(self.node, [PRIVATE, self.userName, peerName, accepted])
+
+    # This function delivers a message of another user, a Delivery, to the user
+    def deliver(self, delivery):
+        self.bus.publishTo(self.node, [DELIVER, self.userName, delivery.kind, delivery.userName, delivery.body])
+
+    # This function delivers a message shared with other recipients to the user
+    def deliverFrame(self, delivery):
+        self.deliver(delivery)
+
+    # This function does nothing, the connection is closed by its own node
+    def close(self):
+        pass
+
+"""
+    Define the offline store of a node. The messages of the recipients owned
+    by the node are kept in its local OfflineStore, the messages of other
+    recipients are published to their owners.
+"""
+class PartitionedOfflineStore:
+
+    # This is the constructor of the store
+    def __init__(self, local, bus):
+        self.local = local
+        self.bus = bus
+
+    # This function queues a message for the given recipient
+    def enqueue(self, recipient, message):
+        owner = self.bus.ownerOf(recipient)
+        if owner == self.bus.node:
+            self.local.enqueue(recipient, message)
+        else:
+            self.bus.publishTo(owner, [OFFLINE, recipient, message])
+
+    # This function returns the number of messages queued for the recipient on
+    # this node
+    def pendingFor(self, recipient):
+        return self.local.pendingFor(recipient)
+
+    # This function returns the number of messages queued on this node
+    def __len__(self):
+        return len(self.local)
+
+    # This function removes and returns up to batchSize of the oldest messages
+    # of the recipient. The messages of a recipient owned by another node are
+    # requested from the owner instead, which delivers them through the bus
+    def takeBatch(self, recipient, batchSize=256):
+        owner = self.bus.ownerOf(recipient)
+        if owner == self.bus.node:
+            return self.local.takeBatch(recipient, batchSize)
+        self.bus.publishTo(owner, [DRAIN, recipient])
+        return []
+
+    # This function yields the messages queued for the recipient in batches.
+    # The owner of a recipient owned by another node has been asked to deliver
+    # them when the recipient logged in
+    def drainBatches(self, recipient, batchSize=256):
+        if self.bus.ownerOf(recipient) == self.bus.node:
+            yield from self.local.drainBatches(recipient, batchSize)
+
+    # This function starts the background thread of the local store
+    def start(self):
+        self.local.start()
+
+    # This function flushes the local store and stops its background thread
+    def close(self):
+        self.local.close()
+
+"""
+    Define the history store of a node. Every node keeps all the messages in
+    its local HistoryStore, so that history and search show the messages sent
+    through any node. A message is appended by the node owning its
+    conversation first, which publishes it to the other nodes, so that the
+    messages of a conversation are numbered alike on every node.
+"""
+class ReplicatedHistoryStore:
+
+    # This is the constructor of the store
+    def __init__(self, local, bus):
+        self.local = local
+        self.bus = bus
+
+    # This function appends a message sent by sender to recipient to their
+    # conversation. A message of a conversation owned by another node is
+    # appended once the owner has published it
+    def append(self, sender, recipient, text):
+        message = [HISTORY, sender, recipient, text, time.time()]
+        owner = self.bus.ownerOf('\n'.join(conversationKey(sender, recipient)))
+        if owner != self.bus.node:
+            self.bus.publishTo(owner, message)
+            return None
+        self.bus.publish(message)
+        return self.local.append(sender, recipient, text, message[4])
+
+    # This function returns a page of the messages between the two users
+    def page(self, userA, userB, beforeId=None, limit=50):
+        return self.local.page(userA, userB, beforeId, limit)
+
+    # This function returns the latest messages of the user containing the
+    # given words, or None until the logs have been read
+    def search(self, userName, words, limit=20):
+        return self.local.search(userName, words, limit)
+
+    # This function returns the number of messages on this node
+    def __len__(self):
+        return len(self.local)
+
+    # This function writes the appended messages to the disk
+    def checkpoint(self):
+        self.local.checkpoint()
+
+    # This function writes the appended messages to the disk and closes the
+    # local store
+    def close(self):
+        self.local.close()
+
+"""
+    Define the bus of the node with the given number in a cluster of
+    nodeCount nodes, over the given PubSub client. The messages of the other
+    nodes are handled on the thread of the client, or passed to the dispatch
+    function given to start(), such as the call_soon_threadsafe of the event
+    loop of the asyncio engine. sharedFiles is set when the nodes share the
+    block log and the credentials file, as the workers of one server do;
+    otherwise every node also writes the changes of the other nodes to its
+    own files.
+"""
+class ShardBus:
+
+    # This is the constructor of the bus
+    def __init__(self, pubsub, node, nodeCount, sharedFiles=True):
+        self.pubsub = pubsub
+        self.node = node
+        self.nodeCount = nodeCount
+        self.sharedFiles = sharedFiles
+        self.dispatch = None
+
+        # The login time of every local user, which decides between two nodes
+        # on which the same user has logged in at the same time
+        self.loginTimes = {}
+        self.handlers = {
+            LOGIN: self.handleLogin,
+            LOGOUT: self.handleLogout,
+            DELIVER: self.handleDeliver,
+            SEND: self.handleSend,
+            TARGET: self.handleTarget,
+            RELAY: self.handleRelay,
+            PRIVATE: self.handlePrivate,
+            BROADCAST: self.handleBroadcast,
+            BLOCKS: self.handleBlocks,
+            CHANNEL: self.handleChannel,
+            CHANNELS: self.handleChannels,
+            REGISTER: self.handleRegister,
+            LOCKOUT: self.handleLockout,
+            OFFLINE: self.handleOffline,
+            DRAIN: self.handleDrain,
+            HISTORY: self.handleHistory,
+            SYNC: self.handleSync,
+            LEFT: self.handleLeft,
+        }
+
+    """
+        Public APIs of the bus.
+    """
+
+    # This function connects the node to the other nodes, publishes the changes
+    # of the local users from now on and asks the other nodes for their users
+    def start(self, dispatch=None):
+        self.dispatch = dispatch
+        serverstate.presence.loginListeners.append(self.publishLogin)
+        serverstate.presence.logoutListeners.append(self.publishLogout)
+        serverstate.blockGraph.listeners.append(self.publishBlocks)
+        serverstate.channels.listeners.append(self.publishChannels)
+        self.pubsub.subscribe(ALL_NODES)
+        self.pubsub.subscribe(NODE_TOPIC.format(self.node))
+        self.pubsub.setWill(ALL_NODES, json.dumps([LEFT, self.node]).encode())
+        self.pubsub.start(self.receive, self.disconnected)
+        self.publish([SYNC, self.node])
+
+    # This function returns the node owning the offline messages of the user
+    def ownerOf(self, userName):
+        return ownerOf(userName, self.nodeCount)
+
+    # This function publishes a message to every other node
+    def publish(self, message):
+        self.pubsub.publish(ALL_NODES, json.dumps(message).encode())
+
+    # This function publishes a message to the given node only
+    def publishTo(self, node, message):
+        self.pubsub.publish(NODE_TOPIC.format(node), json.dumps(message).encode())
+
+    # This function publishes a broadcast, or a login or logout notice, of the
+    # given kind (see wire.py) to the users of the other nodes
+    def publishBroadcast(self, kind, sender, body):
+        self.publish([BROADCAST, kind, sender, body])
+
+    # This function publishes a message of the given user to a channel to the
+    # online members of the channel on the other nodes
+    def publishChannel(self, channel, sender, body):
+        self.publish([CHANNEL, channel, sender, body])
+
+    # This function publishes the registration of a new user
+    def publishRegister(self, userName, password):
+        self.publish([REGISTER, userName, password])
+
+    # This function publishes that the user has been blocked from logging in
+    def publishLockout(self, userName):
+        self.publish([LOCKOUT, userName])
+
+    """
+        Helper functions of the bus.
+    """
+
+    # This function publishes the login of a local user, and asks the owner of
+    # the offline messages of the user to deliver them
+    def publishLogin(self, record):
+        if record.session.remote:
+            return
+        loginTime = self.loginTimes[record.userName] = time.time()
+        self.publish(self.loginMessage(record, loginTime))
+        owner = self.ownerOf(record.userName)
+        if owner != self.node:
+            self.publishTo(owner, [DRAIN, record.userName])
+
+    # This function publishes the logout of a local user
+    def publishLogout(self, record):
+        if not record.session.remote:
+            self.loginTimes.pop(record.userName, None)
+            self.publish([LOGOUT, record.userName, self.node])
+
+    # This function publishes a block or unblock made by a local user
+    def publishBlocks(self, record, blocker, user):
+        self.publish([BLOCKS, record, blocker, user])
+
+    # This function publishes a join or leave of a channel made by a local user
+    def publishChannels(self, record, channel, user):
+        self.publish([CHANNELS, record, channel, user])
+
+    # This function returns the message announcing the login of a local user
+    def loginMessage(self, record, loginTime):
+        return [LOGIN, record.userName, record.ipAddress, record.port, record.p2pPort, self.node, loginTime]
+
+    # This function receives a message of another node
+    def receive(self, topic, data):
+        message = json.loads(data)
+        if self.dispatch is not None:
+            self.dispatch(self.handle, message)
+        else:
+            self.handle(message)
+
+    # This function handles one message of another node
+    def handle(self, message):
+        self.handlers[message[0]](*message[1:])
+
+    # This function stops the node once it has been disconnected from the other
+    # nodes, as it can no longer reach their users
+    def disconnected(self):
+        if serverstate.offlineMessages is not None:
+            serverstate.offlineMessages.close()
+        os._exit(1)
+
+    # This function registers a user who has logged in to another node. If the
+    # user is also logged in here, the earlier login is kept: a later local
+    # login is closed, while for a later remote login the local login is
+    # announced again so that the other nodes replace the later one
+    def handleLogin(self, userName, ipAddress, port, p2pPort, node, loginTime):
+        record = serverstate.presence.lookup(userName)
+        if record is not None:
+            if record.session.remote:
+                serverstate.presence.logout(userName, record.session)
+            elif (self.loginTimes.get(userName, 0), self.node) < (loginTime, node):
+                self.publish(self.loginMessage(record, self.loginTimes[userName]))
+                return
+            else:
+                self.closeLocalSession(record.session)
+        remoteSession = RemoteSession(self, userName, node)
+        serverstate.presence.login(SessionRecord(userName, ipAddress, port, remoteSession, p2pPort))
+        serverstate.activity.login(userName)
+
+    # This function closes a local session whose user has logged in to another
+    # node first
+    def closeLocalSession(self, session):
+        session.clientAlive = False
+        session.loginState = 'closed'
+        if serverstate.idleTimeouts is not None:
+            serverstate.idleTimeouts.cancel(session)
+        session.sendExit("This user is currently active. Please login with another user\n")
+        serverstate.presence.logout(session.userName, session)
+        session.close()
+
+    # This function removes a user who has logged out of another node
+    def handleLogout(self, userName, node):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and record.session.remote and record.session.node == node:
+            serverstate.presence.logout(userName, record.session)
+            serverstate.activity.logout(userName)
+
+    # This function delivers a message to a local user, or queues it for the
+    # user if the user is no longer logged in here
+    def handleDeliver(self, userName, kind, sender, body):
+        record = serverstate.presence.lookup(userName)
+        delivery = Delivery(kind, sender, body)
+        if record is not None and not record.session.remote:
+            record.session.deliver(delivery)
+        else:
+            serverstate.offlineMessages.enqueue(userName, delivery.text())
+
+    # This function sends a text to a local user
+    def handleSend(self, userName, text):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and not record.session.remote:
+            record.session.send(text)
+
+    # This function asks a local user to start private messaging with the peer
+    def handleTarget(self, userName, peerName, address, port, initiator):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and not record.session.remote:
+            record.session.sendTarget(peerName, address, port, userName, initiator)
+
+    # This function relays a frame of private messaging to a local user
+    def handleRelay(self, userName, sender, text):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and not record.session.remote:
+            record.session.sendRelay(sender, text)
+
+    # This function records the answer of a user of another node to a request
+    # of a local user to start private messaging
+    def handlePrivate(self, userName, peerName, accepted):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and not record.session.remote:
+            record.session.updatePrivatePeer(peerName, accepted)
+
+    # This function delivers a broadcast of a user of another node to the local
+    # users, filtered against the block sets of the sender
+    def handleBroadcast(self, kind, sender, body):
+        if kind == wire.BROADCAST:
+            excluded = serverstate.blockGraph.blockersOf(sender)
+        else:
+            excluded = serverstate.blockGraph.blockedBy(sender)
+        fanOut(Delivery(kind, sender, body), excluded)
+
+    # This function applies a block or unblock made on another node
+    def handleBlocks(self, record, blocker, user):
+        serverstate.blockGraph.apply(record, blocker, user, log=not self.sharedFiles)
+
+    # This function delivers a message to a channel from a user of another node
+    # to the local online members of the channel, filtered against the block
+    # sets of the sender
+    def handleChannel(self, channel, sender, body):
+        fanOut(Delivery(wire.CHANNEL, sender, body, channel), serverstate.blockGraph.blockersOf(sender),
+               records=serverstate.channels.onlineMembers(channel))
+
+    # This function applies a join or leave of a channel made on another node
+    def handleChannels(self, record, channel, user):
+        serverstate.channels.apply(record, channel, user, log=not self.sharedFiles)
+
+    # This function registers a user who has registered on another node
+    def handleRegister(self, userName, password):
+        if self.sharedFiles:
+            serverstate.credentials.remember(userName, password)
+        elif not serverstate.credentials.exists(userName):
+            serverstate.credentials.add(userName, password)
+
+    # This function blocks a user from logging in after failed logins on
+    # another node
+    def handleLockout(self, userName):
+        serverstate.loginBlockedList.add(userName, datetime.now())
+
+    # This function queues a message for a recipient owned by this node,
+    # delivering it right away if the recipient is logged in here
+    def handleOffline(self, userName, text):
+        record = serverstate.presence.lookup(userName)
+        if record is not None and not record.session.remote:
+            record.session.deliver(Delivery(wire.NOTICE, body=text))
+        else:
+            serverstate.offlineMessages.local.enqueue(userName, text)
+
+    # This function delivers the queued messages of a recipient owned by this
+    # node who has logged in to another node
+    def handleDrain(self, userName):
+        record = serverstate.presence.lookup(userName)
+        if record is None or not record.session.remote:
+            return
+        for batch in serverstate.offlineMessages.drainBatches(userName):
+            for message in batch:
+                record.session.deliver(Delivery(wire.NOTICE, body=message))
+
+    # This function appends a message of the history published by the owner of
+    # its conversation. A message sent through another node is published to
+    # the other nodes by its owner, which appends it first
+    def handleHistory(self, sender, recipient, text, timestamp):
+        if self.ownerOf('\n'.join(conversationKey(sender, recipient))) == self.node:
+            self.publish([HISTORY, sender, recipient, text, timestamp])
+        serverstate.history.local.append(sender, recipient, text, timestamp)
+
+    # This function announces the local users to a node which has just joined
+    def handleSync(self, node):
+        for record in serverstate.presence.snapshot():
+            loginTime = self.loginTimes.get(record.userName)
+            if not record.session.remote and loginTime is not None:
+                self.publishTo(node, self.loginMessage(record, loginTime))
+
+    # This function removes the users of a node which has left the cluster
+    def handleLeft(self, node):
+        for record in serverstate.presence.snapshot():
+            if record.session.remote and record.session.node == node:
+                serverstate.presence.logout(record.userName, record.session)
+                serverstate.activity.logout(record.userName)
+
+# This function forks the given number of workers, each running
+# startWorker(shard, pubsub) with its own PubSub client. Unless connect is
+# given, a function returning the client of a worker connected to an outside
+# broker, the parent process runs the broker of the workers over socket pairs.
+# The parent returns once the workers have exited or the server is stopped
+def runShardedServer(workerCount, startWorker, connect=None):
+    pairs = [socket.socketpair() for shard in range(workerCount)] if connect is None else []
+    workers = []
+    for shard in range(workerCount):
+        pid = os.fork()
+        if pid == 0:
+            for other, (brokerSocket, workerSocket) in enumerate(pairs):
+                brokerSocket.close()
+                if other != shard:
+                    workerSocket.close()
+            try:
+                startWorker(shard, StreamPubSub(pairs[shard][1]) if connect is None else connect())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        workers.append(pid)
+        if pairs:
+            pairs[shard][1].close()
+
+    # The workers are stopped together with the parent
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: sys.exit(0))
+    try:
+        if pairs:
+            asyncio.run(PubSubBroker().serveSockets([brokerSocket for brokerSocket, workerSocket in pairs]))
+        else:
+            for pid in workers:
+                os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
@@ -0,0 +1,273 @@
+"""
+    Python 3
+    Snapshots and write-ahead logs of the state of the server which has no
+    file of its own, such as the activity index of whoelsesince and the login
+    lockouts. Every change of a component is appended to its log, and the
+    component is written as a snapshot once its log holds many more records
+    than the component holds entries, after which the logs written before
+    the snapshot are deleted. The snapshot is written from a copy of the
+    component taken under its lock, so only the copy holds up the users of
+    the component. On restart the snapshot and the logs written since are
+    read through mmap.
+
+    The files of a component named NAME are NAME.snap, the snapshot, and
+    NAME-GENERATION.log, the logs. A snapshot of generation G holds every
+    change of the logs before generation G, so the state is recovered by
+    reading the snapshot and then the logs from generation G on.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Every record starts with the length of the rest of the record, followed by
+# the record type and the fields
+RECORD_HEADER = struct.Struct('>IB')
+
+# The fields of the records, strings prefixed with their length and times
+STRING_LENGTH = struct.Struct('>H')
+TIME = struct.Struct('>d')
+
+# The header of a snapshot file, a magic value and the generation
+SNAPSHOT_HEADER = struct.Struct('>8sQ')
+SNAPSHOT_MAGIC = b'CHATSNAP'
+
+# A snapshot is written once the log holds more records than this factor
+# times the number of entries of the component, plus SNAPSHOT_SLACK
+SNAPSHOT_FACTOR = 2
+SNAPSHOT_SLACK = 1000
+
+# This function encodes one record from its type and its fields, strings and
+# times
+def encodeRecord(recordType, *fields):
+    data = []
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode()
+            data.append(STRING_LENGTH.pack(len(field)) + field)
+        else:
+            data.append(TIME.pack(field))
+    data = b''.join(data)
+    return RECORD_HEADER.pack(len(data) + 1, recordType) + data
+
+# This function decodes the fields of a record given their layout, 's' for a
+# string and 't' for a time
+def decodeFields(data, layout):
+    fields = []
+    offset = 0
+    for kind in layout:
+        if kind == 's':
+            (length,) = STRING_LENGTH.unpack_from(data, offset)
+            offset += STRING_LENGTH.size
+            fields.append(data[offset:offset + length].decode())
+            offset += length
+        else:
+            fields.append(TIME.unpack_from(data, offset)[0])
+            offset += TIME.size
+    return fields
+
+"""
+    Define the snapshot and the write-ahead log of the component with the
+    given name, kept in the given directory. The component calls append()
+    and rotate() while holding its own lock, so that the records are in the
+    order of the changes and a copy taken under the lock matches a log
+    generation exactly.
+"""
+class SnapshotLog:
+
+    # This is the constructor of the log
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.snapshotPath = os.path.join(directory, name + '.snap')
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.logFile = None
+        self.logRecords = 0
+        self.dirty = False
+        os.makedirs(directory, exist_ok=True)
+
+    """
+        Public APIs of the log.
+    """
+
+    # This function yields the type and data of every record of the snapshot
+    # and of the logs written since, and then opens the latest log for
+    # appending. The logs older than the snapshot are deleted
+    def recover(self):
+        snapshotGeneration = 0
+        if os.path.exists(self.snapshotPath):
+            snapshotGeneration = yield from self.readSnapshot()
+        generations = sorted(self.logGenerations())
+        for generation in generations:
+            if generation < snapshotGeneration:
+                self.removeLog(generation)
+                continue
+            for record in self.readRecords(self.logPath(generation), truncate=True):
+                self.logRecords += 1
+                yield record
+        self.generation = max(generations + [snapshotGeneration])
+        self.logFile = open(self.logPath(self.generation), 'ab')
+
+    # This function appends one record to the log. The record is written to
+    # the disk by the next sync()
+    def append(self, recordType, *fields):
+        record = encodeRecord(recordType, *fields)
+        with self.lock:
+            if self.logFile is not None:
+                self.logFile.write(record)
+                self.logRecords += 1
+                self.dirty = True
+
+    # This function writes the appended records to the disk
+    def sync(self):
+        with self.lock:
+            if not self.dirty or self.logFile is None:
+                return
+            self.logFile.flush()
+            os.fsync(self.logFile.fileno())
+            self.dirty = False
+
+    # This function returns whether the log has grown enough, compared to the
+    # given number of entries of the component, to be replaced by a snapshot
+    def needsSnapshot(self, entries):
+        return self.logFile is not None and self.logRecords > SNAPSHOT_FACTOR * entries + SNAPSHOT_SLACK
+
+    # This function starts the next generation of the log and returns it. The
+    # caller holds the lock of the component and has copied the component,
+    # which it then gives to writeSnapshot() with the returned generation
+    def rotate(self):
+        with self.lock:
+            self.logFile.flush()
+            os.fsync(self.logFile.fileno())
+            self.logFile.close()
+            self.generation += 1
+            self.logFile = open(self.logPath(self.generation), 'ab')
+            self.logRecords = 0
+            self.dirty = False
+            return self.generation
+
+    # This function writes the given records, (recordType, fields) pairs
+    # recreating the component, as the snapshot of the given generation and
+    # deletes the logs it replaces
+    def writeSnapshot(self, generation, records):
+        temporaryPath = self.snapshotPath + '.tmp'
+        with open(temporaryPath, 'wb') as c:
+            c.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation))
+            for recordType, fields in records:
+                c.write(encodeRecord(recordType, *fields))
+            c.flush()
+            os.fsync(c.fileno())
+        os.replace(temporaryPath, self.snapshotPath)
+        for oldGeneration in self.logGenerations():
+            if oldGeneration < generation:
+                self.removeLog(oldGeneration)
+
+    # This function closes the log after writing it to the disk
+    def close(self):
+        self.sync()
+        with self.lock:
+            if self.logFile is not None:
+                self.logFile.close()
+                self.logFile = None
+
+    """
+        Helper functions of the log.
+    """
+
+    # This function returns the path of the log of the given generation
+    def logPath(self, generation):
+        return os.path.join(self.directory, f"{self.name}-{generation:08d}.log")
+
+    # This function returns the generations of the logs on the disk
+    def logGenerations(self):
+        prefix = self.name + '-'
+        return [int(name[len(prefix):-4]) for name in os.listdir(self.directory)
+                if name.startswith(prefix) and name.endswith('.log') and name[len(prefix):-4].isdigit()]
+
+    # This function deletes the log of the given generation
+    def removeLog(self, generation):
+        try:
+            os.remove(self.logPath(generation))
+        except FileNotFoundError:
+            pass
+
+    # This function yields the records of the snapshot and returns its
+    # generation
+    def readSnapshot(self):
+        with open(self.snapshotPath, 'rb') as c:
+            magic, generation = SNAPSHOT_HEADER.unpack(c.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.snapshotPath} is not a snapshot")
+        yield from self.readRecords(self.snapshotPath, SNAPSHOT_HEADER.size)
+        return generation
+
+    # This function yields the type and data of the records of the file from
+    # the given offset, mapped into memory rather than read. A record which was
+    # only partly written when the server stopped ends the file, and is cut off
+    # if truncate is set
+    def readRecords(self, path, offset=0, truncate=False):
+        with open(path, 'rb') as c:
+            size = os.fstat(c.fileno()).st_size
+            if size <= offset:
+                return
+            with mmap.mmap(c.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset + RECORD_HEADER.size <= size:
+                    length, recordType = RECORD_HEADER.unpack_from(data, offset)
+                    end = offset + 4 + length
+                    if end > size or length == 0:
+                        break
+                    yield recordType, data[offset + RECORD_HEADER.size:end]
+                    offset = end
+        if offset < size and truncate:
+            with open(path, 'r+b') as c:
+                c.truncate(offset)
+
+"""
+    Define the background thread which writes the logs of the components to
+    the disk every interval seconds and has every component write a snapshot
+    once its log has grown enough. A component has a checkpoint() function
+    doing both.
+"""
+class Snapshotter:
+
+    # This is the constructor of the snapshotter
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.components = []
+        self.running = False
+        self.lock = threading.Lock()
+
+    # This function adds a component to checkpoint
+    def add(self, component):
+        self.components.append(component)
+
+    # This function starts the background thread
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        thread = threading.Thread(name="snapshotter", target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    # This function checkpoints every component now and stops the thread
+    def close(self):
+        self.running = False
+        self.checkpoint()
+
+    # This function is the main loop of the background thread
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.checkpoint()
+
+    # This function checkpoints every component, one checkpoint at a time
+    def checkpoint(self):
+        with self.lock:
+            for component in self.components:
+                try:
+                    component.checkpoint()
+                except (OSError, ValueError):
+                    pass
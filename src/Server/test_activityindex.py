@@ -0,0 +1,142 @@
+"""
+    Python 3
+    Unit tests of the activity index of activityindex.py behind
+    whoelsesince, kept in memory and in a log with snapshots.
+    Usage: python3 -m pytest src/Server
+"""
+import shutil
+import tempfile
+import unittest
+from activityindex import ActivityIndex
+from statestore import SnapshotLog
+
+"""
+    Define the tests of the activity index, given the times of the logins and
+    logouts.
+"""
+class ActivityIndexTest(unittest.TestCase):
+
+    def testSince(self):
+        index = ActivityIndex()
+        for userName, loginTime in (('hans', 0), ('yoda', 1), ('vader', 2), ('luke', 3)):
+            index.login(userName, loginTime)
+        index.logout('yoda', 10)
+        index.logout('vader', 20)
+        index.logout('luke', 30)
+
+        # The logged in users first, then the others from the latest logout
+        self.assertEqual(index.since(100, 40), ['hans', 'luke', 'vader', 'yoda'])
+        self.assertEqual(index.since(20, 40), ['hans', 'luke', 'vader'])
+        self.assertEqual(index.since(5, 40), ['hans'])
+        self.assertEqual(len(index), 4)
+
+    def testLoginAgain(self):
+        index = ActivityIndex()
+        index.login('yoda', 0)
+        index.logout('yoda', 10)
+        index.login('yoda', 20)
+        self.assertEqual(index.since(1, 30), ['yoda'])
+        index.logout('yoda', 30)
+        index.logout('yoda', 40)
+        self.assertEqual(index.since(5, 35), ['yoda'])
+        self.assertEqual(index.since(100, 100), ['yoda'])
+        self.assertEqual(index.orderedUsers.count('yoda'), 2)
+
+    def testClockSetBack(self):
+        index = ActivityIndex()
+        index.login('hans', 0)
+        index.login('yoda', 0)
+        index.logout('hans', 20)
+        index.logout('yoda', 10)
+        self.assertEqual(index.orderedTimes, [20, 20])
+        self.assertEqual(index.since(1, 20), ['yoda', 'hans'])
+
+    def testEvictAfterRetention(self):
+        index = ActivityIndex(retention=60)
+        for userName in ('hans', 'yoda', 'vader'):
+            index.login(userName, 0)
+        index.logout('hans', 10)
+        index.logout('yoda', 50)
+        self.assertEqual(len(index), 3)
+        index.logout('vader', 100)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.orderedUsers, ['yoda', 'vader'])
+
+    def testSinceClampedToRetention(self):
+        index = ActivityIndex(retention=60)
+        index.login('hans', 0)
+        index.login('yoda', 0)
+        index.logout('hans', 10)
+        index.logout('yoda', 20)
+
+        # hans logged out 65 seconds ago, before the retention period, but has
+        # not been evicted yet as nobody has logged out since
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.since(1000, 75), ['yoda'])
+        self.assertEqual(index.since(30, 75), [])
+        self.assertEqual(index.since(1000, 200), [])
+
+    def testCompact(self):
+        index = ActivityIndex()
+        for step in range(3000):
+            index.login('hans', step)
+            index.logout('hans', step)
+        self.assertLess(len(index.orderedUsers), 1100)
+        self.assertEqual(index.since(1, 3000), ['hans'])
+
+"""
+    Define the tests of the activity index kept in a log with snapshots.
+"""
+class LoggedActivityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='activitytest-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    # This function returns an index read back from the log
+    def open(self):
+        log = SnapshotLog(self.directory, 'activity')
+        self.addCleanup(log.close)
+        index = ActivityIndex(log=log)
+        index.loaded.wait()
+        return index
+
+    def testReadBack(self):
+        index = self.open()
+        index.login('hans', 0)
+        index.login('yoda', 0)
+        index.logout('hans', 10)
+        index.checkpoint()
+        index.log.close()
+
+        # The users logged in when the server stopped are logged out once
+        # settled, unless they have come back
+        index = self.open()
+        self.assertEqual(index.loginTimes, {'yoda': 0})
+        self.assertEqual(index.logoutTimes, {'hans': 10})
+        index.settle(20)
+        self.assertEqual(index.loginTimes, {})
+        self.assertEqual(index.logoutTimes, {'hans': 10, 'yoda': 20})
+        self.assertEqual(index.since(1e12), ['yoda', 'hans'])
+
+    def testUsersBackNotLoggedOut(self):
+        index = self.open()
+        index.login('hans', 0)
+        index.login('yoda', 0)
+        index.log.close()
+
+        # yoda comes back, as a session handed over, before the index settles
+        index = self.open()
+        index.login('yoda', 30)
+        index.settle(40)
+        self.assertEqual(index.loginTimes, {'yoda': 0})
+        self.assertEqual(index.logoutTimes, {'hans': 40})
+        index.log.close()
+
+        # yoda never left, and neither a logout nor a login was logged for yoda
+        index = self.open()
+        self.assertEqual(index.loginTimes, {'yoda': 0})
+        self.assertEqual(index.logoutTimes, {'hans': 40})
+
+if __name__ == "__main__":
+    unittest.main()
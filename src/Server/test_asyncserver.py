@@ -0,0 +1,88 @@
+"""
+    Python 3
+    Tests of the asyncio engine of asyncserver.py, serving clients connected
+    over the loopback interface from the event loop of the tests.
+    Usage: python3 -m pytest src/Server
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import encodeFrame, readFrame
+import serverstate
+from activityindex import ActivityIndex
+from asyncserver import handleConnection
+from blockgraph import BlockGraph
+from channels import ChannelDirectory
+from credentialstore import CredentialStore
+from historystore import HistoryStore
+from lockouts import LoginLockouts
+from loginpool import LoginPool
+from offlinestore import OfflineStore
+from presence import PresenceRegistry
+from presencefeed import PresenceFeed
+
+"""
+    Define the tests of the sessions of the asyncio engine, with a fresh state
+    of the server kept in memory for every test.
+"""
+class AsyncServerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        credentialsPath = os.path.join(directory, 'credentials.txt')
+        with open(credentialsPath, 'w') as c:
+            c.write("hans falcon*solo\nyoda wise@!man\nvader sithlord**")
+        presence = PresenceRegistry()
+        self.replaceState(credentials=CredentialStore(credentialsPath), presence=presence,
+                          blockGraph=BlockGraph(None), activity=ActivityIndex(), offlineMessages=OfflineStore(None),
+                          channels=ChannelDirectory(presence, None), history=HistoryStore(None),
+                          loginBlockedList=LoginLockouts(), loginPool=LoginPool(1), presenceFeed=PresenceFeed(presence),
+                          idleTimeouts=None, rateLimiter=None, bus=None)
+
+    # This function replaces the given attributes of serverstate until the end
+    # of the test
+    def replaceState(self, **values):
+        for name, value in values.items():
+            self.addCleanup(setattr, serverstate, name, getattr(serverstate, name))
+            setattr(serverstate, name, value)
+
+    # This coroutine connects to the server and logs the given user in,
+    # returning the streams of the connection
+    async def logIn(self, port, userName, password):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(encodeFrame(f"['p2pPort'] {port}"))
+        self.assertEqual(await readFrame(reader), 'Username: ')
+        writer.write(encodeFrame(userName))
+        self.assertEqual(await readFrame(reader), 'Password: ')
+        writer.write(encodeFrame(password))
+        self.assertTrue((await readFrame(reader)).startswith('Welcome'))
+        return reader, writer
+
+    def testLoginMessageLogout(self):
+        async def run():
+            server = await asyncio.start_server(handleConnection, '127.0.0.1', 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                hansReader, hansWriter = await self.logIn(port, 'hans', 'falcon*solo')
+                yodaReader, yodaWriter = await self.logIn(port, 'yoda', 'wise@!man')
+                self.assertEqual(await readFrame(hansReader), "yoda logged in\n")
+                self.assertTrue(serverstate.presence.isOnline('hans'))
+
+                hansWriter.write(encodeFrame('message yoda hello'))
+                self.assertEqual(await readFrame(yodaReader), "hans: hello\n")
+
+                # The user is logged out once the client closes the connection
+                hansWriter.close()
+                self.assertEqual(await readFrame(yodaReader), "hans logged out\n")
+                self.assertFalse(serverstate.presence.isOnline('hans'))
+                yodaWriter.close()
+                self.assertIsNone(await readFrame(yodaReader))
+        asyncio.run(asyncio.wait_for(run(), 10))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+    Python 3
+    Unit tests of the block graph of blockgraph.py, kept in memory and in a
+    log which is read back, recovered and compacted.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import blockgraph
+from blockgraph import BlockGraph
+
+"""
+    Define the tests of a graph kept in memory.
+"""
+class BlockGraphTest(unittest.TestCase):
+
+    def testBlocks(self):
+        graph = BlockGraph(None)
+        self.assertTrue(graph.block('yoda', 'vader'))
+        self.assertFalse(graph.block('yoda', 'vader'))
+        graph.block('hans', 'vader')
+        graph.block('hans', 'yoda')
+        self.assertTrue(graph.hasBlocked('yoda', 'vader'))
+        self.assertFalse(graph.hasBlocked('vader', 'yoda'))
+        self.assertEqual(graph.blockersOf('vader'), {'yoda', 'hans'})
+        self.assertEqual(graph.blockedBy('hans'), {'vader', 'yoda'})
+        self.assertEqual(graph.onlineNotBlocking('vader', ['hans', 'luke', 'yoda']), ['luke'])
+        self.assertEqual(len(graph), 3)
+
+        self.assertTrue(graph.unblock('hans', 'vader'))
+        self.assertFalse(graph.unblock('hans', 'vader'))
+        self.assertEqual(graph.blockersOf('vader'), {'yoda'})
+        self.assertEqual(len(graph), 2)
+
+"""
+    Define the tests of a graph kept in a log in a temporary directory.
+"""
+class LoggedBlockGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='blocktest-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'blocks.log')
+
+    # This function opens the graph of the log and waits until it has been read
+    def open(self):
+        graph = BlockGraph(self.path)
+        graph.loaded.wait()
+        self.addCleanup(graph.close)
+        return graph
+
+    # This function returns the lines of the log
+    def lines(self):
+        with open(self.path) as c:
+            return c.read().splitlines()
+
+    def testReadBack(self):
+        graph = self.open()
+        graph.block('yoda', 'vader')
+        graph.block('hans', 'vader')
+        graph.unblock('yoda', 'vader')
+        graph.close()
+        graph = self.open()
+        self.assertEqual(graph.blockersOf('vader'), {'hans'})
+        self.assertEqual(len(graph), 1)
+
+    def testTruncatedLog(self):
+        graph = self.open()
+        graph.block('yoda', 'vader')
+        graph.close()
+
+        # The server stopped while it was writing the last record, whose user
+        # is cut short
+        with open(self.path, 'a') as c:
+            c.write("+ hans va")
+        graph = self.open()
+        self.assertEqual(graph.blockedBy('hans'), set())
+        self.assertEqual(self.lines(), ["+ yoda vader"])
+
+        # The records appended after the cut are read back
+        graph.block('hans', 'vader')
+        graph.close()
+        graph = self.open()
+        self.assertEqual(graph.blockersOf('vader'), {'yoda', 'hans'})
+
+    def testCompaction(self):
+        self.patchCompaction()
+        graph = self.open()
+        for _ in range(3):
+            graph.block('yoda', 'vader')
+            graph.unblock('yoda', 'vader')
+        graph.block('hans', 'vader')
+        graph.checkpoint()
+        self.assertEqual(self.lines(), ["+ hans vader"])
+
+        # The log is compacted while it is read back as well
+        for _ in range(3):
+            graph.block('yoda', 'luke')
+            graph.unblock('yoda', 'luke')
+        graph.close()
+        graph = self.open()
+        self.assertEqual(self.lines(), ["+ hans vader"])
+        graph.block('yoda', 'vader')
+        self.assertEqual(self.lines(), ["+ hans vader", "+ yoda vader"])
+
+    # This function has the log compacted as soon as it holds more than twice
+    # as many records as blocks, until the end of the test
+    def patchCompaction(self):
+        self.addCleanup(setattr, blockgraph, 'COMPACT_SLACK', blockgraph.COMPACT_SLACK)
+        blockgraph.COMPACT_SLACK = 0
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+    Python 3
+    Unit tests of the group channels of channels.py, their online members
+    and their log, which is read back, recovered and compacted.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import channels
+from channels import ChannelDirectory, channelName
+from presence import PresenceRegistry, SessionRecord
+
+"""
+    Define the tests of channels kept in memory.
+"""
+class ChannelDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.presence = PresenceRegistry()
+        self.channels = ChannelDirectory(self.presence, None)
+
+    # This function logs the user in and returns the presence record
+    def login(self, userName):
+        record = SessionRecord(userName, '127.0.0.1', 1000, object(), 1001)
+        self.presence.login(record)
+        return record
+
+    # This function returns the names of the online members of the channel
+    def online(self, channel):
+        return sorted(record.userName for record in self.channels.onlineMembers(channel))
+
+    def testMembers(self):
+        self.assertTrue(self.channels.join('jedi', 'yoda'))
+        self.assertFalse(self.channels.join('jedi', 'yoda'))
+        self.channels.join('jedi', 'luke')
+        self.channels.join('rebels', 'luke')
+        self.assertTrue(self.channels.isMember('jedi', 'luke'))
+        self.assertEqual(len(self.channels), 3)
+        self.assertTrue(self.channels.leave('jedi', 'luke'))
+        self.assertFalse(self.channels.leave('jedi', 'luke'))
+        self.assertFalse(self.channels.isMember('jedi', 'luke'))
+        self.assertTrue(self.channels.isMember('rebels', 'luke'))
+        self.assertEqual(len(self.channels), 2)
+
+    def testOnlineMembers(self):
+        self.login('yoda')
+        self.channels.join('jedi', 'yoda')
+        self.channels.join('jedi', 'luke')
+        self.assertEqual(self.online('jedi'), ['yoda'])
+        self.assertEqual(self.channels.offlineMembers('jedi'), ['luke'])
+
+        # The fan-out tuple is rebuilt once a member logs in or out
+        fanOutList = self.channels.onlineMembers('jedi')
+        self.assertIs(self.channels.onlineMembers('jedi'), fanOutList)
+        luke = self.login('luke')
+        self.assertEqual(self.online('jedi'), ['luke', 'yoda'])
+        self.assertEqual(self.channels.offlineMembers('jedi'), [])
+        self.presence.logout('luke', luke.session)
+        self.assertEqual(self.online('jedi'), ['yoda'])
+        self.channels.leave('jedi', 'yoda')
+        self.assertEqual(self.online('jedi'), [])
+        self.assertEqual(self.online('sith'), [])
+
+    def testLoginAgain(self):
+        self.channels.join('jedi', 'luke')
+        first = self.login('luke')
+        self.presence.logout('luke', first.session)
+        second = self.login('luke')
+
+        # The logout of the earlier session, seen again once the user has
+        # logged in again, leaves the new session online
+        self.channels.memberLoggedOut(first)
+        self.assertEqual(self.channels.onlineMembers('jedi'), (second,))
+
+    def testChannelName(self):
+        self.assertEqual(channelName('#jedi'), 'jedi')
+        self.assertEqual(channelName('rebel-alliance_2'), 'rebel-alliance_2')
+        self.assertIsNone(channelName('jedi!'))
+        self.assertIsNone(channelName('#'))
+        self.assertIsNone(channelName('x' * 33))
+
+"""
+    Define the tests of channels kept in a log in a temporary directory.
+"""
+class LoggedChannelDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='channeltest-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'channels.log')
+        self.presence = PresenceRegistry()
+
+    # This function opens the channels of the log and waits until it has been
+    # read
+    def open(self):
+        directory = ChannelDirectory(self.presence, self.path)
+        directory.loaded.wait()
+        self.addCleanup(directory.close)
+        return directory
+
+    # This function returns the lines of the log
+    def lines(self):
+        with open(self.path) as c:
+            return c.read().splitlines()
+
+    def testReadBack(self):
+        directory = self.open()
+        directory.join('jedi', 'yoda')
+        directory.join('jedi', 'luke')
+        directory.leave('jedi', 'yoda')
+        directory.close()
+
+        # The members online while the log is read are online members once it
+        # has been
+        self.presence.login(SessionRecord('luke', '127.0.0.1', 1000, object(), 1001))
+        directory = self.open()
+        self.assertEqual(len(directory), 1)
+        self.assertEqual([record.userName for record in directory.onlineMembers('jedi')], ['luke'])
+
+    def testTruncatedLog(self):
+        directory = self.open()
+        directory.join('jedi', 'yoda')
+        directory.close()
+
+        # The server stopped while it was writing the last record, whose user
+        # is cut short
+        with open(self.path, 'a') as c:
+            c.write("+ jedi lu")
+        directory = self.open()
+        self.assertFalse(directory.isMember('jedi', 'lu'))
+        self.assertEqual(self.lines(), ["+ jedi yoda"])
+
+        # The records appended after the cut are read back
+        directory.join('jedi', 'luke')
+        directory.close()
+        directory = self.open()
+        self.assertTrue(directory.isMember('jedi', 'luke'))
+        self.assertEqual(len(directory), 2)
+
+    def testCompaction(self):
+        self.addCleanup(setattr, channels, 'COMPACT_SLACK', channels.COMPACT_SLACK)
+        channels.COMPACT_SLACK = 0
+        directory = self.open()
+        for _ in range(3):
+            directory.join('jedi', 'luke')
+            directory.leave('jedi', 'luke')
+        directory.join('jedi', 'yoda')
+        directory.checkpoint()
+        self.assertEqual(self.lines(), ["+ jedi yoda"])
+
+        # The log is compacted while it is read back as well
+        for _ in range(3):
+            directory.join('sith', 'vader')
+            directory.leave('sith', 'vader')
+        directory.close()
+        directory = self.open()
+        self.assertEqual(self.lines(), ["+ jedi yoda"])
+        directory.join('jedi', 'luke')
+        self.assertEqual(self.lines(), ["+ jedi yoda", "+ jedi luke"])
+
+if __name__ == "__main__":
+    unittest.main()
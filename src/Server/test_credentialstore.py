@@ -0,0 +1,77 @@
+"""
+    Python 3
+    Unit tests of the in-memory index of the credentials file of
+    credentialstore.py.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from credentialstore import CredentialStore
+
+"""
+    Define the tests of the credential store, refreshed from its file on
+    every lookup.
+"""
+class CredentialStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'credentials.txt')
+        self.write("hans falcon*solo\nyoda wise@!man")
+        self.store = CredentialStore(self.path, refreshInterval=0)
+
+    # This function writes the given text to the credentials file, or appends
+    # it if append is set
+    def write(self, text, append=False):
+        with open(self.path, 'a' if append else 'w') as c:
+            c.write(text)
+
+    def testLookups(self):
+        self.assertTrue(self.store.exists('hans'))
+        self.assertFalse(self.store.exists('luke'))
+        self.assertTrue(self.store.verify('yoda', 'wise@!man'))
+        self.assertFalse(self.store.verify('yoda', 'falcon*solo'))
+        self.assertFalse(self.store.verify('luke', 'wise@!man'))
+        self.assertEqual(len(self.store), 2)
+
+    def testEveryLineOfUser(self):
+
+        # Like the lookups reading the file, any line of the user matches
+        self.write("\nhans millennium", append=True)
+        self.assertTrue(self.store.verify('hans', 'millennium'))
+        self.assertTrue(self.store.verify('hans', 'falcon*solo'))
+        self.assertEqual(len(self.store), 2)
+        self.store.reload()
+        self.assertTrue(self.store.verify('hans', 'millennium'))
+        self.assertTrue(self.store.verify('hans', 'falcon*solo'))
+
+    def testAdd(self):
+        self.store.add('luke', 'force')
+        self.assertTrue(self.store.verify('luke', 'force'))
+        with open(self.path) as c:
+            self.assertEqual(c.read().split('\n')[-1], 'luke force')
+        self.store.reload()
+        self.assertTrue(self.store.verify('luke', 'force'))
+
+    def testLastLineStillBeingWritten(self):
+        self.write("\nluke fo", append=True)
+        self.assertTrue(self.store.verify('luke', 'fo'))
+        self.write("rce\nhans mill", append=True)
+        self.assertFalse(self.store.verify('luke', 'fo'))
+        self.assertTrue(self.store.verify('luke', 'force'))
+        self.assertTrue(self.store.verify('hans', 'mill'))
+        self.write("ennium\n", append=True)
+        self.assertFalse(self.store.verify('hans', 'mill'))
+        self.assertTrue(self.store.verify('hans', 'millennium'))
+        self.assertTrue(self.store.verify('hans', 'falcon*solo'))
+
+    def testFileReplaced(self):
+        self.write("vader sithlord**")
+        self.assertTrue(self.store.verify('vader', 'sithlord**'))
+        self.assertFalse(self.store.exists('hans'))
+
+if __name__ == "__main__":
+    unittest.main()
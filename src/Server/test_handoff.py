@@ -0,0 +1,156 @@
+"""
+    Python 3
+    Unit tests of the handoff of handoff.py, from an old server process to a
+    new one, run within one process over a Unix socket.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import handoff
+import serverstate
+from framing import encodeFrame
+from handoff import HandoffServer, recvMessage, sendMessage, takeOver, waitDrained, TAKEOVER
+from outbound import OutboundQueue
+
+# The time in seconds a test waits for the handoff
+TIMEOUT = 5
+
+"""
+    Define the state of the server which the old server writes to the disk
+    and closes, here only recording that it has been closed.
+"""
+class ClosedState:
+
+    # This is the constructor of the state
+    def __init__(self):
+        self.closed = False
+
+    # This function records that the state has been closed
+    def close(self):
+        self.closed = True
+
+"""
+    Define a session of the old server, with the socket of its client and a
+    state which is its number.
+"""
+class HandedSession:
+
+    # This is the constructor of the session
+    def __init__(self, number):
+        self.number = number
+        self.clientSocket, self.peerSocket = socket.socketpair()
+        self.outbound = OutboundQueue(self)
+
+    # This function returns the file descriptor of the socket and the state of
+    # the session
+    def handoffState(self):
+        return self.clientSocket.fileno(), {'number': self.number}
+
+"""
+    Define the tests of the messages of the handoff.
+"""
+class MessageTest(unittest.TestCase):
+
+    def testMessagesWithSockets(self):
+        old, new = socket.socketpair()
+        self.addCleanup(old.close)
+        self.addCleanup(new.close)
+        first, second = socket.socketpair()
+        sendMessage(old, {'sessions': 1}, [first.fileno()])
+        sendMessage(old, ['without sockets'])
+        body, fds = recvMessage(new)
+        self.assertEqual((body, len(fds)), ({'sessions': 1}, 1))
+
+        # The socket received is the one sent
+        with socket.socket(fileno=fds[0]) as received:
+            received.sendall(b'hello')
+            self.assertEqual(second.recv(5), b'hello')
+        first.close()
+        second.close()
+        self.assertEqual(recvMessage(new), (['without sockets'], []))
+
+    def testWaitDrained(self):
+        session = HandedSession(0)
+        self.addCleanup(session.clientSocket.close)
+        self.addCleanup(session.peerSocket.close)
+        self.assertTrue(waitDrained(session, time.monotonic()))
+
+        # The frames of the session are never written
+        session.outbound.push(encodeFrame("hello"))
+        self.assertFalse(waitDrained(session, time.monotonic() + 0.05))
+        session.outbound.take()
+        session.outbound.wrote(0)
+        self.assertTrue(waitDrained(session, time.monotonic()))
+        session.outbound.close()
+        self.assertFalse(waitDrained(session, time.monotonic()))
+
+"""
+    Define the tests of a handoff from a HandoffServer to takeOver(), sending
+    a few sockets per message.
+"""
+class HandoffTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='handofftest-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'handoff.sock')
+        self.state = {name: ClosedState() for name in ('snapshots', 'offlineMessages', 'history',
+                                                       'blockGraph', 'channels')}
+        for name, value in self.state.items():
+            self.addCleanup(setattr, serverstate, name, getattr(serverstate, name))
+            setattr(serverstate, name, value)
+        self.addCleanup(setattr, handoff, 'FDS_PER_MESSAGE', handoff.FDS_PER_MESSAGE)
+        handoff.FDS_PER_MESSAGE = 2
+
+    # This function runs the old server, which hands the given listening socket
+    # and sessions over to the first new server connecting to it. The sessions
+    # have 0.5 seconds to write their frames
+    def runOldServer(self, listenSocket, sessions):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen()
+        server = HandoffServer(self.path, timeout=0.5)
+        server.prepare = lambda deadline: (listenSocket.fileno(), sessions)
+
+        def run():
+            connection, address = listener.accept()
+            with connection:
+                self.assertEqual(connection.recv(len(TAKEOVER)), TAKEOVER)
+                server.handOff(connection)
+            listener.close()
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join, TIMEOUT)
+
+    def testTakeOver(self):
+        listenSocket = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(listenSocket.close)
+        sessions = [HandedSession(number) for number in range(5)]
+        for session in sessions:
+            self.addCleanup(session.clientSocket.close)
+            self.addCleanup(session.peerSocket.close)
+
+        # The frames of the last session cannot be written, it is closed instead
+        sessions[-1].outbound.push(encodeFrame("hello"))
+        self.runOldServer(listenSocket, sessions)
+        takeover = takeOver(self.path)
+        self.addCleanup(takeover.listenSocket.close)
+        self.assertEqual(takeover.listenSocket.getsockname(), listenSocket.getsockname())
+        self.assertEqual([state for state, sock in takeover.sessions], [{'number': number} for number in range(4)])
+        self.assertTrue(all(state.closed for state in self.state.values()))
+
+        # Every socket taken over is connected to the client of its session
+        for (state, sock), session in zip(takeover.sessions, sessions):
+            with sock:
+                sock.sendall(b'hello')
+                self.assertEqual(session.peerSocket.recv(5), b'hello')
+
+if __name__ == "__main__":
+    unittest.main()
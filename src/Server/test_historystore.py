@@ -0,0 +1,92 @@
+"""
+    Python 3
+    Unit tests of the search and the pages of the message history of
+    historystore.py, kept in memory and on the disk.
+    Usage: python3 -m pytest src/Server
+"""
+import shutil
+import tempfile
+import unittest
+from historystore import HistoryStore, queryWords
+
+"""
+    Define the tests of a history kept in memory.
+"""
+class HistoryStoreTest(unittest.TestCase):
+
+    # This function returns the store the tests run on
+    def store(self):
+        return HistoryStore(None)
+
+    def setUp(self):
+        self.history = self.store()
+        self.history.append('hans', 'yoda', 'hello world!')
+        self.history.append('yoda', 'hans', 'Hello, Hans. How is the world?')
+        self.history.append('hans', 'vader', 'hello father')
+        self.history.append('vader', 'yoda', 'hello there')
+
+    def tearDown(self):
+        self.history.close()
+
+    # This function returns the texts of the messages found by the search
+    def search(self, userName, query, limit=20):
+        return [(peer, message.text) for peer, message in self.history.search(userName, query.split(), limit)]
+
+    def testSearchIgnoresPunctuationAndCase(self):
+        self.assertEqual(self.search('hans', 'hello!'), [('vader', 'hello father'),
+                                                         ('yoda', 'Hello, Hans. How is the world?'),
+                                                         ('yoda', 'hello world!')])
+        self.assertEqual(self.search('hans', 'WORLD, hello'), [('yoda', 'Hello, Hans. How is the world?'),
+                                                               ('yoda', 'hello world!')])
+        self.assertEqual(self.search('hans', 'hello hello! HELLO'), self.search('hans', 'hello'))
+
+    def testSearchOnlyConversationsOfUser(self):
+        self.assertEqual(self.search('yoda', 'there'), [('vader', 'hello there')])
+        self.assertEqual(self.search('hans', 'there'), [])
+
+    def testSearchWithoutMatch(self):
+        self.assertEqual(self.search('hans', 'hello galaxy'), [])
+        self.assertEqual(self.search('hans', '!?'), [])
+        self.assertEqual(self.search('hans', ''), [])
+
+    def testSearchLimit(self):
+        self.assertEqual(self.search('hans', 'hello', limit=1), [('vader', 'hello father')])
+
+    def testPages(self):
+        for index in range(100):
+            self.history.append('hans', 'yoda', f"page {index}")
+        page = self.history.page('yoda', 'hans', limit=10)
+        self.assertEqual([message.text for message in page], [f"page {index}" for index in range(90, 100)])
+        before = self.history.page('hans', 'yoda', beforeId=page[0].id, limit=3)
+        self.assertEqual([message.text for message in before], ['page 87', 'page 88', 'page 89'])
+        self.assertEqual(self.history.page('hans', 'luke'), [])
+
+    def testQueryWords(self):
+        self.assertEqual(queryWords("Hello, hello world! it's"), ['hello', 'world', 'it', 's'])
+        self.assertEqual(queryWords('?!'), [])
+
+"""
+    Define the tests of a history kept on the disk, which also read it back.
+"""
+class DiskHistoryStoreTest(HistoryStoreTest):
+
+    # This function returns a store in a temporary directory, with small
+    # segments so that the messages span several of them
+    def store(self):
+        self.directory = tempfile.mkdtemp(prefix='historytest-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        history = HistoryStore(self.directory, segmentSize=256)
+        history.loaded.wait()
+        return history
+
+    def testReadBack(self):
+        self.history.checkpoint()
+        self.history.close()
+        self.history = HistoryStore(self.directory, segmentSize=256)
+        self.history.loaded.wait()
+        self.assertEqual(len(self.history), 4)
+        self.assertEqual(self.search('hans', 'world'), [('yoda', 'Hello, Hans. How is the world?'),
+                                                        ('yoda', 'hello world!')])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+    Python 3
+    Unit tests of the login lockouts of lockouts.py, kept in memory and in a
+    log with snapshots, and of the pool of authentication workers of
+    loginpool.py.
+    Usage: python3 -m pytest src/Server
+"""
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+import statestore
+from lockouts import LoginLockouts
+from loginpool import LoginPool
+from statestore import SnapshotLog
+
+# The time in seconds a test waits for a login to be worked on
+TIMEOUT = 5
+
+"""
+    Define the tests of the lockouts, expiring after 10 seconds.
+"""
+class LoginLockoutsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='lockouttest-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    # This function returns the lockouts of the log in the temporary directory
+    def open(self):
+        log = SnapshotLog(self.directory, 'lockouts')
+        self.addCleanup(log.close)
+        return LoginLockouts(log, duration=10)
+
+    def testExpiry(self):
+        lockouts = LoginLockouts(duration=10)
+        now = datetime.now()
+        lockouts.add('hans', now - timedelta(seconds=20))
+        lockouts.add('yoda', now)
+        self.assertIsNone(lockouts.blockedTime('hans'))
+        self.assertEqual(lockouts.blockedTime('yoda'), now)
+        self.assertEqual(len(lockouts), 1)
+
+        # A lockout made again outlives the expiry of the earlier one
+        lockouts.add('vader', now - timedelta(seconds=20))
+        lockouts.add('vader', now)
+        self.assertEqual(lockouts.blockedTime('vader'), now)
+
+    def testLift(self):
+        lockouts = LoginLockouts()
+        lockouts.add('hans', datetime.now())
+        lockouts.lift('hans')
+        lockouts.lift('yoda')
+        self.assertIsNone(lockouts.blockedTime('hans'))
+
+    def testReadBack(self):
+        lockouts = self.open()
+        now = datetime.now()
+        lockouts.add('hans', now - timedelta(seconds=20))
+        lockouts.add('yoda', now)
+        lockouts.add('vader', now)
+        lockouts.lift('vader')
+        lockouts.log.close()
+
+        # The expired lockout of hans and the lifted one of vader are left out
+        lockouts = self.open()
+        self.assertEqual(dict(lockouts), {'yoda': now})
+        self.assertIsNone(lockouts.blockedTime('hans'))
+
+    def testCheckpoint(self):
+        self.addCleanup(setattr, statestore, 'SNAPSHOT_SLACK', statestore.SNAPSHOT_SLACK)
+        statestore.SNAPSHOT_SLACK = 0
+        lockouts = self.open()
+        now = datetime.now()
+        for _ in range(3):
+            lockouts.add('hans', now)
+            lockouts.lift('hans')
+        lockouts.add('yoda', now)
+        lockouts.checkpoint()
+        self.assertEqual(lockouts.log.generation, 1)
+        lockouts.log.close()
+        lockouts = self.open()
+        self.assertEqual(dict(lockouts), {'yoda': now})
+        self.assertEqual(lockouts.log.logRecords, 0)
+
+"""
+    Define the tests of the pool of authentication workers.
+"""
+class LoginPoolTest(unittest.TestCase):
+
+    def testResults(self):
+        pool = LoginPool(workers=2)
+        self.assertEqual(pool.submit(sum, [1, 2, 3]).result(TIMEOUT), 6)
+        future = pool.submit(int, 'falcon*solo')
+        with self.assertRaises(ValueError):
+            future.result(TIMEOUT)
+
+    def testQueueLimit(self):
+        pool = LoginPool(workers=1, queueLimit=2)
+        release = threading.Event()
+        first = pool.submit(release.wait, TIMEOUT)
+        second = pool.submit(len, 'hans')
+
+        # A login beyond the limit is refused at once, until there is room
+        self.assertIsNone(pool.submit(len, 'yoda'))
+        self.assertEqual(len(pool), 2)
+        release.set()
+        self.assertTrue(first.result(TIMEOUT))
+        self.assertEqual(second.result(TIMEOUT), 4)
+        self.assertEqual(pool.submit(len, 'yoda').result(TIMEOUT), 4)
+
+if __name__ == "__main__":
+    unittest.main()
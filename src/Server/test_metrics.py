@@ -0,0 +1,108 @@
+"""
+    Python 3
+    Unit tests of the metrics of metrics.py and of their rendering in the
+    Prometheus text format and in the line of the log.
+    Usage: python3 -m pytest src/Server
+"""
+import unittest
+from metrics import Counter, LabeledCounter, Histogram, Metrics
+
+"""
+    Define the tests of the metrics.
+"""
+class MetricsTest(unittest.TestCase):
+
+    def testCounterAndGauges(self):
+        counter = Counter('chat_test_total', 'Test counter')
+        counter.inc()
+        counter.inc(4)
+        self.assertEqual(counter.render(), ["chat_test_total 5"])
+        gauge = Counter('chat_test_open', 'Test gauge', 'gauge')
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(gauge.render(), ["chat_test_open 2"])
+
+        # A gauge read from a function which fails is rendered as 0
+        self.assertEqual(Counter('chat_test_depth', 'Test', 'gauge', lambda: 7).render(), ["chat_test_depth 7"])
+        self.assertEqual(Counter('chat_test_depth', 'Test', 'gauge', lambda: 1 // 0).render(), ["chat_test_depth 0"])
+
+    def testLabeledCounter(self):
+        counter = LabeledCounter('chat_test_commands_total', 'Test', 'command')
+        counter.inc('whoelse')
+        counter.inc('message', 2)
+        counter.inc('whoelse')
+        self.assertEqual(counter.get(), 4)
+        self.assertEqual(counter.render(), ['chat_test_commands_total{command="message"} 2',
+                                            'chat_test_commands_total{command="whoelse"} 2'])
+
+    def testHistogram(self):
+        histogram = Histogram('chat_test_fanout', 'Test', (1, 5, 10))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0, 1, 2, 5, 7, 50):
+            histogram.observe(value)
+
+        # A value equal to a bound is counted in the bucket of that bound, and
+        # the buckets are cumulative
+        self.assertEqual(histogram.render(), ['chat_test_fanout_bucket{le="1"} 2',
+                                              'chat_test_fanout_bucket{le="5"} 4',
+                                              'chat_test_fanout_bucket{le="10"} 5',
+                                              'chat_test_fanout_bucket{le="+Inf"} 6',
+                                              'chat_test_fanout_sum 65',
+                                              'chat_test_fanout_count 6'])
+        self.assertEqual(histogram.get(), 6)
+        self.assertEqual(histogram.quantile(0.5), 5)
+        self.assertEqual(histogram.quantile(0.8), 10)
+        self.assertEqual(histogram.quantile(0.99), float('inf'))
+
+    def testRender(self):
+        metrics = Metrics()
+        metrics.connections.inc(3)
+        metrics.openConnections.inc(2)
+        metrics.fanOut.observe(3)
+        metrics.addGauge('chat_test_depth', 'Test gauge', lambda: 9)
+        lines = metrics.render().splitlines()
+        self.assertTrue(metrics.render().endswith('\n'))
+
+        # Every metric is preceded by its help and type
+        start = lines.index("# HELP chat_connections_total Connections accepted")
+        self.assertEqual(lines[start:start + 6], ["# HELP chat_connections_total Connections accepted",
+                                                  "# TYPE chat_connections_total counter",
+                                                  "chat_connections_total 3",
+                                                  "# HELP chat_connections_open Connections currently open",
+                                                  "# TYPE chat_connections_open gauge",
+                                                  "chat_connections_open 2"])
+        start = lines.index("# TYPE chat_broadcast_fanout histogram")
+        self.assertEqual(lines[start + 1:start + 6], ['chat_broadcast_fanout_bucket{le="0"} 0',
+                                                      'chat_broadcast_fanout_bucket{le="1"} 0',
+                                                      'chat_broadcast_fanout_bucket{le="2"} 0',
+                                                      'chat_broadcast_fanout_bucket{le="5"} 1',
+                                                      'chat_broadcast_fanout_bucket{le="10"} 1'])
+        self.assertIn('chat_broadcast_fanout_bucket{le="+Inf"} 1', lines)
+        self.assertIn("chat_broadcast_fanout_sum 3", lines)
+        self.assertEqual(lines[-3:], ["# HELP chat_test_depth Test gauge", "# TYPE chat_test_depth gauge",
+                                      "chat_test_depth 9"])
+
+    def testSummary(self):
+        metrics = Metrics()
+        metrics.connections.inc()
+        metrics.fanOut.observe(3)
+        fields = metrics.summary().split()
+        self.assertEqual(fields[0], 'metrics')
+        self.assertIn('connections_total=1', fields)
+        self.assertIn('fanout_p50=5', fields)
+        self.assertIn('delivery_seconds_p99=None', fields)
+        self.assertFalse(any(field.startswith('broadcast_fanout=') for field in fields))
+
+    def testCommands(self):
+
+        # Commands are counted by name, anything else as invalid
+        metrics = Metrics()
+        for command in ('whoelse', 'message', 'whoelse', 'hello'):
+            metrics.commandStarted(command)
+            metrics.commandFinished()
+        self.assertEqual(metrics.commands.render(), ['chat_commands_total{command="invalid"} 1',
+                                                     'chat_commands_total{command="message"} 1',
+                                                     'chat_commands_total{command="whoelse"} 2'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+    Python 3
+    Unit tests of the offline message store of offlinestore.py, kept in
+    memory and in a segmented log which is read back, recovered and
+    compacted.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from offlinestore import OfflineStore
+
+"""
+    Define the tests of the queues of a store kept in memory.
+"""
+class OfflineStoreTest(unittest.TestCase):
+
+    def testQueuesPerRecipient(self):
+        store = OfflineStore(None)
+        for index in range(5):
+            store.enqueue('yoda', f"hans: message {index}")
+        store.enqueue('vader', "hans: hello father")
+        self.assertEqual(store.pendingFor('yoda'), 5)
+        self.assertEqual(len(store), 6)
+        self.assertEqual(list(store.drainBatches('yoda', batchSize=2)),
+                         [["hans: message 0", "hans: message 1"], ["hans: message 2", "hans: message 3"],
+                          ["hans: message 4"]])
+        self.assertEqual(store.pendingFor('yoda'), 0)
+        self.assertEqual(store.takeBatch('luke'), [])
+        self.assertEqual(len(store), 1)
+
+"""
+    Define the tests of a store kept in a log in a temporary directory.
+"""
+class DiskOfflineStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='offlinetest-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    # This function opens the store of the directory and waits until its log
+    # has been read
+    def open(self, **options):
+        store = OfflineStore(self.directory, **options)
+        store.loaded.wait()
+        self.addCleanup(store.close)
+        return store
+
+    # This function returns the segments of the log in the directory
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('segment-'))
+
+    def testReadBack(self):
+        store = self.open()
+        for index in range(3):
+            store.enqueue('yoda', f"hans: message {index}")
+        store.enqueue('vader', "hans: hello father")
+        self.assertEqual(store.takeBatch('yoda', batchSize=2), ["hans: message 0", "hans: message 1"])
+        store.close()
+
+        # Only the messages which have not been delivered are queued again
+        store = self.open()
+        self.assertEqual(store.takeBatch('yoda'), ["hans: message 2"])
+        self.assertEqual(store.takeBatch('vader'), ["hans: hello father"])
+        store.enqueue('yoda', "hans: message 3")
+        self.assertEqual(store.takeBatch('yoda'), ["hans: message 3"])
+
+    def testTruncatedLog(self):
+        store = self.open()
+        store.enqueue('yoda', "hans: hello")
+        store.sync()
+        path = os.path.join(self.directory, self.segments()[-1])
+        size = os.path.getsize(path)
+        store.enqueue('yoda', "hans: still there?")
+        store.close()
+
+        # The server stopped while it was writing the last record
+        with open(path, 'r+b') as c:
+            c.truncate(os.path.getsize(path) - 5)
+        store = self.open()
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(store.takeBatch('yoda'), ["hans: hello"])
+
+        # The records appended after the cut are read back
+        store.enqueue('yoda', "hans: hello again")
+        store.close()
+        store = self.open()
+        self.assertEqual(store.takeBatch('yoda'), ["hans: hello again"])
+
+    def testCompaction(self):
+        store = self.open(segmentSize=256)
+        store.enqueue('vader', "hans: hello father")
+        for index in range(20):
+            store.enqueue('yoda', f"hans: message {index:02d}")
+        written = self.segments()
+        self.assertGreater(len(written), 2)
+
+        # The segments of the delivered messages are deleted and the message
+        # of vader is moved out of its sparse segment
+        self.assertEqual(len(store.takeBatch('yoda')), 20)
+        store.compact()
+        self.assertTrue(set(self.segments()).isdisjoint(written[:-1]))
+        store.close()
+        store = self.open(segmentSize=256)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.takeBatch('vader'), ["hans: hello father"])
+        self.assertEqual(store.takeBatch('yoda'), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+    Python 3
+    Unit tests of the bounded outbound queue of outbound.py, its watermarks
+    and its slow consumer policies, and of the vectored writes of its frames.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import encodeFrame
+from offlinestore import OfflineStore
+import outbound
+from outbound import OutboundQueue, sendFrames, DISCONNECT, DROP, SPILL
+from wire import TEXT_CODEC
+
+# Every frame of the tests is 10 bytes long
+FRAME_SIZE = len(encodeFrame("message 0"))
+
+"""
+    Define a session holding an outbound queue, which spills messages to an
+    offline store kept in memory.
+"""
+class QueueSession:
+
+    # This is the constructor of the session, whose queue has the given policy
+    # and watermarks of 3 and 1 frames
+    def __init__(self, policy):
+        self.codec = TEXT_CODEC
+        self.offline = OfflineStore(None)
+        self.disconnected = False
+        self.outbound = OutboundQueue(self, highWatermark=3 * FRAME_SIZE, lowWatermark=FRAME_SIZE, policy=policy)
+
+    # This function keeps a message the client does not keep up with
+    def spillMessage(self, message):
+        self.offline.enqueue('spill', message)
+
+    # This function returns a batch of the spilled messages
+    def recoverSpilledMessages(self, batchSize):
+        return self.offline.takeBatch('spill', batchSize)
+
+    # This function records the disconnection of the client
+    def disconnectSlowConsumer(self):
+        self.disconnected = True
+        self.outbound.close()
+
+"""
+    Define the tests of the outbound queue.
+"""
+class OutboundQueueTest(unittest.TestCase):
+
+    # This function offers the frames of the given messages to the queue and
+    # returns which ones have been queued
+    def offer(self, queue, indices):
+        return [queue.offer(encodeFrame(f"message {index}")) for index in indices]
+
+    # This function returns the messages of the frames taken from the queue
+    def take(self, queue, frames=None):
+        maxBytes = 1 if frames == 1 else 256 * 1024
+        return [frame[4:].decode() for frame in queue.take(maxBytes)]
+
+    def testWatermarks(self):
+        session = QueueSession(DROP)
+        queue = session.outbound
+        self.assertEqual(self.offer(queue, range(4)), [True, True, True, False])
+        self.assertTrue(queue.congested)
+
+        # The connection stays congested until it drains to the low watermark
+        self.assertEqual(self.take(queue, 1), ["message 0"])
+        self.assertTrue(queue.congested)
+        self.assertEqual(self.offer(queue, [4]), [False])
+        self.assertEqual(self.take(queue, 1), ["message 1"])
+        self.assertFalse(queue.congested)
+        self.assertEqual(self.offer(queue, [5]), [True])
+        self.assertEqual(self.take(queue), ["message 2", "message 5"])
+        self.assertEqual(queue.droppedCount, 2)
+
+    def testPushIgnoresWatermarks(self):
+        session = QueueSession(DROP)
+        queue = session.outbound
+        for index in range(5):
+            queue.push(encodeFrame(f"message {index}"))
+        self.assertTrue(queue.congested)
+        self.assertEqual(self.offer(queue, [5]), [False])
+        self.assertEqual(len(self.take(queue)), 5)
+
+    def testSpill(self):
+        session = QueueSession(SPILL)
+        queue = session.outbound
+        self.assertEqual(self.offer(queue, range(5)), [True, True, True, False, False])
+        self.assertEqual(session.offline.pendingFor('spill'), 2)
+        self.assertEqual(self.take(queue), ["message 0", "message 1", "message 2"])
+
+        # Messages delivered while spilled messages remain are spilled as well,
+        # so they are taken back in order
+        self.assertEqual(self.offer(queue, [5]), [False])
+        self.assertEqual(self.take(queue), ["message 3", "message 4", "message 5"])
+        self.assertEqual(self.take(queue), [])
+        self.assertFalse(queue.spilling)
+        self.assertEqual(self.offer(queue, [6]), [True])
+        self.assertEqual(queue.spilledCount, 3)
+
+    def testDisconnect(self):
+        session = QueueSession(DISCONNECT)
+        queue = session.outbound
+        self.assertEqual(self.offer(queue, range(4)), [True, True, True, False])
+        self.assertTrue(session.disconnected)
+
+        # The frames already queued are still written before the connection is
+        # closed, nothing is queued anymore
+        self.assertEqual(self.offer(queue, [4]), [False])
+        self.assertEqual(self.take(queue), ["message 0", "message 1", "message 2"])
+        self.assertTrue(queue.isFinished())
+
+"""
+    Define a blocking socket which accepts at most the given number of bytes
+    per sendmsg call, as a socket whose send buffer is nearly full does.
+"""
+class TricklingSocket:
+
+    # This is the constructor of the socket
+    def __init__(self, chunkSize):
+        self.chunkSize = chunkSize
+        self.data = bytearray()
+        self.calls = []
+
+    # This function writes the first bytes of the given buffers and returns
+    # their number, keeping the number of buffers of the call
+    def sendmsg(self, buffers):
+        self.calls.append(len(buffers))
+        sent = b''.join(buffers)[:self.chunkSize]
+        self.data += sent
+        return len(sent)
+
+"""
+    Define the tests of the vectored writes of the frames to a socket.
+"""
+class SendFramesTest(unittest.TestCase):
+
+    def testPartialWrites(self):
+
+        # Every call stops within a frame, whose rest starts the next call
+        frames = [encodeFrame(f"message {index}") for index in range(5)]
+        sock = TricklingSocket(7)
+        sendFrames(sock, frames)
+        self.assertEqual(bytes(sock.data), b''.join(frames))
+        self.assertEqual(len(sock.calls), -(-len(sock.data) // 7))
+        self.assertEqual(sock.calls[:3], [5, 5, 4])
+
+    def testBuffersPerCall(self):
+        frames = [encodeFrame(f"message {index}") for index in range(5)]
+        sock = TricklingSocket(1024)
+        with mock.patch.object(outbound, 'IOV_MAX', 2):
+            sendFrames(sock, frames)
+        self.assertEqual(bytes(sock.data), b''.join(frames))
+        self.assertEqual(sock.calls, [2, 2, 1])
+
+    def testSharedFrame(self):
+
+        # A broadcast encodes its frame once for all the recipients, which is
+        # written unchanged to every socket however it is split
+        frame = encodeFrame("hans: hello everyone")
+        original = bytes(frame)
+        sockets = [TricklingSocket(3), TricklingSocket(1024)]
+        for sock in sockets:
+            sendFrames(sock, [frame, encodeFrame("yoda logged in")])
+        self.assertEqual(bytes(sockets[0].data), bytes(sockets[1].data))
+        self.assertEqual(bytes(sockets[0].data), original + encodeFrame("yoda logged in"))
+        self.assertEqual(frame, original)
+
+if __name__ == "__main__":
+    unittest.main()
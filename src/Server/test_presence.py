@@ -0,0 +1,86 @@
+"""
+    Python 3
+    Unit tests of the registry of the logged in users of presence.py.
+    Usage: python3 -m pytest src/Server
+"""
+import unittest
+from presence import PresenceRegistry, SessionRecord
+
+"""
+    Define a session, which the registry only compares by identity.
+"""
+class Session:
+    pass
+
+"""
+    Define the tests of the presence registry.
+"""
+class PresenceRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.presence = PresenceRegistry()
+
+    # This function logs the given user in with a new session and returns the
+    # record of the user
+    def logIn(self, userName, port=1000):
+        record = SessionRecord(userName, '127.0.0.1', port, Session(), port + 1)
+        self.assertTrue(self.presence.login(record))
+        return record
+
+    def testLoginAndLogout(self):
+        hans = self.logIn('hans')
+        self.assertFalse(self.presence.login(SessionRecord('hans', '127.0.0.1', 2000, Session(), 2001)))
+        self.assertIs(self.presence.lookup('hans'), hans)
+        self.assertEqual(len(self.presence), 1)
+        self.assertIs(self.presence.logout('hans'), hans)
+        self.assertIsNone(self.presence.logout('hans'))
+        self.assertEqual(len(self.presence), 0)
+
+    def testLogoutOfStaleSession(self):
+        old = self.logIn('hans')
+        self.presence.logout('hans', old.session)
+        new = self.logIn('hans', 2000)
+
+        # The logout of the session which has been replaced leaves the new
+        # login of the user in place
+        self.assertIsNone(self.presence.logout('hans', old.session))
+        self.assertIs(self.presence.lookup('hans'), new)
+        self.assertIs(self.presence.logout('hans', new.session), new)
+        self.assertFalse(self.presence.isOnline('hans'))
+
+    def testSnapshot(self):
+        hans = self.logIn('hans')
+        snapshot = self.presence.snapshot()
+        self.assertEqual(snapshot, (hans,))
+
+        # The snapshot is kept until somebody logs in or out
+        self.assertIs(self.presence.snapshot(), snapshot)
+        yoda = self.logIn('yoda', 2000)
+        self.assertEqual(snapshot, (hans,))
+        self.assertEqual(set(self.presence.snapshot()), {hans, yoda})
+        snapshot = self.presence.snapshot()
+        self.presence.logout('hans')
+        self.assertEqual(self.presence.snapshot(), (yoda,))
+        self.assertEqual(set(snapshot), {hans, yoda})
+
+        # A failed login or logout keeps the snapshot
+        snapshot = self.presence.snapshot()
+        self.presence.login(SessionRecord('yoda', '127.0.0.1', 3000, Session(), 3001))
+        self.presence.logout('vader')
+        self.assertIs(self.presence.snapshot(), snapshot)
+
+    def testLookup(self):
+
+        # The record holds the address and the port of the peer to peer
+        # connections of the user
+        record = self.logIn('yoda', 2000)
+        found = self.presence.lookup('yoda')
+        self.assertIs(found, record)
+        self.assertEqual((found.userName, found.ipAddress, found.port, found.p2pPort),
+                         ('yoda', '127.0.0.1', 2000, 2001))
+        self.assertTrue(self.presence.isOnline('yoda'))
+        self.assertIsNone(self.presence.lookup('vader'))
+        self.assertFalse(self.presence.isOnline('vader'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+    Python 3
+    Unit tests of the presence feed of presencefeed.py, its snapshots and its
+    coalesced changes filtered against the blocks of every subscriber.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import serverstate
+from blockgraph import BlockGraph
+from framing import FrameDecoder
+from presence import PresenceRegistry, SessionRecord
+from presencefeed import PresenceFeed
+from wire import TEXT_CODEC
+
+"""
+    Define a session of the text protocol which keeps the texts sent to it,
+    and the frames themselves.
+"""
+class FeedSession:
+
+    # This is the constructor of the session of the given user
+    def __init__(self, userName):
+        self.userName = userName
+        self.codec = TEXT_CODEC
+        self.followsPresence = False
+        self.decoder = FrameDecoder()
+        self.frames = []
+
+    # This function keeps the frame
+    def sendFrame(self, frame):
+        self.frames.append(frame)
+
+    # This function returns the texts of the frames sent since the last call
+    def take(self):
+        frames, self.frames = self.frames, []
+        return [payload.decode() for frame in frames for payload in self.decoder.feed(frame)]
+
+"""
+    Define the tests of the feed, whose changes are sent by calling flush()
+    instead of once per window.
+"""
+class PresenceFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, serverstate, 'blockGraph', serverstate.blockGraph)
+        serverstate.blockGraph = BlockGraph(None)
+        self.presence = PresenceRegistry()
+        self.feed = PresenceFeed(self.presence)
+        self.sessions = {}
+
+    # This function logs the user in with a new session and returns it
+    def login(self, userName):
+        session = self.sessions[userName] = FeedSession(userName)
+        self.presence.login(SessionRecord(userName, '127.0.0.1', 1000, session, 1001))
+        return session
+
+    # This function logs the user out
+    def logout(self, userName):
+        self.presence.logout(userName, self.sessions.pop(userName))
+
+    def testSnapshot(self):
+        self.login('yoda')
+        self.login('vader')
+        hans = self.login('hans')
+        self.feed.subscribe(hans)
+        self.assertEqual(hans.take(), ["Presence version 3, online: vader yoda\n"])
+        self.assertTrue(hans.followsPresence)
+        luke = self.login('luke')
+        self.feed.subscribe(luke, ['hans', 'leia'])
+        self.assertEqual(luke.take(), ["Presence version 4, online: hans\n"])
+        self.assertEqual(self.feed.follows(luke), ['hans', 'leia'])
+        self.assertIs(self.feed.follows(hans), True)
+
+    def testCoalescing(self):
+        hans = self.login('hans')
+        self.feed.subscribe(hans)
+        hans.take()
+
+        # A user logging in and out within the window is left out, a user
+        # logging in, out and in again is sent once
+        self.login('yoda')
+        self.login('vader')
+        self.logout('vader')
+        self.logout('yoda')
+        self.login('yoda')
+        self.login('luke')
+        self.feed.flush()
+        self.assertEqual(hans.take(), ["Presence version 7: yoda logged in, luke logged in\n"])
+        self.logout('luke')
+        self.login('luke')
+        self.feed.flush()
+        self.assertEqual(hans.take(), [])
+
+    def testSharedFrame(self):
+        hans = self.login('hans')
+        yoda = self.login('yoda')
+        self.feed.subscribe(hans)
+        self.feed.subscribe(yoda)
+        self.login('luke')
+        self.feed.flush()
+
+        # The frame of the changes is built once for all the subscribers
+        self.assertIs(hans.frames[-1], yoda.frames[-1])
+        self.assertEqual(hans.take()[-1], "Presence version 3: luke logged in\n")
+
+    def testFollowedUsers(self):
+        hans = self.login('hans')
+        self.feed.subscribe(hans, ['yoda'])
+        hans.take()
+        self.login('yoda')
+        self.login('vader')
+        self.feed.flush()
+        self.assertEqual(hans.take(), ["Presence version 3: yoda logged in\n"])
+
+        # The subscription is extended to more users
+        self.feed.subscribe(hans, ['vader'])
+        self.assertEqual(hans.take(), ["Presence version 3, online: vader yoda\n"])
+        self.logout('vader')
+        self.feed.flush()
+        self.assertEqual(hans.take(), ["Presence version 4: vader logged out\n"])
+
+    def testBlockers(self):
+        hans = self.login('hans')
+        yoda = self.login('yoda')
+        serverstate.blockGraph.block('vader', 'hans')
+        self.login('vader')
+        self.feed.subscribe(hans)
+        self.feed.subscribe(yoda)
+        self.assertEqual(hans.take(), ["Presence version 3, online: yoda\n"])
+
+        # Only yoda sees vader, who blocks hans, log out
+        self.logout('vader')
+        self.login('luke')
+        self.feed.flush()
+        self.assertEqual(hans.take(), ["Presence version 5: luke logged in\n"])
+        self.assertEqual(yoda.take(), ["Presence version 3, online: hans vader\n",
+                                       "Presence version 5: vader logged out, luke logged in\n"])
+
+    def testLogoutEndsSubscription(self):
+        hans = self.login('hans')
+        self.feed.subscribe(hans)
+        self.logout('hans')
+        self.assertFalse(hans.followsPresence)
+        self.assertEqual(len(self.feed), 0)
+        self.assertIsNone(self.feed.follows(hans))
+        self.assertFalse(self.feed.unsubscribe(hans))
+
+if __name__ == "__main__":
+    unittest.main()
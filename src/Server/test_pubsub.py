@@ -0,0 +1,125 @@
+"""
+    Python 3
+    Unit tests of the publish/subscribe clients of pubsub.py, connected in
+    one process and through a broker over socket pairs.
+    Usage: python3 -m pytest src/Server
+"""
+import asyncio
+import queue
+import socket
+import threading
+import unittest
+from pubsub import LocalPubSub, PubSubBroker, StreamPubSub
+
+# The time in seconds a test waits for a message
+TIMEOUT = 5
+
+"""
+    Define the base of the tests, whose clients put the messages they receive
+    into one queue each.
+"""
+class PubSubTestCase(unittest.TestCase):
+
+    # This function starts the given client and returns the queue of its
+    # messages, to which None is put once it has been disconnected
+    def startClient(self, client):
+        messages = queue.Queue()
+        client.start(lambda topic, data: messages.put((topic, data)), lambda: messages.put(None))
+        return messages
+
+    # This function returns the next message of the queue
+    def next(self, messages):
+        return messages.get(timeout=TIMEOUT)
+
+    # This function waits until the subscriptions of the given queues to the
+    # topic have been made, as the broker handles the requests of every client
+    # in order but those of different clients in any order. The publisher
+    # publishes until every queue has received one of its messages, and the
+    # messages published meanwhile are then taken from the queues
+    def waitForSubscribers(self, publisher, topic, subscribers):
+        pending = list(subscribers)
+        while pending:
+            publisher.publish(topic, b'ready')
+            for messages in list(pending):
+                try:
+                    if messages.get(timeout=0.05) == (topic, b'ready'):
+                        pending.remove(messages)
+                except queue.Empty:
+                    pass
+        publisher.publish(topic, b'done')
+        for messages in subscribers:
+            while self.next(messages) != (topic, b'done'):
+                pass
+
+    # This function checks that the queue has received nothing else
+    def assertNothingElse(self, messages):
+        with self.assertRaises(queue.Empty):
+            messages.get(timeout=0.1)
+
+    # This function has the three clients exchange messages and checks that
+    # each reaches the other subscribers of its topic only
+    def exchange(self, hans, yoda, vader):
+        hansMessages = self.startClient(hans)
+        yodaMessages = self.startClient(yoda)
+        vaderMessages = self.startClient(vader)
+        for client in (hans, yoda, vader):
+            client.subscribe('all')
+        yoda.subscribe('node.1')
+        vader.setWill('all', b'vader left')
+        self.waitForSubscribers(hans, 'all', [yodaMessages, vaderMessages])
+        self.waitForSubscribers(vader, 'all', [hansMessages, yodaMessages])
+        self.waitForSubscribers(hans, 'node.1', [yodaMessages])
+        hans.publish('all', b'hello\nthere')
+        yoda.publish('node.1', b'to myself')
+        vader.publish('node.2', b'to nobody')
+        self.assertEqual(self.next(yodaMessages), ('all', b'hello\nthere'))
+        self.assertEqual(self.next(vaderMessages), ('all', b'hello\nthere'))
+        self.assertNothingElse(hansMessages)
+        self.assertNothingElse(yodaMessages)
+        self.assertNothingElse(vaderMessages)
+
+        # The will of a client is published once it is gone
+        vader.close()
+        self.assertEqual(self.next(hansMessages), ('all', b'vader left'))
+        self.assertEqual(self.next(yodaMessages), ('all', b'vader left'))
+
+"""
+    Define the tests of the clients connected in one process.
+"""
+class LocalPubSubTest(PubSubTestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, LocalPubSub, 'subscribers', LocalPubSub.subscribers)
+        LocalPubSub.subscribers = {}
+
+    def testExchange(self):
+        self.exchange(LocalPubSub(), LocalPubSub(), LocalPubSub())
+
+"""
+    Define the tests of the clients of a broker, which runs on its own event
+    loop over socket pairs like the broker of the workers of a server.
+"""
+class StreamPubSubTest(PubSubTestCase):
+
+    def setUp(self):
+        pairs = [socket.socketpair() for index in range(3)]
+        self.clients = [StreamPubSub(clientSocket) for brokerSocket, clientSocket in pairs]
+        broker = threading.Thread(target=asyncio.run,
+                                  args=(PubSubBroker().serveSockets([brokerSocket for brokerSocket, clientSocket in pairs]),))
+        broker.daemon = True
+        broker.start()
+        self.addCleanup(broker.join, TIMEOUT)
+        for client in self.clients:
+            self.addCleanup(client.close)
+
+    def testExchange(self):
+        self.exchange(*self.clients)
+
+    def testBrokerGone(self):
+        messages = self.startClient(self.clients[0])
+        for client in self.clients:
+            client.close()
+        self.assertIsNone(self.next(messages))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+    Python 3
+    Unit tests of the token buckets and the rate limits of ratelimit.py.
+    Usage: python3 -m pytest src/Server
+"""
+import time
+import unittest
+from ratelimit import TokenBucket, RateLimiter, parseCosts, ADMITTED, DELAYED, REJECTED, SHED
+
+"""
+    Define the tests of a token bucket, charged at given times.
+"""
+class TokenBucketTest(unittest.TestCase):
+
+    # This function returns a full bucket last refilled at time 0
+    def bucket(self, rate, burst):
+        bucket = TokenBucket(rate, burst)
+        bucket.updated = 0.0
+        return bucket
+
+    def testTakesWithinBurst(self):
+        bucket = self.bucket(10, 5)
+        self.assertEqual(bucket.take(5, 0.0), 0.0)
+        self.assertIsNone(bucket.take(1, 0.0))
+        self.assertEqual(bucket.tokens, 0)
+
+    def testRefillsUpToBurst(self):
+        bucket = self.bucket(10, 5)
+        bucket.take(5, 0.0)
+        bucket.refill(0.2)
+        self.assertAlmostEqual(bucket.tokens, 2)
+        bucket.refill(0.1)
+        self.assertAlmostEqual(bucket.tokens, 2)
+        bucket.refill(10.0)
+        self.assertEqual(bucket.tokens, 5)
+
+    def testDelaysIntoDebt(self):
+        bucket = self.bucket(10, 5)
+        bucket.take(5, 0.0)
+        self.assertAlmostEqual(bucket.take(2, 0.0, maxDelay=1.0), 0.2)
+        self.assertAlmostEqual(bucket.take(2, 0.0, maxDelay=1.0), 0.4)
+        self.assertIsNone(bucket.take(2, 0.0, maxDelay=0.5))
+        self.assertEqual(bucket.tokens, -4)
+
+        # A command costing more than the burst waits for a full bucket
+        self.assertAlmostEqual(bucket.take(10, 0.0, maxDelay=1.0), 0.9)
+
+    def testAdmitsCostAboveBurstWhenFull(self):
+        bucket = self.bucket(1, 5)
+        self.assertEqual(bucket.take(10, 0.0), 0.0)
+        self.assertIsNone(bucket.take(10, 0.0))
+        self.assertEqual(bucket.take(10, 10.0), 0.0)
+
+"""
+    Define the tests of the rate limits of the users and of the process.
+"""
+class RateLimiterTest(unittest.TestCase):
+
+    # The commands of a test are charged at this time, after the limiter was
+    # created
+    def setUp(self):
+        self.now = time.monotonic() + 1.0
+
+    def testUnlimited(self):
+        limiter = RateLimiter()
+        for _ in range(1000):
+            self.assertEqual(limiter.admit('hans', 'broadcast', self.now), (ADMITTED, 0.0))
+
+    def testBurstCoversHighestCost(self):
+        for policy in ('delay', 'reject'):
+            limiter = RateLimiter(userRate=1, policy=policy)
+            self.assertEqual(limiter.userBurst, 10)
+            self.assertEqual(limiter.admit('hans', 'broadcast', self.now), (ADMITTED, 0.0))
+            self.assertEqual(limiter.admit('hans', 'broadcast', self.now)[0], REJECTED)
+        limiter = RateLimiter(globalRate=1)
+        self.assertEqual(limiter.admit('hans', 'search', self.now), (ADMITTED, 0.0))
+        self.assertEqual(limiter.admit('hans', 'search', self.now)[0], SHED)
+
+    def testExplicitBurst(self):
+        self.assertEqual(RateLimiter(userRate=100, userBurst=20).userBurst, 20)
+        self.assertEqual(RateLimiter(userRate=100, userBurst=0).userBurst, 10)
+        self.assertEqual(RateLimiter(globalRate=100, globalBurst=20).globalBucket.burst, 20)
+        self.assertEqual(RateLimiter(userRate=100).userBurst, 500)
+
+    def testBucketKeptByUser(self):
+        limiter = RateLimiter(userRate=1, userBurst=10, policy='reject')
+        for _ in range(10):
+            self.assertEqual(limiter.admit('hans', 'message', self.now)[0], ADMITTED)
+        self.assertEqual(limiter.admit('hans', 'message', self.now)[0], REJECTED)
+        self.assertEqual(limiter.admit('yoda', 'message', self.now)[0], ADMITTED)
+        tokens = limiter.userTokens('hans', self.now)
+        self.assertLess(tokens, 1)
+
+        # Another process taking the session over goes on with the tokens left
+        other = RateLimiter(userRate=1, userBurst=10, policy='reject')
+        other.restoreUserTokens('hans', tokens)
+        self.assertEqual(other.admit('hans', 'message', self.now)[0], REJECTED)
+
+    def testDelayPolicy(self):
+        limiter = RateLimiter(userRate=10, userBurst=10, maxDelay=1.0)
+        self.assertEqual(limiter.admit('hans', 'broadcast', self.now), (ADMITTED, 0.0))
+        verdict, wait = limiter.admit('hans', 'whoelse', self.now)
+        self.assertEqual(verdict, DELAYED)
+        self.assertAlmostEqual(wait, 0.5, places=2)
+        self.assertEqual(limiter.admit('hans', 'broadcast', self.now)[0], REJECTED)
+
+    def testOverloadShedsExpensiveCommands(self):
+        limiter = RateLimiter(userRate=1000, globalRate=1, globalBurst=10)
+        self.assertEqual(limiter.admit('hans', 'broadcast', self.now)[0], ADMITTED)
+        self.assertTrue(limiter.isOverloaded(self.now))
+        self.assertEqual(limiter.admit('hans', 'whoelse', self.now)[0], SHED)
+        self.assertEqual(limiter.admit('yoda', 'message', self.now)[0], ADMITTED)
+
+        # The tokens of a shed command are given back to its user
+        self.assertEqual(limiter.userTokens('hans', self.now), limiter.userBurst - 10)
+
+    def testFreeCommands(self):
+        limiter = RateLimiter(userRate=1, globalRate=1, policy='reject')
+        limiter.admit('hans', 'broadcast', self.now)
+        self.assertEqual(limiter.admit('hans', "['0']", self.now), (ADMITTED, 0.0))
+        self.assertEqual(limiter.admit('hans', 'logout', self.now), (ADMITTED, 0.0))
+
+    def testPrunesFullBuckets(self):
+        limiter = RateLimiter(userRate=1000)
+        limiter.pruneThreshold = 4
+        for index in range(4):
+            limiter.admit(f"user{index}", 'message', self.now)
+        for bucket in limiter.userBuckets.values():
+            bucket.updated -= 1.0
+        limiter.admit('hans', 'message', self.now)
+        self.assertEqual(list(limiter.userBuckets), ['hans'])
+
+    def testParseCosts(self):
+        costs = parseCosts('broadcast=20, message=0,')
+        self.assertEqual((costs['broadcast'], costs['message'], costs['search']), (20, 0, 10))
+        for text in ('broadcast', 'broadcast=x', 'broadcast=-1'):
+            with self.assertRaises(ValueError):
+                parseCosts(text)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+    Python 3
+    Tests of both engines of server.py, which is started as a process of its
+    own for every test and spoken to over the text protocol.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import SocketFrameReader, sendFrame
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+"""
+    Define the tests of the thread per connection engine. The tests of the
+    asyncio engine run the same tests with --mode async.
+"""
+class ThreadServerTest(unittest.TestCase):
+    mode = 'thread'
+
+    # This function starts the server in a directory of its own, with the
+    # credentials of the tests
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'credentials.txt'), 'w') as credentials:
+            credentials.write("hans falcon*solo\nyoda wise@!man\nvader sithlord**")
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.server = subprocess.Popen([sys.executable, SERVER, str(self.port), '10', '30', '--mode', self.mode],
+                                       cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(self.server.wait)
+        self.addCleanup(self.server.terminate)
+
+    # This function connects to the server and sends the handshake, returning
+    # the socket and the frame reader of the connection
+    def connect(self):
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', self.port))
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.addCleanup(sock.close)
+        sock.settimeout(10)
+        sendFrame(sock, "['p2pPort'] 9999")
+        reader = SocketFrameReader(sock)
+        self.assertEqual(reader.recvFrame(), 'Username: ')
+        return sock, reader
+
+    # This function logs the given user in on a new connection
+    def logIn(self, userName, password):
+        sock, reader = self.connect()
+        sendFrame(sock, userName)
+        self.assertEqual(reader.recvFrame(), 'Password: ')
+        sendFrame(sock, password)
+        self.assertTrue(reader.recvFrame().startswith('Welcome'))
+        return sock, reader
+
+    def testEmptyUserName(self):
+
+        # An empty user name is refused without closing the connection
+        sock, reader = self.connect()
+        sendFrame(sock, '')
+        self.assertEqual(reader.recvFrame(), "Invalid username. Please try again\nUsername: ")
+        sendFrame(sock, 'hans')
+        self.assertEqual(reader.recvFrame(), 'Password: ')
+
+    def testEmptyFrame(self):
+        hans, hansReader = self.logIn('hans', 'falcon*solo')
+        yoda, yodaReader = self.logIn('yoda', 'wise@!man')
+        self.assertEqual(hansReader.recvFrame(), "yoda logged in\n")
+
+        # An empty frame is an invalid command, not the end of the connection
+        sendFrame(hans, '')
+        self.assertEqual(hansReader.recvFrame(), "Error. Invalid command\n")
+        sendFrame(hans, 'message yoda hello')
+        self.assertEqual(yodaReader.recvFrame(), "hans: hello\n")
+
+"""
+    Define the tests of the asyncio engine.
+"""
+class AsyncServerTest(ThreadServerTest):
+    mode = 'async'
+
+if __name__ == "__main__":
+    unittest.main()
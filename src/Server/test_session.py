@@ -0,0 +1,186 @@
+"""
+    Python 3
+    Unit tests of the commands of session.py, run by sessions which keep
+    what the server sends them instead of writing it to a connection.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from framing import FrameDecoder
+import serverstate
+from activityindex import ActivityIndex
+from blockgraph import BlockGraph
+from credentialstore import CredentialStore
+from presence import PresenceRegistry, SessionRecord
+from session import ServerSession
+from timingwheel import TimingWheel
+
+"""
+    Define a session of the text protocol logged in as the given user, which
+    keeps the texts sent to it.
+"""
+class RecordingSession(ServerSession):
+
+    # This is the constructor of the session, logged in as the user
+    def __init__(self, userName, port):
+        ServerSession.__init__(self, ('127.0.0.1', port))
+        self.decoder = FrameDecoder()
+        self.received = []
+        self.p2pPort = port + 1
+        self.userName = userName
+        self.loginState = 'done'
+        self.clientAlive = True
+        serverstate.presence.login(SessionRecord(userName, '127.0.0.1', port, self, self.p2pPort))
+
+    # This function keeps the texts of the frame
+    def sendFrame(self, frame):
+        self.received.extend(payload.decode() for payload in self.decoder.feed(frame))
+
+    # This function keeps the text of the delivery, which is a frame of the
+    # text protocol
+    def deliverFrame(self, delivery):
+        self.sendFrame(delivery)
+
+    # This function does nothing, the session has no connection
+    def close(self):
+        pass
+
+    # This function returns the texts sent since the last call
+    def take(self):
+        received, self.received = self.received, []
+        return received
+
+"""
+    Define the base of the tests, which replaces the state of the server with
+    a fresh one for every test.
+"""
+class SessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        credentialsPath = os.path.join(directory, 'credentials.txt')
+        with open(credentialsPath, 'w') as c:
+            c.write("hans falcon*solo\nyoda wise@!man\nvader sithlord**")
+        self.replaceState(credentials=CredentialStore(credentialsPath), presence=PresenceRegistry(),
+                          blockGraph=BlockGraph(None), activity=ActivityIndex(), idleTimeouts=None, bus=None)
+
+    # This function replaces the given attributes of serverstate until the end
+    # of the test
+    def replaceState(self, **values):
+        for name, value in values.items():
+            self.addCleanup(setattr, serverstate, name, getattr(serverstate, name))
+            setattr(serverstate, name, value)
+
+"""
+    Define the tests of the idle timeouts postponed by the commands.
+"""
+class IdleTimeoutTest(SessionTestCase):
+
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.replaceState(idleTimeouts=TimingWheel(10, ServerSession.systemTimeOut, tickInterval=0.5))
+        self.session = RecordingSession('hans', 1000)
+        serverstate.idleTimeouts.touch(self.session)
+
+        # The last command of the session was 5 seconds ago
+        serverstate.idleTimeouts.lastActivity[self.session] -= 5
+
+    def testValidCommandPostponesTimeout(self):
+        self.session.handleCommand('whoelse')
+        self.assertGreater(serverstate.idleTimeouts.remaining(self.session), 9)
+
+    def testInvalidCommandsDoNotPostponeTimeout(self):
+
+        # As with the timer of the original server, only valid commands count
+        # as activity, not invalid ones or those failing
+        for command in ('', 'hello', 'whoelsesince x', 'message hans hi', 'block luke'):
+            self.session.handleCommand(command)
+        self.assertTrue(all(text.startswith('Error.') for text in self.session.take()))
+        self.assertLess(serverstate.idleTimeouts.remaining(self.session), 5.5)
+
+"""
+    Define the tests of private messaging relayed by the server.
+"""
+class RelayTest(SessionTestCase):
+
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.hans = RecordingSession('hans', 1000)
+        self.yoda = RecordingSession('yoda', 2000)
+
+    # This function has hans ask yoda to start private messaging
+    def startPrivate(self):
+        self.hans.handleCommand('startprivate yoda')
+        self.assertEqual(self.hans.take(), ["Start private messaging with yoda\n",
+                                            "['TARGET'] yoda 127.0.0.1 2001 hans True\n"])
+        self.assertEqual(self.yoda.take(), ["['TARGET'] hans 127.0.0.1 1001 yoda False\n"])
+
+    def testRelayWithoutRequest(self):
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+        self.hans.handleCommand('relay luke hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to luke\n"])
+        self.assertEqual(self.yoda.take(), [])
+
+    def testRelayOnceAccepted(self):
+        self.startPrivate()
+
+        # hans may not message yoda before yoda accepts, while yoda may answer
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+        self.yoda.handleCommand('acceptprivate hans')
+        self.yoda.handleCommand('relay hans yoda accepts private messaging')
+        self.assertEqual(self.hans.take(), ["['RELAY'] yoda yoda accepts private messaging"])
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.yoda.take(), ["['RELAY'] hans hans(private): hi"])
+
+    def testRelayDeclined(self):
+        self.startPrivate()
+        self.yoda.handleCommand("relay hans ['EXIT'] yoda ['END']")
+        self.yoda.handleCommand('declineprivate hans')
+        self.assertEqual(self.hans.take(), ["['RELAY'] yoda ['EXIT'] yoda ['END']"])
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.yoda.handleCommand('relay hans yoda(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+        self.assertEqual(self.yoda.take(), ["Error. Cannot relay private messages to hans\n"])
+
+    def testAnswerWithoutRequest(self):
+        self.yoda.handleCommand('acceptprivate hans')
+        self.assertEqual(self.yoda.take(), ["Error. hans has not asked to private message\n"])
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+
+    def testLogoutEndsPrivateMessaging(self):
+        self.startPrivate()
+        self.yoda.handleCommand('acceptprivate hans')
+        self.yoda.handleDisconnect()
+
+        # yoda logs in again with a client which has accepted nothing
+        self.yoda = RecordingSession('yoda', 3000)
+        self.hans.take()
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+        self.assertEqual(self.yoda.take(), [])
+
+    def testNewRequestNeedsNewAnswer(self):
+        self.startPrivate()
+        self.yoda.handleCommand('acceptprivate hans')
+        self.startPrivate()
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(), ["Error. Cannot relay private messages to yoda\n"])
+
+    def testBlockedAfterAccepting(self):
+        self.startPrivate()
+        self.yoda.handleCommand('acceptprivate hans')
+        self.yoda.handleCommand('block hans')
+        self.hans.handleCommand('relay yoda hans(private): hi')
+        self.assertEqual(self.hans.take(),
+                         ["Error. You can not privately message yoda as the recipient has blocked you\n"])
+
+if __name__ == "__main__":
+    unittest.main()
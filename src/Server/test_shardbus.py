@@ -0,0 +1,192 @@
+"""
+    Python 3
+    Unit tests of the partitioning of the offline messages and of the
+    replication of the history of a server cluster by shardbus.py, over a
+    publish/subscribe client which keeps what is published instead of
+    sending it.
+    Usage: python3 -m pytest src/Server
+"""
+import json
+import os
+import sys
+import unittest
+import zlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import serverstate
+from activityindex import ActivityIndex
+from historystore import HistoryStore
+from offlinestore import OfflineStore
+from presence import PresenceRegistry, SessionRecord
+from pubsub import PubSub
+from shardbus import ShardBus, PartitionedOfflineStore, ReplicatedHistoryStore, RemoteSession, ownerOf, DELIVER, DRAIN, LOGIN, LOGOUT, OFFLINE, SEND
+import wire
+
+"""
+    Define a publish/subscribe client which keeps the published messages.
+"""
+class RecordingPubSub(PubSub):
+
+    # This is the constructor of the client
+    def __init__(self):
+        self.published = []
+
+    # This function keeps the topic and the decoded message
+    def publish(self, topic, data):
+        self.published.append((topic, json.loads(data)))
+
+    # This function returns the messages published since the last call
+    def take(self):
+        published, self.published = self.published, []
+        return published
+
+"""
+    Define the tests of the offline messages of node 0 of a cluster of 2
+    nodes. Of the users of the tests, luke is owned by node 1 and the others
+    by node 0.
+"""
+class PartitionedOfflineStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pubsub = RecordingPubSub()
+        self.bus = ShardBus(self.pubsub, 0, 2)
+        self.store = PartitionedOfflineStore(OfflineStore(None), self.bus)
+        for name, value in (('presence', PresenceRegistry()), ('offlineMessages', self.store),
+                            ('activity', ActivityIndex())):
+            self.addCleanup(setattr, serverstate, name, getattr(serverstate, name))
+            setattr(serverstate, name, value)
+
+    def testOwnerOf(self):
+
+        # The owner is the CRC of the user name, the same in every process
+        # whatever the hash seed of Python
+        for userName in ('hans', 'yoda', 'vader', 'luke'):
+            self.assertEqual(ownerOf(userName, 4), zlib.crc32(userName.encode()) % 4)
+        self.assertEqual([ownerOf(userName, 2) for userName in ('hans', 'yoda', 'luke')], [0, 0, 1])
+        owners = {ownerOf(f"user{index}", 4) for index in range(100)}
+        self.assertEqual(owners, {0, 1, 2, 3})
+
+    def testEnqueue(self):
+        self.store.enqueue('yoda', "hans: hello")
+        self.store.enqueue('luke', "hans: hello")
+        self.assertEqual(self.store.pendingFor('yoda'), 1)
+        self.assertEqual(self.store.pendingFor('luke'), 0)
+        self.assertEqual(self.pubsub.take(), [('node.1', [OFFLINE, 'luke', "hans: hello"])])
+
+    def testTakeBatch(self):
+        self.store.enqueue('yoda', "hans: hello")
+        self.assertEqual(self.store.takeBatch('yoda'), ["hans: hello"])
+
+        # The owner of luke is asked to deliver the messages of luke instead
+        self.assertEqual(self.store.takeBatch('luke'), [])
+        self.assertEqual(list(self.store.drainBatches('luke')), [])
+        self.assertEqual(self.pubsub.take(), [('node.1', [DRAIN, 'luke'])])
+
+    def testMessagesOfOtherNodes(self):
+
+        # A message queued on another node for a user owned by this node
+        self.bus.handle([OFFLINE, 'yoda', "luke: hello\n"])
+        self.assertEqual(self.store.pendingFor('yoda'), 1)
+
+        # Once yoda has logged in to node 1, which asks for the messages of yoda
+        session = RemoteSession(self.bus, 'yoda', 1)
+        serverstate.presence.login(SessionRecord('yoda', '127.0.0.1', 2000, session, 2001))
+        self.bus.handle([DRAIN, 'yoda'])
+        self.assertEqual(self.store.pendingFor('yoda'), 0)
+        self.assertEqual(self.pubsub.take(), [('node.1', [DELIVER, 'yoda', wire.NOTICE, None, "luke: hello\n"])])
+
+    def testUsersOfOtherNodes(self):
+
+        # A user logged in to node 1 is looked up like a local user, with a
+        # session which sends to node 1
+        self.bus.handle([LOGIN, 'luke', '10.0.0.2', 3000, 3001, 1, 100.0])
+        record = serverstate.presence.lookup('luke')
+        self.assertEqual((record.userName, record.ipAddress, record.port, record.p2pPort),
+                         ('luke', '10.0.0.2', 3000, 3001))
+        self.assertTrue(record.session.remote)
+        self.assertEqual(record.session.node, 1)
+        self.assertIn('luke', serverstate.activity.loginTimes)
+        record.session.send("hans: hello\n")
+        self.assertEqual(self.pubsub.take(), [('node.1', [SEND, 'luke', "hans: hello\n"])])
+
+        # Only the node of the user logs the user out
+        self.bus.handle([LOGOUT, 'luke', 2])
+        self.assertIs(serverstate.presence.lookup('luke'), record)
+        self.bus.handle([LOGOUT, 'luke', 1])
+        self.assertIsNone(serverstate.presence.lookup('luke'))
+        self.assertIn('luke', serverstate.activity.logoutTimes)
+
+"""
+    Define the tests of the history of a cluster of 2 nodes, such as the
+    workers of one server, run in the same process. The conversation of hans
+    and yoda is owned by node 1, that of hans and luke by node 0.
+"""
+class ReplicatedHistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, serverstate, 'history', serverstate.history)
+        self.pubsubs = [RecordingPubSub(), RecordingPubSub()]
+        self.buses = [ShardBus(pubsub, node, 2) for node, pubsub in enumerate(self.pubsubs)]
+        self.stores = [ReplicatedHistoryStore(HistoryStore(None), bus) for bus in self.buses]
+
+    # This function sends a message through the given node, as its session
+    # does with serverstate.history
+    def send(self, node, sender, recipient, text):
+        serverstate.history = self.stores[node]
+        self.stores[node].append(sender, recipient, text)
+
+    # This function hands what the nodes have published to the nodes it is
+    # published to until nothing is left
+    def pump(self):
+        while any(pubsub.published for pubsub in self.pubsubs):
+            for node, pubsub in enumerate(self.pubsubs):
+                for topic, message in pubsub.take():
+                    for other, bus in enumerate(self.buses):
+                        if (other != node and topic == 'all') or topic == f"node.{other}":
+                            serverstate.history = self.stores[other]
+                            bus.handle(message)
+
+    # This function returns the messages of a page read through the given node
+    def page(self, node, userA, userB):
+        return [(message.id, message.timestamp, message.sender, message.text)
+                for message in self.stores[node].page(userA, userB)]
+
+    def testSendThroughOtherWorker(self):
+
+        # hans sends through node 0 and yoda answers through node 1, then both
+        # read the conversation through the other node
+        self.send(0, 'hans', 'yoda', "hello yoda")
+        self.assertEqual(self.pubsubs[0].published[0][0], 'node.1')
+        self.pump()
+        self.send(1, 'yoda', 'hans', "hello hans")
+        self.pump()
+        self.send(0, 'hans', 'luke', "hello luke")
+        self.pump()
+        for userA, userB in (('hans', 'yoda'), ('hans', 'luke')):
+            messages = self.page(1, userA, userB)
+            self.assertEqual(self.page(0, userA, userB), messages)
+        self.assertEqual([(id, sender, text) for id, timestamp, sender, text in self.page(1, 'yoda', 'hans')],
+                         [(1, 'hans', "hello yoda"), (2, 'yoda', "hello hans")])
+        self.assertEqual(len(self.stores[0]), 3)
+        self.assertEqual(len(self.stores[1]), 3)
+
+        # The messages sent through either node are found through both
+        for node in (0, 1):
+            results = self.stores[node].search('hans', ['hello'])
+            self.assertEqual([(peer, message.text) for peer, message in results],
+                             [('luke', "hello luke"), ('yoda', "hello hans"), ('yoda', "hello yoda")])
+
+    def testConversationOrder(self):
+
+        # Messages sent through both nodes before the owner has published any
+        # of them are numbered in the order the owner appends them on every
+        # node
+        self.send(0, 'hans', 'yoda', "first")
+        self.send(1, 'yoda', 'hans', "second")
+        self.send(0, 'hans', 'yoda', "third")
+        self.pump()
+        for node in (0, 1):
+            self.assertEqual([(id, text) for id, timestamp, sender, text in self.page(node, 'hans', 'yoda')],
+                             [(1, "second"), (2, "first"), (3, "third")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+    Python 3
+    Unit tests of the snapshots and write-ahead logs of statestore.py.
+    Usage: python3 -m pytest src/Server
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import statestore
+from statestore import SnapshotLog, decodeFields
+
+# The record types of the tests
+JOIN = 1
+LEAVE = 2
+
+"""
+    Define the tests of the log of a component named 'test', kept in a
+    temporary directory.
+"""
+class SnapshotLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='statetest-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    # This function opens the log and returns it with the records read back,
+    # decoded as a user name and a time
+    def open(self):
+        log = SnapshotLog(self.directory, 'test')
+        self.addCleanup(log.close)
+        records = [(recordType, decodeFields(data, 'st')) for recordType, data in log.recover()]
+        return log, records
+
+    # This function returns the files of the directory
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def testReadBack(self):
+        log, records = self.open()
+        self.assertEqual(records, [])
+        log.append(JOIN, 'hans', 10.0)
+        log.append(LEAVE, 'hans', 20.5)
+        log.close()
+        log, records = self.open()
+        self.assertEqual(records, [(JOIN, ['hans', 10.0]), (LEAVE, ['hans', 20.5])])
+
+    def testTruncatedLog(self):
+        log, records = self.open()
+        log.append(JOIN, 'hans', 10.0)
+        log.sync()
+        path = log.logPath(log.generation)
+        size = os.path.getsize(path)
+        log.append(JOIN, 'yoda', 20.0)
+        log.close()
+
+        # The server stopped while it was writing the last record
+        with open(path, 'r+b') as c:
+            c.truncate(os.path.getsize(path) - 3)
+        log, records = self.open()
+        self.assertEqual(records, [(JOIN, ['hans', 10.0])])
+        self.assertEqual(os.path.getsize(path), size)
+
+        # The records appended after the cut are read back
+        log.append(JOIN, 'vader', 30.0)
+        log.close()
+        log, records = self.open()
+        self.assertEqual(records, [(JOIN, ['hans', 10.0]), (JOIN, ['vader', 30.0])])
+
+    def testSnapshot(self):
+        log, records = self.open()
+        log.append(JOIN, 'hans', 10.0)
+        log.append(JOIN, 'yoda', 20.0)
+        log.append(LEAVE, 'hans', 30.0)
+
+        # The component copies its entries, here only yoda, under its lock
+        generation = log.rotate()
+        log.append(JOIN, 'vader', 40.0)
+        log.writeSnapshot(generation, [(JOIN, ['yoda', 20.0])])
+        self.assertEqual(self.files(), ['test-00000001.log', 'test.snap'])
+        log.close()
+        log, records = self.open()
+        self.assertEqual(records, [(JOIN, ['yoda', 20.0]), (JOIN, ['vader', 40.0])])
+
+    def testNeedsSnapshot(self):
+        self.addCleanup(setattr, statestore, 'SNAPSHOT_SLACK', statestore.SNAPSHOT_SLACK)
+        statestore.SNAPSHOT_SLACK = 0
+        log, records = self.open()
+        for _ in range(3):
+            log.append(JOIN, 'hans', 10.0)
+        self.assertFalse(log.needsSnapshot(2))
+        self.assertTrue(log.needsSnapshot(1))
+        log.rotate()
+        self.assertFalse(log.needsSnapshot(1))
+
+    def testNotSnapshot(self):
+        with open(os.path.join(self.directory, 'test.snap'), 'wb') as c:
+            c.write(b'NOTSNAP!' + bytes(8))
+        with self.assertRaises(ValueError):
+            self.open()
+
+if __name__ == "__main__":
+    unittest.main()
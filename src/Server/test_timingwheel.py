@@ -0,0 +1,110 @@
+"""
+    Python 3
+    Unit tests of the timing wheel of timingwheel.py scheduling the idle
+    timeouts of the sessions.
+    Usage: python3 -m pytest src/Server
+"""
+import asyncio
+import time
+import unittest
+from timingwheel import TimingWheel
+
+"""
+    Define the tests of the timing wheel, advanced to given times.
+"""
+class TimingWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.expired = []
+        self.wheel = TimingWheel(10, self.expired.append, tickInterval=0.5)
+
+    # This function touches the given keys and returns the time before and
+    # after, between which their deadlines were set
+    def touch(self, *keys):
+        before = time.monotonic()
+        for key in keys:
+            self.wheel.touch(key)
+        return before, time.monotonic()
+
+    def testTimesOutAfterTimeout(self):
+        before, after = self.touch('hans', 'yoda')
+        self.assertEqual(self.wheel.pendingCount(), 2)
+        self.assertEqual(self.wheel.advance(before + 9.9), [])
+        self.assertEqual(sorted(self.wheel.advance(after + 10.5)), ['hans', 'yoda'])
+        self.assertEqual(sorted(self.expired), ['hans', 'yoda'])
+        self.assertEqual(self.wheel.pendingCount(), 0)
+        self.assertIsNone(self.wheel.remaining('hans'))
+
+    def testActivityPostponesTimeout(self):
+        before, after = self.touch('hans', 'yoda')
+
+        # hans was active again 5 seconds later, which only updates the time of
+        # its last activity, and is moved on when its slot comes around
+        self.wheel.lastActivity['hans'] += 5
+        self.assertEqual(self.wheel.advance(after + 10.5), ['yoda'])
+        self.assertEqual(self.wheel.pendingCount(), 1)
+        self.assertEqual(self.wheel.advance(before + 14.9), [])
+        self.assertEqual(self.wheel.advance(after + 15.5), ['hans'])
+
+    def testTouchKeepsOneSlot(self):
+        for _ in range(100):
+            self.touch('hans')
+        self.assertEqual(sum(len(slot) for slot in self.wheel.slots), 1)
+
+    def testCancel(self):
+        before, after = self.touch('hans', 'yoda')
+        self.wheel.cancel('hans')
+        self.wheel.cancel('vader')
+        self.assertEqual(self.wheel.advance(after + 20), ['yoda'])
+        self.assertEqual(self.expired, ['yoda'])
+
+    def testRestore(self):
+        now = time.monotonic()
+        self.wheel.restore('hans', 2)
+        self.assertAlmostEqual(self.wheel.remaining('hans'), 2, places=1)
+        self.assertEqual(self.wheel.advance(now + 1.9), [])
+        self.assertEqual(self.wheel.advance(now + 3), ['hans'])
+
+    def testDeadlineBeyondWheel(self):
+        now = time.monotonic()
+        self.wheel.restore('hans', 35)
+        self.assertEqual(self.wheel.advance(now + 20), [])
+        self.assertEqual(self.wheel.advance(now + 34.9), [])
+        self.assertEqual(self.wheel.advance(now + 36), ['hans'])
+
+    def testLargeJump(self):
+        keys = [f"user{index}" for index in range(1000)]
+        before, after = self.touch(*keys)
+        self.assertEqual(sorted(self.wheel.advance(after + 1000)), sorted(keys))
+        self.assertEqual(self.wheel.advance(after + 2000), [])
+
+"""
+    Define the tests of the drivers advancing the wheel once per tick.
+"""
+class TimingWheelDriverTest(unittest.TestCase):
+
+    def testThreadDriver(self):
+        expired = []
+        wheel = TimingWheel(0.2, expired.append, tickInterval=0.05)
+        wheel.start()
+        wheel.touch('hans')
+        time.sleep(0.5)
+        wheel.stop(wait=True)
+        self.assertEqual(expired, ['hans'])
+
+    def testAsyncDriver(self):
+        expired = []
+        wheel = TimingWheel(0.2, expired.append, tickInterval=0.05)
+
+        async def run():
+            driver = asyncio.create_task(wheel.runAsync())
+            wheel.touch('hans')
+            await asyncio.sleep(0.5)
+            wheel.stop()
+            driver.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(expired, ['hans'])
+
+if __name__ == "__main__":
+    unittest.main()
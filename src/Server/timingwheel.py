@@ -0,0 +1,147 @@
+"""
+    Python 3
+    Hashed timing wheel used as the single idle timeout scheduler of the
+    server. Sessions record their activity on every command in O(1) and one
+    driver (a thread for the thread per client engine, a task for the asyncio
+    engine) advances the wheel once per tick and evicts the idle sessions.
+"""
+import asyncio
+import math
+import threading
+import time
+
+"""
+    Define the timing wheel. Each session is kept in exactly one slot of the
+    wheel together with the time of its last activity. Recording activity only
+    updates that time; a session whose slot comes around before it is really
+    idle is moved to the slot of its new deadline, so every command costs O(1)
+    amortized work and no timer object is created per command.
+"""
+class TimingWheel:
+
+    # This is the constructor of the wheel. timeout is the idle period in
+    # seconds after which onTimeout(key) is called for a key, tickInterval
+    # is the resolution of the wheel in seconds
+    def __init__(self, timeout, onTimeout, tickInterval=None):
+        if tickInterval is None:
+            tickInterval = max(0.05, min(1.0, timeout / 10))
+        self.timeout = timeout
+        self.onTimeout = onTimeout
+        self.tickInterval = tickInterval
+        self.wheelSize = int(math.ceil(timeout / tickInterval)) + 2
+        self.slots = [set() for _ in range(self.wheelSize)]
+        self.lastActivity = {}
+        self.slotOfKey = {}
+        self.currentTick = self.tickOf(time.monotonic())
+        self.lock = threading.Lock()
+        self.running = False
+        self.driver = None
+
+    # This function converts a monotonic timestamp into the number of ticks
+    def tickOf(self, timestamp):
+        return int(timestamp / self.tickInterval)
+
+    # This function records activity of the given key, scheduling it in the
+    # wheel if it is not scheduled yet
+    def touch(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self.lastActivity[key] = now
+            if key not in self.slotOfKey:
+                self.insert(key, now + self.timeout)
+
+    # This function schedules the key to time out after the given number of
+    # seconds, as if its last activity had been that long before the timeout
+    def restore(self, key, remaining):
+        now = time.monotonic()
+        with self.lock:
+            self.lastActivity[key] = now + remaining - self.timeout
+            if key not in self.slotOfKey:
+                self.insert(key, now + remaining)
+
+    # This function returns the number of seconds before the key times out, or
+    # None if it is not scheduled
+    def remaining(self, key):
+        lastActivity = self.lastActivity.get(key)
+        if lastActivity is None:
+            return None
+        return lastActivity + self.timeout - time.monotonic()
+
+    # This function removes the given key from the wheel
+    def cancel(self, key):
+        with self.lock:
+            self.lastActivity.pop(key, None)
+            slot = self.slotOfKey.pop(key, None)
+            if slot is not None:
+                self.slots[slot].discard(key)
+
+    # This function returns the number of keys which currently have a pending
+    # idle timeout
+    def pendingCount(self):
+        return len(self.slotOfKey)
+
+    # This function places the key in the slot of the given deadline. The
+    # caller must hold the lock
+    def insert(self, key, deadline):
+        tick = int(math.ceil(deadline / self.tickInterval))
+        tick = max(self.currentTick, min(tick, self.currentTick + self.wheelSize - 1))
+        slot = tick % self.wheelSize
+        self.slots[slot].add(key)
+        self.slotOfKey[key] = slot
+
+    # This function advances the wheel up to the given time, calls onTimeout
+    # for every key which has been idle for longer than the timeout and
+    # returns the list of those keys
+    def advance(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self.lock:
+            targetTick = self.tickOf(now)
+            while self.currentTick <= targetTick:
+                slot = self.slots[self.currentTick % self.wheelSize]
+                self.currentTick += 1
+                if not slot:
+                    continue
+                due = list(slot)
+                slot.clear()
+                for key in due:
+                    del self.slotOfKey[key]
+                    deadline = self.lastActivity[key] + self.timeout
+                    if deadline <= now:
+                        del self.lastActivity[key]
+                        expired.append(key)
+                    else:
+                        self.insert(key, deadline)
+        for key in expired:
+            self.onTimeout(key)
+        return expired
+
+    # This function starts a daemon thread which advances the wheel once per
+    # tick, used by the thread per client engine
+    def start(self):
+        self.running = True
+        self.driver = threading.Thread(name="idleTimeouts", target=self.runThread)
+        self.driver.daemon = True
+        self.driver.start()
+
+    # This function is the main loop of the driver thread
+    def runThread(self):
+        while self.running:
+            time.sleep(self.tickInterval)
+            self.advance()
+
+    # This coroutine advances the wheel once per tick, used by the asyncio
+    # engine as a task on the event loop
+    async def runAsync(self):
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.tickInterval)
+            self.advance()
+
+    # This function stops the driver. The driver thread is waited for unless
+    # wait is False, so that no key times out after the function returns
+    def stop(self, wait=False):
+        self.running = False
+        if wait and self.driver is not None and self.driver is not threading.current_thread():
+            self.driver.join()
@@ -0,0 +1,276 @@
+"""
+    Python 3
+    Wire encodings of what the server sends to its clients. Messages of users
+    are passed around the server as Delivery objects, which are the text
+    frame of the message, so they are written as they are to the clients of
+    the text protocol, and which also carry the kind, the user and the body
+    from which the binary frame is built for the clients of the binary
+    protocol (see binaryproto.py). Every session encodes everything else with
+    its codec, a TextCodec or a BinaryCodec once the binary protocol has been
+    negotiated.
+"""
+import threading
+from framing import HEADER, encodeFrame
+import binaryproto
+from binaryproto import encodeBinaryFrame, encodeVarint, encodeString, BatchCompressor
+
+# The kinds of deliveries. A message or broadcast carries the body sent by a
+# user, a channel message also the name of its channel, a login or logout
+# notice carries the user only and a notice any text
+MESSAGE = 'message'
+BROADCAST = 'broadcast'
+CHANNEL = 'channel'
+LOGIN = 'login'
+LOGOUT = 'logout'
+NOTICE = 'notice'
+
+# The ids of the user names in the binary protocol, shared by all the
+# connections of the process so that the binary frame of a delivery is built
+# once for all of its recipients
+userIds = {}
+userIdsLock = threading.Lock()
+
+# This function returns the id of the given user name
+def userId(userName):
+    id = userIds.get(userName)
+    if id is None:
+        with userIdsLock:
+            id = userIds.setdefault(userName, len(userIds))
+    return id
+
+"""
+    Define a binary frame referring to users by id. The writer defines the
+    ids of userNames to the client before writing the frame.
+"""
+class BinaryFrame(bytes):
+
+    # This function creates the frame from its opcode, its encoded fields and
+    # the user names it refers to
+    def __new__(cls, userNames, opcode, *fields):
+        frame = bytes.__new__(cls, encodeBinaryFrame(opcode, *fields))
+        frame.userNames = userNames
+        return frame
+
+"""
+    Define the delivery of a message to users. It is the text frame of the
+    message and builds its binary frame once, on first use.
+"""
+class Delivery(bytes):
+
+    # This function creates the delivery of the given kind from the user, to
+    # the given channel for a channel message
+    def __new__(cls, kind, userName=None, body='', channel=None):
+        if kind == MESSAGE or kind == BROADCAST:
+            text = f"{userName}: {body}\n"
+        elif kind == CHANNEL:
+            text = f"[#{channel}] {userName}: {body}\n"
+        elif kind == LOGIN:
+            text = f"{userName} logged in\n"
+        elif kind == LOGOUT:
+            text = f"{userName} logged out\n"
+        else:
+            text = body
+        delivery = bytes.__new__(cls, encodeFrame(text))
+        delivery.kind = kind
+        delivery.userName = userName
+        delivery.body = body
+        delivery.channel = channel
+        delivery.binary = None
+        return delivery
+
+    # This function returns the text of the delivery
+    def text(self):
+        return self[HEADER.size:].decode()
+
+    # This function returns the binary frame of the delivery
+    def binaryFrame(self):
+        if self.binary is None:
+            kind = self.kind
+            if kind == MESSAGE or kind == BROADCAST:
+                opcode = binaryproto.MESSAGE if kind == MESSAGE else binaryproto.BROADCAST
+                self.binary = BinaryFrame((self.userName,), opcode, encodeVarint(userId(self.userName)),
+                                          encodeString(self.body))
+            elif kind == CHANNEL:
+                self.binary = BinaryFrame((self.userName,), binaryproto.CHANNEL, encodeVarint(userId(self.userName)),
+                                          encodeString(self.channel), encodeString(self.body))
+            elif kind == LOGIN or kind == LOGOUT:
+                self.binary = BinaryFrame((self.userName,), binaryproto.PRESENCE,
+                                          encodeVarint(userId(self.userName)), bytes((kind == LOGIN,)))
+            else:
+                self.binary = BinaryFrame((), binaryproto.TEXT, encodeString(self.body))
+        return self.binary
+
+"""
+    Define the presence changes of the followed users sent to the subscribers
+    of the presence feed (see presencefeed.py) at the given version, a list
+    of (userName, online) pairs. Like a Delivery, it is the text frame of the
+    changes and builds its binary frame once, so that the same changes are
+    queued for every subscriber following all the users.
+"""
+class PresenceDeltas(bytes):
+
+    # This function creates the frame of the changes
+    def __new__(cls, version, changes):
+        text = ', '.join(f"{userName} logged {'in' if online else 'out'}" for userName, online in changes)
+        deltas = bytes.__new__(cls, encodeFrame(f"Presence version {version}: {text}\n"))
+        deltas.version = version
+        deltas.changes = changes
+        deltas.binary = None
+        return deltas
+
+    # This function returns the binary frame of the changes
+    def binaryFrame(self):
+        if self.binary is None:
+            fields = b''.join(encodeVarint(userId(userName)) + bytes((online,)) for userName, online in self.changes)
+            self.binary = BinaryFrame(tuple(userName for userName, online in self.changes), binaryproto.DELTAS,
+                                      encodeVarint(self.version), encodeVarint(len(self.changes)), fields)
+        return self.binary
+
+"""
+    Define the codec of the text protocol, where every frame is the text shown
+    to the user with magic markers for the client.
+"""
+class TextCodec:
+    binary = False
+
+    # This function encodes any text for the user
+    def text(self, text):
+        return encodeFrame(text)
+
+    # This function returns the state of the codec handed to another server
+    # taking over the connection
+    def handoffState(self):
+        return {'binary': False}
+
+    # This function encodes the reply to a successful login
+    def welcome(self, userName, text):
+        return encodeFrame(text)
+
+    # This function encodes a list of users, one per line, or returns None for
+    # an empty list, which sends nothing
+    def users(self, userNames):
+        return encodeFrame(''.join(userName + '\n' for userName in userNames)) if userNames else None
+
+    # This function encodes the online users followed by a subscriber of the
+    # presence feed at the given version
+    def snapshot(self, version, userNames):
+        return encodeFrame(f"Presence version {version}, online: {' '.join(userNames) or 'nobody'}\n")
+
+    # This function encodes the request to start private messaging with the
+    # peer, listening on the given address and port
+    def target(self, peerName, address, port, userName, initiator):
+        return encodeFrame(f"['TARGET'] {peerName} {address} {port} {userName} {initiator}\n")
+
+    # This function encodes a frame of private messaging relayed from the
+    # sender, whose client could not connect to the client of the session
+    def relay(self, sender, text):
+        return encodeFrame(f"['RELAY'] {sender} {text}")
+
+    # This function encodes the text telling the client that the session is over
+    def exit(self, text):
+        return encodeFrame(text + "['EXIT']")
+
+    # This function returns the frames to write for a batch taken from the
+    # outbound queue
+    def encodeBatch(self, frames):
+        return frames
+
+"""
+    Define the codec of a connection using the binary protocol. The frames of
+    the session are encoded when they are queued, while the user ids are
+    defined and the batches compressed by encodeBatch(), which is only called
+    by the writer of the session, in the order the frames are written.
+"""
+class BinaryCodec:
+    binary = True
+
+    # This is the constructor of the codec
+    def __init__(self, compress, resumed=False):
+        self.compressor = BatchCompressor(compress, resumed=resumed)
+        self.definedUsers = set()
+        self.started = False
+
+    # This function returns the state of the codec handed to another server
+    # taking over the connection, which has the same user ids
+    def handoffState(self):
+        return {'binary': True, 'compress': self.compressor.compressor is not None, 'started': self.started,
+                'compressorStarted': self.compressor.started, 'definedUsers': sorted(self.definedUsers)}
+
+    # This function encodes any text for the user
+    def text(self, text):
+        return encodeBinaryFrame(binaryproto.TEXT, encodeString(text))
+
+    # This function encodes the reply to a successful login
+    def welcome(self, userName, text):
+        return BinaryFrame((userName,), binaryproto.WELCOME, encodeVarint(userId(userName)), encodeString(text))
+
+    # This function encodes a list of users, or returns None for an empty list
+    def users(self, userNames):
+        if not userNames:
+            return None
+        ids = b''.join(encodeVarint(userId(userName)) for userName in userNames)
+        return BinaryFrame(userNames, binaryproto.USERS, encodeVarint(len(userNames)), ids)
+
+    # This function encodes the online users followed by a subscriber of the
+    # presence feed at the given version
+    def snapshot(self, version, userNames):
+        ids = b''.join(encodeVarint(userId(userName)) for userName in userNames)
+        return BinaryFrame(userNames, binaryproto.SNAPSHOT, encodeVarint(version), encodeVarint(len(userNames)), ids)
+
+    # This function encodes the request to start private messaging with the
+    # peer, listening on the given address and port
+    def target(self, peerName, address, port, userName, initiator):
+        return BinaryFrame((peerName, userName), binaryproto.TARGET, encodeVarint(userId(peerName)),
+                           encodeString(address), encodeVarint(int(port)), encodeVarint(userId(userName)),
+                           bytes((bool(initiator),)))
+
+    # This function encodes a frame of private messaging relayed from the
+    # sender, whose client could not connect to the client of the session
+    def relay(self, sender, text):
+        return BinaryFrame((sender,), binaryproto.RELAY, encodeVarint(userId(sender)), encodeString(text))
+
+    # This function encodes the text telling the client that the session is over
+    def exit(self, text):
+        return encodeBinaryFrame(binaryproto.EXIT, encodeString(text))
+
+    # This function returns the frames to write for a batch taken from the
+    # outbound queue. The first frame of the connection is the reply to the
+    # handshake, which is still a text frame and never compressed
+    def encodeBatch(self, frames):
+        out = []
+        if not self.started:
+            self.started = True
+            out.append(frames[0])
+            frames = frames[1:]
+        batch = []
+        append = batch.append
+        definedUsers = self.definedUsers
+        for frame in frames:
+            frameClass = frame.__class__
+            if frameClass is Delivery or frameClass is PresenceDeltas:
+                frame = frame.binary or frame.binaryFrame()
+            elif frameClass is bytes:
+                append(frame)
+                continue
+            for userName in frame.userNames:
+                if userName not in definedUsers:
+                    definedUsers.add(userName)
+                    append(encodeBinaryFrame(binaryproto.USER, encodeVarint(userId(userName)),
+                                             encodeString(userName)))
+            append(frame)
+        if batch:
+            out.extend(self.compressor.pack(batch))
+        return out
+
+# The codec of every session until the binary protocol is negotiated
+TEXT_CODEC = TextCodec()
+
+# This function returns the codec continuing the connection whose codec had
+# the given state
+def restoreCodec(state):
+    if not state['binary']:
+        return TEXT_CODEC
+    codec = BinaryCodec(state['compress'], resumed=state['compressorStarted'])
+    codec.started = state['started']
+    codec.definedUsers = set(state['definedUsers'])
+    return codec